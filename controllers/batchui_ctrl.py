@@ -5,20 +5,86 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 
 import pathfinder
 from models import mainmodel
+from models import batchwriter
 from models import dataio
+from models import outofcore
+from models import pipeline
+from models import resultcache
+from models import runprofile
+from models import tiling
+import h5py
+import numpy as np
 import json
 import os.path
 
+module_logger = mainmodel.get_logger(__name__)
+
 # Currently supported filetypes - keys are the names of the file formats supported, values are
 # lists of expected file extensions
 file_types = {'nditoolbox':['.hdf5'],
               'winspect':['.sdt'],
               'utwin':['.csc'],
               'dicom':['.dcm'],
+              'csv':['.csv'],
               'image':['.bmp', '.dcx', '.eps', '.gif', '.im', '.imt', '.jpg', '.jpeg', '.pcx',
                        '.png', '.ppm', '.psd', '.sgi', '.tga', '.tiff', '.xpm']}
 
 
+# While a batch job runs the input data, the toolkit's output and temporary copies made during
+# conversions are typically all in memory - used to estimate a job's memory from its data size
+job_memory_factor = 3
+
+
+# Plugins and parsed toolkit configurations loaded once per batch worker process (see init_worker)
+worker_cache = {}
+
+
+def init_worker(toolkit_config=None, results_queue=None):
+    """Initializer for batch worker processes:  loads the available plugins and parses the toolkit
+    configuration file toolkit_config (if specified) once, so that each input file the worker processes
+    doesn't have to re-import every plugin and re-read the configuration.  If specified, results saved
+    to a container by run_plugin are sent to the batch writer reading from results_queue."""
+    worker_cache.clear()
+    worker_cache['plugins'] = mainmodel.load_plugins()
+    if toolkit_config is not None:
+        worker_cache[('config', toolkit_config)] = read_toolkit_config(toolkit_config)
+    if results_queue is not None:
+        worker_cache['results_queue'] = results_queue
+
+
+def get_available_plugins():
+    """Returns the list of available plugins (name, class) - loaded by init_worker if called,
+    otherwise loaded from the plugins folder"""
+    if 'plugins' in worker_cache:
+        return worker_cache['plugins']
+    return mainmodel.load_plugins()
+
+
+def toolkit_signature(toolkit):
+    """Returns a str identifying the toolkit's plugin class(es) and version(s), or an empty str
+    if toolkit is None or can't be found"""
+    if toolkit is None:
+        return ''
+    try:
+        if pipeline.is_pipeline(toolkit):
+            return resultcache.plugin_signature(pipeline.PluginPipeline.from_toolkit(toolkit,
+                                                                                     get_available_plugins()))
+        plugins = dict(get_available_plugins())
+        return resultcache.plugin_signature(plugins[toolkit])
+    except (ValueError, KeyError, IOError):
+        return ''
+
+
+def read_toolkit_config(toolkit_config):
+    """Returns a new dict of the JSON toolkit configuration file toolkit_config, using the copy parsed
+    by init_worker if available"""
+    cfg_dict = worker_cache.get(('config', toolkit_config))
+    if cfg_dict is None:
+        with open(toolkit_config, "rb") as fidin:
+            cfg_dict = json.load(fidin)
+    return dict(cfg_dict)
+
+
 def available_file_types():
     """Returns a list of the currently supported filetypes"""
     return file_types.keys()
@@ -37,10 +103,9 @@ def get_file_type(filename):
 def read_data(filename, filetype=None):
     """Attempts to import the specified file based on the provided filetype, or automatically guesses the file format
     based on the file extension if no filetype is given.  Returns the data as a NumPy array if successfully imported as
-    a NumPy array if the file contained a single dataset or as a dict if multiple datasets were found."""
-    tof_counter = 0
-    amp_counter = 0
-    waveform_counter = 0
+    a NumPy array if the file contained a single dataset or as a dict if multiple datasets were found.  Multiple
+    datasets from UTWin and Winspect files are returned as a dataio.LazyDatasetMap, which only reads each dataset
+    when it's first accessed."""
     data = {}
     if filetype is None:
         filetype = get_file_type(filename)
@@ -48,46 +113,83 @@ def read_data(filename, filetype=None):
         if filetype == 'nditoolbox':
             data = dataio.get_data(filename)
         if filetype == 'winspect':
-            raw_data = dataio.get_winspect_data(filename)
-            # Handle any files that may have stored multiple datasets of
-            # a given type(s)
-            for dataset in raw_data:
-                dataset_key = os.path.basename(filename)
-                if dataset.data_type == 'waveform':
-                    dataset_key = 'waveform' + str(waveform_counter)
-                    waveform_counter +=1
-                elif dataset.data_type == 'amplitude':
-                    dataset_key = 'amplitude' + str(amp_counter)
-                    amp_counter += 1
-                elif dataset.data_type == 'tof': #TODO -confirm SDT files use tof
-                    dataset_key = 'tof' + str(tof_counter)
-                    tof_counter += 1
-                data[dataset_key] = dataset.data
+            data = dataio.get_winspect_datasets(filename)
         if filetype == 'csv':
-            data = dataio.get_txt_data(filename)
+            # Files with other extensions read with -f csv are assumed to be whitespace-delimited
+            delimiter = ',' if os.path.splitext(filename)[1].lower() == '.csv' else None
+            data = dataio.get_txt_data(filename, delimiter=delimiter)
         if filetype == 'image':
             data = dataio.get_img_data(filename, flatten=True)
         if filetype == 'dicom':
             data = dataio.get_dicom_data(filename)
         if filetype == 'utwin':
-            raw_data = dataio.get_utwin_data(filename)
-            for k in raw_data.keys():
-                for idx in range(len(raw_data[k])):
-                    data[k + str(idx)] = raw_data[k][idx]
+            data = dataio.get_utwin_datasets(filename)
     return data
 
 
+def output_datasets(data):
+    """Returns the list of the names of the datasets in data (dict) to save:  every dataset, except for a
+    dataio.LazyDatasetMap where datasets that were never read can't have changed and are skipped."""
+    if hasattr(data, "loaded_keys"):
+        return data.loaded_keys
+    return list(data.keys())
+
+
+def estimate_data_size(filename, filetype=None):
+    """Returns the estimated size in bytes of the data in filename once read into memory.  Where
+    possible only the file's header is read; otherwise the size of the file is used."""
+    if filetype is None:
+        filetype = get_file_type(filename)
+    file_size = os.path.getsize(filename)
+    try:
+        if filetype == 'nditoolbox':
+            with h5py.File(filename, 'r') as fidin:
+                return sum(fidin[key].size * fidin[key].dtype.itemsize for key in fidin.keys()
+                           if isinstance(fidin[key], h5py.Dataset))
+        if filetype == 'winspect':
+            data_file = dataio.WinspectDataFile(filename)
+            data_file.read_header()
+            return sum(dataset.num_points() * np.dtype(dataset.element_type).itemsize
+                       for dataset in data_file.datasets)
+        if filetype == 'utwin':
+            scan_reader = dataio.UTWinCScanDataFile(filename)
+            scan_properties = scan_reader.scan_properties
+            # Decompressed waveforms are assembled as 64-bit integers
+            itemsize = 8 if scan_reader.compression_properties.get('is_waveform_compressed') else 2
+            num_channels = max(1, sum(scan_properties.get('channel_active', [1])))
+            num_points = scan_properties['n_width'] * scan_properties['n_height']
+            return int(num_points * scan_properties['rf_length'] * num_channels * itemsize) + file_size
+        if filetype == 'image':
+            from PIL import Image
+            # Image.open only reads the header; images are flattened to single precision grayscale
+            width, height = Image.open(filename).size
+            return width * height * 4
+    except Exception: # Unreadable headers are reported when the job runs
+        pass
+    return file_size
+
+
+def estimate_memory(filename, filetype=None):
+    """Returns the estimated peak memory in bytes required to run a batch job on filename"""
+    return job_memory_factor * estimate_data_size(filename, filetype)
+
+
 class BatchPluginAdapter(object):
     """Adapter class for running NDIToolbox plugins in batch mode"""
 
-    def __init__(self, toolkit, datafname, toolkit_cfg=None, filetype=None):
+    def __init__(self, toolkit, datafname, toolkit_cfg=None, filetype=None, use_cache=True, save_data=False,
+                 container=None):
         self.toolkit = toolkit
         self.datafile = datafname
         self.toolkit_cfg = toolkit_cfg
+        self.use_cache = use_cache
+        self.save_data = save_data
+        self.container = container
         if filetype is None:
             filetype = get_file_type(datafname)
         self.filetype = filetype
         self._data = {}
+        self.profile = runprofile.RunProfile(toolkit, source='batch', input_file=datafname)
 
     @property
     def data(self):
@@ -96,7 +198,7 @@ class BatchPluginAdapter(object):
 
     def get_plugin_class(self):
         """Returns the plugin class with the specified name, or None if not found."""
-        available_plugins = mainmodel.load_plugins()
+        available_plugins = get_available_plugins()
         plugin_names = [plugin[0] for plugin in available_plugins]
         plugin_classes = [plugin[1] for plugin in available_plugins]
         if self.toolkit in plugin_names:
@@ -104,13 +206,17 @@ class BatchPluginAdapter(object):
         return plugin_class
 
     def init_toolkit(self):
-        """Instantiates the NDIToolbox toolkit"""
-        plugin_cls = self.get_plugin_class()
-        self.toolkit_instance = plugin_cls()
+        """Instantiates the NDIToolbox toolkit.  If the toolkit is a chain of plugins
+        or a saved pipeline file, a PluginPipeline is created instead and the toolkit
+        configuration is shared by every step."""
+        if pipeline.is_pipeline(self.toolkit):
+            self.toolkit_instance = pipeline.PluginPipeline.from_toolkit(self.toolkit, get_available_plugins())
+        else:
+            plugin_cls = self.get_plugin_class()
+            self.toolkit_instance = plugin_cls()
         cfg_dict = {'datafile':self.datafile}
         if self.toolkit_cfg is not None:
-            with open(self.toolkit_cfg, "rb") as fidin:
-                cfg_dict.update(json.load(fidin))
+            cfg_dict.update(read_toolkit_config(self.toolkit_cfg))
         if hasattr(self.toolkit_instance, 'config'):
             self.toolkit_instance.config.update(cfg_dict)
         else:
@@ -122,20 +228,97 @@ class BatchPluginAdapter(object):
         self._data = read_data(self.datafile, self.filetype)
 
     def run(self):
-        """Executes the toolkit"""
-        self.init_toolkit()
-        self.read_data()
-        self.toolkit_instance.data = self._data
-        self.toolkit_instance.run()
-        self._data = self.toolkit_instance.data
+        """Executes the toolkit.  If use_cache is True and the toolkit has already been run with the
+        same configuration on the same data, the results are retrieved from the result cache instead.
+        The timing and memory use of each stage are recorded in the adapter's profile."""
+        self.load()
+        self.process()
 
+    def load(self):
+        """Instantiates the toolkit and reads the data file - the first half of run"""
+        with self.profile.stage('init toolkit'):
+            self.init_toolkit()
+        with self.profile.stage('read data'):
+            self.read_data()
+        self.profile.info['data_bytes'] = runprofile.data_size(self._data)
 
-def run_plugin(toolkit, input_file, toolkit_config=None, file_type=None, save_data=True):
+    def process(self):
+        """Runs the toolkit on the data read by load (or retrieves its results from the cache) - the
+        second half of run"""
+        cache_key = None
+        if self.use_cache:
+            toolkit = self.toolkit_instance
+            if not isinstance(toolkit, pipeline.PluginPipeline):
+                toolkit = type(toolkit)
+            with self.profile.stage('cache lookup'):
+                cache_key, cached_data = mainmodel.get_cached_result(toolkit, self._data,
+                                                                     self.toolkit_instance.config)
+            if cached_data is not None:
+                self._data = cached_data
+                return
+        with self.profile.stage('run'):
+            if tiling.is_tileable(self.toolkit_instance, self._data):
+                self.toolkit_instance.data = tiling.run_tiled(type(self.toolkit_instance), self._data,
+                                                              self.toolkit_instance.config)
+            else:
+                self.toolkit_instance.data = self._data
+                self.toolkit_instance.run()
+            self._data = self.toolkit_instance.data
+        if cache_key is not None:
+            with self.profile.stage('cache store'):
+                mainmodel.cache_result(cache_key, self._data)
+
+    def save(self):
+        """Saves the toolkit's results if save_data is True:  to new HDF5 data files in the batch output folder
+        with the same basename as the input file, or to the batch writer if a container was specified.
+        Returns the list of files the results were saved to."""
+        output_files = []
+        if self.save_data and self.container is not None:
+            with self.profile.stage('send data'):
+                if hasattr(self._data, "keys"):
+                    datasets = dict((dataset, self._data[dataset]) for dataset in output_datasets(self._data))
+                else:
+                    datasets = {batchwriter.default_dataset_name: self._data}
+                batchwriter.send_results(worker_cache['results_queue'], self.datafile, datasets)
+                output_files.append(self.container)
+        elif self.save_data:
+            with self.profile.stage('save data'):
+                root, ext = os.path.splitext(os.path.basename(self.datafile))
+                if hasattr(self._data, "keys"):
+                    # Handle multiple datasets
+                    for dataset in output_datasets(self._data):
+                        output_fname = os.path.join(pathfinder.batchoutput_path(), root + "_" + dataset + ".hdf5")
+                        dataio.save_data(output_fname, self._data[dataset])
+                        output_files.append(output_fname)
+                else:
+                    # Handle single dataset
+                    output_fname = os.path.join(pathfinder.batchoutput_path(), root + ".hdf5")
+                    dataio.save_data(output_fname, self._data)
+                    output_files.append(output_fname)
+        return output_files
+
+    def finish(self):
+        """Saves the toolkit's results (see save) and the run's profile.  Returns the profile (dict)."""
+        self.profile.info['output_files'] = self.save()
+        self.profile.finish()
+        try:
+            self.profile.save()
+        except IOError as err:
+            module_logger.warning("Unable to save batch run profile: {0}".format(err))
+        return self.profile.to_dict()
+
+
+def run_plugin(toolkit, input_file, toolkit_config=None, file_type=None, save_data=True, use_cache=True,
+               container=None):
     """Convenience function for creating and executing BatchPluginAdapters and optionally saving
-    results to NDIToolbox data folder, e.g. for multiprocessing Pools.
+    results to NDIToolbox data folder, e.g. for multiprocessing Pools.  Returns the run's profile
+    (dict, see models.runprofile), which is also saved to the user's profiles file.
 
     toolkit -           name of plugin class (NOT name of plugin file):  e.g. MedianFilterPlugin,
-                        not medfilter_plugin.py.  Must be an installed NDIToolbox plugin.
+                        not medfilter_plugin.py.  Must be an installed NDIToolbox plugin.  May also
+                        be a comma-separated chain of plugins e.g. NormalizePlugin,MedianFilterPlugin
+                        or the name of a saved pipeline (.json) file, in which case the plugins are
+                        run in turn on the data (see models.pipeline).
 
     input_file -        name of the input data file.  If file_type is not specified (default),
                         type of file is assumed based on file extension.
@@ -150,24 +333,73 @@ def run_plugin(toolkit, input_file, toolkit_config=None, file_type=None, save_da
 
     save_data -         (optional) if True, resultant data are saved to a new HDF5 data file with
                         the same basename as the input file.  Defaults to True.
+
+    use_cache -         (optional) if True (default), results are retrieved from the result cache if
+                        the toolkit has previously been run with the same configuration on the same
+                        data, and new results are added to the cache.
+
+    container -         (optional) name of an HDF5 container file.  If specified and save_data is True,
+                        the results are sent to the batch writer set up by init_worker and saved in a group
+                        in the container instead of separate data files (see models.batchwriter).
     """
-    batch_runner = BatchPluginAdapter(toolkit, input_file, toolkit_cfg=toolkit_config, filetype=file_type)
-    batch_runner.run()
-    if save_data:
-        if hasattr(batch_runner.data, "keys"):
-            # Handle multiple datasets
-            for dataset in batch_runner.data:
-                root, ext = os.path.splitext(os.path.basename(input_file))
-                output_fname = os.path.join(pathfinder.batchoutput_path(), root + "_" + dataset + ".hdf5")
-                dataio.save_data(output_fname, batch_runner.data[dataset])
-        else:
-            # Handle single dataset
-            root, ext = os.path.splitext(os.path.basename(input_file))
-            output_fname = os.path.join(pathfinder.batchoutput_path(), root + ".hdf5")
-            dataio.save_data(output_fname, batch_runner._data)
+    return finish_plugin_run(process_plugin_run(load_plugin_run(toolkit, input_file, toolkit_config, file_type,
+                                                                save_data, use_cache, container)))
+
+
+def load_plugin_run(toolkit, input_file, toolkit_config=None, file_type=None, save_data=True, use_cache=True,
+                    container=None):
+    """First stage of run_plugin (same arguments):  instantiates the toolkit and reads the input file.
+    Returns the BatchPluginAdapter to pass to process_plugin_run."""
+    if container is not None and save_data and 'results_queue' not in worker_cache:
+        raise ValueError("No batch writer available to save results to {0}.".format(container))
+    batch_runner = BatchPluginAdapter(toolkit, input_file, toolkit_cfg=toolkit_config, filetype=file_type,
+                                      use_cache=use_cache, save_data=save_data, container=container)
+    batch_runner.load()
+    return batch_runner
 
 
-def import_data(input_file, file_type=None):
+def process_plugin_run(batch_runner):
+    """Second stage of run_plugin:  runs the toolkit on the data read by load_plugin_run.  Returns the
+    BatchPluginAdapter to pass to finish_plugin_run."""
+    batch_runner.process()
+    return batch_runner
+
+
+def finish_plugin_run(batch_runner):
+    """Final stage of run_plugin:  saves the results and the run's profile.  Returns the profile (dict)."""
+    return batch_runner.finish()
+
+
+def run_plugin_out_of_core(toolkit, input_file, toolkit_config=None, file_type=None):
+    """Runs the plugin on an NDIToolbox HDF5 data file one chunk of data at a time, saving the results to a
+    new HDF5 data file in the batch output folder with the same basename as the input file (see
+    models.outofcore).  For data files too large to be read into memory.  Returns the run's profile
+    (dict, see models.runprofile), which is also saved to the user's profiles file.
+
+    Raises ValueError if the input file is not an NDIToolbox HDF5 data file or if the toolkit is not
+    a plugin that can be run on chunks of data (see the tile_mode attribute in models.tiling).
+    Arguments are as for run_plugin.
+    """
+    batch_runner = BatchPluginAdapter(toolkit, input_file, toolkit_cfg=toolkit_config, filetype=file_type,
+                                      use_cache=False)
+    if batch_runner.filetype != 'nditoolbox':
+        raise ValueError("Only NDIToolbox HDF5 data files can be processed out of core.")
+    with batch_runner.profile.stage('init toolkit'):
+        batch_runner.init_toolkit()
+    root, ext = os.path.splitext(os.path.basename(input_file))
+    output_fname = os.path.join(pathfinder.batchoutput_path(), root + ".hdf5")
+    with batch_runner.profile.stage('run out of core'):
+        outofcore.run_out_of_core(type(batch_runner.toolkit_instance), input_file, output_fname,
+                                  batch_runner.toolkit_instance.config)
+    batch_runner.profile.info['output_files'] = [output_fname]
+    batch_runner.profile.finish()
+    try:
+        batch_runner.profile.save()
+    except IOError as err:
+        module_logger.warning("Unable to save batch run profile: {0}".format(err))
+    return batch_runner.profile.to_dict()
+
+def import_data(input_file, file_type=None, profile=None):
     """Convenience function for importing recognized file formats and saving the results to NDIToolbox data folder.
     Primarily used for multiprocess pools.
 
@@ -179,16 +411,30 @@ def import_data(input_file, file_type=None):
                         'utwin', 'csv', 'winspect', 'dicom' (use the available_file_types
                         function to retrieve a list of supported types).  If not specified,
                         format is assumed based on file extension.
+
+    profile -           (optional) RunProfile in which to record the timing and memory use of reading
+                        and saving the data.
+
+    Returns the list of data files created.
     """
-    data = read_data(input_file, file_type)
-    if hasattr(data, "keys"):
+    output_files = []
+    with runprofile.stage(profile, 'read data'):
+        data = read_data(input_file, file_type)
+    with runprofile.stage(profile, 'save data'):
+        if hasattr(data, "keys"):
             # Handle multiple datasets
             for dataset in data:
                 root, ext = os.path.splitext(os.path.basename(input_file))
                 output_fname = os.path.join(pathfinder.data_path(), root + "_" + dataset + ".hdf5")
                 dataio.save_data(output_fname, data[dataset])
-    else:
-        # Handle single dataset
-        root, ext = os.path.splitext(os.path.basename(input_file))
-        output_fname = os.path.join(pathfinder.data_path(), root + ".hdf5")
-        dataio.save_data(output_fname, data)
\ No newline at end of file
+                output_files.append(output_fname)
+                if hasattr(data, "unload"):
+                    # Only keep one dataset of a LazyDatasetMap in memory at a time
+                    data.unload(dataset)
+        else:
+            # Handle single dataset
+            root, ext = os.path.splitext(os.path.basename(input_file))
+            output_fname = os.path.join(pathfinder.data_path(), root + ".hdf5")
+            dataio.save_data(output_fname, data)
+            output_files.append(output_fname)
+    return output_files
\ No newline at end of file
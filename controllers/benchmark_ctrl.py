@@ -0,0 +1,259 @@
+"""benchmark_ctrl.py - controller for the batch mode throughput benchmark
+
+Generates synthetic input files of each supported format (see models.synthetic), imports them and runs a
+toolkit on them in sequential and multiprocess batch modes, and reports the throughput, time spent in each
+stage and peak memory of each run as a JSON-friendly dict so that releases and machines can be compared.
+
+Also compares computing several C-scan features of a synthetic scan in a single pass over the data
+(NDEScanHandler.gen_cscan_features) against computing each feature in a separate pass.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import batchui_ctrl
+from models import batchprefetch
+from models import batchscheduler
+from models import mainmodel
+from models import ndescanhandler
+from models import runprofile
+from models import synthetic
+import numpy as np
+import datetime
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import tempfile
+import time
+
+module_logger = mainmodel.get_logger(__name__)
+
+# Synthetic input formats - name: (file extension, NDIToolbox file type, writer function and keyword arguments)
+benchmark_formats = {'nditoolbox': ('.hdf5', 'nditoolbox', synthetic.write_hdf5, {}),
+                     'utwin': ('.csc', 'utwin', synthetic.write_utwin, {}),
+                     'utwin_compressed': ('.csc', 'utwin', synthetic.write_utwin, {'compression_ratio': 2}),
+                     'winspect': ('.sdt', 'winspect', synthetic.write_winspect, {}),
+                     'csv': ('.csv', 'csv', synthetic.write_csv, {})}
+
+# Batch modes benchmarked
+benchmark_modes = ['sequential', 'multiprocess']
+
+# Default number of files and size of each file (MB) of each format
+default_num_files = 4
+default_file_size = 8
+
+
+def generate_inputs(folder, data_format, num_files, file_size):
+    """Writes num_files synthetic data files of the specified format (one of benchmark_formats), each with
+    approximately file_size MB of data, to folder.  Returns the list of files."""
+    ext, file_type, write_fn, write_kwargs = benchmark_formats[data_format]
+    input_files = []
+    for idx in range(num_files):
+        input_file = os.path.join(folder, "nditoolbox_benchmark_{0}_{1:03d}{2}".format(data_format, idx, ext))
+        write_fn(input_file, int(file_size * 2 ** 20), seed=idx, **write_kwargs)
+        input_files.append(input_file)
+    return input_files
+
+
+def profile_import(input_file, file_type=None):
+    """Imports input_file (see batchui_ctrl.import_data) and returns the run's profile (dict)"""
+    profile = runprofile.RunProfile('import', source='benchmark', input_file=input_file)
+    profile.info['output_files'] = batchui_ctrl.import_data(input_file, file_type, profile=profile)
+    profile.finish()
+    return profile.to_dict()
+
+
+def summarize_run(data_format, task, mode, jobs, wall_time):
+    """Returns a dict of the throughput, time spent in each stage and peak memory of a benchmark run of the
+    list of BatchJobs jobs that took wall_time seconds"""
+    completed_jobs = [job for job in jobs if job.succeeded]
+    input_mb = sum(job.size for job in completed_jobs) / float(2 ** 20)
+    stages = {}
+    peak_rss = []
+    for job in completed_jobs:
+        for record in job.result['stages']:
+            stage = stages.setdefault(record['stage'], {'wall_time': 0., 'cpu_time': 0., 'peak_rss': None})
+            stage['wall_time'] += record['wall_time']
+            stage['cpu_time'] += record['cpu_time']
+            if record['peak_rss'] is not None:
+                stage['peak_rss'] = max(stage['peak_rss'], record['peak_rss'])
+                peak_rss.append(record['peak_rss'])
+    return {'format': data_format,
+            'task': task,
+            'mode': mode,
+            'files': len(completed_jobs),
+            'errors': [job.error for job in jobs if job.error is not None],
+            'input_mb': input_mb,
+            'wall_time': wall_time,
+            'files_per_s': len(completed_jobs) / wall_time if wall_time > 0 else 0.,
+            'mb_per_s': input_mb / wall_time if wall_time > 0 else 0.,
+            'peak_rss': max(peak_rss) if peak_rss else None,
+            'stages': stages}
+
+
+def remove_outputs(jobs):
+    """Deletes the data files created by the benchmark jobs"""
+    for job in jobs:
+        if job.succeeded:
+            for output_file in job.result.get('output_files', []):
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+
+
+def run_benchmark_mode(input_files, data_format, toolkit, mode, num_workers=None):
+    """Imports (if toolkit is None) or runs the toolkit on the input_files in the specified mode (one of
+    benchmark_modes) and returns the summary of the run (see summarize_run)"""
+    file_type = benchmark_formats[data_format][1]
+    multiprocess = mode == 'multiprocess'
+    if toolkit is None:
+        scheduler = batchscheduler.BatchScheduler(num_workers=num_workers, multiprocess=multiprocess,
+                                                  initializer=batchui_ctrl.init_worker)
+        job_fn = profile_import
+    elif multiprocess:
+        scheduler = batchscheduler.BatchScheduler(num_workers=num_workers, multiprocess=True,
+                                                  initializer=batchui_ctrl.init_worker)
+        job_fn = batchui_ctrl.run_plugin
+    else:
+        # Same pipelined sequential mode as batch mode
+        scheduler = batchprefetch.PrefetchScheduler(batchui_ctrl.load_plugin_run, batchui_ctrl.process_plugin_run,
+                                                    batchui_ctrl.finish_plugin_run,
+                                                    initializer=batchui_ctrl.init_worker)
+        job_fn = batchui_ctrl.run_plugin
+    for input_file in input_files:
+        kwds = {'input_file': input_file, 'file_type': file_type}
+        if toolkit is not None:
+            kwds.update({'toolkit': toolkit, 'save_data': True, 'use_cache': False})
+        scheduler.add_job(input_file, job_fn, kwds, memory=batchui_ctrl.estimate_memory(input_file, file_type),
+                          size=os.path.getsize(input_file))
+    jobs = scheduler.run()
+    remove_outputs(jobs)
+    return summarize_run(data_format, toolkit or 'import', mode, jobs, scheduler.wall_time)
+
+
+def run_benchmark(toolkit=None, formats=None, num_files=None, file_size=None, modes=None, num_workers=None,
+                  progress_fn=None):
+    """Runs the batch mode benchmark and returns the results as a JSON-friendly dict.  For each of the formats
+    (defaults to all benchmark_formats), num_files synthetic files of approximately file_size MB each are
+    imported and, if specified, the toolkit is run on them in each of the modes (defaults to all
+    benchmark_modes).  If specified, progress_fn is called with a str describing each run as it starts."""
+    if formats is None:
+        formats = sorted(benchmark_formats)
+    if num_files is None:
+        num_files = default_num_files
+    if file_size is None:
+        file_size = default_file_size
+    if modes is None:
+        modes = benchmark_modes
+    for data_format in formats:
+        if data_format not in benchmark_formats:
+            raise ValueError("Unknown benchmark format '{0}', must be one of {1}".format(
+                data_format, ", ".join(sorted(benchmark_formats))))
+    tasks = [None] if toolkit is None else [None, toolkit]
+    results = {'started': datetime.datetime.now().isoformat(),
+               'host': socket.gethostname(),
+               'platform': platform.platform(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'cpu_count': multiprocessing.cpu_count(),
+               'physical_memory': batchscheduler.physical_memory(),
+               'settings': {'toolkit': toolkit,
+                            'formats': formats,
+                            'num_files': num_files,
+                            'file_size_mb': file_size,
+                            'modes': modes,
+                            'num_workers': num_workers or multiprocessing.cpu_count()},
+               'runs': []}
+    work_folder = tempfile.mkdtemp(prefix="nditoolbox_benchmark")
+    try:
+        for data_format in formats:
+            if progress_fn is not None:
+                progress_fn("Generating {0} {1} MB {2} files...".format(num_files, file_size, data_format))
+            input_files = generate_inputs(work_folder, data_format, num_files, file_size)
+            for task in tasks:
+                for mode in modes:
+                    if progress_fn is not None:
+                        progress_fn("Running {0} on {1} files ({2})...".format(task or 'import', data_format, mode))
+                    results['runs'].append(run_benchmark_mode(input_files, data_format, task, mode, num_workers))
+            for input_file in input_files:
+                os.remove(input_file)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+    results['finished'] = datetime.datetime.now().isoformat()
+    return results
+
+
+def benchmark_cscan_features(file_size=None, features=None, threshold=0.5, repeats=3, num_workers=None):
+    """Times computing the C scans of the features (defaults to all of ndescanhandler.cscan_features) of
+    synthetic float32 waveforms of approximately file_size MB (defaults to default_file_size) in a single pass,
+    and in one pass per feature.  Each is run repeats times and the fastest time is reported.  Returns the
+    results as a JSON-friendly dict."""
+    if file_size is None:
+        file_size = default_file_size
+    if features is None:
+        features = list(ndescanhandler.cscan_features)
+    shape = synthetic.waveform_shape(int(file_size * 2 ** 20), 4)
+    data = synthetic.waveforms(shape)
+    start_idx, stop_idx = shape[2] // 4, shape[2]
+
+    def single_pass():
+        """Computes all the features together"""
+        scnr = ndescanhandler.NDEScanHandler(data, cache_bytes=0)
+        scnr.gen_cscan_features(start_idx, stop_idx, features, threshold, num_workers=num_workers)
+
+    def separate_passes():
+        """Computes each feature in turn"""
+        scnr = ndescanhandler.NDEScanHandler(data, cache_bytes=0)
+        for feature in features:
+            scnr.gen_cscan_features(start_idx, stop_idx, [feature], threshold, num_workers=num_workers)
+
+    timings = {}
+    for name, run_fn in [('single_pass', single_pass), ('separate_passes', separate_passes)]:
+        run_times = []
+        for idx in range(repeats):
+            start_time = time.time()
+            run_fn()
+            run_times.append(time.time() - start_time)
+        timings[name] = min(run_times)
+    gate_mb = data[:, :, start_idx:stop_idx].nbytes / float(2 ** 20)
+    return {'started': datetime.datetime.now().isoformat(),
+            'host': socket.gethostname(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'cpu_count': multiprocessing.cpu_count(),
+            'shape': list(shape),
+            'gate': [start_idx, stop_idx],
+            'gate_mb': gate_mb,
+            'features': features,
+            'single_pass_time': timings['single_pass'],
+            'separate_passes_time': timings['separate_passes'],
+            'single_pass_mb_per_s': gate_mb / timings['single_pass'] if timings['single_pass'] > 0 else 0.,
+            'speedup': (timings['separate_passes'] / timings['single_pass'] if timings['single_pass'] > 0
+                        else 0.)}
+
+
+def format_cscan_results(results):
+    """Returns a human-readable summary of the C scan features benchmark results (dict)"""
+    return "\n".join(["{0} features of a {1:.1f} MB gate ({2})".format(len(results['features']), results['gate_mb'],
+                                                                     ", ".join(results['features'])),
+                      "    single pass:     {0:.3f} s ({1:.1f} MB/s)".format(results['single_pass_time'],
+                                                                          results['single_pass_mb_per_s']),
+                      "    separate passes: {0:.3f} s".format(results['separate_passes_time']),
+                      "    speedup:         {0:.2f}x".format(results['speedup'])])
+
+
+def format_results(results):
+    """Returns a human-readable table of the benchmark results (dict)"""
+    lines = ["{0:<18}{1:<22}{2:<14}{3:>10}{4:>10}{5:>12}".format("Format", "Task", "Mode", "files/s", "MB/s",
+                                                                 "peak RSS MB")]
+    for run in results['runs']:
+        peak = "n/a" if run['peak_rss'] is None else "{0:.1f}".format(run['peak_rss'] / float(2 ** 20))
+        lines.append("{0:<18}{1:<22}{2:<14}{3:>10.2f}{4:>10.2f}{5:>12}".format(
+            run['format'], run['task'], run['mode'], run['files_per_s'], run['mb_per_s'], peak))
+        for error in run['errors']:
+            lines.append("    ** {0}".format(error))
+    return "\n".join(lines)
@@ -7,6 +7,8 @@ __author__ = 'Chris R. Coughlin'
 
 from models import mainmodel
 from models import dataio
+from models import outofcore
+from models import precision
 from models import workerthread
 import views.plotwindow as plotwindow
 import views.preview_window as preview_window
@@ -376,6 +378,18 @@ class MainUIController(object):
             mainmodel.set_loglevel(choose_logging_level_dlg.GetStringSelection())
         choose_logging_level_dlg.Destroy()
 
+    def on_choose_precision(self, evt):
+        """Handles request to set the floating point precision used in calculations"""
+        precision_modes = precision.precision_modes
+        choose_precision_dlg = wx.SingleChoiceDialog(parent=self.view, caption="Choose Compute Precision",
+                                                     message="Please choose the precision to use in calculations.\n"
+                                                             "native keeps the data's own type where possible.",
+                                                     choices=precision_modes)
+        choose_precision_dlg.SetSelection(precision_modes.index(precision.get_precision()))
+        if choose_precision_dlg.ShowModal() == wx.ID_OK:
+            precision.set_precision(choose_precision_dlg.GetStringSelection())
+        choose_precision_dlg.Destroy()
+
     def on_gc(self, evt):
         """Handles request to run a full garbage collection"""
         unreachable_objects = gc.collect()
@@ -385,6 +399,93 @@ class MainUIController(object):
         info_dlg.ShowModal()
         info_dlg.Destroy()
 
+    def on_clear_cache(self, evt):
+        """Handles request to delete the cached results of previous plugin runs"""
+        confirm_deletion_dlg = wx.MessageDialog(parent=self.view,
+                                                caption="Clear Cache?",
+                                                message="Are you sure you want to delete all cached plugin results?",
+                                                style=wx.OK | wx.CANCEL)
+        if confirm_deletion_dlg.ShowModal() == wx.ID_OK:
+            mainmodel.clear_result_cache()
+        confirm_deletion_dlg.Destroy()
+
+    def on_run_plugin_out_of_core(self, evt):
+        """Handles request to run a plugin on the selected data file one chunk at a time, for
+        data files too large to be plotted"""
+        data_file = self.view.data_panel.data
+        if data_file is None:
+            return
+        chunk_safe_plugins = [(name, cls) for name, cls in mainmodel.load_plugins()
+                              if outofcore.is_chunk_safe(cls)]
+        if not chunk_safe_plugins:
+            err_dlg = wx.MessageDialog(self.view, message="No installed plugins can be run on chunks of data.",
+                                       caption="No Plugins Available", style=wx.ICON_ERROR)
+            err_dlg.ShowModal()
+            err_dlg.Destroy()
+            return
+        plugin_names = [plugin[0] for plugin in chunk_safe_plugins]
+        choose_dlg = wx.SingleChoiceDialog(self.view, caption="Run Plugin On Data File",
+                                           message="Please choose a plugin to run", choices=plugin_names)
+        plugin_cls = None
+        if choose_dlg.ShowModal() == wx.ID_OK:
+            plugin_cls = chunk_safe_plugins[choose_dlg.GetSelection()][1]
+        choose_dlg.Destroy()
+        if plugin_cls is None:
+            return
+        plugin_instance = plugin_cls()
+        plugin_cfg = None
+        if hasattr(plugin_instance, "config"):
+            cfg_dlg = dlg.ConfigurePluginDialog(self.view, plugin_instance)
+            if cfg_dlg.ShowModal() == wx.ID_OK:
+                plugin_cfg = cfg_dlg.get_config()
+            cfg_dlg.Destroy()
+            if plugin_cfg is None:
+                return
+        root, ext = os.path.splitext(os.path.basename(data_file))
+        dest_fname = os.path.join(pathfinder.data_path(), "_".join([root, plugin_cls.__name__]) + ".hdf5")
+        self.run_out_of_core(plugin_cls, data_file, dest_fname, plugin_cfg)
+        self.view.data_panel.populate()
+
+    def run_out_of_core(self, plugin_cls, data_file, dest_fname, plugin_cfg=None):
+        """Runs the plugin on data_file one chunk at a time in a separate thread, saving the results to
+        dest_fname and displaying the progress"""
+        exception_queue = Queue.Queue()
+        progress_queue = Queue.Queue()
+        run_thd = workerthread.WorkerThread(exception_queue=exception_queue,
+                                            target=outofcore.run_out_of_core,
+                                            args=(plugin_cls, data_file, dest_fname, plugin_cfg),
+                                            kwargs={'progress_fn':progress_queue.put, 'use_threads':True})
+        progress_dlg = wx.ProgressDialog("Running Plugin", "Running {0}...".format(plugin_cls.__name__),
+                                         parent=self.view, style=wx.PD_APP_MODAL | wx.PD_ELAPSED_TIME)
+        run_thd.start()
+        try:
+            while True:
+                run_thd.join(0.125)
+                try:
+                    while True:
+                        progress_dlg.Update(int(100 * progress_queue.get(block=False)))
+                except Queue.Empty:
+                    pass
+                if not run_thd.is_alive():
+                    try:
+                        exc_type, exc = exception_queue.get(block=False)
+                        err_str = str(exc)
+                        if len(err_str) == 0:
+                            err_str = exc_type.__name__
+                        module_logger.error("Error running plugin on data file: {0}".format(err_str))
+                        err_msg = "An error occurred running the plugin:\n{0}".format(err_str)
+                        err_dlg = wx.MessageDialog(self.view, message=err_msg,
+                                                   caption="Unable To Run Plugin", style=wx.ICON_ERROR)
+                        err_dlg.ShowModal()
+                        err_dlg.Destroy()
+                    except Queue.Empty:
+                        pass
+                    gc.collect()
+                    break
+                wx.GetApp().Yield()
+        finally:
+            progress_dlg.Destroy()
+
     def import_data(self, import_fn, *args, **kwargs):
         """Imports data using the specified function"""
         exception_queue = Queue.Queue()
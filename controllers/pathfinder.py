@@ -144,4 +144,19 @@ def colormaps_path():
 @normalized
 def batchoutput_path():
     """Returns the path to data files produced with batch processing mode"""
-    return os.path.join(data_path(), "batch_output")
\ No newline at end of file
+    return os.path.join(data_path(), "batch_output")
+
+@normalized
+def pipelines_path():
+    """Returns the path to saved plugin pipelines"""
+    return os.path.join(user_path(), "pipelines")
+
+@normalized
+def cache_path():
+    """Returns the path to cached plugin results"""
+    return os.path.join(user_path(), "cache")
+
+@normalized
+def profiles_path():
+    """Returns the path to the plugin run profiles (JSON lines) file"""
+    return os.path.join(user_path(), "plugin_profiles.jsonl")
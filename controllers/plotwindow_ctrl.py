@@ -7,17 +7,26 @@ __author__ = 'Chris R. Coughlin'
 from views import dialogs
 from views import fetchplugin_dialog
 from views import colormapcreator
+from views import blitmanager
+from controllers import pathfinder
 from models import mainmodel
+from models import cinerenderer
 from models import dataio
+from models import decimation
+from models import pipeline
+from models import runprofile
 from models import ndescanhandler
+from models import workerthread
 import models.plotwindow_model as model
 import matplotlib
 import matplotlib.axes
+import numpy as np
 import wx
 import wx.lib.dialogs
 from functools import wraps
 import os.path
 import Queue
+import threading
 
 module_logger = mainmodel.get_logger(__name__)
 
@@ -35,8 +44,12 @@ def replace_plot(fn):
                 for ax in self.view.axes:
                     ax.hold()
             fn(self, *args, **kwargs)
-            self.plot(self.model.data)
-            self.refresh_plot()
+            run_profile = getattr(self, 'run_profile', None)
+            with runprofile.stage(run_profile, 'replot'):
+                self.plot(self.model.data)
+                self.refresh_plot()
+            if run_profile is not None:
+                self.finish_profile()
 
             if isinstance(self.view.axes, matplotlib.axes.Subplot):
                 self.view.axes.hold()
@@ -53,6 +66,7 @@ class BasicPlotWindowController(object):
     def __init__(self, view, data_file):
         self.view = view
         self.axes_grid = True
+        self.run_profile = None
         self.model = model.BasicPlotWindowModel(self, data_file)
         self.init_plot_defaults()
         module_logger.info("Successfully initialized BasicPlotWindowController.")
@@ -145,8 +159,11 @@ class BasicPlotWindowController(object):
             cfg = self.configure_plugin_dlg(plugin_instance)
             if cfg is None:
                 return
+        self.run_profile = runprofile.RunProfile(plugin_cls.__name__, data_bytes=runprofile.data_size(self.data))
         try:
-            plugin_process, plugin_queue, exception_queue = mainmodel.run_plugin(plugin_cls, self.data, cfg, **kwargs)
+            plugin_process, plugin_queue, exception_queue = self.start_plugin(mainmodel.run_plugin, plugin_cls,
+                                                                              self.data, cfg, profile=self.run_profile,
+                                                                              **kwargs)
         except MemoryError as err: # Insufficient memory to run plugin with current data
             err_dlg = wx.MessageDialog(self.view, message="Insufficient memory to run plugin.",
                                        caption="Unable To Run Plugin",
@@ -154,6 +171,54 @@ class BasicPlotWindowController(object):
             err_dlg.ShowModal()
             err_dlg.Destroy()
             return
+        self.monitor_plugin(plugin_process, plugin_queue, exception_queue)
+
+    def start_plugin(self, start_fn, *args, **kwargs):
+        """Calls start_fn(*args, **kwargs) (mainmodel.run_plugin or run_pipeline) in a separate thread, since
+        checking the result cache hashes the data.  Returns start_fn's (process, queue, exception queue) tuple;
+        exceptions raised by start_fn are re-raised."""
+        exception_queue = Queue.Queue()
+        return_queue = Queue.Queue()
+        start_thd = workerthread.WorkerThread(exception_queue=exception_queue, return_queue=return_queue,
+                                              target=start_fn, args=args, kwargs=kwargs)
+        progress_dlg = wx.ProgressDialog("Running Plugin", "Please wait, checking for previous results...",
+                                         parent=self.view, style=wx.PD_APP_MODAL)
+        start_thd.start()
+        try:
+            while start_thd.is_alive():
+                start_thd.join(0.125)
+                progress_dlg.Pulse()
+                wx.GetApp().Yield()
+        finally:
+            progress_dlg.Destroy()
+        try:
+            exc_type, exc = exception_queue.get(block=False)
+            raise exc
+        except Queue.Empty:
+            pass
+        return return_queue.get(block=False)
+
+    def finish_profile(self):
+        """Adds the stages run in the plugin's process to the current plugin run profile,
+        writes a summary to the log and saves the profile"""
+        run_profile, self.run_profile = self.run_profile, None
+        run_profile.collect()
+        run_profile.finish()
+        module_logger.info("Plugin run profile:\n{0}".format(run_profile.summary()))
+        try:
+            run_profile.save()
+        except IOError as err:
+            module_logger.warning("Unable to save plugin run profile: {0}".format(err))
+
+    def monitor_plugin(self, plugin_process, plugin_queue, exception_queue):
+        """Displays a progress dialog while the plugin (or pipeline) running in plugin_process
+        executes.  Replaces the current data with the results returned in plugin_queue, or
+        displays any errors returned in exception_queue."""
+        with runprofile.stage(getattr(self, 'run_profile', None), 'wait for results'):
+            self.show_plugin_progress(plugin_process, plugin_queue, exception_queue)
+
+    def show_plugin_progress(self, plugin_process, plugin_queue, exception_queue):
+        """Polls the plugin's queues until results or an error are returned or the user cancels"""
         keepGoing = True
         try:
             progress_dlg = wx.ProgressDialog("Running Plugin",
@@ -163,20 +228,16 @@ class BasicPlotWindowController(object):
             while keepGoing:
                 wx.MilliSleep(125)
                 (keepGoing, skip) = progress_dlg.UpdatePulse()
+                # Check for results first - results retrieved from the result cache are returned
+                # without starting a process
                 try:
-                    if not plugin_process.is_alive():
-                        # Catch low-level exceptions thrown by multiprocessing, such as MemoryError
-                        # exceptions raised when attempting to send data through the queue
-                        module_logger.error("Unknown error occurred during plugin execution, plugin terminated")
-                        err_msg = ' '.join(["An unknown error has occurred running the plugin.",
-                                            "Please ensure your system has sufficient memory and disk space to process this data.",
-                                            "If the problem persists, please contact the plugin's author."])
-                        err_dlg = wx.MessageDialog(self.view, message=err_msg,
-                                                   caption="Unable To Run Plugin",
-                                                   style=wx.ICON_ERROR)
-                        err_dlg.ShowModal()
-                        err_dlg.Destroy()
+                    returned_data = plugin_queue.get(False)
+                    if returned_data is not None:
+                        self.model.data = returned_data
                         break
+                except Queue.Empty:
+                    pass
+                try:
                     exc_type, exc = exception_queue.get(block=False)
                     err_str = str(exc)
                     if len(err_str) == 0:
@@ -191,12 +252,18 @@ class BasicPlotWindowController(object):
                     break
                 except Queue.Empty:
                     pass
-                try:
-                    returned_data = plugin_queue.get(False)
-                except Queue.Empty:
-                    continue
-                if returned_data is not None:
-                    self.model.data = returned_data
+                if not plugin_process.is_alive() and plugin_queue.empty() and exception_queue.empty():
+                    # Catch low-level exceptions thrown by multiprocessing, such as MemoryError
+                    # exceptions raised when attempting to send data through the queue
+                    module_logger.error("Unknown error occurred during plugin execution, plugin terminated")
+                    err_msg = ' '.join(["An unknown error has occurred running the plugin.",
+                                        "Please ensure your system has sufficient memory and disk space to process this data.",
+                                        "If the problem persists, please contact the plugin's author."])
+                    err_dlg = wx.MessageDialog(self.view, message=err_msg,
+                                               caption="Unable To Run Plugin",
+                                               style=wx.ICON_ERROR)
+                    err_dlg.ShowModal()
+                    err_dlg.Destroy()
                     break
                 if not keepGoing:
                     break
@@ -205,6 +272,78 @@ class BasicPlotWindowController(object):
             plugin_process.join()
             progress_dlg.Destroy()
 
+    def on_run_pipeline(self, evt):
+        """Handles request to run a saved plugin pipeline"""
+        file_dlg = wx.FileDialog(parent=self.view,
+                                 message="Please select a pipeline to run.",
+                                 defaultDir=pathfinder.pipelines_path(),
+                                 wildcard="Pipeline files (*.json)|*.json|All files (*.*)|*.*")
+        if file_dlg.ShowModal() == wx.ID_OK:
+            try:
+                plugin_pipeline = pipeline.PluginPipeline.from_file(file_dlg.GetPath())
+            except Exception as err:
+                module_logger.error("Unable to load pipeline: {0}".format(err))
+                err_dlg = wx.MessageDialog(self.view, message="{0}".format(err),
+                                           caption="Unable To Load Pipeline", style=wx.ICON_ERROR)
+                err_dlg.ShowModal()
+                err_dlg.Destroy()
+            else:
+                module_logger.info("Attempt to run pipeline {0}".format(plugin_pipeline.name))
+                self.run_pipeline(plugin_pipeline)
+        file_dlg.Destroy()
+
+    def on_create_pipeline(self, evt):
+        """Handles request to create and save a new plugin pipeline.  The user selects
+        and configures each plugin in turn; the pipeline is complete when the user
+        cancels the plugin selection."""
+        plugin_pipeline = pipeline.PluginPipeline()
+        plugins = [plugin for plugin_id, plugin in sorted(self.available_plugins.items())]
+        plugin_names = [plugin[1].name for plugin in plugins]
+        while True:
+            msg = "Select plugin #{0} in the pipeline, or Cancel to finish.".format(len(plugin_pipeline.steps) + 1)
+            choice_dlg = wx.SingleChoiceDialog(parent=self.view, message=msg, caption="Create Pipeline",
+                                               choices=plugin_names)
+            if choice_dlg.ShowModal() != wx.ID_OK:
+                choice_dlg.Destroy()
+                break
+            plugin_cls = plugins[choice_dlg.GetSelection()][1]
+            choice_dlg.Destroy()
+            cfg = None
+            plugin_instance = plugin_cls()
+            if hasattr(plugin_instance, "config"):
+                cfg = self.configure_plugin_dlg(plugin_instance)
+                if cfg is None:
+                    continue
+            plugin_pipeline.add_step(plugin_cls, cfg)
+        if len(plugin_pipeline.steps) > 0:
+            file_dlg = wx.FileDialog(parent=self.view, message="Please specify a filename for the pipeline.",
+                                     defaultDir=pathfinder.pipelines_path(),
+                                     wildcard="Pipeline files (*.json)|*.json", style=wx.SAVE | wx.OVERWRITE_PROMPT)
+            if file_dlg.ShowModal() == wx.ID_OK:
+                pipeline_fname = file_dlg.GetPath()
+                if not pipeline_fname.lower().endswith(pipeline.pipeline_ext):
+                    pipeline_fname += pipeline.pipeline_ext
+                plugin_pipeline.save(pipeline_fname)
+            file_dlg.Destroy()
+
+    @replace_plot
+    def run_pipeline(self, plugin_pipeline):
+        """Runs the PluginPipeline plugin_pipeline on current data set, replaces
+        current data with the results of the last step and refreshes plot"""
+        self.run_profile = runprofile.RunProfile(plugin_pipeline.name, data_bytes=runprofile.data_size(self.data))
+        try:
+            plugin_process, plugin_queue, exception_queue = self.start_plugin(mainmodel.run_pipeline,
+                                                                              plugin_pipeline, self.data,
+                                                                              profile=self.run_profile)
+        except MemoryError as err: # Insufficient memory to run pipeline with current data
+            err_dlg = wx.MessageDialog(self.view, message="Insufficient memory to run pipeline.",
+                                       caption="Unable To Run Pipeline",
+                                       style=wx.ICON_ERROR)
+            err_dlg.ShowModal()
+            err_dlg.Destroy()
+            return
+        self.monitor_plugin(plugin_process, plugin_queue, exception_queue)
+
     def on_close(self, evt):
         """Handles request to close plot window"""
         self.view.Destroy()
@@ -331,9 +470,45 @@ class PlotWindowController(BasicPlotWindowController):
         self.model = model.PlotWindowModel(self, data_file)
         self.gates = {}
         self.get_gates()
+        # Long 1D data are decimated to the width of the plot - see plot_line
+        self.decimator = None
+        self.decimated_data = None
+        self.line = None
+        self.xlim_cid = None
         self.init_plot_defaults()
         module_logger.info("PlotWindowController successfully initialized.")
 
+    def show_plugin_progress(self, plugin_process, plugin_queue, exception_queue):
+        """Polls the plugin's queues until results or an error are returned or the user cancels.
+        The decimated line is discarded in case the plugin modified the data in place."""
+        super(PlotWindowController, self).show_plugin_progress(plugin_process, plugin_queue, exception_queue)
+        self.decimator = None
+
+    def plot_width(self):
+        """Returns the width of the plot in pixels"""
+        return int(self.view.axes.bbox.width) or None
+
+    def plot_line(self, data):
+        """Plots the 1D or X, Y data decimated to the width of the plot, i.e. the minimum and maximum of the
+        data in each pixel are drawn.  The line is decimated again when the plot is zoomed or panned."""
+        if self.decimator is None or self.decimated_data is not data:
+            if data.ndim == 1:
+                self.decimator = decimation.MinMaxDecimator(data)
+            else:
+                self.decimator = decimation.MinMaxDecimator(data[0], data[1])
+            self.decimated_data = data
+        self.line, = self.view.axes.plot(*self.decimator.decimate(num_pixels=self.plot_width()))
+        # Replots clear the axes' callbacks, but not if the axes are held
+        if self.xlim_cid is not None:
+            self.view.axes.callbacks.disconnect(self.xlim_cid)
+        self.xlim_cid = self.view.axes.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def on_xlim_changed(self, axes):
+        """Decimates the line to the new X axis limits"""
+        if self.line is not None and self.decimator is not None:
+            x0, x1 = axes.get_xlim()
+            self.line.set_data(*self.decimator.decimate(x0, x1, self.plot_width()))
+
     def plot(self, data):
         """Plots the dataset"""
         if data is not None:
@@ -342,10 +517,10 @@ class PlotWindowController(BasicPlotWindowController):
                 # save current values to reset after the replot
                 titles = self.get_titles()
                 if data.ndim == 1:
-                    self.view.axes.plot(data)
+                    self.plot_line(data)
                 elif data.ndim == 2:
                     if 2 in data.shape: # Assume data is X, Y
-                        self.view.axes.plot(data[0], data[1])
+                        self.plot_line(data)
                     else:
                         slice_dlg = dialogs.LinearSliceDialog(parent=self.view, data_shape=data.shape,
                                                               title="Select Axis To Plot")
@@ -642,7 +817,11 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
         self.ypos = 0
         self.axes_grid = True
         self.model = model.MegaPlotWindowModel(self, data_file)
+        self.scnr = None
+        self.cine = None
+        self.cine_timer = None
         self.colorbar = None
+        self._blit_manager = None
         self.gate_coords = [None, None]
         self.gates = {}
         self.get_gates()
@@ -659,10 +838,28 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
             self.conventional_bscans = False
         self.use_colorbar = self.get_colorbar_config()
 
+    def on_close(self, evt):
+        """Handles request to close plot window, stopping cine playback"""
+        self.stop_cine(replot=False)
+        self.view.Destroy()
+
+    def show_plugin_progress(self, plugin_process, plugin_queue, exception_queue):
+        """Polls the plugin's queues until results or an error are returned or the user cancels.
+        Cached C scans and slices are discarded in case the plugin modified the data in place."""
+        super(MegaPlotWindowController, self).show_plugin_progress(plugin_process, plugin_queue, exception_queue)
+        if self.scnr is not None:
+            self.scnr.invalidate()
+
     def plot(self, data):
         """Plots the dataset"""
         if data is not None:
-            self.scnr = ndescanhandler.NDEScanHandler(self.data)
+            if self.cine is not None:
+                self.stop_cine(replot=False)
+            # Keep the scan handler (and its cache of C scans and slices) unless the data have been replaced
+            if self.scnr is None:
+                self.scnr = ndescanhandler.NDEScanHandler(self.data, quantile_mode=self.get_quantile_mode_config())
+            else:
+                self.scnr.set_data(self.data)
             try:
                 if self.view.slice_cb.IsChecked():
                     self.plot_cscan(self.scnr.cscan_data(self.slice_idx), self.slice_idx)
@@ -681,41 +878,93 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
                 err_dlg.ShowModal()
                 err_dlg.Destroy()
 
+    @property
+    def blit_manager(self):
+        """Returns the BlitManager that redraws the A and B scans without redrawing the whole figure"""
+        if self._blit_manager is None:
+            self._blit_manager = blitmanager.BlitManager(self.view.canvas)
+        return self._blit_manager
+
+    def reuse_artist(self, axes, artists, new_data, title):
+        """Updates the plotted artists (list of one line or image) in axes with new_data and sets the axes title.
+        Returns False if the artists can't be reused (e.g. they've been cleared or a line has to become an
+        image), in which case nothing is changed."""
+        if not artists or len(artists) != 1:
+            return False
+        artist = artists[0]
+        if new_data.ndim == 1 and artist in axes.lines and len(artist.get_xdata()) == len(new_data):
+            artist.set_ydata(new_data)
+        elif new_data.ndim == 2 and artist in axes.images and artist.get_array().shape == new_data.shape:
+            artist.set_data(new_data)
+            artist.set_cmap(self.colormap)
+            artist.autoscale()
+        else:
+            return False
+        axes.title.set_text(title)
+        return True
+
+    def rescale_line(self, axes, line_data):
+        """Expands the y limits of axes if required to show line_data.  Returns True if the limits
+        changed, i.e. the axes have to be redrawn rather than blitted."""
+        finite_data = line_data[np.isfinite(line_data)]
+        if finite_data.size == 0:
+            return False
+        ymin, ymax = axes.get_ylim()
+        data_min, data_max = finite_data.min(), finite_data.max()
+        if data_min >= ymin and data_max <= ymax:
+            return False
+        axes.set_ylim(min(ymin, data_min), max(ymax, data_max))
+        return True
+
+    def plot_line_or_image(self, axes, plot_data, title):
+        """Clears axes and plots plot_data as a line (1D) or image (2D) with the specified title.  The new
+        artists and title are redrawn by blitting (see blit_manager).  Returns the new artists."""
+        axes.cla()
+        if plot_data.ndim == 1:
+            artists = axes.plot(plot_data)
+        else:
+            artists = [axes.imshow(plot_data, aspect='auto', origin='lower', cmap=self.colormap,
+                                   interpolation='nearest')]
+        axes.autoscale_view(tight=True)
+        axes.set_title(title)
+        self.blit_manager.animate(axes, artists + [axes.title])
+        return artists
+
     def plot_ascan(self, ascan_data, xpos, ypos):
-        """Plots the provided A-scan data"""
-        self.view.ascan_axes.cla()
-        self.view.ascan_plt = self.view.ascan_axes.plot(ascan_data)
-        self.view.ascan_axes.autoscale_view(tight=True)
-        self.view.ascan_axes.set_title("A Scan x={0} y={1}".format(xpos, ypos))
+        """Plots the provided A-scan data, reusing the current A-scan plot where possible.  Returns True if
+        the A-scan axes were rebuilt or rescaled (i.e. the figure has to be redrawn)."""
+        title = "A Scan x={0} y={1}".format(xpos, ypos)
+        if self.reuse_artist(self.view.ascan_axes, getattr(self.view, 'ascan_plt', None), ascan_data, title):
+            return self.rescale_line(self.view.ascan_axes, ascan_data)
+        self.view.ascan_plt = self.plot_line_or_image(self.view.ascan_axes, ascan_data, title)
+        for gate_coord in self.gate_coords:
+            if gate_coord is not None:
+                self.view.ascan_axes.axvline(x=gate_coord, color='r', linestyle='--')
+        return True
 
     def plot_hbscan(self, hbscan_data, ypos, slice_idx=None):
         """Plots the provided horizontal B-scan data.  If plotting a conventional Bscan, the slice_idx parameter
-        can be omitted."""
-        self.view.hbscan_axes.cla()
+        can be omitted.  Returns True if the horizontal B-scan axes were rebuilt or rescaled."""
         if hbscan_data.ndim == 1:
-            self.view.hbscan_plt = self.view.hbscan_axes.plot(hbscan_data)
-            self.view.hbscan_axes.set_title("Horizontal B Scan y={0} z={1}".format(ypos, slice_idx))
+            title = "Horizontal B Scan y={0} z={1}".format(ypos, slice_idx)
         else:
-            self.view.hbscan_plt = self.view.hbscan_axes.imshow(hbscan_data, aspect='auto',
-                                                                origin='lower', cmap=self.colormap,
-                                                                interpolation='nearest')
-            self.view.hbscan_axes.set_title("Horizontal B Scan y={0}".format(ypos))
-        self.view.hbscan_axes.autoscale_view(tight=True)
-
+            title = "Horizontal B Scan y={0}".format(ypos)
+        if self.reuse_artist(self.view.hbscan_axes, getattr(self.view, 'hbscan_plt', None), hbscan_data, title):
+            return hbscan_data.ndim == 1 and self.rescale_line(self.view.hbscan_axes, hbscan_data)
+        self.view.hbscan_plt = self.plot_line_or_image(self.view.hbscan_axes, hbscan_data, title)
+        return True
 
     def plot_vbscan(self, vbscan_data, xpos, slice_idx=None):
         """Plots the provided vertical B-scan data.  If plotting a conventional Bscan, the slice_idx parameter
-        can be omitted."""
-        self.view.vbscan_axes.cla()
+        can be omitted.  Returns True if the vertical B-scan axes were rebuilt or rescaled."""
         if vbscan_data.ndim == 1:
-            self.view.vbscan_plt = self.view.vbscan_axes.plot(vbscan_data)
-            self.view.vbscan_axes.set_title("Vertical B Scan x={0} z={1}".format(xpos, slice_idx))
+            title = "Vertical B Scan x={0} z={1}".format(xpos, slice_idx)
         else:
-            self.view.vbscan_plt = self.view.vbscan_axes.imshow(vbscan_data, aspect='auto',
-                                                                origin='lower', cmap=self.colormap,
-                                                                interpolation='nearest')
-            self.view.vbscan_axes.set_title("Vertical B Scan x={0}".format(xpos))
-        self.view.vbscan_axes.autoscale_view(tight=True)
+            title = "Vertical B Scan x={0}".format(xpos)
+        if self.reuse_artist(self.view.vbscan_axes, getattr(self.view, 'vbscan_plt', None), vbscan_data, title):
+            return vbscan_data.ndim == 1 and self.rescale_line(self.view.vbscan_axes, vbscan_data)
+        self.view.vbscan_plt = self.plot_line_or_image(self.view.vbscan_axes, vbscan_data, title)
+        return True
 
     def plot_cscan(self, cscan_data, slice_idx):
         """Plots the supplied C-scan data"""
@@ -856,7 +1105,7 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
         """Handles toggle of enable/disable colorbar display"""
         use_colorbar = not self.get_colorbar_config()
         self.set_colorbar_config(use_colorbar)
-        self.update_plot()
+        self.update_plot(redraw=True)
 
     def set_colorbar_config(self, colorbar_enabled):
         """Sets the enable colorbar option in the config"""
@@ -871,8 +1120,126 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
             return cfg.get_boolean("MegaPlot", "show_colorbar")
         return False
 
+    def on_toggle_approx_quantiles(self, evt):
+        """Handles toggle of exact / approximate median and percentile C scans"""
+        if self.get_quantile_mode_config() == ndescanhandler.APPROXIMATE:
+            quantile_mode = ndescanhandler.EXACT
+        else:
+            quantile_mode = ndescanhandler.APPROXIMATE
+        self.set_quantile_mode_config(quantile_mode)
+
+    def set_quantile_mode_config(self, quantile_mode):
+        """Sets the median and percentile C scan mode (one of ndescanhandler.quantile_modes) in the config"""
+        cfg = mainmodel.get_config()
+        cfg.set("MegaPlot", {"quantiles":quantile_mode})
+        if self.scnr is not None:
+            self.scnr.quantile_mode = quantile_mode
+
+    def get_quantile_mode_config(self):
+        """Returns the median and percentile C scan mode setting from config (defaults to exact)."""
+        cfg = mainmodel.get_config()
+        if cfg.has_option("MegaPlot", "quantiles"):
+            quantile_mode = cfg.get("MegaPlot", "quantiles")
+            if quantile_mode in ndescanhandler.quantile_modes:
+                return quantile_mode
+        return ndescanhandler.EXACT
+
+    def get_cine_frame_rate_config(self):
+        """Returns the cine playback frame rate (frames per second) setting from config."""
+        cfg = mainmodel.get_config()
+        if cfg.has_option("MegaPlot", "cine frame rate"):
+            try:
+                frame_rate = float(cfg.get("MegaPlot", "cine frame rate"))
+                if frame_rate > 0:
+                    return frame_rate
+            except ValueError:
+                pass
+        return cinerenderer.default_frame_rate
+
+    def set_cine_frame_rate_config(self, frame_rate):
+        """Sets the cine playback frame rate (frames per second) in the config"""
+        cfg = mainmodel.get_config()
+        cfg.set("MegaPlot", {"cine frame rate":frame_rate})
+        if self.cine_timer is not None and self.cine_timer.IsRunning():
+            self.cine_timer.Start(max(1, int(1000 / frame_rate)))
+
+    def on_set_cine_frame_rate(self, evt):
+        """Handles request to set the cine playback frame rate"""
+        try:
+            frame_rate = self.get_float("Please specify the playback frame rate (frames per second).",
+                                        "Cine Frame Rate")
+            if frame_rate is not None:
+                if frame_rate <= 0:
+                    raise ValueError("Frame rate must be greater than 0")
+                self.set_cine_frame_rate_config(frame_rate)
+        except ValueError as err:
+            module_logger.error("Unable to set cine frame rate: {0}".format(err))
+            err_dlg = wx.MessageDialog(self.view, message="{0}".format(err),
+                                       caption="Unable To Set Frame Rate", style=wx.ICON_ERROR)
+            err_dlg.ShowModal()
+            err_dlg.Destroy()
+
+    def on_toggle_cine(self, evt):
+        """Handles request to start or stop cine playback through the Z slices"""
+        if self.view.cine_tb.GetValue():
+            self.start_cine()
+        else:
+            self.stop_cine()
+
+    def start_cine(self):
+        """Starts playing the Z slices as the C scan from the current slice index.  Frames are rendered
+        ahead of playback with the current colormap and color scale (see cinerenderer) and blitted."""
+        if self.model.data is None or self.scnr is None:
+            self.view.cine_tb.SetValue(False)
+            return
+        if not self.view.slice_cb.IsChecked():
+            self.view.slice_cb.SetValue(True)
+            self.update_plot(redraw=True)
+        self.cine = cinerenderer.CineRenderer(self.scnr, self.colormap, self.view.cscan_img.get_clim())
+        self.cine.start(self.slice_idx)
+        self.blit_manager.animate(self.view.cscan_axes, [self.view.cscan_img, self.view.cscan_axes.title])
+        self.refresh_plot()
+        if self.cine_timer is None:
+            self.cine_timer = wx.Timer(self.view)
+            self.view.Bind(wx.EVT_TIMER, self.on_cine_timer, self.cine_timer)
+        self.cine_timer.Start(max(1, int(1000 / self.get_cine_frame_rate_config())))
+
+    def stop_cine(self, replot=True):
+        """Stops cine playback and, if replot is True, replots the current Z slice"""
+        if self.cine_timer is not None:
+            self.cine_timer.Stop()
+        if self.cine is not None:
+            self.cine.stop()
+            self.cine = None
+            self.blit_manager.remove(self.view.cscan_axes)
+        self.view.cine_tb.SetValue(False)
+        if replot:
+            self.update_plot(redraw=True)
+
+    def on_cine_timer(self, evt):
+        """Shows the next frame of cine playback"""
+        if self.cine is not None:
+            slice_idx = self.cine.next_index(self.slice_idx)
+            if slice_idx is None:
+                self.stop_cine()
+            else:
+                self.show_cine_frame(slice_idx)
+
+    def show_cine_frame(self, slice_idx):
+        """Blits the cine frame of the Z slice slice_idx to the C scan plot"""
+        self.slice_idx = slice_idx
+        self.cine.seek(slice_idx)
+        self.view.cscan_img.set_data(self.cine.frame(slice_idx))
+        self.view.cscan_axes.set_title("C Scan z={0}".format(slice_idx))
+        self.view.slice_sc.SetValue(slice_idx)
+        self.blit_manager.update([self.view.cscan_axes])
+
     def on_sliceidx_change(self, evt):
         """Responds to changes in the z position spin control"""
+        if self.cine is not None:
+            # Scrub through the cine frames
+            self.show_cine_frame(self.view.slice_sc.GetValue())
+            return
         self.update_plot(self.view.xpos_sc.GetValue(), self.view.ypos_sc.GetValue(),
                          self.view.slice_sc.GetValue())
 
@@ -880,12 +1247,21 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
         """Responds to changes in the x position and y position spin controls"""
         self.update_plot(self.view.xpos_sc.GetValue(), self.view.ypos_sc.GetValue())
 
-    @replace_plot
-    def update_plot(self, xpos=None, ypos=None, slice_idx=None):
+    def update_plot(self, xpos=None, ypos=None, slice_idx=None, redraw=False):
         """Updates the A and B scans based on the provided (x,y) position in the data.  If xpos and/or ypos
         are None (default), A and B scans are updated on the last (x,y) position selected by the user.
         If slice_idx is provided the C scan plot is updated to that position, default is to leave unchanged if
-        slice_idx is None."""
+        slice_idx is None.
+
+        The A and B scan plots are updated in place and only their axes are redrawn (see blit_manager);
+        the whole figure is redrawn if the C scan changes, the A or B scan axes have to be rebuilt or rescaled,
+        or redraw is True."""
+        if self.model.data is None:
+            return
+        if self.cine is not None:
+            # The C scan has to be replotted from the data for the B scans
+            self.stop_cine(replot=False)
+            redraw = True
         if xpos is None:
             xpos = self.xpos
         else:
@@ -896,17 +1272,20 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
             self.ypos = ypos
         self.view.xpos_sc.SetValue(xpos)
         self.view.ypos_sc.SetValue(ypos)
-        self.plot_ascan(self.scnr.ascan_data(xpos, ypos), xpos, ypos)
-        if self.conventional_bscans is False:
-            self.plot_hbscan(self.view.cscan_img.get_array()[ypos, :], slice_idx=self.slice_idx, ypos=ypos)
-            self.plot_vbscan(self.view.cscan_img.get_array()[:, xpos], slice_idx=self.slice_idx, xpos=xpos)
-        else:
-            self.plot_hbscan(self.scnr.hbscan_data(ypos).T, ypos)
-            self.plot_vbscan(self.scnr.vbscan_data(xpos), xpos)
         if slice_idx is not None:
+            redraw = redraw or (slice_idx != self.slice_idx and self.view.slice_cb.IsChecked())
             self.slice_idx = slice_idx
-            if self.view.slice_cb.IsChecked():
-                self.plot_cscan(self.scnr.cscan_data(self.slice_idx), self.slice_idx)
+        if redraw:
+            self.plot(self.model.data)
+        redraw = self.plot_ascan(self.scnr.ascan_data(xpos, ypos), xpos, ypos) or redraw
+        if self.conventional_bscans is False:
+            redraw = self.plot_hbscan(self.view.cscan_img.get_array()[ypos, :], slice_idx=self.slice_idx,
+                                      ypos=ypos) or redraw
+            redraw = self.plot_vbscan(self.view.cscan_img.get_array()[:, xpos], slice_idx=self.slice_idx,
+                                      xpos=xpos) or redraw
+        else:
+            redraw = self.plot_hbscan(self.scnr.hbscan_data(ypos).T, ypos) or redraw
+            redraw = self.plot_vbscan(self.scnr.vbscan_data(xpos), xpos) or redraw
         if not self.use_colorbar:
             if self.colorbar:
                 # In MegaPlot the colorbar is the fifth AxesSubplot if present -
@@ -914,10 +1293,11 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
                 if len(self.view.figure.axes) == 5:
                     self.view.figure.delaxes(self.view.figure.axes[4])
                     self.view.figure.subplots_adjust(right=0.90)
-        if self.gate_coords != [None, None]:
-            self.view.ascan_axes.axvline(x=self.gate_coords[0], color='r', linestyle='--')
-            self.view.ascan_axes.axvline(x=self.gate_coords[1], color='r', linestyle='--')
-        self.refresh_plot()
+                    redraw = True
+        if redraw:
+            self.refresh_plot()
+        else:
+            self.blit_manager.update([self.view.ascan_axes, self.view.hbscan_axes, self.view.vbscan_axes])
 
     def on_select_cmap(self, evt):
         """Generates a list of available matplotlib colormaps and sets the plot's
@@ -937,7 +1317,7 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
                 cfg.set("ImgPlot", {"colormap":colormap})
             if self.view.cscan_img is not None:
                 self.view.cscan_img.set_cmap(self.colormap)
-                self.update_plot()
+                self.update_plot(redraw=True)
 
     @replace_plot
     def on_toggle_grid(self, evt):
@@ -968,6 +1348,44 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
         self.view.slice_cb.SetValue(False)
         self.define_cscan()
 
+    def compute_cscan(self, cscan_fn, *args, **kwargs):
+        """Generates a C scan with cscan_fn(*args, **kwargs) (e.g. the scan handler's gen_cscan) in a
+        separate thread while displaying its progress.  Returns the results, or None if the user cancelled.
+        Exceptions raised generating the C scan are re-raised."""
+        exception_queue = Queue.Queue()
+        return_queue = Queue.Queue()
+        progress_queue = Queue.Queue()
+        cancel_event = threading.Event()
+        kwargs.update({'progress_fn': progress_queue.put, 'cancel_event': cancel_event})
+        cscan_thd = workerthread.WorkerThread(exception_queue=exception_queue, return_queue=return_queue,
+                                              target=cscan_fn, args=args, kwargs=kwargs)
+        progress_dlg = wx.ProgressDialog("Generating C Scan", "Please wait, generating C scan...",
+                                         parent=self.view, style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME)
+        cscan_thd.start()
+        try:
+            progress = 0
+            while cscan_thd.is_alive():
+                cscan_thd.join(0.125)
+                try:
+                    while True:
+                        progress = int(100 * progress_queue.get(block=False))
+                except Queue.Empty:
+                    pass
+                keepGoing, skip = progress_dlg.Update(min(progress, 99))
+                if not keepGoing:
+                    cancel_event.set()
+                wx.GetApp().Yield()
+        finally:
+            progress_dlg.Destroy()
+        try:
+            exc_type, exc = exception_queue.get(block=False)
+            raise exc
+        except Queue.Empty:
+            pass
+        if cancel_event.is_set():
+            return None
+        return return_queue.get(block=False)
+
     @replace_plot
     def define_cscan(self):
         """Specify a range of data and a function
@@ -977,18 +1395,32 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
             if rng_dlg.ShowModal() == wx.ID_OK:
                 try:
                     start_pos, end_pos = rng_dlg.GetValue()
+                    fn_names = self.scnr.available_cscan_function_names + ["Percentile"]
                     fn_dlg = wx.SingleChoiceDialog(parent=self.view, caption="Choose C Scan Function",
                                                    message="Please choose a function to generate the C Scan data.",
-                                                   choices=self.scnr.available_cscan_function_names)
+                                                   choices=fn_names)
                     if fn_dlg.ShowModal() == wx.ID_OK:
-                        wx.BeginBusyCursor()
-                        cscan_data = self.scnr.gen_cscan(start_pos, end_pos,
-                                                         fn=self.scnr.available_cscan_functions[fn_dlg.GetSelection()])
-                        self.plot_cscan(cscan_data, self.slice_idx)
-                        plot_title = "C Scan {0} z={1}:{2}".format(
-                            self.scnr.available_cscan_function_names[fn_dlg.GetSelection()], start_pos, end_pos)
-                        self.set_titles(self.view.cscan_axes, plot=plot_title)
-                        wx.EndBusyCursor()
+                        fn_idx = fn_dlg.GetSelection()
+                        fn_name = fn_names[fn_idx]
+                        is_percentile = fn_idx == len(self.scnr.available_cscan_functions)
+                        if is_percentile:
+                            q = self.get_float("Please specify the percentile (0-100).", "Percentile")
+                            if q is None:
+                                return
+                            if not 0 <= q <= 100:
+                                raise ValueError("Percentile must be between 0 and 100")
+                            cscan_data = self.compute_cscan(self.scnr.gen_quantile_cscan, start_pos, end_pos, q)
+                            fn_name = "{0:g}th Percentile".format(q)
+                        else:
+                            cscan_data = self.compute_cscan(self.scnr.gen_cscan, start_pos, end_pos,
+                                                            self.scnr.available_cscan_functions[fn_idx])
+                        if cscan_data is not None:
+                            self.plot_cscan(cscan_data, self.slice_idx)
+                            if self.scnr.quantile_mode == ndescanhandler.APPROXIMATE and (
+                                    is_percentile or self.scnr.available_cscan_functions[fn_idx] is np.median):
+                                fn_name += " (approx.)"
+                            plot_title = "C Scan {0} z={1}:{2}".format(fn_name, start_pos, end_pos)
+                            self.set_titles(self.view.cscan_axes, plot=plot_title)
                 except ValueError as err:
                     module_logger.error("Unable to generate C-scan: {0}".format(err))
                     err_msg = "{0}".format(err)
@@ -997,4 +1429,152 @@ class MegaPlotWindowController(BasicImgPlotWindowController, PlotWindowControlle
                     err_dlg.ShowModal()
                     err_dlg.Destroy()
                 finally:
-                    rng_dlg.Destroy()
\ No newline at end of file
+                    rng_dlg.Destroy()
+
+    def on_gated_cscan(self, evt):
+        """Handles request to generate a gated peak amplitude or time of flight C scan"""
+        self.view.slice_cb.SetValue(False)
+        self.define_gated_cscan()
+
+    def get_gate_range(self, msg):
+        """Returns the gate (start, stop) clicked on the A-scan, or asks the user for it if the gate hasn't
+        been set.  Returns None if the user cancelled."""
+        if None not in self.gate_coords:
+            return tuple(self.gate_coords)
+        rng_dlg = dialogs.FloatRangeDialog(msg)
+        try:
+            if rng_dlg.ShowModal() == wx.ID_OK:
+                return rng_dlg.GetValue()
+        finally:
+            rng_dlg.Destroy()
+
+    def get_float(self, msg, caption):
+        """Asks the user for a floating point number, returns None if the user cancelled.
+        Raises ValueError if the user's entry isn't a number."""
+        float_dlg = wx.TextEntryDialog(self.view, msg, caption)
+        try:
+            if float_dlg.ShowModal() == wx.ID_OK:
+                return float(float_dlg.GetValue())
+        finally:
+            float_dlg.Destroy()
+
+    @replace_plot
+    def define_gated_cscan(self):
+        """Generates a C scan of the peak amplitude, time of the peak or time of the first threshold crossing
+        of each A-scan in the gate clicked on the A-scan (or specified by the user).  The gate can optionally
+        follow the interface echo, in which case it's positioned relative to the interface echo of each
+        A-scan as it is relative to the interface echo of the current A-scan."""
+        if self.model.data is None:
+            return
+        gated_cscans = [('peak', "Peak Amplitude"), ('peak_time', "Time Of Flight (Peak)"),
+                        ('crossing_time', "Time Of Flight (Threshold Crossing)")]
+        try:
+            gate = self.get_gate_range("Please specify the gate region in Z.")
+            if gate is None:
+                return
+            gate_start, gate_stop = gate
+            choice_dlg = wx.SingleChoiceDialog(parent=self.view, caption="Choose Gated C Scan",
+                                               message="Please choose the gated C scan to generate.",
+                                               choices=[name for key, name in gated_cscans])
+            if choice_dlg.ShowModal() != wx.ID_OK:
+                choice_dlg.Destroy()
+                return
+            cscan_key, cscan_name = gated_cscans[choice_dlg.GetSelection()]
+            choice_dlg.Destroy()
+            threshold = None
+            if cscan_key == 'crossing_time':
+                threshold = self.get_float("Please specify the threshold amplitude.", "Threshold Crossing")
+                if threshold is None:
+                    return
+            interface_gate = None
+            follow_dlg = wx.MessageDialog(self.view, "Should the gate follow the interface echo?",
+                                          "Interface Echo", style=wx.YES_NO | wx.NO_DEFAULT | wx.ICON_QUESTION)
+            follow_interface = follow_dlg.ShowModal() == wx.ID_YES
+            follow_dlg.Destroy()
+            if follow_interface:
+                rng_dlg = dialogs.FloatRangeDialog("Please specify the interface echo search region in Z.")
+                try:
+                    if rng_dlg.ShowModal() != wx.ID_OK:
+                        return
+                    if_start, if_stop = rng_dlg.GetValue()
+                finally:
+                    rng_dlg.Destroy()
+                if_threshold = self.get_float("Please specify the interface echo threshold amplitude.",
+                                              "Interface Echo")
+                if if_threshold is None:
+                    return
+                interface_gate = (if_start, if_stop, if_threshold)
+                # Position the gate relative to the interface echo of the current A-scan
+                ascan = self.scnr.ascan_data(self.xpos, self.ypos).reshape((1, 1, -1))
+                current_interface = ndescanhandler.extract_gated(ascan, 0, 1, interface_gate=interface_gate)
+                interface_time = current_interface['interface_time'][0, 0]
+                if interface_time < 0:
+                    raise ValueError("No interface echo found in the current A-scan between z={0}:{1}".format(
+                        if_start, if_stop))
+                gate_start -= interface_time
+                gate_stop -= interface_time
+            gated_maps = self.compute_cscan(self.scnr.gen_gated_cscan, gate_start, gate_stop, threshold,
+                                            interface_gate=interface_gate)
+            if gated_maps is not None:
+                self.plot_cscan(gated_maps[cscan_key], self.slice_idx)
+                plot_title = "C Scan {0} z={1}:{2}".format(cscan_name, *gate)
+                if interface_gate is not None:
+                    plot_title += " (following interface)"
+                self.set_titles(self.view.cscan_axes, plot=plot_title)
+        except ValueError as err:
+            module_logger.error("Unable to generate gated C-scan: {0}".format(err))
+            err_dlg = wx.MessageDialog(self.view, message="{0}".format(err),
+                                       caption="Unable To Generate C Scan", style=wx.ICON_ERROR)
+            err_dlg.ShowModal()
+            err_dlg.Destroy()
+
+    def on_cscan_features(self, evt):
+        """Handles request to compute C scans of several A-scan features"""
+        self.view.slice_cb.SetValue(False)
+        self.define_cscan_features()
+
+    @replace_plot
+    def define_cscan_features(self):
+        """Computes C scans of the A-scan features chosen by the user over a range of data in a single pass,
+        saves each C scan to the data folder and plots the first"""
+        if self.model.data is not None:
+            rng_dlg = dialogs.FloatRangeDialog("Please specify the index range in Z.")
+            feature_names = ndescanhandler.cscan_features.values()
+            features_dlg = wx.MultiChoiceDialog(self.view, "Please choose the features to compute.",
+                                                "Choose C Scan Features", feature_names)
+            try:
+                if rng_dlg.ShowModal() == wx.ID_OK and features_dlg.ShowModal() == wx.ID_OK:
+                    start_pos, end_pos = rng_dlg.GetValue()
+                    features = [ndescanhandler.cscan_features.keys()[idx] for idx in features_dlg.GetSelections()]
+                    if not features:
+                        return
+                    threshold = None
+                    if 'first_crossing' in features:
+                        threshold_dlg = wx.TextEntryDialog(self.view, "Please specify the threshold amplitude.",
+                                                           "Threshold Crossing")
+                        if threshold_dlg.ShowModal() != wx.ID_OK:
+                            threshold_dlg.Destroy()
+                            return
+                        threshold = float(threshold_dlg.GetValue())
+                        threshold_dlg.Destroy()
+                    feature_maps = self.compute_cscan(self.scnr.gen_cscan_features, start_pos, end_pos, features,
+                                                      threshold)
+                    if feature_maps is not None:
+                        root, ext = os.path.splitext(os.path.basename(self.model.data_file))
+                        for feature in features:
+                            dataio.save_data(os.path.join(pathfinder.data_path(), "_".join([root, "cscan", feature])),
+                                             feature_maps[feature])
+                        self.view.parent.refresh()
+                        self.plot_cscan(feature_maps[features[0]], self.slice_idx)
+                        plot_title = "C Scan {0} z={1}:{2}".format(ndescanhandler.cscan_features[features[0]],
+                                                                   start_pos, end_pos)
+                        self.set_titles(self.view.cscan_axes, plot=plot_title)
+            except ValueError as err:
+                module_logger.error("Unable to generate C-scan features: {0}".format(err))
+                err_dlg = wx.MessageDialog(self.view, message="{0}".format(err),
+                                           caption="Unable To Generate C Scan", style=wx.ICON_ERROR)
+                err_dlg.ShowModal()
+                err_dlg.Destroy()
+            finally:
+                rng_dlg.Destroy()
+                features_dlg.Destroy()
\ No newline at end of file
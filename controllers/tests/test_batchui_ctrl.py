@@ -4,13 +4,20 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 """
 
 import unittest
+from models import batchprefetch
+from models import batchwriter
+from models import config
 from models import dataio
 from models import mainmodel
+from models import runprofile
 from controllers import pathfinder
 from controllers import batchui_ctrl
+import h5py
 import numpy as np
+import json
 import os
 import random
+import shutil
 import tempfile
 
 
@@ -58,6 +65,16 @@ class TestBatchUIController(unittest.TestCase):
         for dataset in expected_utwin_data:
             if expected_utwin_data is not None:
                 self.assertTrue(np.array_equal(expected_utwin_data[dataset], retrieved_utwin_data[dataset]))
+        # Verify comma-delimited text retrieval
+        expected_csv_data = np.arange(12, dtype=np.float64).reshape(3, 4)
+        csv_fd, csv_fname = tempfile.mkstemp(suffix=".csv")
+        os.close(csv_fd)
+        try:
+            np.savetxt(csv_fname, expected_csv_data, delimiter=",")
+            self.assertEqual('csv', batchui_ctrl.get_file_type(csv_fname))
+            self.assertTrue(np.array_equal(expected_csv_data, batchui_ctrl.read_data(csv_fname)))
+        finally:
+            os.remove(csv_fname)
 
 class TestBatchPluginAdapter(unittest.TestCase):
     """Tests the BatchPluginAdapter class"""
@@ -65,6 +82,10 @@ class TestBatchPluginAdapter(unittest.TestCase):
     def setUp(self):
         self.toolkit_class = "MedianFilterPlugin"
         self.datafile = self.create_datafile() # Sample HDF5 data file
+        # Keep cached results, run profiles and batch output out of the user's data folders
+        self.original_user_path = pathfinder.user_path()
+        self.temp_user_path = tempfile.mkdtemp()
+        mainmodel.MainModel("").migrate_user_path(self.temp_user_path)
 
     def tearDown(self):
         if os.path.exists(self.datafile):
@@ -74,6 +95,8 @@ class TestBatchPluginAdapter(unittest.TestCase):
                 pass
             except OSError: # other OS error
                 pass
+        config.Configure(pathfinder.config_path()).set_app_option({"User Path": self.original_user_path})
+        shutil.rmtree(self.temp_user_path, ignore_errors=True)
 
     def create_datafile(self, ext=".hdf5"):
         """Returns a NamedTemporaryFile containing NumPy data.  Caller responsible for deletion."""
@@ -105,6 +128,28 @@ class TestBatchPluginAdapter(unittest.TestCase):
         self.assertTrue(hasattr(adapter.toolkit_instance, 'config'))
         self.assertEqual(adapter.toolkit_instance.config['datafile'], self.datafile)
 
+    def test_init_worker(self):
+        """Verify plugins and toolkit configuration are loaded once per worker and reused"""
+        cfg_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+        cfg_file.write(json.dumps({'kernel size': '5'}))
+        cfg_file.close()
+        try:
+            batchui_ctrl.init_worker(cfg_file.name)
+            available_plugins = batchui_ctrl.get_available_plugins()
+            self.assertIs(available_plugins, batchui_ctrl.get_available_plugins())
+            os.remove(cfg_file.name)
+            # Configuration was parsed when the worker was initialized
+            adapter = batchui_ctrl.BatchPluginAdapter(self.toolkit_class, self.datafile, cfg_file.name)
+            adapter.init_toolkit()
+            self.assertEqual('5', adapter.toolkit_instance.config['kernel size'])
+            self.assertEqual(self.datafile, adapter.toolkit_instance.config['datafile'])
+            adapter.toolkit_instance.config['kernel size'] = '7'
+            self.assertEqual({'kernel size': '5'}, batchui_ctrl.read_toolkit_config(cfg_file.name))
+        finally:
+            batchui_ctrl.worker_cache.clear()
+            if os.path.exists(cfg_file.name):
+                os.remove(cfg_file.name)
+
     def test_get_plugin_class(self):
         """Verify returning the correct plugin class based on name"""
         plugin_names, plugin_classes = self.get_available_plugins()
@@ -148,6 +193,28 @@ class TestBatchPluginAdapter(unittest.TestCase):
             if expected_utwin_data[dataset] is not None:
                 self.assertTrue(np.array_equal(expected_utwin_data[dataset], retrieved_utwin_data[dataset]))
 
+    def test_save_lazy_datasets(self):
+        """Verify only the datasets of a multi-dataset file that were read or replaced are saved"""
+        sample_data_folder = os.path.join(pathfinder.app_path(), 'models', 'tests', 'support_files')
+        sample_utwin_file = os.path.join(sample_data_folder, 'CScanData.csc')
+        adapter = batchui_ctrl.BatchPluginAdapter(self.toolkit_class, sample_utwin_file, save_data=True)
+        adapter.read_data()
+        self.assertTrue(isinstance(adapter.data, dataio.LazyDatasetMap))
+        self.assertListEqual([], adapter.data.loaded_keys)
+        self.assertListEqual([], batchui_ctrl.output_datasets(adapter.data))
+        adapter.data['amplitude0'] = adapter.data['amplitude0'] * 2
+        self.assertListEqual(['amplitude0'], batchui_ctrl.output_datasets(adapter.data))
+        self.assertListEqual(['a', 'b'], sorted(batchui_ctrl.output_datasets({'a': 1, 'b': 2})))
+        output_files = adapter.save()
+        try:
+            root, ext = os.path.splitext(os.path.basename(sample_utwin_file))
+            self.assertListEqual([os.path.join(pathfinder.batchoutput_path(), root + "_amplitude0.hdf5")],
+                                 output_files)
+            self.assertTrue(np.array_equal(adapter.data['amplitude0'], dataio.get_data(output_files[0])))
+        finally:
+            for output_file in output_files:
+                os.remove(output_file)
+
     def test_run(self):
         """Verify correctly executing NDIToolbox plugins"""
         plugin_names, plugin_classes = self.get_available_plugins()
@@ -161,6 +228,39 @@ class TestBatchPluginAdapter(unittest.TestCase):
             returned_data = adapter.data
             self.assertTrue(np.array_equal(expected_data, returned_data))
 
+    def test_run_pipeline(self):
+        """Verify correctly executing a chain of NDIToolbox plugins"""
+        plugin_names, plugin_classes = self.get_available_plugins()
+        chain = ["NormalizePlugin", "MedianFilterPlugin"]
+        expected_data = dataio.get_data(self.datafile)
+        for toolkit in chain:
+            plugin_cls_inst = plugin_classes[plugin_names.index(toolkit)]()
+            plugin_cls_inst._data = expected_data
+            plugin_cls_inst.run()
+            expected_data = plugin_cls_inst._data
+        adapter = batchui_ctrl.BatchPluginAdapter(",".join(chain), self.datafile)
+        adapter.run()
+        self.assertEqual(self.datafile, adapter.toolkit_instance.config['datafile'])
+        self.assertTrue(np.allclose(expected_data, adapter.data))
+
+    def test_run_cached(self):
+        """Verify results are retrieved from the result cache on subsequent runs"""
+        adapter = self.create_adapter(self.datafile)
+        adapter.run()
+        cache_key, cached_data = mainmodel.get_cached_result(type(adapter.toolkit_instance),
+                                                             dataio.get_data(self.datafile),
+                                                             adapter.toolkit_instance.config)
+        self.assertTrue(np.array_equal(adapter.data, cached_data))
+        # Replace the cached results to confirm the toolkit isn't run again
+        substitute_data = np.zeros(5)
+        mainmodel.cache_result(cache_key, substitute_data)
+        cached_adapter = self.create_adapter(self.datafile)
+        cached_adapter.run()
+        self.assertTrue(np.array_equal(substitute_data, cached_adapter.data))
+        uncached_adapter = batchui_ctrl.BatchPluginAdapter(self.toolkit_class, self.datafile, use_cache=False)
+        uncached_adapter.run()
+        self.assertTrue(np.array_equal(adapter.data, uncached_adapter.data))
+
     def test_run_plugin(self):
         """Verify run_plugin convenience function correctly executes"""
         root, ext = os.path.splitext(os.path.basename(self.datafile))
@@ -187,6 +287,80 @@ class TestBatchPluginAdapter(unittest.TestCase):
             except OSError: # other OS error
                 pass
 
+    def test_run_plugin_profile(self):
+        """Verify run_plugin returns the timing and memory use of each stage of the run"""
+        run_profile = batchui_ctrl.run_plugin(self.toolkit_class, self.datafile, save_data=False, use_cache=False)
+        self.assertEqual(self.toolkit_class, run_profile['name'])
+        self.assertEqual('batch', run_profile['source'])
+        self.assertEqual(self.datafile, run_profile['input_file'])
+        stages = [record['stage'] for record in run_profile['stages']]
+        self.assertListEqual(['init toolkit', 'read data', 'run'], stages)
+        self.assertListEqual([], run_profile['output_files'])
+        saved_profiles = runprofile.load_profiles()
+        self.assertTrue(any(profile['started'] == run_profile['started'] for profile in saved_profiles))
+
+    def test_run_plugin_stages(self):
+        """Verify the stages of run_plugin can be run in a prefetching pipeline"""
+        scheduler = batchprefetch.PrefetchScheduler(batchui_ctrl.load_plugin_run, batchui_ctrl.process_plugin_run,
+                                                    batchui_ctrl.finish_plugin_run, memory_budget=None)
+        for idx in range(3):
+            scheduler.add_job(self.datafile, kwds={'toolkit': self.toolkit_class, 'input_file': self.datafile,
+                                                   'save_data': False, 'use_cache': False})
+        for job in scheduler.run():
+            self.assertIsNone(job.error)
+            stages = [record['stage'] for record in job.result['stages']]
+            self.assertListEqual(['init toolkit', 'read data', 'run'], stages)
+
+    def test_estimate_memory(self):
+        """Verify estimating the memory required to process a data file"""
+        data = dataio.get_data(self.datafile)
+        self.assertEqual(data.nbytes, batchui_ctrl.estimate_data_size(self.datafile))
+        self.assertEqual(batchui_ctrl.job_memory_factor * data.nbytes, batchui_ctrl.estimate_memory(self.datafile))
+        # Unknown formats fall back to the size of the file
+        self.assertEqual(os.path.getsize(self.datafile), batchui_ctrl.estimate_data_size(self.datafile, 'csv'))
+        sample_utwin_file = os.path.join(pathfinder.app_path(), 'models', 'tests', 'support_files', 'CScanData.csc')
+        self.assertTrue(batchui_ctrl.estimate_data_size(sample_utwin_file) >= os.path.getsize(sample_utwin_file))
+
+    def test_run_plugin_container(self):
+        """Verify run_plugin convenience function sends results to the batch writer when saving to a container"""
+        container_fname = os.path.join(pathfinder.batchoutput_path(), "test_run_plugin_container.hdf5")
+        with self.assertRaises(ValueError):
+            batchui_ctrl.run_plugin(self.toolkit_class, self.datafile, container=container_fname)
+        writer = batchwriter.BatchWriter(container_fname)
+        writer.start()
+        try:
+            batchui_ctrl.init_worker(results_queue=writer.queue)
+            run_profile = batchui_ctrl.run_plugin(self.toolkit_class, self.datafile, container=container_fname,
+                                                  use_cache=False)
+            self.assertListEqual([container_fname], run_profile['output_files'])
+        finally:
+            batchui_ctrl.worker_cache.clear()
+            self.assertListEqual([], writer.close())
+        root, ext = os.path.splitext(os.path.basename(self.datafile))
+        with h5py.File(container_fname, 'r') as fidin:
+            self.assertListEqual([batchwriter.default_dataset_name], list(fidin[root].keys()))
+            returned_data = fidin[root][batchwriter.default_dataset_name][...]
+        adapter = batchui_ctrl.BatchPluginAdapter(self.toolkit_class, self.datafile, use_cache=False)
+        adapter.run()
+        self.assertTrue(np.array_equal(adapter.data, returned_data))
+        os.remove(container_fname)
+
+    def test_run_plugin_out_of_core(self):
+        """Verify run_plugin_out_of_core convenience function saves the same results as run_plugin"""
+        root, ext = os.path.splitext(os.path.basename(self.datafile))
+        output_fname = os.path.join(pathfinder.batchoutput_path(), root + ".hdf5")
+        batchui_ctrl.run_plugin(self.toolkit_class, self.datafile, save_data=True, use_cache=False)
+        expected_data = dataio.get_data(output_fname)
+        os.remove(output_fname)
+        run_profile = batchui_ctrl.run_plugin_out_of_core(self.toolkit_class, self.datafile)
+        self.assertTrue(np.allclose(expected_data, dataio.get_data(output_fname)))
+        stages = [record['stage'] for record in run_profile['stages']]
+        self.assertListEqual(['init toolkit', 'run out of core'], stages)
+        os.remove(output_fname)
+        # Only NDIToolbox HDF5 files are supported
+        with self.assertRaises(ValueError):
+            batchui_ctrl.run_plugin_out_of_core(self.toolkit_class, self.datafile, file_type='csv')
+
     def test_run_plugin_multi_datasets(self):
         """Verify run_plugin convenience function correctly handles datafiles with
         multiple datasets"""
@@ -243,12 +417,13 @@ class TestBatchPluginAdapter(unittest.TestCase):
         root, ext = os.path.splitext(os.path.basename(sample_utwin_file))
         for dataset in expected_utwin_data:
             output_fnames.append(os.path.join(pathfinder.data_path(), root + "_" + dataset + ".hdf5"))
-        batchui_ctrl.import_data(sample_utwin_file)
+        returned_fnames = batchui_ctrl.import_data(sample_utwin_file)
         for dataset in expected_utwin_data:
             if expected_utwin_data[dataset] is not None:
                 fname = os.path.join(pathfinder.data_path(), root + "_" + dataset + ".hdf5")
                 self.assertTrue(os.path.exists(fname))
                 self.assertTrue(np.array_equal(expected_utwin_data[dataset], dataio.get_data(fname)))
+                self.assertTrue(fname in returned_fnames)
         for fname in output_fnames:
             try:
                 if os.path.exists(fname):
@@ -0,0 +1,105 @@
+"""test_benchmark_ctrl.py - tests the benchmark_ctrl module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import batchui_ctrl
+from controllers import benchmark_ctrl
+from models import batchscheduler
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBenchmarkController(unittest.TestCase):
+    """Tests the benchmark_ctrl functions"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def test_generate_inputs(self):
+        """Verify generate_inputs writes readable files of each benchmark format"""
+        for data_format in benchmark_ctrl.benchmark_formats:
+            input_files = benchmark_ctrl.generate_inputs(self.temp_folder, data_format, 2, 0.05)
+            self.assertEqual(2, len(input_files))
+            file_type = benchmark_ctrl.benchmark_formats[data_format][1]
+            for input_file in input_files:
+                self.assertEqual(file_type, batchui_ctrl.get_file_type(input_file))
+                data = batchui_ctrl.read_data(input_file, file_type)
+                self.assertTrue(len(data) > 0)
+
+    def test_profile_import(self):
+        """Verify profile_import returns the profile of the import with its output files"""
+        input_file = benchmark_ctrl.generate_inputs(self.temp_folder, 'nditoolbox', 1, 0.05)[0]
+        profile = benchmark_ctrl.profile_import(input_file)
+        try:
+            self.assertEqual('import', profile['name'])
+            self.assertListEqual(['read data', 'save data'], [record['stage'] for record in profile['stages']])
+            self.assertEqual(1, len(profile['output_files']))
+            self.assertTrue(os.path.exists(profile['output_files'][0]))
+        finally:
+            for output_file in profile['output_files']:
+                os.remove(output_file)
+
+    def test_summarize_run(self):
+        """Verify summarize_run totals the throughput and stages of a run"""
+        jobs = []
+        for idx in range(2):
+            job = batchscheduler.BatchJob("job{0}".format(idx), None, size=2 ** 20)
+            job.result = {'stages': [{'stage': 'read data', 'wall_time': 1.0, 'cpu_time': 0.5,
+                                      'peak_rss': 100 * (idx + 1)}]}
+            job.finished = 1.0
+            jobs.append(job)
+        failed_job = batchscheduler.BatchJob("failed", None, size=2 ** 20)
+        failed_job.error = "Unable to read"
+        failed_job.finished = 1.0
+        jobs.append(failed_job)
+        summary = benchmark_ctrl.summarize_run('csv', 'import', 'sequential', jobs, 4.0)
+        self.assertEqual(2, summary['files'])
+        self.assertListEqual(["Unable to read"], summary['errors'])
+        self.assertAlmostEqual(2.0, summary['input_mb'])
+        self.assertAlmostEqual(0.5, summary['files_per_s'])
+        self.assertAlmostEqual(0.5, summary['mb_per_s'])
+        self.assertEqual(200, summary['peak_rss'])
+        self.assertEqual({'wall_time': 2.0, 'cpu_time': 1.0, 'peak_rss': 200}, summary['stages']['read data'])
+
+    def test_run_benchmark(self):
+        """Verify run_benchmark runs each format, task and mode and returns JSON-friendly results"""
+        results = benchmark_ctrl.run_benchmark(toolkit="MedianFilterPlugin", formats=['nditoolbox', 'csv'],
+                                               num_files=2, file_size=0.05, modes=['sequential'])
+        json.dumps(results)
+        self.assertEqual(2, results['settings']['num_files'])
+        self.assertListEqual([('nditoolbox', 'import'), ('nditoolbox', 'MedianFilterPlugin'),
+                              ('csv', 'import'), ('csv', 'MedianFilterPlugin')],
+                             [(run['format'], run['task']) for run in results['runs']])
+        for run in results['runs']:
+            self.assertListEqual([], run['errors'])
+            self.assertEqual(2, run['files'])
+            self.assertTrue(run['files_per_s'] > 0)
+        self.assertTrue(len(benchmark_ctrl.format_results(results).splitlines()) > 4)
+
+    def test_run_benchmark_unknown_format(self):
+        """Verify run_benchmark raises ValueError for unknown formats"""
+        with self.assertRaises(ValueError):
+            benchmark_ctrl.run_benchmark(formats=['qqq'], num_files=1, file_size=0.05)
+
+    def test_benchmark_cscan_features(self):
+        """Verify benchmark_cscan_features times single and separate passes"""
+        results = benchmark_ctrl.benchmark_cscan_features(file_size=0.25, features=['max', 'argmax'], repeats=1)
+        json.dumps(results)
+        self.assertEqual(['max', 'argmax'], results['features'])
+        self.assertTrue(results['single_pass_time'] > 0)
+        self.assertTrue(results['separate_passes_time'] > 0)
+        self.assertTrue(results['speedup'] > 0)
+        self.assertEqual(4, len(benchmark_ctrl.format_cscan_results(results).splitlines()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -126,5 +126,20 @@ class TestPathFinder(unittest.TestCase):
         batchoutput_path = os.path.join(self.user_path, "data", "batch_output")
         self.assertEqual(batchoutput_path, pathfinder.batchoutput_path())
 
+    def test_pipelines_path(self):
+        """Verify returning correct path to saved plugin pipelines"""
+        pipelines_path = os.path.join(self.user_path, "pipelines")
+        self.assertEqual(pipelines_path, pathfinder.pipelines_path())
+
+    def test_cache_path(self):
+        """Verify returning correct path to cached plugin results"""
+        cache_path = os.path.join(self.user_path, "cache")
+        self.assertEqual(cache_path, pathfinder.cache_path())
+
+    def test_profiles_path(self):
+        """Verify returning correct path to plugin run profiles"""
+        profiles_path = os.path.join(self.user_path, "plugin_profiles.jsonl")
+        self.assertEqual(profiles_path, pathfinder.profiles_path())
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
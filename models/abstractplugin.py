@@ -20,6 +20,15 @@ class AbstractPlugin(object):
     url - getter - str
     run() method
 
+    Plugins may optionally declare a tile_mode (and tile_axis / tile_halo as required) if run()
+    can be applied to subsets of the data independently, in which case NDIToolbox splits the data
+    into tiles and runs the plugin on the tiles in parallel.  Plugins that process every dataset of
+    multiple datasets (dicts) the same way can also set tile_datasets = True to have each dataset
+    tiled separately.  See the tiling module for details.
+
+    The results of plugin runs are cached (see the resultcache module); plugins whose results
+    depend on anything other than their config and data should set cacheable = False.
+
     For more concrete examples, consult the TRIPlugin, ComputationalToolsPlugin,
     and CompanyPlugin modules.
     """
@@ -72,6 +81,10 @@ class CompanyPlugin(AbstractPlugin):
     version = "1.0"
     url = "www.company_url.com"
     copyright = "Copyright (C) 2012 Company Name.  All rights reserved."
+    # Plugins are run on the complete data set unless they declare a tiling mode
+    tile_mode = None
+    tile_datasets = False
+    cacheable = True
 
     def __init__(self, **kwargs):
         self.name = kwargs.get('name', self.name)
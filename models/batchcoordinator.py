@@ -0,0 +1,352 @@
+"""batchcoordinator.py - distributes batch mode jobs to worker processes on this or other machines
+
+The coordinator serves a queue of BatchJobs over TCP (see multiprocessing.connection, messages are
+authenticated with a shared key).  Any number of workers - started with nditoolbox.py --worker on
+this or other hosts - connect to the coordinator, request a job, run it and send back the results.
+While a job runs its worker sends a heartbeat every few seconds; a job whose worker stops sending
+heartbeats (e.g. the machine was shut down) or that raises an exception is put back on the queue
+up to max_retries times before it's recorded as failed.
+
+Messages are tuples, the first element is the type of message:
+
+    worker                                      coordinator
+    ('get_job', worker_id)                  ->  ('job', job_id, fn, kwds), ('wait',) or ('done',)
+    ('heartbeat', worker_id, job_id)        ->  ('ok',)
+    ('result', worker_id, job_id, result, error)  ->  ('ok',)
+
+Jobs are sent by reference (module and function name) so every worker must have the same version of
+NDIToolbox installed, and input files must be accessible to every worker at the same path (e.g. on a
+shared drive).
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import mainmodel
+from models.batchscheduler import BatchScheduler, format_error
+from multiprocessing.connection import Listener, Client
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+module_logger = mainmodel.get_logger(__name__)
+
+# Default TCP port the coordinator listens on
+default_port = 6543
+
+# Number of random bytes in a generated key
+authkey_bytes = 16
+
+# Default time in seconds between heartbeats from a worker running a job
+default_heartbeat_interval = 10.0
+
+# Default time in seconds without a heartbeat before a worker is considered lost
+default_heartbeat_timeout = 60.0
+
+# Default number of times a failed job is retried
+default_max_retries = 1
+
+
+def generate_authkey():
+    """Returns a random key (str of hexadecimal digits) to share between the coordinator and its workers"""
+    return os.urandom(authkey_bytes).encode('hex')
+
+
+def parse_address(address, default_host='localhost', default_port=default_port):
+    """Returns a (host, port) tuple from a str of the form host:port, host or port.
+    Raises ValueError if the port isn't a number."""
+    address = str(address)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+    elif address.isdigit():
+        host, port = '', address
+    else:
+        host, port = address, default_port
+    try:
+        return host or default_host, int(port)
+    except ValueError:
+        raise ValueError("Invalid address '{0}', expected host:port".format(address))
+
+
+class BatchCoordinator(BatchScheduler):
+    """Serves BatchJobs to the worker processes that connect to address (host, port); set the port to 0
+    to use any free port.  Jobs are added, run and summarized in the same way as BatchScheduler (on_complete
+    is called in the coordinator's process as each job finishes), but a job is only started when a worker
+    asks for one so the workers' number and memory are managed on each worker's host.  Workers must present
+    authkey (defaults to a random key, see generate_authkey), which should be kept private as it allows them
+    to exchange code with the coordinator."""
+
+    def __init__(self, address=('localhost', default_port), authkey=None, heartbeat_timeout=None,
+                 max_retries=None, on_complete=None):
+        BatchScheduler.__init__(self, num_workers=1, memory_budget=0, multiprocess=False, on_complete=on_complete)
+        if heartbeat_timeout is None:
+            heartbeat_timeout = default_heartbeat_timeout
+        if max_retries is None:
+            max_retries = default_max_retries
+        if authkey is None:
+            authkey = generate_authkey()
+        self.address = address
+        self.authkey = authkey
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_retries = max_retries
+        self.listener = None
+        self.stopping = False
+        self.lock = threading.RLock()
+        # Jobs finished by the workers that haven't been passed to finish_job yet
+        self.completed_jobs = []
+        # Time each worker was last heard from - worker_id: time
+        self.worker_seen = {}
+
+    def add_job(self, name, fn, kwds=None, memory=0, size=0):
+        """Adds a job to the end of the queue and returns the new BatchJob"""
+        with self.lock:
+            job = BatchScheduler.add_job(self, name, fn, kwds, memory, size)
+            job.job_id = len(self.jobs) - 1
+            job.worker = None
+            job.heartbeat = None
+            job.attempts = 0
+            return job
+
+    @property
+    def idle(self):
+        """Returns True if there are no pending or running jobs and all finished jobs have been collected"""
+        with self.lock:
+            return not (self.pending_jobs or self.running_jobs or self.completed_jobs)
+
+    def start(self):
+        """Starts listening for workers"""
+        if self.started is None:
+            self.started = time.time()
+        self.finished = None
+        if self.listener is None:
+            self.stopping = False
+            self.listener = Listener(self.address, authkey=self.authkey)
+            self.address = self.listener.address
+            accept_thread = threading.Thread(target=self.serve)
+            accept_thread.daemon = True
+            accept_thread.start()
+
+    def serve(self):
+        """Accepts connections from workers until the coordinator is stopped"""
+        listener = self.listener
+        while not self.stopping:
+            try:
+                connection = listener.accept()
+            except Exception as err: # e.g. wrong key
+                if self.stopping:
+                    break
+                module_logger.warning("Unable to accept batch worker connection: {0}".format(err))
+                continue
+            if self.stopping:
+                connection.close()
+                break
+            handler_thread = threading.Thread(target=self.handle_connection, args=(connection,))
+            handler_thread.daemon = True
+            handler_thread.start()
+        listener.close()
+
+    def handle_connection(self, connection):
+        """Replies to a worker's messages until it disconnects"""
+        try:
+            while True:
+                connection.send(self.handle_message(connection.recv()))
+        except (EOFError, IOError):
+            pass
+        finally:
+            connection.close()
+
+    def handle_message(self, message):
+        """Returns the reply to a message from a worker"""
+        with self.lock:
+            message_type = message[0]
+            self.worker_seen[message[1]] = time.time()
+            if message_type == 'get_job':
+                return self.dispatch(message[1])
+            elif message_type == 'heartbeat':
+                job = self.jobs[message[2]]
+                if job.worker == message[1]:
+                    job.heartbeat = time.time()
+                return ('ok',)
+            elif message_type == 'result':
+                self.report(*message[1:])
+                return ('ok',)
+            return ('error', "Unknown message '{0}'".format(message_type))
+
+    def dispatch(self, worker_id):
+        """Assigns the next pending job to the worker worker_id and returns the reply to send it"""
+        with self.lock:
+            if self.stopping:
+                return ('done',)
+            if not self.pending_jobs:
+                return ('wait',)
+            job = self.pending_jobs.pop(0)
+            job.started = time.time()
+            job.heartbeat = job.started
+            job.worker = worker_id
+            job.attempts += 1
+            self.running_jobs.append(job)
+            return ('job', job.job_id, job.fn, job.kwds)
+
+    def report(self, worker_id, job_id, result, error=None):
+        """Records the result (or error) of a job from worker worker_id.  Reports for jobs that have since been
+        assigned to another worker are ignored."""
+        with self.lock:
+            job = self.jobs[job_id]
+            if job.worker != worker_id or job not in self.running_jobs:
+                return
+            self.running_jobs.remove(job)
+            if error is not None and self.retry(job, error):
+                return
+            job.result = result
+            job.error = error
+            self.completed_jobs.append(job)
+
+    def retry(self, job, error):
+        """Puts a job that failed with error back on the queue if it hasn't used all its retries.
+        Returns True if the job will be retried."""
+        job.worker = None
+        if job.attempts > self.max_retries:
+            return False
+        module_logger.warning("Retrying {0}: {1}".format(job.name, error))
+        self.pending_jobs.append(job)
+        return True
+
+    def step(self):
+        """Requeues jobs whose workers have stopped sending heartbeats and returns the list of jobs completed
+        since the last call"""
+        with self.lock:
+            now = time.time()
+            for job in [job for job in self.running_jobs if now - job.heartbeat > self.heartbeat_timeout]:
+                error = "Lost contact with worker {0}".format(job.worker)
+                self.running_jobs.remove(job)
+                if not self.retry(job, error):
+                    job.error = error
+                    self.completed_jobs.append(job)
+            completed_jobs = self.completed_jobs
+            self.completed_jobs = []
+        for job in completed_jobs:
+            self.finish_job(job)
+        return completed_jobs
+
+    def stop(self, terminate=False):
+        """Stops serving jobs; workers asking for another job are told to exit"""
+        with self.lock:
+            self.stopping = True
+        if self.listener is not None:
+            # Wake the accept thread so that it exits
+            host, port = self.address
+            try:
+                Client((host if host not in ('', '0.0.0.0') else 'localhost', port), authkey=self.authkey).close()
+            except Exception:
+                pass
+            self.listener = None
+        self.finished = time.time()
+
+    @property
+    def num_connected_workers(self):
+        """Returns the number of workers heard from in the last heartbeat timeout"""
+        with self.lock:
+            now = time.time()
+            return len([seen for seen in self.worker_seen.values() if now - seen <= self.heartbeat_timeout])
+
+
+def connect(address, authkey, timeout=30.0):
+    """Returns a connection to the coordinator at address (host, port), retrying for up to timeout seconds
+    while the coordinator starts.  Raises IOError if unable to connect."""
+    start_time = time.time()
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except socket.error as err:
+            if time.time() - start_time >= timeout:
+                raise IOError("Unable to connect to batch coordinator at {0}:{1}: {2}".format(address[0],
+                                                                                               address[1], err))
+            time.sleep(1)
+
+
+def run_worker(address, authkey, worker_id=None, initializer=None, initargs=(),
+               heartbeat_interval=None, connect_timeout=30.0, poll_interval=1.0):
+    """Connects to the coordinator at address (host, port) and runs the jobs it serves one at a time until
+    the coordinator has no more jobs or shuts down.  If specified, initializer(*initargs) is called before
+    the first job.  Returns the number of jobs run."""
+    if worker_id is None:
+        worker_id = "{0}:{1}".format(socket.gethostname(), os.getpid())
+    if heartbeat_interval is None:
+        heartbeat_interval = default_heartbeat_interval
+    connection = connect(address, authkey, connect_timeout)
+    if initializer is not None:
+        initializer(*initargs)
+    connection_lock = threading.Lock()
+    current_job = [None]
+    stop_heartbeats = threading.Event()
+
+    def request(*message):
+        """Sends a message to the coordinator and returns its reply"""
+        with connection_lock:
+            connection.send(message)
+            return connection.recv()
+
+    def send_heartbeats():
+        """Sends a heartbeat for the current job every heartbeat_interval seconds"""
+        while not stop_heartbeats.wait(heartbeat_interval):
+            job_id = current_job[0]
+            if job_id is not None:
+                try:
+                    request('heartbeat', worker_id, job_id)
+                except (EOFError, IOError):
+                    return
+
+    heartbeat_thread = threading.Thread(target=send_heartbeats)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+    jobs_run = 0
+    try:
+        while True:
+            try:
+                reply = request('get_job', worker_id)
+            except (EOFError, IOError): # coordinator has shut down
+                break
+            if reply[0] == 'done':
+                break
+            elif reply[0] != 'job':
+                time.sleep(poll_interval)
+                continue
+            job_id, fn, kwds = reply[1:]
+            current_job[0] = job_id
+            result = None
+            error = None
+            try:
+                result = fn(**kwds)
+            except Exception as err:
+                error = format_error(err)
+            current_job[0] = None
+            jobs_run += 1
+            try:
+                request('result', worker_id, job_id, result, error)
+            except (EOFError, IOError):
+                break
+            except Exception as err: # results can't be pickled
+                try:
+                    request('result', worker_id, job_id, None, "Unable to return results: {0}".format(err))
+                except (EOFError, IOError):
+                    break
+    finally:
+        stop_heartbeats.set()
+        connection.close()
+    return jobs_run
+
+
+def run_workers(address, authkey, num_workers=None, **kwargs):
+    """Runs num_workers (defaults to one per CPU) worker processes connected to the coordinator at
+    address until the coordinator has no more jobs.  Keyword arguments are passed to run_worker."""
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    workers = [multiprocessing.Process(target=run_worker, args=(address, authkey), kwargs=kwargs)
+               for idx in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,117 @@
+"""batchmanifest.py - records the batch mode jobs run on each input file so that later runs can skip them
+
+The manifest is appended as JSON lines to batch_manifest.jsonl in the batch output folder (see
+pathfinder.batchoutput_path), one line per completed or failed job:
+
+    {"input_file": "/data/scan1.csc", "size": 104857600, "mtime": 1381939200.0, "toolkit": "MedianFilterPlugin",
+     "params": "3f2a...", "status": "completed", "outputs": ["/home/user/nditoolbox/batchoutput/scan1.hdf5"],
+     "error": null, "time": 1381939260.0}
+
+params is a hash of the toolkit (including its version), its configuration and the batch options that
+affect its output.  The last line for an input file and toolkit is the current state of that job; lines
+that were only partially written (e.g. if batch mode was interrupted) are ignored.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+from models import precision
+import hashlib
+import json
+import os
+import time
+
+# Job states recorded in the manifest
+COMPLETED = 'completed'
+FAILED = 'failed'
+
+
+def manifest_path():
+    """Returns the default location of the batch manifest"""
+    return os.path.join(pathfinder.batchoutput_path(), "batch_manifest.jsonl")
+
+
+def file_state(input_file):
+    """Returns a dict of the size (bytes) and modification time of input_file"""
+    stat = os.stat(input_file)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def params_hash(toolkit, signature='', toolkit_config=None, **options):
+    """Returns a str hash of the toolkit name, its signature (e.g. plugin class and version), its
+    configuration dict toolkit_config, the current compute precision and any other options that affect
+    the job's output"""
+    params = {'toolkit': toolkit,
+              'signature': signature,
+              'config': toolkit_config or {},
+              'precision': precision.get_precision(),
+              'options': options}
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+
+class BatchManifest(object):
+    """Record of the batch jobs run on each input file, loaded from and appended to manifest_file
+    (defaults to manifest_path())"""
+
+    def __init__(self, manifest_file=None):
+        if manifest_file is None:
+            manifest_file = manifest_path()
+        self.manifest_file = manifest_file
+        self.records = {}
+        self.load()
+
+    @staticmethod
+    def job_key(input_file, toolkit):
+        """Returns the key identifying the job running toolkit on input_file"""
+        return os.path.abspath(input_file), toolkit
+
+    def load(self):
+        """Reads the manifest file, keeping the most recent record of each job"""
+        self.records = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r") as fidin:
+                for line in fidin:
+                    line = line.strip()
+                    if line:
+                        try:
+                            record = json.loads(line)
+                        except ValueError: # partially-written line
+                            continue
+                        self.records[self.job_key(record['input_file'], record['toolkit'])] = record
+
+    def get(self, input_file, toolkit):
+        """Returns the most recent record of the job running toolkit on input_file, or None if not found"""
+        return self.records.get(self.job_key(input_file, toolkit))
+
+    def record(self, input_file, toolkit, params, status, outputs=None, error=None):
+        """Appends the record of a completed or failed job to the manifest and returns the record"""
+        record = {'input_file': os.path.abspath(input_file),
+                  'toolkit': toolkit,
+                  'params': params,
+                  'status': status,
+                  'outputs': [os.path.abspath(output) for output in outputs or []],
+                  'error': error,
+                  'time': time.time()}
+        record.update(file_state(input_file))
+        with open(self.manifest_file, "a") as fidout:
+            fidout.write(json.dumps(record) + "\n")
+        self.records[self.job_key(input_file, toolkit)] = record
+        return record
+
+    def is_completed(self, input_file, toolkit, params):
+        """Returns True if the job's most recent run with the same parameters completed successfully"""
+        record = self.get(input_file, toolkit)
+        return record is not None and record['status'] == COMPLETED and record['params'] == params
+
+    def is_up_to_date(self, input_file, toolkit, params):
+        """Returns True if the job has completed with the same parameters, the input file hasn't changed
+        since and all of its output files still exist"""
+        if not self.is_completed(input_file, toolkit, params):
+            return False
+        record = self.get(input_file, toolkit)
+        state = file_state(input_file)
+        if record['size'] != state['size'] or record['mtime'] != state['mtime']:
+            return False
+        return all(os.path.exists(output) for output in record['outputs'])
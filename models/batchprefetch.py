@@ -0,0 +1,130 @@
+"""batchprefetch.py - runs batch mode jobs in the current process as a pipeline of read, compute and write stages
+
+Running a batch job reads the input file, runs the toolkit and saves the results one after the other, so
+the CPU is idle while files are read and written and the disk is idle while the toolkit runs.  The
+PrefetchScheduler splits each job into its three stages:  a reader thread reads the next few input files
+ahead of the toolkit, the toolkit runs in the calling thread and a writer thread saves the results.  Once
+the pipeline is full the total time approaches that of the slowest stage rather than the sum of the stages.
+
+The number of jobs in the pipeline is limited by prefetch and by the memory budget (see batchscheduler), so
+the reader waits rather than reading ahead if the jobs already in the pipeline are using the memory.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models.batchscheduler import BatchScheduler, format_error
+import Queue
+import threading
+import time
+
+# Default number of input files read ahead of the toolkit
+default_prefetch = 2
+
+
+class PrefetchScheduler(BatchScheduler):
+    """Runs BatchJobs in the current process in three overlapping stages:  read_fn(**job.kwds) in a reader
+    thread, compute_fn(state) in the calling thread on the value returned by read_fn and write_fn(state) in a
+    writer thread on the value returned by compute_fn.  The value returned by write_fn is the job's result.
+    Up to prefetch jobs are read ahead of the one being computed as long as the estimated memory of all the
+    jobs in the pipeline fits within memory_budget bytes (defaults to get_memory_budget()).  on_complete,
+    initializer and initargs are used in the same way as BatchScheduler; on_complete is called in the
+    writer thread."""
+
+    def __init__(self, read_fn, compute_fn, write_fn, prefetch=None, memory_budget=None, on_complete=None,
+                 initializer=None, initargs=()):
+        BatchScheduler.__init__(self, num_workers=1, memory_budget=memory_budget, multiprocess=False,
+                                on_complete=on_complete, initializer=initializer, initargs=initargs)
+        if prefetch is None:
+            prefetch = default_prefetch
+        self.read_fn = read_fn
+        self.compute_fn = compute_fn
+        self.write_fn = write_fn
+        self.prefetch = max(0, prefetch)
+        # Jobs read but not yet written - one being computed and one being written plus those read ahead
+        self.max_in_flight = self.prefetch + 2
+        self.in_flight = []
+        self.in_flight_changed = threading.Condition()
+
+    def add_job(self, name, fn=None, kwds=None, memory=0, size=0):
+        """Adds a job to the end of the queue and returns the new BatchJob.  The job's stages are run with
+        the scheduler's read_fn, compute_fn and write_fn; fn is ignored."""
+        return BatchScheduler.add_job(self, name, fn, kwds, memory, size)
+
+    def can_start(self, job, running_jobs):
+        """Returns True if job can be read alongside running_jobs without exceeding the number of jobs
+        in the pipeline or the memory budget"""
+        if not running_jobs:
+            return True
+        if len(running_jobs) >= self.max_in_flight:
+            return False
+        if self.memory_budget is None:
+            return True
+        return sum(running_job.memory for running_job in running_jobs) + job.memory <= self.memory_budget
+
+    def run(self):
+        """Runs all the queued jobs and returns the list of BatchJobs.  Exceptions raised by any
+        stage are stored in the job's error attribute rather than being raised."""
+        self.start()
+        compute_queue = Queue.Queue()
+        write_queue = Queue.Queue()
+        reader = threading.Thread(target=self.read_jobs, args=(list(self.pending_jobs), compute_queue))
+        writer = threading.Thread(target=self.write_jobs, args=(write_queue,))
+        self.pending_jobs = []
+        for thread in (reader, writer):
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                job_state = compute_queue.get()
+                if job_state is None:
+                    break
+                job, state = job_state
+                if job.error is None:
+                    try:
+                        state = self.compute_fn(state)
+                    except Exception as err:
+                        job.error = format_error(err)
+                        state = None
+                write_queue.put((job, state))
+        finally:
+            write_queue.put(None)
+        writer.join()
+        self.stop()
+        return self.jobs
+
+    def read_jobs(self, jobs, compute_queue):
+        """Reads each job in turn as soon as it fits in the pipeline and passes it to the compute stage"""
+        try:
+            for job in jobs:
+                with self.in_flight_changed:
+                    while not self.can_start(job, self.in_flight):
+                        self.in_flight_changed.wait()
+                    self.in_flight.append(job)
+                job.started = time.time()
+                state = None
+                try:
+                    state = self.read_fn(**job.kwds)
+                except Exception as err:
+                    job.error = format_error(err)
+                compute_queue.put((job, state))
+        finally:
+            compute_queue.put(None)
+
+    def write_jobs(self, write_queue):
+        """Writes each job's results as they're computed and removes the job from the pipeline"""
+        while True:
+            job_state = write_queue.get()
+            if job_state is None:
+                break
+            job, state = job_state
+            if job.error is None:
+                try:
+                    job.result = self.write_fn(state)
+                except Exception as err:
+                    job.error = format_error(err)
+            with self.in_flight_changed:
+                self.in_flight.remove(job)
+                self.in_flight_changed.notify_all()
+            self.finish_job(job)
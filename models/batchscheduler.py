@@ -0,0 +1,244 @@
+"""batchscheduler.py - memory-aware scheduling of batch mode jobs
+
+Each job carries an estimate of the memory it will need (see batchui_ctrl.estimate_memory).  Jobs are
+started in the order they were added as long as the estimated memory of the jobs already running plus
+the new job fits within the memory budget, so that a folder of multi-GB scans doesn't start one
+import per CPU at the same time.  A job larger than the budget is still run, but on its own.
+
+The budget is set with the Batch Memory Budget option (in MB) in the Application section of the
+configuration file, and defaults to 75% of the physical memory of the machine.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+from models import config
+import multiprocessing
+import os
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Fraction of physical memory used as the default memory budget
+default_budget_fraction = 0.75
+
+
+def physical_memory():
+    """Returns the total physical memory of the machine in bytes, or None if not available"""
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError): # Windows w/o psutil
+        return None
+
+
+def get_memory_budget():
+    """Returns the memory budget for batch jobs in bytes set in the application's configuration,
+    default_budget_fraction of the physical memory if not set, or None if unknown."""
+    budget = config.Configure(pathfinder.config_path()).get_app_option_float("Batch Memory Budget")
+    if budget is not None and budget > 0:
+        return int(budget * 2 ** 20)
+    total_memory = physical_memory()
+    if total_memory is None:
+        return None
+    return int(total_memory * default_budget_fraction)
+
+
+class BatchJob(object):
+    """A single batch mode job:  calls fn(**kwds).  name identifies the job (e.g. the input file),
+    memory is the estimated memory required in bytes and size is the amount of data processed in bytes
+    (used to report throughput)."""
+
+    def __init__(self, name, fn, kwds=None, memory=0, size=0):
+        self.name = name
+        self.fn = fn
+        self.kwds = kwds or {}
+        self.memory = memory
+        self.size = size
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self._async_result = None
+
+    @property
+    def succeeded(self):
+        """Returns True if the job has finished without raising an exception"""
+        return self.finished is not None and self.error is None
+
+    @property
+    def wall_time(self):
+        """Returns the time taken by the job in seconds, or None if it hasn't finished"""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+class BatchScheduler(object):
+    """Runs BatchJobs in a pool of num_workers processes (defaults to one per CPU), limiting the
+    total estimated memory of the jobs running at any one time to memory_budget bytes (defaults to
+    get_memory_budget()).  If multiprocess is False, jobs are run one at a time in the current process.
+    If specified, on_complete is called with each BatchJob in the current process as it finishes, and
+    initializer(*initargs) is called once in each worker process (or once in the current process if
+    multiprocess is False) before it runs any jobs."""
+
+    def __init__(self, num_workers=None, memory_budget=None, multiprocess=True, on_complete=None,
+                 initializer=None, initargs=()):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if memory_budget is None:
+            memory_budget = get_memory_budget()
+        self.num_workers = max(1, num_workers)
+        self.memory_budget = memory_budget
+        self.multiprocess = multiprocess
+        self.on_complete = on_complete
+        self.initializer = initializer
+        self.initargs = initargs
+        self.jobs = []
+        self.pending_jobs = []
+        self.running_jobs = []
+        self.workers = None
+        self.initialized = False
+        self.started = None
+        self.finished = None
+        self.poll_interval = 0.05
+
+    def add_job(self, name, fn, kwds=None, memory=0, size=0):
+        """Adds a job to the end of the queue and returns the new BatchJob.  Jobs can be added
+        while the scheduler is running (see step)."""
+        job = BatchJob(name, fn, kwds, memory, size)
+        self.jobs.append(job)
+        self.pending_jobs.append(job)
+        return job
+
+    def can_start(self, job, running_jobs):
+        """Returns True if job can be started alongside running_jobs without exceeding the
+        number of workers or the memory budget"""
+        if not running_jobs:
+            return True
+        if len(running_jobs) >= self.num_workers:
+            return False
+        if self.memory_budget is None:
+            return True
+        return sum(running_job.memory for running_job in running_jobs) + job.memory <= self.memory_budget
+
+    def finish_job(self, job):
+        """Records the results of a completed job"""
+        job.finished = time.time()
+        if self.on_complete is not None:
+            self.on_complete(job)
+
+    @property
+    def idle(self):
+        """Returns True if there are no pending or running jobs"""
+        return not (self.pending_jobs or self.running_jobs)
+
+    def start(self):
+        """Starts the pool of worker processes (or runs the initializer in the current process if
+        multiprocess is False).  The workers are kept until stop is called."""
+        if self.started is None:
+            self.started = time.time()
+        self.finished = None
+        if self.multiprocess:
+            if self.workers is None:
+                self.workers = multiprocessing.Pool(self.num_workers, self.initializer, self.initargs)
+        elif not self.initialized:
+            if self.initializer is not None:
+                self.initializer(*self.initargs)
+            self.initialized = True
+
+    def step(self):
+        """Starts as many pending jobs as the workers and memory budget allow and collects any jobs that
+        have finished (or runs the next pending job if multiprocess is False).  Returns the list of jobs
+        completed.  Exceptions raised by jobs are stored in the job's error attribute rather than being raised."""
+        completed_jobs = []
+        if not self.multiprocess:
+            if self.pending_jobs:
+                job = self.pending_jobs.pop(0)
+                job.started = time.time()
+                try:
+                    job.result = job.fn(**job.kwds)
+                except Exception as err:
+                    job.error = format_error(err)
+                self.finish_job(job)
+                completed_jobs.append(job)
+            return completed_jobs
+        while self.pending_jobs and self.can_start(self.pending_jobs[0], self.running_jobs):
+            job = self.pending_jobs.pop(0)
+            job.started = time.time()
+            job._async_result = self.workers.apply_async(job.fn, kwds=job.kwds)
+            self.running_jobs.append(job)
+        for job in [job for job in self.running_jobs if job._async_result.ready()]:
+            try:
+                job.result = job._async_result.get()
+            except Exception as err:
+                job.error = format_error(err)
+            job._async_result = None
+            self.running_jobs.remove(job)
+            self.finish_job(job)
+            completed_jobs.append(job)
+        return completed_jobs
+
+    def stop(self, terminate=False):
+        """Shuts down the worker processes once their jobs have finished, or immediately if terminate is True"""
+        if self.workers is not None:
+            if terminate:
+                self.workers.terminate()
+            else:
+                self.workers.close()
+            self.workers.join()
+            self.workers = None
+        self.finished = time.time()
+
+    def run(self):
+        """Runs all the queued jobs and returns the list of BatchJobs.  Exceptions raised by
+        jobs are stored in the job's error attribute rather than being raised."""
+        self.start()
+        try:
+            while not self.idle:
+                if not self.step():
+                    time.sleep(self.poll_interval)
+        except:
+            self.stop(terminate=True)
+            raise
+        self.stop()
+        return self.jobs
+
+    @property
+    def failed_jobs(self):
+        """Returns the list of jobs that raised an exception"""
+        return [job for job in self.jobs if job.error is not None]
+
+    @property
+    def wall_time(self):
+        """Returns the total time taken to run the jobs in seconds"""
+        if self.started is None:
+            return 0.
+        return (self.finished or time.time()) - self.started
+
+    def summary(self):
+        """Returns a human-readable summary of the number of jobs completed and failed and the throughput"""
+        completed_jobs = [job for job in self.jobs if job.succeeded]
+        wall_time = self.wall_time
+        total_mb = sum(job.size for job in completed_jobs) / float(2 ** 20)
+        files_per_s = len(completed_jobs) / wall_time if wall_time > 0 else 0.
+        mb_per_s = total_mb / wall_time if wall_time > 0 else 0.
+        lines = ["{0} of {1} files processed successfully in {2:.2f} s ({3:.2f} files/s, {4:.2f} MB/s)".format(
+            len(completed_jobs), len(self.jobs), wall_time, files_per_s, mb_per_s)]
+        for job in self.failed_jobs:
+            lines.append("** Error processing {0}: {1}".format(job.name, job.error))
+        return "\n".join(lines)
+
+
+def format_error(err):
+    """Returns a str describing the exception err"""
+    err_str = str(err)
+    if len(err_str) == 0:
+        return type(err).__name__
+    return "{0}: {1}".format(type(err).__name__, err_str)
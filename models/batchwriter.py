@@ -0,0 +1,133 @@
+"""batchwriter.py - writes the results of a batch run to a single HDF5 container file
+
+Rather than saving one HDF5 file per dataset per input file, the results of every input file are
+written to one group in a container file named after the input file, with one dataset per result
+(e.g. /scan1/tof0, /scan1/amplitude0, /scan2/data).  The container is only ever opened by a dedicated
+writer process:  batch workers send their results to the writer over a queue, so they never wait on
+each other for access to the file.  The queue is bounded so that workers wait for the writer rather
+than accumulating results in memory if the writer falls behind.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models.batchscheduler import format_error
+import h5py
+import multiprocessing
+import os.path
+import Queue
+import signal
+
+# Default maximum number of results waiting to be written
+default_queue_size = 8
+
+# Name of the dataset used for input files with a single set of results
+default_dataset_name = 'data'
+
+
+def group_name(hdf5_file, input_file):
+    """Returns the name of the group in the open h5py File hdf5_file for the results of input_file:  the base
+    name of the input file, with a numeric suffix if another input file with the same base name has already
+    been written to the container"""
+    input_file = os.path.abspath(input_file)
+    root, ext = os.path.splitext(os.path.basename(input_file))
+    name = root
+    idx = 1
+    while name in hdf5_file and hdf5_file[name].attrs.get('input_file') != input_file:
+        name = "{0}_{1}".format(root, idx)
+        idx += 1
+    return name
+
+
+def write_results(hdf5_file, input_file, datasets):
+    """Writes the dict of NumPy arrays datasets to the group for input_file in the open h5py File hdf5_file,
+    replacing any previous results for the same input file.  Returns the name of the group."""
+    name = group_name(hdf5_file, input_file)
+    if name in hdf5_file:
+        del hdf5_file[name]
+    group = hdf5_file.create_group(name)
+    group.attrs['input_file'] = os.path.abspath(input_file)
+    for key, data in datasets.items():
+        group.create_dataset(key, data=data)
+    return name
+
+
+def writer_loop(container_fname, results_queue, errors_queue):
+    """Writes the (input_file, datasets) results from results_queue to the HDF5 file container_fname until
+    a None is received, then puts the list of (input_file, error) tuples for results that couldn't be
+    written on errors_queue"""
+    # Ctrl-C is handled by the main process, which then tells the writer to finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    errors = []
+    try:
+        fidout = h5py.File(container_fname, 'a')
+    except Exception as err:
+        fidout = None
+        errors.append((None, "Unable to open {0}: {1}".format(container_fname, format_error(err))))
+    try:
+        while True:
+            results = results_queue.get()
+            if results is None:
+                break
+            input_file, datasets = results
+            if fidout is None:
+                errors.append((input_file, "Results not saved"))
+                continue
+            try:
+                write_results(fidout, input_file, datasets)
+                fidout.flush()
+            except Exception as err:
+                errors.append((input_file, format_error(err)))
+    finally:
+        if fidout is not None:
+            fidout.close()
+        errors_queue.put(errors)
+
+
+class BatchWriter(object):
+    """Writes results sent from any process with put() to the HDF5 container file container_fname in a
+    separate writer process.  Worker processes must receive the writer's queue when they are created
+    (e.g. as a multiprocessing.Pool initializer argument)."""
+
+    def __init__(self, container_fname, queue_size=None):
+        if queue_size is None:
+            queue_size = default_queue_size
+        self.container_fname = container_fname
+        self.queue = multiprocessing.Queue(queue_size)
+        self.errors = []
+        self._errors_queue = multiprocessing.Queue()
+        self.process = None
+
+    def start(self):
+        """Starts the writer process"""
+        self.process = multiprocessing.Process(target=writer_loop,
+                                               args=(self.container_fname, self.queue, self._errors_queue))
+        self.process.start()
+
+    def put(self, input_file, datasets):
+        """Sends the dict of NumPy arrays datasets from input_file to the writer"""
+        send_results(self.queue, input_file, datasets)
+
+    def close(self):
+        """Waits for the writer to finish writing the results and returns the list of (input_file, error)
+        tuples for any results that couldn't be written"""
+        if self.process is None:
+            return self.errors
+        self.queue.put(None)
+        while True:
+            try:
+                self.errors = self._errors_queue.get(timeout=1)
+                break
+            except Queue.Empty:
+                if not self.process.is_alive():
+                    self.errors = [(None, "Batch writer process exited unexpectedly")]
+                    break
+        self.process.join()
+        self.process = None
+        return self.errors
+
+
+def send_results(results_queue, input_file, datasets):
+    """Sends the dict of NumPy arrays datasets from input_file to the writer reading from results_queue"""
+    results_queue.put((os.path.abspath(input_file), datasets))
@@ -0,0 +1,157 @@
+"""cinerenderer.py - renders the Z slices of 3D data as colormapped images ahead of cine playback
+
+Playing a 3D data set slice by slice (cine playback) replots the C-scan for every Z index, which is far too
+slow to animate through thousands of slices.  The CineRenderer instead renders each Z slice to an RGBA image
+with a fixed colormap and color scale in a background thread, a few frames ahead of the playback position.
+Frames are kept in a ring buffer of a fixed number of preallocated frames:  each new frame replaces one that
+is no longer ahead of the playback position, so memory use doesn't depend on the number of slices.  The
+plot only has to copy each frame to the screen.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+import matplotlib.colors
+import numpy as np
+import threading
+
+# Default maximum size in bytes of the ring buffer of rendered frames
+default_buffer_bytes = 64 * 2 ** 20
+
+# Default maximum number of frames rendered ahead of the playback position
+default_capacity = 64
+
+# Default playback frame rate (frames per second)
+default_frame_rate = 25
+
+
+class CineRenderer(object):
+    """Renders the Z slices of the NDEScanHandler scnr's data as RGBA images with the matplotlib colormap cmap
+    scaled to the (vmin, vmax) color limits clim.  Up to capacity frames (defaults to default_capacity,
+    or as many as fit in max_bytes bytes if fewer) are rendered ahead of the playback position in a
+    background thread once started.  If no frames fit in max_bytes, every frame is rendered when it's
+    requested.  Playback steps through step slices at a time (negative to play
+    backwards) and wraps around at either end of the data if loop is True."""
+
+    def __init__(self, scnr, cmap, clim, capacity=None, max_bytes=None, step=1, loop=True):
+        if capacity is None:
+            capacity = default_capacity
+        if max_bytes is None:
+            max_bytes = default_buffer_bytes
+        self.scnr = scnr
+        self.cmap = cmap
+        self.norm = matplotlib.colors.Normalize(*clim)
+        height, width, self.num_slices = scnr.data.shape
+        frame_bytes = height * width * 4
+        self.capacity = max(0, min(capacity, self.num_slices, max_bytes // frame_bytes))
+        self.frames = np.zeros((self.capacity, height, width, 4), dtype=np.uint8)
+        # Z index of the frame in each slot of the ring buffer (-1 if empty) and slot of each Z index
+        self.slot_indices = [-1] * self.capacity
+        self.slots = {}
+        self.step = step or 1
+        self.loop = loop
+        self.position = 0
+        self.misses = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def next_index(self, slice_idx):
+        """Returns the Z index of the frame after slice_idx, or None if playback stops at slice_idx"""
+        next_idx = slice_idx + self.step
+        if 0 <= next_idx < self.num_slices:
+            return next_idx
+        if self.loop:
+            return next_idx % self.num_slices
+        return None
+
+    def window(self):
+        """Returns the list of Z indices of the frames from the playback position onwards that fit in the
+        ring buffer"""
+        if self.capacity == 0:
+            return []
+        indices = [self.position]
+        while len(indices) < self.capacity:
+            next_idx = self.next_index(indices[-1])
+            if next_idx is None or next_idx == self.position:
+                break
+            indices.append(next_idx)
+        return indices
+
+    def render(self, slice_idx):
+        """Returns the RGBA image (uint8 array) of the Z slice slice_idx"""
+        return self.cmap(self.norm(self.scnr.read_block(np.s_[:, :, slice_idx])), bytes=True)
+
+    def is_ready(self, slice_idx):
+        """True if the frame of the Z slice slice_idx has been rendered"""
+        with self.condition:
+            return slice_idx in self.slots
+
+    def frame(self, slice_idx):
+        """Returns the RGBA image of the Z slice slice_idx, rendered in the calling thread if it hasn't
+        been rendered ahead"""
+        with self.condition:
+            slot = self.slots.get(slice_idx)
+            if slot is not None:
+                return self.frames[slot].copy()
+            self.misses += 1
+        return self.render(slice_idx)
+
+    def seek(self, slice_idx):
+        """Sets the playback position to slice_idx, so that the frames after it are rendered next"""
+        with self.condition:
+            self.position = slice_idx
+            self.condition.notify_all()
+
+    def start(self, slice_idx=None):
+        """Starts rendering frames ahead of the playback position (slice_idx if specified)"""
+        with self.condition:
+            if slice_idx is not None:
+                self.position = slice_idx
+            if self.running or self.capacity == 0:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stops rendering frames and waits for the frame being rendered to finish"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def next_frame(self):
+        """Waits for a frame ahead of the playback position that hasn't been rendered.  Returns its Z index and
+        the slot of the ring buffer to render it into, or None if rendering has been stopped."""
+        with self.condition:
+            while self.running:
+                window = self.window()
+                missing = [slice_idx for slice_idx in window if slice_idx not in self.slots]
+                if missing:
+                    # The ring buffer holds as many frames as the window, so a slot is free or holds a
+                    # frame that's no longer needed
+                    in_window = set(window)
+                    slot = next(slot for slot, slot_idx in enumerate(self.slot_indices) if slot_idx not in in_window)
+                    self.slots.pop(self.slot_indices[slot], None)
+                    self.slot_indices[slot] = -1
+                    return missing[0], slot
+                self.condition.wait()
+        return None
+
+    def run(self):
+        """Renders frames ahead of the playback position until stopped"""
+        while True:
+            next_frame = self.next_frame()
+            if next_frame is None:
+                return
+            slice_idx, slot = next_frame
+            self.frames[slot] = self.render(slice_idx)
+            with self.condition:
+                self.slot_indices[slot] = slice_idx
+                self.slots[slice_idx] = slot
+                self.condition.notify_all()
@@ -6,15 +6,31 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'Chris R. Coughlin'
 
 from controllers import pathfinder
+from models import precision
 import numpy as np
 import scipy.misc
 import h5py
+import collections
 import gc
 import itertools
 import os
 import os.path
 import re
 
+def read_dataset(dataset, slice_idx=None):
+    """Returns the NumPy array (or the slice slice_idx of the array if specified) from the open h5py
+    Dataset.  Integer data stored with scale_factor and/or add_offset attributes are converted
+    to floating point in the application's compute precision."""
+    if slice_idx is None:
+        data = dataset[...]
+    else:
+        data = dataset[slice_idx]
+    scale = dataset.attrs.get('scale_factor', 1.0)
+    offset = dataset.attrs.get('add_offset', 0.0)
+    if scale != 1 or offset != 0:
+        data = precision.apply_scale(data, scale, offset)
+    return data
+
 def get_data(data_fname, slice_idx=None):
     """Returns the NumPy array from the specified HDF5 file.  If slice_idx is specified (numpy.s_),
     returns a slice of the data rather than the entire array (default)."""
@@ -22,20 +38,23 @@ def get_data(data_fname, slice_idx=None):
         root, ext = os.path.splitext(os.path.basename(data_fname))
         for key in fidin.keys():
             if key.startswith(root):
-                if slice_idx is None:
-                    return fidin[key][...]
-                else:
-                    return fidin[key][slice_idx]
+                return read_dataset(fidin[key], slice_idx)
 
-def save_data(data_fname, data):
-    """Saves the data to the HDF5 file data_fname"""
+def save_data(data_fname, data, scale=None, offset=None):
+    """Saves the data to the HDF5 file data_fname.  If specified, scale and offset are stored as
+    the dataset's scale_factor and add_offset attributes and applied when the data are read
+    with get_data (i.e. the data are data * scale + offset)."""
     root, ext = os.path.splitext(data_fname)
     output_filename = data_fname
     hdf5_ext = '.hdf5'
     if ext.lower() != hdf5_ext:
         output_filename += hdf5_ext
     with h5py.File(output_filename, 'w') as fidout:
-        fidout.create_dataset(os.path.basename(data_fname), data=data)
+        dataset = fidout.create_dataset(os.path.basename(data_fname), data=data)
+        if scale is not None:
+            dataset.attrs['scale_factor'] = scale
+        if offset is not None:
+            dataset.attrs['add_offset'] = offset
         gc.collect()
 
 def get_txt_data(data_fname, **import_params):
@@ -177,6 +196,130 @@ def import_winspect(data_file):
     scan_reader = WinspectReader(data_file)
     scan_reader.import_winspect()
 
+def read_utwin_dataset(data_file, data_type, dataset_idx):
+    """Returns only the dataset_idx-th dataset of the specified type ('tof', 'amplitude' or 'waveform') from the
+    UTWin file data_file.  Primarily intended for use as a LazyDatasetMap loader."""
+    return UTWinCScanDataFile(data_file).read_dataset(data_type, dataset_idx)
+
+def get_utwin_datasets(data_file):
+    """Returns a LazyDatasetMap of the datasets in the UTWin file data_file keyed by type and number, e.g. 'tof0',
+    'amplitude0' and 'waveform0'.  Only the file's headers are read; each dataset is read when first accessed."""
+    positions = UTWinCScanDataFile(data_file).dataset_positions()
+    loaders = {}
+    for data_type in ('tof', 'amplitude'):
+        for dataset_idx in range(len(positions[data_type])):
+            loaders[data_type + str(dataset_idx)] = (read_utwin_dataset, (data_file, data_type, dataset_idx))
+    if positions['waveform']:
+        loaders['waveform0'] = (read_utwin_dataset, (data_file, 'waveform', 0))
+    return LazyDatasetMap(data_file, loaders)
+
+def read_winspect_dataset(data_file, dataset_idx):
+    """Returns only the dataset_idx-th data subset's data from the Winspect file data_file.  Primarily intended for
+    use as a LazyDatasetMap loader."""
+    scan_file = WinspectDataFile(data_file)
+    scan_file.read_header()
+    return scan_file.read_dataset(dataset_idx).data
+
+def get_winspect_datasets(data_file):
+    """Returns a LazyDatasetMap of the data subsets in the Winspect file data_file keyed by type and number, e.g.
+    'amplitude0' and 'waveform0'.  Subsets with other labels are keyed by label and number, e.g. 'amplitude_gate_2_0'
+    for the first subset labelled 'Amplitude (Gate 2)'.  Only the file's header is read; each subset is read when first
+    accessed."""
+    scan_file = WinspectDataFile(data_file)
+    scan_file.read_header()
+    counters = {}
+    loaders = {}
+    for dataset_idx, dataset in enumerate(scan_file.datasets):
+        if dataset.data_type in ('waveform', 'amplitude', 'tof'):
+            dataset_key = dataset.data_type + str(counters.get(dataset.data_type, 0))
+        else:
+            subset_name = re.sub(r'\W+', '_', dataset.data_type).strip('_')
+            dataset_key = subset_name + '_' + str(counters.get(dataset.data_type, 0))
+        counters[dataset.data_type] = counters.get(dataset.data_type, 0) + 1
+        loaders[dataset_key] = (read_winspect_dataset, (data_file, dataset_idx))
+    return LazyDatasetMap(data_file, loaders)
+
+
+class LazyDatasetMap(collections.MutableMapping):
+    """Dict-like collection of the datasets in a multi-dataset file such as a UTWin or Winspect scan.  The keys
+    are known from the file's headers but each dataset is only read when it's first accessed, so a plugin that
+    only uses e.g. 'amplitude0' never pays for decoding the waveforms.  loaders is a dict of (function, args)
+    tuples - function(*args) returns the dataset.  Use module-level functions so that the map can be sent to
+    another process (e.g. to run a plugin) without reading the data."""
+
+    def __init__(self, source, loaders):
+        self.source = source
+        self._loaders = dict(loaders)
+        self._keys = sorted(self._loaders)
+        self._datasets = {}
+        self._replaced = set()
+
+    def __getitem__(self, key):
+        if key not in self._datasets:
+            if key not in self._loaders:
+                raise KeyError(key)
+            loader, args = self._loaders[key]
+            self._datasets[key] = loader(*args)
+        return self._datasets[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._keys:
+            self._keys.append(key)
+        self._datasets[key] = value
+        self._replaced.add(key)
+
+    def __delitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        self._keys.remove(key)
+        self._loaders.pop(key, None)
+        self._datasets.pop(key, None)
+        self._replaced.discard(key)
+
+    def __contains__(self, key):
+        # Mapping's default would read the dataset
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return "LazyDatasetMap({0!r}, loaded={1!r}, unread={2!r})".format(
+            self.source, self.loaded_keys, [key for key in self._keys if key not in self._datasets])
+
+    def is_loaded(self, key):
+        """Returns True if the dataset key has been read or replaced"""
+        return key in self._datasets
+
+    @property
+    def loaded_keys(self):
+        """Returns the list of datasets that have been read or replaced.  As arrays can be modified in place these
+        are the only datasets that may differ from the source file, i.e. the only datasets to write back."""
+        return [key for key in self._keys if key in self._datasets]
+
+    def unload(self, key):
+        """Discards the data read for dataset key, which is read again if accessed, to limit memory use when
+        each dataset is only needed once.  Replaced datasets are kept."""
+        if key not in self._replaced:
+            self._datasets.pop(key, None)
+
+    def fingerprint(self, key):
+        """Returns a str identifying the dataset key as stored in the source file by the file's path, size and
+        modification time, e.g. to use in place of the unread data in result cache keys"""
+        stat = os.stat(self.source)
+        return "{0}:{1}:{2}:{3}".format(os.path.abspath(self.source), stat.st_size, stat.st_mtime, key)
+
+    def overlay(self, datasets):
+        """Returns a copy of the map with the datasets in the dict datasets replacing (or added to) the datasets
+        from the source file"""
+        lazy_map = LazyDatasetMap(self.source, self._loaders)
+        for key, data in datasets.items():
+            lazy_map[key] = data
+        return lazy_map
+
 
 class UTWinCscanReader(object):
     """Handles reading UTWin CScan (.csc) files"""
@@ -233,7 +376,9 @@ class UTWinCscanReader(object):
             fidin.seek(cls.header_string_length)
             msg_id, msg_len = cls.msg_info(fidin)
             while msg_id != message_id:
-                fidin.read(msg_len-4)
+                if msg_len < 4: # truncated or corrupt message
+                    return -1
+                fidin.seek(msg_len-4, os.SEEK_CUR)
                 msg_id, msg_len = cls.msg_info(fidin)
                 if msg_id is None or msg_len == 0:
                     return -1
@@ -247,10 +392,13 @@ class UTWinCscanReader(object):
         with open(file_name, "rb") as fidin:
             fidin.seek(cls.header_string_length)
             msg_id, msg_len = cls.msg_info(fidin)
-            while fidin.tell() != file_size:
+            while fidin.tell() < file_size:
                 if msg_id == message_id:
                     block_positions.append(fidin.tell())
-                fidin.read(msg_len-4)
+                if msg_len < 4: # truncated or corrupt message
+                    break
+                # Skip the message's contents rather than reading them
+                fidin.seek(msg_len-4, os.SEEK_CUR)
                 msg_id, msg_len = cls.msg_info(fidin)
         return block_positions
 
@@ -523,16 +671,24 @@ class UTWinCScanDataFile(object):
 
     def read_amplitude_data(self):
         """Reads the amplitude datasets in the UTWin data file"""
-        amplitude_positions = UTWinCscanReader.find_blocks(self.data_file, UTWinCscanReader.message_ids['UTSAVE_UTCD2'])
+        self._data['amplitude'].extend(self.read_amplitude_blocks())
+
+    def read_amplitude_blocks(self, amplitude_positions=None):
+        """Returns a list of the amplitude datasets starting at the specified file positions (defaults to every
+        amplitude dataset in the UTWin data file)"""
+        if amplitude_positions is None:
+            amplitude_positions = UTWinCscanReader.find_blocks(self.data_file,
+                                                               UTWinCscanReader.message_ids['UTSAVE_UTCD2'])
+        amplitude_data = []
         with open(self.data_file, "rb") as fidin:
             for pos in amplitude_positions:
                 fidin.seek(pos)
                 gate = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['ushort'])
                 nsize = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['int'])
                 amp_data = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['short'], nsize)
-                self._data['amplitude'].append(np.reshape(amp_data,
-                                                          (self.scan_properties['n_height'],
-                                                           self.scan_properties['n_width'])))
+                amplitude_data.append(np.reshape(amp_data,
+                                                 (self.scan_properties['n_height'], self.scan_properties['n_width'])))
+        return amplitude_data
 
     def import_amplitude_data(self):
         """Imports the amplitude datasets as HDF5 files"""
@@ -546,9 +702,14 @@ class UTWinCScanDataFile(object):
                                             os.path.basename(output_basename) + "_ampdata" + str(dataset_idx) + ext)
                 save_data(output_fname, dataset)
 
-    def read_tof_data(self):
-        """Reads the Time Of Flight (TOF) datasets from the UTWin data file"""
-        tof_positions = UTWinCscanReader.find_blocks(self.data_file, UTWinCscanReader.message_ids['UTSAVE_UTCD1'])
+    def read_tof_counts(self, tof_positions=None):
+        """Returns a list of the raw (unsigned integer) Time Of Flight (TOF) datasets starting at the specified
+        file positions (defaults to every TOF dataset in the UTWin data file).  Multiply by the scan's
+        tof_resolution to convert to time."""
+        tof_counts = []
+        if tof_positions is None:
+            tof_positions = UTWinCscanReader.find_blocks(self.data_file,
+                                                         UTWinCscanReader.message_ids['UTSAVE_UTCD1'])
         with open(self.data_file, "rb") as fidin:
             for pos in tof_positions:
                 fidin.seek(pos)
@@ -556,22 +717,59 @@ class UTWinCScanDataFile(object):
                 tof_start = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['float'])
                 nsize = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['int'])
                 tof_data = UTWinCscanReader.read_field(fidin, UTWinCscanReader.field_sizes['ushort'], nsize)
-                tof_data = np.reshape(tof_data,
-                                      (self.scan_properties['n_height'], self.scan_properties['n_width'])) * \
-                           self.scan_properties['tof_resolution']
-                self._data['tof'].append(tof_data)
+                tof_counts.append(np.reshape(tof_data,
+                                             (self.scan_properties['n_height'], self.scan_properties['n_width'])))
+        return tof_counts
+
+    def read_tof_data(self):
+        """Reads the Time Of Flight (TOF) datasets from the UTWin data file"""
+        for tof_data in self.read_tof_counts():
+            self._data['tof'].append(precision.apply_scale(tof_data, self.scan_properties['tof_resolution']))
+
+    def dataset_positions(self):
+        """Returns a dict of the file positions of each dataset in the UTWin data file by type ('tof', 'amplitude'
+        or 'waveform') without reading the datasets.  The waveform blocks together make up one dataset."""
+        if self.get_scan_version() >= 240:
+            waveform_id = UTWinCscanReader.message_ids['WAVEFORM_post240']
+        else:
+            waveform_id = UTWinCscanReader.message_ids['WAVEFORM_pre240']
+        return {'tof': UTWinCscanReader.find_blocks(self.data_file, UTWinCscanReader.message_ids['UTSAVE_UTCD1']),
+                'amplitude': UTWinCscanReader.find_blocks(self.data_file,
+                                                          UTWinCscanReader.message_ids['UTSAVE_UTCD2']),
+                'waveform': UTWinCscanReader.find_blocks(self.data_file, waveform_id)}
+
+    def read_dataset(self, data_type, dataset_idx):
+        """Reads and returns only the dataset_idx-th dataset of the specified type ('tof', 'amplitude' or 'waveform')
+        from the UTWin data file.  Raises IndexError if the file has no such dataset."""
+        if data_type == 'waveform':
+            if len(self._data['waveform']) == 0:
+                self.read_waveform_data()
+            return self._data['waveform'][dataset_idx]
+        message_id = {'tof': 'UTSAVE_UTCD1', 'amplitude': 'UTSAVE_UTCD2'}[data_type]
+        position = UTWinCscanReader.find_blocks(self.data_file,
+                                                UTWinCscanReader.message_ids[message_id])[dataset_idx]
+        if data_type == 'tof':
+            return precision.apply_scale(self.read_tof_counts([position])[0], self.scan_properties['tof_resolution'])
+        return self.read_amplitude_blocks([position])[0]
 
     def import_tof_data(self):
-        """Converts the TOF datasets to HDF5"""
-        if len(self._data['tof']) == 0:
-            self.read_tof_data()
-        for dataset_idx in range(len(self._data['tof'])):
-            dataset = self._data['tof'][dataset_idx]
+        """Converts the TOF datasets to HDF5.  Under native compute precision the raw TOF data are saved
+        with the TOF resolution as their scale_factor rather than being converted to floating point."""
+        scale = None
+        if len(self._data['tof']) == 0 and precision.store_scaled(np.uint16):
+            datasets = self.read_tof_counts()
+            scale = self.scan_properties['tof_resolution']
+        else:
+            if len(self._data['tof']) == 0:
+                self.read_tof_data()
+            datasets = self._data['tof']
+        for dataset_idx in range(len(datasets)):
+            dataset = datasets[dataset_idx]
             if dataset.size > 0:
                 output_basename, ext = os.path.splitext(self.data_file)
                 output_fname = os.path.join(pathfinder.data_path(),
                                             os.path.basename(output_basename) + "_tofdata" + str(dataset_idx) + ext)
-                save_data(output_fname, dataset)
+                save_data(output_fname, dataset, scale=scale)
 
     def unzip_waveform_data(self, compressed_waveform_data, start_pos, stop_pos, index, wave_size):
         """Reverses run-length encoding compression on specified dataset."""
@@ -924,6 +1122,18 @@ class WinspectDataFile(object):
                                        count=dataset.num_points())
                 dataset.set_data(raw_data)
 
+    def read_dataset(self, dataset_idx):
+        """Reads the binary data of only the dataset_idx-th data subset and returns the subset.  The header must
+        have been read (see read_header)."""
+        offset = self._data_offset
+        for dataset in self.datasets[:dataset_idx]:
+            offset += dataset.num_points() * np.dtype(dataset.element_type).itemsize
+        dataset = self.datasets[dataset_idx]
+        with open(self.file_name, "rb") as fidin:
+            fidin.seek(offset)
+            dataset.set_data(np.fromfile(fidin, dtype=dataset.element_type, count=dataset.num_points()))
+        return dataset
+
     def add_section(self, section_name, config):
         """Reads the section name and creates a new WinspectScanAxis or WinspectDataSubset with the supplied config."""
         if "axis" in section_name:
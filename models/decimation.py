@@ -0,0 +1,152 @@
+"""decimation.py - reduces long 1D data to the points needed to draw them at the resolution of a plot
+
+Drawing every point of a long A-scan or encoder trace makes every pan, zoom and redraw of a line plot slow,
+although only a few thousand points can be distinguished on screen.  Min/max decimation divides the data
+in view into blocks of roughly one pixel and keeps the minimum and maximum of each block (in their original
+order), so the drawn line has the same envelope as the complete data and no peaks are lost.
+
+The indices of the minimum and maximum of each block are computed once for blocks of base_block_size points
+and for blocks of twice the size of the previous level, so decimating any range of the data reads only
+the few thousand block extrema in view rather than the data.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+import numpy as np
+
+# Number of points in the smallest block of the precomputed levels - views of fewer than
+# base_block_size points per pixel are decimated directly from the data
+base_block_size = 64
+
+# Number of points read at a time when computing the smallest blocks
+chunk_size = base_block_size * 2 ** 14
+
+# Default number of pixels (blocks) if the width of the plot isn't known
+default_num_pixels = 2000
+
+
+def fill_nan(values, fill_value):
+    """Returns values with any NaN replaced by fill_value, e.g. so that NaN is ignored by argmin"""
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return np.where(np.isnan(values), fill_value, values)
+    return values
+
+
+def block_extrema(data, block_size, offset=0):
+    """Returns the indices (plus offset) of the minimum and maximum of each complete block of block_size points
+    in the 1D array data.  NaN is ignored unless every point in the block is NaN."""
+    num_blocks = data.shape[0] // block_size
+    blocks = data[:num_blocks * block_size].reshape(num_blocks, block_size)
+    starts = offset + np.arange(num_blocks) * block_size
+    return (starts + np.argmin(fill_nan(blocks, np.inf), axis=1),
+            starts + np.argmax(fill_nan(blocks, -np.inf), axis=1))
+
+
+class MinMaxDecimator(object):
+    """Min/max decimation of 1D data y, optionally plotted against x.  If y is not specified, the first
+    argument is the data and is plotted against its indices (as with matplotlib's plot)."""
+
+    def __init__(self, x, y=None):
+        if y is None:
+            x, y = None, x
+        self.y = np.asarray(y).ravel()
+        self.x = None if x is None else np.asarray(x).ravel()
+        if self.x is not None and self.x.shape != self.y.shape:
+            raise ValueError("X and Y data must be the same length")
+        # Ranges of X data are found by bisection, which requires X to be sorted
+        self.sorted = self.x is None or self.x.size < 2 or bool(np.all(np.diff(self.x) >= 0))
+        self.levels = []
+        self.build_levels()
+
+    def __len__(self):
+        return self.y.shape[0]
+
+    def build_levels(self):
+        """Computes the indices of the minimum and maximum of each block of base_block_size points, and of
+        each block of twice the previous level's size until a level has fewer than two blocks"""
+        min_idx = []
+        max_idx = []
+        num_points = base_block_size * (len(self) // base_block_size)
+        for start_idx in range(0, num_points, chunk_size):
+            chunk_mins, chunk_maxes = block_extrema(self.y[start_idx:min(start_idx + chunk_size, num_points)],
+                                                    base_block_size, start_idx)
+            min_idx.append(chunk_mins)
+            max_idx.append(chunk_maxes)
+        if not min_idx:
+            return
+        block_size = base_block_size
+        min_idx = np.concatenate(min_idx)
+        max_idx = np.concatenate(max_idx)
+        self.levels.append((block_size, min_idx, max_idx))
+        while min_idx.shape[0] >= 2:
+            # Pairs of adjacent blocks are merged; a trailing odd block is left out as it's not a complete block
+            pairs = np.arange(min_idx.shape[0] // 2)
+            min_idx = min_idx[:2 * pairs.shape[0]].reshape(-1, 2)
+            max_idx = max_idx[:2 * pairs.shape[0]].reshape(-1, 2)
+            min_idx = min_idx[pairs, np.argmin(fill_nan(self.y[min_idx], np.inf), axis=1)]
+            max_idx = max_idx[pairs, np.argmax(fill_nan(self.y[max_idx], -np.inf), axis=1)]
+            block_size *= 2
+            self.levels.append((block_size, min_idx, max_idx))
+
+    def visible_range(self, x0, x1):
+        """Returns the (start, stop) indices of the points between x0 and x1 and the point either side"""
+        if x0 is None or x1 is None:
+            return 0, len(self)
+        x0, x1 = min(x0, x1), max(x0, x1)
+        if self.x is None:
+            start_idx = int(np.floor(x0)) - 1
+            stop_idx = int(np.ceil(x1)) + 2
+        else:
+            start_idx = int(np.searchsorted(self.x, x0, side='left')) - 1
+            stop_idx = int(np.searchsorted(self.x, x1, side='right')) + 1
+        return max(0, start_idx), max(0, min(len(self), stop_idx))
+
+    def decimate_indices(self, start_idx, stop_idx, num_pixels):
+        """Returns the sorted indices of the points that draw the points start_idx:stop_idx in approximately
+        num_pixels blocks"""
+        num_points = stop_idx - start_idx
+        target_size = num_points // num_pixels
+        level = None
+        for block_size, min_idx, max_idx in self.levels:
+            if block_size > target_size:
+                break
+            level = block_size, min_idx, max_idx
+        if level is None:
+            # Blocks smaller than the precomputed levels are decimated directly from the data
+            block_mins, block_maxes = block_extrema(self.y[start_idx:stop_idx], target_size, start_idx)
+            inner_start = start_idx + target_size * block_mins.shape[0]
+            indices = [block_mins, block_maxes]
+            edges = [(inner_start, stop_idx)]
+        else:
+            block_size, min_idx, max_idx = level
+            first_block = min(-(-start_idx // block_size), min_idx.shape[0])
+            last_block = max(first_block, min(stop_idx // block_size, min_idx.shape[0]))
+            indices = [min_idx[first_block:last_block], max_idx[first_block:last_block]]
+            edges = [(start_idx, max(start_idx, min(first_block * block_size, stop_idx))),
+                     (max(last_block * block_size, start_idx), stop_idx)]
+        # Points outside the complete blocks make up less than a block and are kept as one min/max pair
+        for edge_start, edge_stop in edges:
+            if edge_stop > edge_start:
+                indices.extend(block_extrema(self.y[edge_start:edge_stop], edge_stop - edge_start, edge_start))
+        indices.append(np.array([start_idx, stop_idx - 1]))
+        return np.unique(np.concatenate(indices))
+
+    def decimate(self, x0=None, x1=None, num_pixels=None):
+        """Returns the (X, Y) arrays to plot to draw the data between x0 and x1 (defaults to all the data)
+        num_pixels wide.  Views of no more than two points per pixel, and unsorted X data, are returned
+        without decimation."""
+        if num_pixels is None:
+            num_pixels = default_num_pixels
+        num_pixels = max(1, int(num_pixels))
+        if not self.sorted:
+            return self.x, self.y
+        start_idx, stop_idx = self.visible_range(x0, x1)
+        if stop_idx - start_idx <= 2 * num_pixels:
+            indices = slice(start_idx, stop_idx)
+            x = np.arange(start_idx, stop_idx) if self.x is None else self.x[indices]
+        else:
+            indices = self.decimate_indices(start_idx, stop_idx, num_pixels)
+            x = indices if self.x is None else self.x[indices]
+        return x, self.y[indices]
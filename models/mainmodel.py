@@ -9,6 +9,9 @@ from controllers import pathfinder
 from models import abstractplugin
 from models import config
 from models import dataio
+from models import resultcache
+from models import runprofile
+from models import tiling
 import matplotlib
 import numpy as np
 import gc
@@ -18,6 +21,7 @@ import logging
 import logging.handlers
 import multiprocessing
 import os
+import Queue
 import shutil
 import sys
 
@@ -118,41 +122,228 @@ def load_gates():
     return load_dynamic_modules(pathfinder.gates_path(), abstractplugin.AbstractPlugin)
 
 
-def plugin_wrapper(exception_queue, plugin_cls, plugin_data, plugin_queue, plugin_cfg=None, **kwargs):
+def get_result_cache():
+    """Returns the ResultCache for plugin results, or None if the cache has been disabled
+    in the application's configuration.  The maximum size of the cache is set with the
+    Result Cache Size option (in MB)."""
+    config = get_config()
+    if config.get_app_option_boolean("Enable Result Cache") is False:
+        return None
+    max_size = config.get_app_option_float("Result Cache Size")
+    if max_size is not None:
+        max_size = int(max_size * 2 ** 20)
+    return resultcache.ResultCache(pathfinder.cache_path(), max_size)
+
+
+def clear_result_cache():
+    """Deletes all cached plugin results"""
+    resultcache.ResultCache(pathfinder.cache_path()).clear()
+
+
+def get_cache_key(plugin, data, config=None, **kwargs):
+    """Returns the result cache key for running the plugin class (or PluginPipeline) plugin on data with
+    the configuration dict config and keyword arguments kwargs, or None if the cache is disabled or the
+    plugin's results can't be cached.  Hashes the data, which can take a while for large data sets."""
+    if not resultcache.is_cacheable(plugin):
+        return None
+    cache = get_result_cache()
+    if cache is None:
+        return None
+    return cache.key(plugin, config, data, **kwargs)
+
+
+def load_cached_result(cache_key, data):
+    """Returns the results cached under cache_key for a plugin run on data, or None if not found"""
+    cache = get_result_cache()
+    if cache_key is None or cache is None or not cache.contains(cache_key):
+        return None
+    cached_data = cache.get(cache_key)
+    if isinstance(cached_data, resultcache.PartialResults):
+        # Only the datasets the plugin read were cached, the rest are the input's
+        cached_data = data.overlay(cached_data) if hasattr(data, "overlay") else None
+    return cached_data
+
+
+def get_cached_result(plugin, data, config=None, **kwargs):
+    """Checks the result cache for the results of running the plugin class (or PluginPipeline)
+    plugin on data with the configuration dict config and keyword arguments kwargs.  Returns a tuple
+    (cache key, cached results).  Cached results are None if not found; the cache key is None if
+    the cache is disabled or the plugin's results can't be cached."""
+    cache_key = get_cache_key(plugin, data, config, **kwargs)
+    return cache_key, load_cached_result(cache_key, data)
+
+
+def cache_result(cache_key, data):
+    """Stores data in the result cache under cache_key.  Failing to store the results is logged
+    but otherwise ignored."""
+    if cache_key is None:
+        return
+    try:
+        cache = get_result_cache()
+        if cache is not None:
+            cache.put(cache_key, data)
+    except Exception as err:
+        module_logger.warning("Unable to cache plugin results: {0}".format(err))
+
+
+class CompletedProcess(object):
+    """Stands in for the multiprocessing.Process returned by run_plugin and run_pipeline
+    when the results were found in the result cache and no process was started."""
+
+    exitcode = 0
+
+    def is_alive(self):
+        return False
+
+    def join(self, timeout=None):
+        pass
+
+    def terminate(self):
+        pass
+
+
+def cached_run(cached_data):
+    """Returns a (process, queue, exception queue) tuple for results retrieved from the result cache"""
+    cache_queue = Queue.Queue()
+    cache_queue.put(cached_data)
+    return CompletedProcess(), cache_queue, Queue.Queue()
+
+
+def plugin_wrapper(exception_queue, plugin_cls, plugin_data, plugin_queue, plugin_cfg=None, cache_key=None,
+                   profile_queue=None, **kwargs):
     """multiprocessing wrapper function, used to execute
     plugin run() method in separate process.  plugin_cls is the Plugin class
     to instantiate, plugin_data is the data to run the plugin on, and
     plugin_queue is the Queue instance the function should return the
     results in back to the caller.  If plugin_cfg is not None, it is
-    supplied to the Plugin instance as its config dict.
+    supplied to the Plugin instance as its config dict.  Plugins that declare a
+    tile_mode are run in parallel over tiles of the data (see models.tiling).
+    If cache_key is not None the results are stored in the result cache.  If
+    profile_queue is not None, the timing and memory use of each stage are
+    returned in profile_queue (see models.runprofile).
     """
-
-    plugin_instance = plugin_cls(**kwargs)
-    plugin_instance.data = plugin_data
-    if plugin_cfg is not None:
-        plugin_instance.config = plugin_cfg
+    profile = None
+    if profile_queue is not None:
+        profile = runprofile.RunProfile(plugin_cls.__name__, source='worker')
+    with runprofile.stage(profile, 'instantiate'):
+        plugin_instance = plugin_cls(**kwargs)
+        plugin_instance.data = plugin_data
+        if plugin_cfg is not None:
+            plugin_instance.config = plugin_cfg
     try:
         # Instruct NumPy to raise all warnings (division by zero, etc.)
         # to Exceptions to pass to exception queue
         np.seterr(all='raise')
-        plugin_instance.run()
-        plugin_queue.put(plugin_instance.data)
+        with runprofile.stage(profile, 'run'):
+            if tiling.is_tileable(plugin_instance, plugin_data):
+                # Plugin has declared it can be run on subsets of the data - split into tiles and run in parallel
+                plugin_instance.data = tiling.run_tiled(plugin_cls, plugin_data, plugin_cfg, **kwargs)
+            else:
+                plugin_instance.run()
+        if cache_key is not None:
+            with runprofile.stage(profile, 'cache store'):
+                cache_result(cache_key, plugin_instance.data)
+        return_results(plugin_queue, plugin_instance.data, profile)
     except Exception as err:
         # Pass a message to the parent process with the Exception information
         module_logger.error("Error running plugin: {0}".format(err))
         exception_queue.put(sys.exc_info()[:2])
-
-
-def run_plugin(plugin_cls, data=None, config=None, **kwargs):
-    """Runs the plugin plugin_cls"""
+    finally:
+        if profile is not None:
+            profile.send(profile_queue)
+
+
+def return_results(results_queue, results, profile=None):
+    """Returns results to the parent process through results_queue.  If profiling, waits for the
+    results to be pickled and sent so that the time taken is included in the profile."""
+    with runprofile.stage(profile, 'return'):
+        results_queue.put(results)
+        if profile is not None:
+            results_queue.close()
+            results_queue.join_thread()
+
+
+def run_plugin(plugin_cls, data=None, config=None, use_cache=True, profile=None, **kwargs):
+    """Runs the plugin plugin_cls, returning a tuple (process, queue, exception queue).  If use_cache
+    is True (default) and the results are found in the result cache, no process is started - the
+    results are already in the queue.  Checking the cache hashes the data, so call from a worker thread
+    rather than the GUI thread for large data sets.  If profile is a RunProfile, the timing and memory use of each
+    stage are recorded (call profile.collect() once the results have been received to add the stages
+    run in the plugin's process)."""
+    cache_key = None
+    if use_cache:
+        with runprofile.stage(profile, 'cache lookup'):
+            cache_key = get_cache_key(plugin_cls, data, config, **kwargs)
+            cached_data = load_cached_result(cache_key, data)
+        if cached_data is not None:
+            module_logger.info("Retrieved results of {0} from cache.".format(plugin_cls))
+            return cached_run(cached_data)
     plugin_queue = multiprocessing.Queue()
     plugin_exception_queue = multiprocessing.Queue()
+    kwargs['cache_key'] = cache_key
+    if profile is not None:
+        kwargs['profile_queue'] = profile.queue
     plugin_process = multiprocessing.Process(target=plugin_wrapper,
                                              args=(plugin_exception_queue, plugin_cls, data, plugin_queue, config),
                                              kwargs=kwargs)
-    plugin_process.start()
+    with runprofile.stage(profile, 'process start'):
+        plugin_process.start()
     return plugin_process, plugin_queue, plugin_exception_queue
 
+
+def pipeline_wrapper(exception_queue, pipeline, pipeline_data, pipeline_queue, cache_key=None, profile_queue=None):
+    """multiprocessing wrapper function, used to execute a
+    PluginPipeline (see models.pipeline) in a separate process.  Every step of the
+    pipeline is run in the same process so intermediate results are never
+    passed back to the caller; only the final results are returned in pipeline_queue.
+    If cache_key is not None the results are stored in the result cache.  If profile_queue
+    is not None, the timing and memory use of each stage are returned in profile_queue.
+    """
+    profile = None
+    if profile_queue is not None:
+        profile = runprofile.RunProfile(pipeline.name, source='worker')
+    try:
+        np.seterr(all='raise')
+        pipeline.data = pipeline_data
+        with runprofile.stage(profile, 'run'):
+            pipeline.run()
+        if cache_key is not None:
+            with runprofile.stage(profile, 'cache store'):
+                cache_result(cache_key, pipeline.data)
+        return_results(pipeline_queue, pipeline.data, profile)
+    except Exception as err:
+        module_logger.error("Error running pipeline: {0}".format(err))
+        exception_queue.put(sys.exc_info()[:2])
+    finally:
+        if profile is not None:
+            profile.send(profile_queue)
+
+
+def run_pipeline(pipeline, data=None, use_cache=True, profile=None):
+    """Runs the PluginPipeline pipeline, returning a tuple (process, queue, exception queue).  If
+    use_cache is True (default) and the results are found in the result cache, no process is started.
+    As for run_plugin, call from a worker thread for large data sets.  If profile is a RunProfile, the timing and
+    memory use of each stage are recorded."""
+    cache_key = None
+    if use_cache:
+        with runprofile.stage(profile, 'cache lookup'):
+            cache_key = get_cache_key(pipeline, data, pipeline.config)
+            cached_data = load_cached_result(cache_key, data)
+        if cached_data is not None:
+            module_logger.info("Retrieved results of pipeline {0} from cache.".format(pipeline.name))
+            return cached_run(cached_data)
+    pipeline_queue = multiprocessing.Queue()
+    pipeline_exception_queue = multiprocessing.Queue()
+    profile_queue = None
+    if profile is not None:
+        profile_queue = profile.queue
+    pipeline_process = multiprocessing.Process(target=pipeline_wrapper,
+                                               args=(pipeline_exception_queue, pipeline, data, pipeline_queue,
+                                                     cache_key, profile_queue))
+    with runprofile.stage(profile, 'process start'):
+        pipeline_process.start()
+    return pipeline_process, pipeline_queue, pipeline_exception_queue
+
 def get_windows_version():
     """Returns the major, minor version of the
     Windows OS, or None if not on Windows."""
@@ -256,8 +447,10 @@ class MainModel(object):
         gates_folder = pathfinder.gates_path()
         colormaps_folder = pathfinder.colormaps_path()
         batch_folder = pathfinder.batchoutput_path()
+        pipelines_folder = pathfinder.pipelines_path()
+        cache_folder = pathfinder.cache_path()
         for fldr in (user_folder, data_folder, thumbnail_folder, plugins_folder, podmodels_folder, gates_folder,
-                     colormaps_folder, batch_folder):
+                     colormaps_folder, batch_folder, pipelines_folder, cache_folder):
             if not os.path.exists(fldr):
                 os.makedirs(fldr)
 
@@ -1,23 +1,418 @@
 """ndescanhandler.py - returns A, B, and C scan datasets
 from three-dimensional NumPy arrays
 
+Computed C-scans of large data sets are generated in tiles:  the (y, x) plane is split into
+blocks of rows (and of columns if a single row is too large), each block's gate is read and
+reduced in a pool of worker threads or processes and the results are written into the C-scan.
+Data stored in an HDF5 file (h5py Dataset) are read one block at a time rather than all at once.
+
+Computed C-scans and the slices returned for plotting are kept in a least recently used cache of
+limited size, so that replotting (e.g. changing the colormap) or returning to a previous C-scan
+definition doesn't recompute them.  The cache is emptied when the handler's data are replaced.
+
 Chris R. Coughlin (TRI/Austin, Inc.)
 """
 
 __author__ = 'Chris R. Coughlin'
 
+from models import dataio
+from models import precision
+from models import tiling
+import h5py
 import numpy as np
+import collections
+import math
+import multiprocessing
+import threading
+
+# Default maximum size in bytes of the gated data read for each C-scan block
+default_block_bytes = 16 * 2 ** 20
+
+# Gates smaller than this many bytes are reduced in a single call in the current thread
+min_tiled_bytes = 2 * default_block_bytes
+
+
+# Per-trace features available from extract_features - name: human-friendly name
+cscan_features = collections.OrderedDict([('max', "Maximum"),
+                                          ('min', "Minimum"),
+                                          ('ptp', "Peak-To-Peak"),
+                                          ('mean', "Mean"),
+                                          ('rms', "RMS"),
+                                          ('energy', "Energy"),
+                                          ('argmax', "Index Of Maximum (Time Of Flight)"),
+                                          ('first_crossing', "Index Of First Threshold Crossing")])
+
+# Default maximum size in bytes of the gated data read for each block of a multi-feature C-scan - small enough
+# that each block stays in the CPU cache while all the features are computed from it
+default_feature_block_bytes = 2 ** 20
+
+# Ways of computing median and percentile C-scans:  exactly from each block's complete traces, or estimated
+# from a streaming histogram that reads the traces a few samples at a time (see approximate_quantile)
+EXACT = 'exact'
+APPROXIMATE = 'approximate'
+quantile_modes = [EXACT, APPROXIMATE]
+
+# Default number of histogram bins per pass and number of passes of approximate quantiles - estimates are
+# within (maximum - minimum) / bins ** passes of each trace's exact quantile
+default_quantile_bins = 64
+default_quantile_passes = 2
+
+# Default number of samples of each trace read at a time by streaming reductions
+default_stream_length = 64
+
+# Default maximum size in bytes of the cache of computed C-scans and slices
+default_cache_bytes = 256 * 2 ** 20
+
+
+class ScanCache(object):
+    """Least recently used cache of NumPy arrays holding no more than max_bytes bytes (defaults to
+    default_cache_bytes).  The cache stores its own read-only copy of each array and returns copies of
+    it, so callers can modify the arrays they're given without changing the cache."""
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = default_cache_bytes
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Returns a copy of the array stored under key and marks it as most recently used, or None if
+        not cached"""
+        with self._lock:
+            cached_arr = self._entries.pop(key, None)
+            if cached_arr is None:
+                return None
+            self._entries[key] = cached_arr
+        return cached_arr.copy()
+
+    def put(self, key, arr):
+        """Stores a copy of the array arr under key, discarding the least recently used arrays as required
+        to stay within the size limit.  Arrays larger than the limit aren't stored.  Returns arr."""
+        cached_arr = None
+        if arr.nbytes <= self.max_bytes:
+            cached_arr = np.array(arr, copy=True)
+            cached_arr.flags.writeable = False
+        with self._lock:
+            old_arr = self._entries.pop(key, None)
+            if old_arr is not None:
+                self.nbytes -= old_arr.nbytes
+            if cached_arr is None:
+                return arr
+            while self._entries and self.nbytes + cached_arr.nbytes > self.max_bytes:
+                discarded_key, discarded_arr = self._entries.popitem(last=False)
+                self.nbytes -= discarded_arr.nbytes
+            self._entries[key] = cached_arr
+            self.nbytes += cached_arr.nbytes
+        return arr
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+def cscan_blocks(shape, gate_length, itemsize, max_block_bytes=None):
+    """Returns a list of (row slice, column slice) blocks covering the (y, x) plane of a 3D array of the
+    specified shape such that the gate of gate_length elements of itemsize bytes of each block is no larger
+    than max_block_bytes (defaults to default_block_bytes).  Blocks are whole rows where possible."""
+    if max_block_bytes is None:
+        max_block_bytes = default_block_bytes
+    height, width = shape[:2]
+    trace_bytes = max(1, gate_length * itemsize)
+    traces_per_block = max(1, int(max_block_bytes // trace_bytes))
+    blocks = []
+    if traces_per_block >= width:
+        rows_per_block = max(1, traces_per_block // max(width, 1))
+        for row in range(0, height, rows_per_block):
+            blocks.append((slice(row, min(row + rows_per_block, height)), slice(0, width)))
+    else:
+        for row in range(height):
+            for col in range(0, width, traces_per_block):
+                blocks.append((slice(row, row + 1), slice(col, min(col + traces_per_block, width))))
+    return blocks
+
+
+def reduce_cscan(data, fn, compute_precision=None):
+    """Applies fn along the last axis of the 3D array data and returns the 2D results in the compute
+    precision (defaults to the application's compute precision)"""
+    if fn in [np.average, np.mean]:
+        # Unweighted average == mean; np.mean accumulates in the requested dtype
+        return np.mean(data, axis=2, dtype=precision.compute_dtype(data.dtype, compute_precision))
+    exact = fn in [np.amax, np.amin, np.ptp]
+    return fn(data, axis=2).astype(precision.compute_dtype(data.dtype, compute_precision, exact=exact), copy=False)
+
+
+def extract_features(data, features, threshold=None, index_offset=0, compute_precision=None):
+    """Returns a dict of the 2D maps of the requested features (see cscan_features) of each trace along the
+    last axis of the 3D array data, computed together so that the data are only read once.  Amplitudes are
+    returned in the compute precision (defaults to the application's compute precision) and indices as
+    integers offset by index_offset; traces that never reach the threshold have a first_crossing of -1.
+    Raises ValueError if a feature is unknown or if first_crossing is requested without a threshold."""
+    features = list(features)
+    for feature in features:
+        if feature not in cscan_features:
+            raise ValueError("Unknown C scan feature '{0}', must be one of {1}".format(feature,
+                                                                                        ", ".join(cscan_features)))
+    if 'first_crossing' in features and threshold is None:
+        raise ValueError("A threshold is required to find the first threshold crossing")
+    num_samples = data.shape[2]
+    float_dtype = precision.compute_dtype(data.dtype, compute_precision)
+    exact_dtype = precision.compute_dtype(data.dtype, compute_precision, exact=True)
+    maps = {}
+    if 'argmax' in features:
+        peak_idx = np.argmax(data, axis=2)
+        maps['argmax'] = peak_idx + index_offset
+        # Maximum is read from the peak rather than searching the data again
+        peak = peak_values(data, peak_idx)
+    elif 'max' in features or 'ptp' in features:
+        peak = np.amax(data, axis=2)
+    if 'min' in features or 'ptp' in features:
+        trough = np.amin(data, axis=2)
+    if 'max' in features:
+        maps['max'] = peak.astype(exact_dtype, copy=False)
+    if 'min' in features:
+        maps['min'] = trough.astype(exact_dtype, copy=False)
+    if 'ptp' in features:
+        maps['ptp'] = np.subtract(peak, trough).astype(exact_dtype, copy=False)
+    if 'mean' in features:
+        maps['mean'] = np.mean(data, axis=2, dtype=float_dtype)
+    if 'energy' in features or 'rms' in features:
+        # Sum of squares without a temporary array of the squared data
+        energy = np.einsum('ijk,ijk->ij', data, data, dtype=float_dtype, casting='unsafe')
+        if 'energy' in features:
+            maps['energy'] = energy
+        if 'rms' in features:
+            maps['rms'] = np.sqrt(energy / num_samples)
+    if 'first_crossing' in features:
+        crossed = np.abs(data) >= threshold
+        first_crossing = np.argmax(crossed, axis=2) + index_offset
+        first_crossing[~crossed.any(axis=2)] = -1
+        maps['first_crossing'] = first_crossing
+    return maps
+
+
+def peak_values(data, peak_idx):
+    """Returns the values of the 3D array data at the indices peak_idx (2D) along its last axis"""
+    flat_data = data.reshape(-1, data.shape[2])
+    return flat_data[np.arange(flat_data.shape[0]), peak_idx.ravel()].reshape(peak_idx.shape)
+
+
+def first_crossings(crossed, times):
+    """Returns the times (1D, one per sample) of the first True sample along the last axis of the 3D boolean
+    array crossed, or -1 where there are none"""
+    first_idx = np.argmax(crossed, axis=2)
+    return np.where(crossed.any(axis=2), times[first_idx], -1)
+
+
+def extract_gated(data, gate_start, gate_stop, threshold=None, rectify=True, interface_gate=None, index_offset=0,
+                  compute_precision=None):
+    """Returns a dict of the 2D maps of the peak amplitude ('peak') and the z index of the peak ('peak_time') of
+    each trace along the last axis of the 3D array data inside the gate between z=gate_start and z=gate_stop.
+    The first sample of data is at z=index_offset.  If threshold is specified the z index at which each trace
+    first reaches the threshold inside the gate is returned as 'crossing_time'.  Amplitudes are rectified
+    unless rectify is False and returned in the compute precision (defaults to the application's compute
+    precision).
+
+    If interface_gate (start, stop, threshold) is specified the gate follows the interface echo:  the first
+    sample of each trace between z=start and z=stop to reach the interface threshold is returned as
+    'interface_time', and the gate is from gate_start to gate_stop samples after it.  Traces without an
+    interface echo, or with a gate entirely outside the data, have a peak of NaN and times of -1.  All
+    traces are processed together, without looping over the traces."""
+    num_samples = data.shape[2]
+    amplitude = data.astype(precision.compute_dtype(data.dtype, compute_precision), copy=False)
+    if rectify:
+        amplitude = np.abs(amplitude)
+    times = np.arange(index_offset, index_offset + num_samples)
+    maps = {}
+    if interface_gate is None:
+        gate_lo = max(0, int(gate_start) - index_offset)
+        gate_hi = min(num_samples, int(gate_stop) - index_offset)
+        if gate_hi <= gate_lo:
+            raise ValueError("Gate z={0}:{1} is outside the data".format(gate_start, gate_stop))
+        gated = amplitude[:, :, gate_lo:gate_hi]
+        peak_idx = np.argmax(gated, axis=2)
+        maps['peak'] = peak_values(gated, peak_idx)
+        maps['peak_time'] = times[gate_lo:gate_hi][peak_idx]
+        if threshold is not None:
+            maps['crossing_time'] = first_crossings(gated >= threshold, times[gate_lo:gate_hi])
+        return maps
+    if_start, if_stop, if_threshold = interface_gate
+    in_if_gate = (times >= if_start) & (times < if_stop)
+    interface_time = first_crossings((amplitude >= if_threshold) & in_if_gate, times)
+    maps['interface_time'] = interface_time
+    # Gate of each trace relative to its interface echo
+    gate_lo = (interface_time + int(gate_start))[..., np.newaxis]
+    gate_hi = (interface_time + int(gate_stop))[..., np.newaxis]
+    in_gate = (times >= gate_lo) & (times < gate_hi) & (interface_time >= 0)[..., np.newaxis]
+    gated = np.where(in_gate, amplitude, -np.inf)
+    peak_idx = np.argmax(gated, axis=2)
+    has_gate = in_gate.any(axis=2)
+    maps['peak'] = np.where(has_gate, peak_values(gated, peak_idx), np.nan).astype(amplitude.dtype, copy=False)
+    maps['peak_time'] = np.where(has_gate, times[peak_idx], -1)
+    if threshold is not None:
+        maps['crossing_time'] = first_crossings(gated >= threshold, times)
+    return maps
+
+
+def exact_quantile(data, q, compute_precision=None):
+    """Returns the q-th percentile (0-100) of each trace along the last axis of the 3D array data in the compute
+    precision (defaults to the application's compute precision)"""
+    if q == 50:
+        quantile = np.median(data, axis=2)
+    else:
+        quantile = np.percentile(data, q, axis=2)
+    return quantile.astype(precision.compute_dtype(data.dtype, compute_precision), copy=False)
+
+
+def approximate_quantile(read_fn, num_samples, q, bins=None, passes=None, stream_length=None,
+                         compute_precision=None):
+    """Returns an estimate of the q-th percentile (0-100) of each of a 2D array of traces of num_samples samples,
+    read stream_length (defaults to default_stream_length) samples at a time with read_fn(start, stop), which
+    returns the 3D array of samples start to stop of every trace.  Only one group of samples is in memory at a
+    time; the traces are read passes + 1 times.
+
+    The first pass finds each trace's range.  Each later pass counts the samples of each trace in bins
+    (defaults to default_quantile_bins) equal divisions of the parts of the range found to hold the samples
+    either side of the quantile's rank q * (num_samples - 1) / 100 in the previous pass.  The two samples are
+    interpolated as numpy.percentile does, so the estimate is within (maximum - minimum) / bins ** passes of the
+    exact quantile.  Results are returned in the compute precision (defaults to the application's compute
+    precision).
+    """
+    if bins is None:
+        bins = default_quantile_bins
+    if passes is None:
+        passes = default_quantile_passes
+    if stream_length is None:
+        stream_length = default_stream_length
+    rank = q / 100. * (num_samples - 1)
+    target_ranks = sorted(set([int(math.floor(rank)), int(math.ceil(rank))]))
+    lo = None
+    hi = None
+    float_dtype = None
+    for start in range(0, num_samples, stream_length):
+        samples = read_fn(start, min(start + stream_length, num_samples))
+        if lo is None:
+            float_dtype = precision.compute_dtype(samples.dtype, compute_precision)
+            lo = np.amin(samples, axis=2).astype(np.float64)
+            hi = np.amax(samples, axis=2).astype(np.float64)
+        else:
+            np.minimum(lo, np.amin(samples, axis=2), out=lo)
+            np.maximum(hi, np.amax(samples, axis=2), out=hi)
+    shape = lo.shape
+    num_traces = lo.size
+    # Each sample is assigned to one of bins ** passes cells of its trace's range; every pass works with the same
+    # integer cells so that a sample is never counted in two neighbouring bins
+    num_cells = bins ** passes
+    cell_scale = np.zeros(shape)
+    np.divide(num_cells, hi - lo, out=cell_scale, where=hi > lo)
+    # Cell holding the sample at each target rank and number of samples in the cells below it
+    cells = [np.zeros(shape, dtype=np.int64) for target_rank in target_ranks]
+    belows = [np.zeros(shape, dtype=np.int64) for target_rank in target_ranks]
+    samples_in_cells = [None] * len(target_ranks)
+    offsets = (np.arange(num_traces, dtype=np.int64) * bins).reshape(shape + (1,))
+    for pass_idx in range(passes):
+        cells_per_bin = bins ** (passes - pass_idx - 1)
+        # Both samples are usually in the same cell, in which case they share the counts
+        search_cells = cells[:1] if np.array_equal(cells[0], cells[-1]) else cells
+        # Samples outside the current cell are counted in an extra bin that's discarded
+        counts = [np.zeros(num_traces * bins + 1, dtype=np.int64) for cell in search_cells]
+        for start in range(0, num_samples, stream_length):
+            samples = read_fn(start, min(start + stream_length, num_samples))
+            sample_cells = np.minimum((samples - lo[..., np.newaxis]) * cell_scale[..., np.newaxis],
+                                      num_cells - 1).astype(np.int64)
+            sample_bins = sample_cells // cells_per_bin
+            for cell, cell_counts in zip(search_cells, counts):
+                inside = (sample_bins // bins) == cell[..., np.newaxis]
+                cell_counts += np.bincount(np.where(inside, sample_bins % bins + offsets, num_traces * bins).ravel(),
+                                           minlength=num_traces * bins + 1)
+        for idx, target_rank in enumerate(target_ranks):
+            target_counts = counts[min(idx, len(counts) - 1)][:-1].reshape(shape + (bins,))
+            cumulative_counts = np.cumsum(target_counts, axis=2) + belows[idx][..., np.newaxis]
+            rank_bin = np.argmax(cumulative_counts > target_rank, axis=2)
+            samples_in_cells[idx] = peak_values(target_counts, rank_bin)
+            belows[idx] = peak_values(cumulative_counts, rank_bin) - samples_in_cells[idx]
+            cells[idx] = cells[idx] * bins + rank_bin
+    cell_width = np.zeros(shape)
+    np.divide(1., cell_scale, out=cell_width, where=cell_scale > 0)
+    estimates = []
+    for target_rank, cell, below, samples_in_cell in zip(target_ranks, cells, belows, samples_in_cells):
+        # Assume the samples in the final cell are evenly spread across it
+        position = (target_rank - below + 0.5) / np.maximum(samples_in_cell, 1)
+        estimates.append(np.clip(lo + (cell + np.clip(position, 0, 1)) * cell_width, lo, hi))
+    estimate = estimates[0] + (rank - target_ranks[0]) * (estimates[-1] - estimates[0])
+    return estimate.astype(float_dtype, copy=False)
+
+
+def reduce_block(block_args):
+    """Reduces a single C-scan block and returns the results.  block_args is a tuple
+    (reduce_fn, block data, args, np_err) and the results are reduce_fn(block data, *args);
+    np_err is the NumPy floating point error handling in effect in the caller, which is
+    not inherited by worker processes."""
+    reduce_fn, block_data, args, np_err = block_args
+    np.seterr(**np_err)
+    return reduce_fn(block_data, *args)
+
 
 class NDEScanHandler(object):
     """Utility class to return A, B, and C scan
     arrays from three-dimensional NDE scans"""
 
-    def __init__(self, np_array):
+    def __init__(self, np_array, cache_bytes=None, quantile_mode=EXACT):
         """Creates the array handler from the specified
         NumPy array.  Raises AssertionError if np_array
-        does not have three dimensions."""
+        does not have three dimensions.  Computed C scans and
+        slices are cached up to cache_bytes bytes (defaults to
+        default_cache_bytes).  Median and percentile C scans are
+        computed according to quantile_mode (one of quantile_modes)."""
+        assert np_array.ndim == 3
+        self.data = np_array
+        self.quantile_mode = quantile_mode
+        self.data_version = 0
+        self.cache = ScanCache(cache_bytes)
+
+    def set_data(self, np_array):
+        """Replaces the handler's data with the specified NumPy array and empties
+        the cache.  Does nothing if np_array is already the handler's data.
+        Raises AssertionError if np_array does not have three dimensions."""
         assert np_array.ndim == 3
+        if np_array is self.data:
+            return
         self.data = np_array
+        self.invalidate()
+
+    def invalidate(self):
+        """Empties the cache, e.g. after the data have been modified in place"""
+        self.data_version += 1
+        self.cache.clear()
+
+    def cached(self, operation, index, fn_name, compute_fn, *args):
+        """Returns the result of operation on the data at index with the function named fn_name from the cache,
+        or computes it with compute_fn(*args) and caches it.  Results of None (e.g. a cancelled C scan) and
+        results for data that were replaced while they were computed aren't cached."""
+        data_version = self.data_version
+        key = (operation, index, fn_name, data_version)
+        result = self.cache.get(key)
+        if result is None:
+            result = compute_fn(*args)
+            if result is not None and data_version == self.data_version:
+                result = self.cache.put(key, result)
+        return result
+
+    def read_block(self, block_idx):
+        """Returns the NumPy array of the data at index block_idx, reading only that block from disk if
+        the data are an HDF5 (h5py) Dataset"""
+        if isinstance(self.data, h5py.Dataset):
+            return dataio.read_dataset(self.data, block_idx)
+        return self.data[block_idx]
 
     @property
     def available_cscan_functions(self):
@@ -34,11 +429,11 @@ class NDEScanHandler(object):
     def cscan_data(self, slice_idx):
         """Returns the 2D slice of the 3D array
         at index z=slice_idx."""
-        return self.data[:, :, slice_idx]
+        return self.cached('cscan_data', slice_idx, None, self.read_block, np.s_[:, :, slice_idx])
 
     def ascan_data(self, xpos, ypos):
         """Returns the waveform from the (x,y) position"""
-        return self.data[ypos, xpos, :]
+        return self.read_block(np.s_[ypos, xpos, :])
 
     def hslice_cscan_data(self, slice_idx, ypos):
         """Returns the horizontal slice at y=ypos through the 2D slice at z=slice_idx (1D cross-section through the
@@ -51,7 +446,7 @@ class NDEScanHandler(object):
 
     def hbscan_data(self, y_idx):
         """Returns the 2D planar slice at the specified Y position through the 3D data."""
-        return self.data[y_idx, :, :]
+        return self.cached('hbscan_data', y_idx, None, self.read_block, np.s_[y_idx, :, :])
 
     def vslice_cscan_data(self, slice_idx, xpos):
         """Returns the vertical slice at x=xpos through the 2D slice at z=slice_idx (1D cross-section through the
@@ -64,9 +459,10 @@ class NDEScanHandler(object):
 
     def vbscan_data(self, x_idx):
         """Returns the 2D planar slice at the specified X position through the 3D data."""
-        return self.data[:, x_idx, :]
+        return self.cached('vbscan_data', x_idx, None, self.read_block, np.s_[:, x_idx, :])
 
-    def gen_cscan(self, start_idx, stop_idx, fn=None):
+    def gen_cscan(self, start_idx, stop_idx, fn=None, progress_fn=None, cancel_event=None, num_workers=None,
+                  use_threads=True, max_block_bytes=None):
         """Returns a computed C scan dataset:  takes the subset
         of data between z=start_idx and z=stop_idx and applies a
         function to return a computed 2D array.  Raises an
@@ -75,12 +471,259 @@ class NDEScanHandler(object):
         Function defaults to numpy.amax if not provided and must be
         one of the following functions that support an axis argument:
         [np.amax, np.amin, np.ptp, np.average, np.mean, np.median].
+
+        Results are returned in the application's compute precision; averages are
+        accumulated in the compute precision rather than converting the data.
+
+        Gates larger than min_tiled_bytes are split into blocks of up to max_block_bytes (see cscan_blocks)
+        that are reduced in a pool of num_workers (defaults to one per CPU) threads, or processes if use_threads
+        is False.  If specified, progress_fn(fraction) is called as each block is completed, and the C scan is
+        abandoned and None returned once the threading.Event cancel_event is set.
+
+        C scans are cached (see ScanCache), so the same C scan is only computed once.
         """
         assert stop_idx > start_idx
-        data = self.data[:, :, start_idx:stop_idx]
         if fn is None:
-            cscan_data = np.amax(data, axis=2)
+            fn = np.amax
+        assert fn in self.available_cscan_functions
+        start_idx = int(start_idx)
+        stop_idx = min(int(stop_idx), self.data.shape[2])
+        if fn is np.median and self.quantile_mode == APPROXIMATE:
+            return self.gen_quantile_cscan(start_idx, stop_idx, 50, progress_fn=progress_fn, cancel_event=cancel_event,
+                                           num_workers=num_workers, max_block_bytes=max_block_bytes)
+        # Results depend on the compute precision as well as the function
+        fn_name = (fn.__name__, precision.get_precision())
+        if progress_fn is not None and ('gen_cscan', (start_idx, stop_idx), fn_name, self.data_version) in self.cache:
+            progress_fn(1.0)
+        return self.cached('gen_cscan', (start_idx, stop_idx), fn_name, self.compute_cscan, start_idx,
+                           stop_idx, fn, progress_fn, cancel_event, num_workers, use_threads, max_block_bytes)
+
+    def compute_cscan(self, start_idx, stop_idx, fn, progress_fn=None, cancel_event=None, num_workers=None,
+                      use_threads=True, max_block_bytes=None):
+        """Computes the C scan of fn between z=start_idx and z=stop_idx without using the cache (see gen_cscan)"""
+        return self.run_blocks(start_idx, stop_idx, reduce_cscan, (fn, precision.get_precision()), progress_fn,
+                               cancel_event, num_workers, use_threads, max_block_bytes)
+
+    def gen_quantile_cscan(self, start_idx, stop_idx, q, mode=None, bins=None, passes=None, progress_fn=None,
+                           cancel_event=None, num_workers=None, use_threads=True, max_block_bytes=None):
+        """Returns the C scan of the q-th percentile (0-100, 50 is the median) of each A-scan between
+        z=start_idx and z=stop_idx.  Raises AssertionError if stop_idx <= start_idx or q isn't between 0
+        and 100.
+
+        If mode (defaults to the handler's quantile_mode) is EXACT the percentiles are computed from each
+        block's complete A-scans.  If mode is APPROXIMATE the A-scans are read default_stream_length samples
+        at a time and the percentiles estimated to within (maximum - minimum) / bins ** passes of each A-scan
+        (see approximate_quantile), so memory use doesn't depend on the length of the gate; approximate
+        C scans are always computed in threads.  Progress, cancellation and caching are handled in the same
+        way as gen_cscan.
+        """
+        assert stop_idx > start_idx
+        assert 0 <= q <= 100
+        if mode is None:
+            mode = self.quantile_mode
+        if mode not in quantile_modes:
+            raise ValueError("Quantile mode must be one of {0}".format(", ".join(quantile_modes)))
+        if bins is None:
+            bins = default_quantile_bins
+        if passes is None:
+            passes = default_quantile_passes
+        start_idx = int(start_idx)
+        stop_idx = min(int(stop_idx), self.data.shape[2])
+        compute_precision = precision.get_precision()
+        if mode == EXACT:
+            params = (q, mode, compute_precision)
+            reduce_fn, args, stream_length = exact_quantile, (q, compute_precision), None
+        else:
+            params = (q, mode, bins, passes, compute_precision)
+            stream_length = default_stream_length
+            reduce_fn, args = approximate_quantile, (q, bins, passes, stream_length, compute_precision)
+        if progress_fn is not None and ('gen_quantile_cscan', (start_idx, stop_idx), params,
+                                        self.data_version) in self.cache:
+            progress_fn(1.0)
+        return self.cached('gen_quantile_cscan', (start_idx, stop_idx), params, self.run_blocks, start_idx, stop_idx,
+                           reduce_fn, args, progress_fn, cancel_event, num_workers, use_threads, max_block_bytes,
+                           stream_length)
+
+    def gen_cscan_features(self, start_idx, stop_idx, features=None, threshold=None, progress_fn=None,
+                           cancel_event=None, num_workers=None, use_threads=True, max_block_bytes=None):
+        """Returns a dict of computed C scans of the features (defaults to all cscan_features) of each
+        A-scan between z=start_idx and z=stop_idx.  All the features are computed from each block of data
+        in turn (see extract_features) rather than passing over the data once per feature; blocks
+        default to default_feature_block_bytes.  Indices (argmax and first_crossing) are z indices.
+        Raises AssertionError if stop_idx <= start_idx and ValueError if a feature is unknown.
+
+        Progress, cancellation and parallel execution are handled in the same way as gen_cscan, and
+        features that have already been computed are returned from the cache.
+        """
+        assert stop_idx > start_idx
+        if features is None:
+            features = list(cscan_features)
+        for feature in features:
+            if feature not in cscan_features:
+                raise ValueError("Unknown C scan feature '{0}', must be one of {1}".format(
+                    feature, ", ".join(cscan_features)))
+        start_idx = int(start_idx)
+        stop_idx = min(int(stop_idx), self.data.shape[2])
+        if max_block_bytes is None and self.gate_bytes(start_idx, stop_idx) >= min_tiled_bytes:
+            max_block_bytes = default_feature_block_bytes
+        compute_precision = precision.get_precision()
+        data_version = self.data_version
+        keys = dict((feature, ('gen_cscan_features', (start_idx, stop_idx), (feature, compute_precision, threshold),
+                               data_version)) for feature in features)
+        maps = {}
+        for feature in features:
+            feature_map = self.cache.get(keys[feature])
+            if feature_map is not None:
+                maps[feature] = feature_map
+        missing_features = [feature for feature in features if feature not in maps]
+        if missing_features:
+            computed_maps = self.run_blocks(start_idx, stop_idx, extract_features,
+                                            (missing_features, threshold, start_idx, compute_precision),
+                                            progress_fn, cancel_event, num_workers, use_threads, max_block_bytes)
+            if computed_maps is None:
+                return None
+            for feature, feature_map in computed_maps.items():
+                if data_version == self.data_version:
+                    feature_map = self.cache.put(keys[feature], feature_map)
+                maps[feature] = feature_map
+        elif progress_fn is not None:
+            progress_fn(1.0)
+        return maps
+
+    def gen_gated_cscan(self, gate_start, gate_stop, threshold=None, rectify=True, interface_gate=None,
+                        progress_fn=None, cancel_event=None, num_workers=None, use_threads=True, max_block_bytes=None):
+        """Returns a dict of gated C scans:  the peak amplitude ('peak') and z index of the peak ('peak_time')
+        of each A-scan between z=gate_start and z=gate_stop, and the z index of the first threshold crossing
+        in the gate ('crossing_time') if threshold is specified (see extract_gated).  If interface_gate
+        (start, stop, threshold) is specified, gate_start and gate_stop are relative to the first threshold
+        crossing between z=start and z=stop (the interface echo) of each A-scan, which is returned as
+        'interface_time'.  Raises AssertionError if gate_stop <= gate_start and ValueError if the gate is
+        outside the data.
+
+        Only the data that can be inside the gate are read, in blocks over the (y, x) plane (see run_blocks);
+        progress, cancellation and caching are handled in the same way as gen_cscan.
+        """
+        assert gate_stop > gate_start
+        gate_start, gate_stop = int(gate_start), int(gate_stop)
+        if interface_gate is None:
+            read_start, read_stop = gate_start, gate_stop
+        else:
+            if_start, if_stop, if_threshold = interface_gate
+            interface_gate = int(if_start), int(if_stop), float(if_threshold)
+            read_start = min(interface_gate[0], interface_gate[0] + gate_start)
+            read_stop = max(interface_gate[1], interface_gate[1] + gate_stop)
+        read_start = max(0, read_start)
+        read_stop = min(read_stop, self.data.shape[2])
+        if read_stop <= read_start:
+            raise ValueError("Gate z={0}:{1} is outside the data".format(gate_start, gate_stop))
+        compute_precision = precision.get_precision()
+        params = (gate_start, gate_stop, threshold, rectify, interface_gate, compute_precision)
+        names = ['peak', 'peak_time']
+        if threshold is not None:
+            names.append('crossing_time')
+        if interface_gate is not None:
+            names.append('interface_time')
+        data_version = self.data_version
+        keys = dict((name, ('gen_gated_cscan', name, params, data_version)) for name in names)
+        maps = dict((name, self.cache.get(keys[name])) for name in names)
+        if all(gated_map is not None for gated_map in maps.values()):
+            if progress_fn is not None:
+                progress_fn(1.0)
+            return maps
+        maps = self.run_blocks(read_start, read_stop, extract_gated,
+                               (gate_start, gate_stop, threshold, rectify, interface_gate, read_start,
+                                compute_precision),
+                               progress_fn, cancel_event, num_workers, use_threads, max_block_bytes)
+        if maps is not None and data_version == self.data_version:
+            for name in names:
+                maps[name] = self.cache.put(keys[name], maps[name])
+        return maps
+
+    def gate_bytes(self, start_idx, stop_idx):
+        """Returns the size in bytes of the data between z=start_idx and z=stop_idx"""
+        height, width = self.data.shape[:2]
+        return height * width * max(0, stop_idx - start_idx) * self.data.dtype.itemsize
+
+    def stream_reader(self, rows, cols, start_idx):
+        """Returns a function read_fn(start, stop) that returns the data in rows and columns between
+        z=start_idx+start and z=start_idx+stop"""
+
+        def read_fn(start, stop):
+            """Returns the samples start to stop of the block"""
+            return self.read_block((rows, cols, slice(start_idx + start, start_idx + stop)))
+
+        return read_fn
+
+    def run_blocks(self, start_idx, stop_idx, reduce_fn, args=(), progress_fn=None, cancel_event=None,
+                   num_workers=None, use_threads=True, max_block_bytes=None, stream_length=None):
+        """Applies reduce_fn(data, *args) to the data between z=start_idx and z=stop_idx and returns the
+        results, a 2D array or a dict of 2D arrays.  Unless the gated data are smaller than min_tiled_bytes
+        and max_block_bytes isn't specified, reduce_fn is applied to blocks of the data (see cscan_blocks) in
+        a pool of num_workers (defaults to one per CPU) threads, or processes if use_threads is False.  Blocks
+        are read in the calling thread and at most two blocks per worker are in flight at once, so that no
+        more than a few blocks of the gated data are in memory at any time.  If specified, progress_fn(fraction)
+        is called as each block is completed; returns None once the threading.Event cancel_event is set.
+
+        If stream_length is specified, reduce_fn(read_fn, num_samples, *args) is called instead, where
+        read_fn(start, stop) returns samples start to stop of each of the block's num_samples long traces
+        (see approximate_quantile).  Blocks are sized for stream_length samples rather than the whole gate
+        and always reduced in threads, which read their own data."""
+        gate_length = max(0, stop_idx - start_idx)
+        if self.gate_bytes(start_idx, stop_idx) < min_tiled_bytes and max_block_bytes is None:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            if stream_length is None:
+                results = reduce_fn(self.read_block(np.s_[:, :, start_idx:stop_idx]), *args)
+            else:
+                results = reduce_fn(self.stream_reader(slice(None), slice(None), start_idx), gate_length, *args)
+            if progress_fn is not None:
+                progress_fn(1.0)
+            return results
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        height, width = self.data.shape[:2]
+        if stream_length is None:
+            blocks = cscan_blocks(self.data.shape, gate_length, self.data.dtype.itemsize, max_block_bytes)
         else:
-            assert fn in self.available_cscan_functions
-            cscan_data = fn(data, axis=2)
-        return cscan_data
+            use_threads = True
+            args = (gate_length,) + tuple(args)
+            blocks = cscan_blocks(self.data.shape, min(stream_length, gate_length), self.data.dtype.itemsize,
+                                  max_block_bytes)
+        np_err = np.geterr()
+        results = None
+        pool = tiling.get_pool(num_workers, use_threads)
+        try:
+            pending = []
+            next_block = 0
+            completed = 0
+            while completed < len(blocks):
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                while next_block < len(blocks) and len(pending) < 2 * num_workers:
+                    rows, cols = blocks[next_block]
+                    if stream_length is None:
+                        block_data = self.read_block((rows, cols, slice(start_idx, stop_idx)))
+                    else:
+                        block_data = self.stream_reader(rows, cols, start_idx)
+                    pending.append((blocks[next_block],
+                                    pool.apply_async(reduce_block, ((reduce_fn, block_data, args, np_err),))))
+                    next_block += 1
+                (rows, cols), result = pending.pop(0)
+                block_results = result.get()
+                if hasattr(block_results, "keys"):
+                    if results is None:
+                        results = dict((key, np.empty((height, width), dtype=block_results[key].dtype))
+                                       for key in block_results)
+                    for key in block_results:
+                        results[key][rows, cols] = block_results[key]
+                else:
+                    if results is None:
+                        results = np.empty((height, width), dtype=block_results.dtype)
+                    results[rows, cols] = block_results
+                completed += 1
+                if progress_fn is not None:
+                    progress_fn(float(completed) / len(blocks))
+        finally:
+            pool.terminate()
+            pool.join()
+        return results
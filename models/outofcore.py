@@ -0,0 +1,122 @@
+"""outofcore.py - runs NDIToolbox plugins on HDF5 data sets too large to fit in memory
+
+Plugins that declare a tile_mode (see the tiling module) process subsets of the data independently
+of each other, so they can also be run one chunk at a time:  each chunk is read from the source HDF5
+file, passed through the plugin and written to a chunked dataset in a new HDF5 file.  Only one chunk
+(plus any halo required by the plugin) is held in memory at a time.  Plugins that define prepare()
+are given each chunk of the data in turn before any chunks are processed.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import dataio
+from models import mainmodel
+from models import tiling
+import h5py
+import inspect
+import numpy as np
+import math
+import os.path
+
+module_logger = mainmodel.get_logger(__name__)
+
+# Default maximum size of a chunk of data in bytes
+default_chunk_bytes = 64 * 2 ** 20
+
+
+def is_chunk_safe(plugin):
+    """Returns True if the plugin (class or instance) can be run one chunk of data at a time"""
+    if inspect.isclass(plugin):
+        # Plugins may declare their tiling as properties, which can only be read from an instance
+        plugin = plugin()
+    return tiling.get_tiling(plugin) is not None
+
+
+def find_dataset(hdf5_file, data_fname):
+    """Returns the NDIToolbox dataset in the open h5py File hdf5_file (read from data_fname), or None
+    if not found.  Uses the same naming convention as dataio.get_data."""
+    root, ext = os.path.splitext(os.path.basename(data_fname))
+    for key in hdf5_file.keys():
+        if key.startswith(root) and isinstance(hdf5_file[key], h5py.Dataset):
+            return hdf5_file[key]
+    return None
+
+
+def slice_bytes(shape, itemsize, slices):
+    """Returns the size in bytes of the region slices of an array of the specified shape and item size"""
+    return itemsize * int(np.prod([len(range(*slc.indices(dim))) for slc, dim in zip(slices, shape)]))
+
+
+def chunk_slices(shape, itemsize, tile_mode, tile_axis=-1, tile_halo=0, max_chunk_bytes=None):
+    """Returns a list of chunks of an array of the specified shape and item size (bytes) no larger than
+    max_chunk_bytes (excluding halos) where possible.  The array is split along the first axis the
+    plugin's tiling mode allows, and the chunks along the second as well if a single slice along the
+    first is too large.  Logs a warning if the chunks are still larger than max_chunk_bytes.  Each chunk
+    is a tuple (source, destination, crop) of slices, see tiling.tile_slices."""
+    if max_chunk_bytes is None:
+        max_chunk_bytes = default_chunk_bytes
+    nbytes = itemsize * int(np.prod(shape))
+    num_chunks = max(1, int(math.ceil(nbytes / float(max_chunk_bytes))))
+    axes = tiling.split_axes(shape, tile_mode, tile_axis)
+    chunks = tiling.axis_slices(shape, axes[0] if axes else None, tile_halo, num_chunks)
+    largest_chunk = max(slice_bytes(shape, itemsize, destination) for source, destination, crop in chunks)
+    if largest_chunk > max_chunk_bytes and len(axes) > 1:
+        axis = axes[1]
+        num_splits = int(math.ceil(largest_chunk / float(max_chunk_bytes)))
+        splits = tiling.axis_slices(shape, axis, tile_halo, num_splits)
+        chunks = [tuple(slices[:axis] + split_slices[axis:axis + 1] + slices[axis + 1:]
+                        for slices, split_slices in zip(chunk, split))
+                  for chunk in chunks for split in splits]
+        largest_chunk = max(slice_bytes(shape, itemsize, destination) for source, destination, crop in chunks)
+    if largest_chunk > max_chunk_bytes:
+        module_logger.warning("Unable to split data of shape {0} into chunks of {1} bytes or less, "
+                              "largest chunk is {2} bytes.".format(shape, max_chunk_bytes, largest_chunk))
+    return chunks
+
+
+def run_out_of_core(plugin_cls, src_fname, dest_fname, plugin_cfg=None, max_chunk_bytes=None, progress_fn=None,
+                    num_workers=None, use_threads=None, **kwargs):
+    """Runs the plugin class plugin_cls on the data in the NDIToolbox HDF5 file src_fname one chunk at a
+    time, writing the results to a chunked dataset in the new HDF5 file dest_fname.  If plugin_cfg is not
+    None it is used as the plugin's config dict.  Each chunk is itself run as tiles in parallel if large
+    enough (see tiling.run_tiled).  If specified, progress_fn is called with the fraction of chunks
+    completed after each chunk.  Returns dest_fname.
+
+    Raises ValueError if the plugin hasn't declared it can be run on chunks of data, if no data were found
+    in src_fname, if src_fname and dest_fname are the same file or if the plugin changed the shape of a chunk.
+    """
+    if os.path.abspath(src_fname) == os.path.abspath(dest_fname):
+        raise ValueError("Output file must be different from the input file.")
+    plugin_instance = plugin_cls(**kwargs)
+    if plugin_cfg is not None:
+        plugin_instance.config = plugin_cfg
+    chunk_tiling = tiling.get_tiling(plugin_instance)
+    if chunk_tiling is None:
+        raise ValueError("Plugin {0} can't be run on chunks of data.".format(plugin_cls.__name__))
+    tile_mode, tile_axis, tile_halo = chunk_tiling
+    with h5py.File(src_fname, 'r') as fidin:
+        src_dataset = find_dataset(fidin, src_fname)
+        if src_dataset is None:
+            raise ValueError("No data found in {0}.".format(src_fname))
+        chunks = chunk_slices(src_dataset.shape, src_dataset.dtype.itemsize, tile_mode, tile_axis, tile_halo,
+                              max_chunk_bytes)
+        # First pass - let the plugin see the complete data set if it needs to
+        cfg = tiling.prepare_config(plugin_instance, plugin_cfg,
+                                    (dataio.read_dataset(src_dataset, destination) for source, destination, crop in chunks))
+        with h5py.File(dest_fname, 'w') as fidout:
+            dest_dataset = None
+            for idx, (source, destination, crop) in enumerate(chunks):
+                chunk = dataio.read_dataset(src_dataset, source)
+                results = np.asarray(tiling.run_tiled_array(plugin_cls, chunk, cfg, num_workers, use_threads,
+                                                            prepared=True, **kwargs))
+                if results.shape != chunk.shape:
+                    raise ValueError("Plugin changed the shape of the data, unable to run on chunks.")
+                if dest_dataset is None:
+                    dest_dataset = fidout.create_dataset(os.path.basename(dest_fname), shape=src_dataset.shape,
+                                                         dtype=results.dtype, chunks=True)
+                dest_dataset[destination] = results[crop]
+                if progress_fn is not None:
+                    progress_fn(float(idx + 1) / len(chunks))
+    return dest_fname
@@ -0,0 +1,161 @@
+"""pipeline.py - runs an ordered chain of NDIToolbox plugins on a data set in a single process
+
+Pipelines are saved as JSON files of the form
+
+    {"steps": [{"toolkit": "NormalizePlugin", "config": {}},
+               {"toolkit": "MedianFilterPlugin", "config": {"kernel size": "5"}}]}
+
+where toolkit is the name of the plugin class (NOT the name of the plugin file) and config is the
+(optional) configuration dict passed to the plugin.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+from models import mainmodel
+from models import tiling
+import json
+import os.path
+
+# Extension used for saved pipeline files
+pipeline_ext = '.json'
+# Separator used to specify a chain of plugins on the command line, e.g. NormalizePlugin,MedianFilterPlugin
+chain_separator = ','
+
+
+def is_pipeline(toolkit):
+    """Returns True if the toolkit specification is a chain of plugins or a saved pipeline file rather
+    than the name of a single plugin."""
+    if toolkit is None:
+        return False
+    return chain_separator in toolkit or toolkit.lower().endswith(pipeline_ext)
+
+
+def find_pipeline_file(pipeline_fname):
+    """Returns the path to the saved pipeline file pipeline_fname, which is looked for relative to the current
+    folder and then in the user's pipelines folder.  Raises IOError if not found."""
+    if os.path.exists(pipeline_fname):
+        return pipeline_fname
+    saved_pipeline = os.path.join(pathfinder.pipelines_path(), pipeline_fname)
+    if os.path.exists(saved_pipeline):
+        return saved_pipeline
+    raise IOError("Unable to locate pipeline file '{0}' in the current folder or in {1}.".format(
+        pipeline_fname, pathfinder.pipelines_path()))
+
+
+class PluginPipeline(object):
+    """Ordered list of (plugin class, config) steps run on the same data set.  The output of each step
+    is the input of the next; only the final result is returned to the caller.  Provides the same
+    data / config / run() interface as a plugin so it can be used wherever a plugin instance is expected."""
+
+    def __init__(self, steps=None):
+        self.steps = []
+        if steps is not None:
+            for plugin_cls, plugin_cfg in steps:
+                self.add_step(plugin_cls, plugin_cfg)
+        # Configuration shared by every step e.g. batch mode's datafile
+        self.config = {}
+        self._data = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, new_data):
+        self._data = new_data
+
+    @property
+    def name(self):
+        """Returns a human-friendly name for the pipeline"""
+        return " -> ".join([plugin_cls.__name__ for plugin_cls, plugin_cfg in self.steps])
+
+    def add_step(self, plugin_cls, plugin_cfg=None):
+        """Appends a step running plugin_cls with the (optional) config dict plugin_cfg."""
+        self.steps.append((plugin_cls, plugin_cfg))
+
+    def step_config(self, plugin_instance, plugin_cfg):
+        """Returns the configuration for a step:  the plugin's defaults updated with the pipeline's shared
+        config and then the step's own config.  Returns None if the plugin has no config and none was
+        specified."""
+        cfg = None
+        if hasattr(plugin_instance, 'config'):
+            cfg = dict(plugin_instance.config)
+        if self.config or plugin_cfg:
+            if cfg is None:
+                cfg = {}
+            cfg.update(self.config)
+            if plugin_cfg is not None:
+                cfg.update(plugin_cfg)
+        return cfg
+
+    def run(self):
+        """Runs each step in turn on the pipeline's data"""
+        for plugin_cls, plugin_cfg in self.steps:
+            plugin_instance = plugin_cls()
+            cfg = self.step_config(plugin_instance, plugin_cfg)
+            if cfg is not None:
+                plugin_instance.config = cfg
+            if tiling.is_tileable(plugin_instance, self._data):
+                self._data = tiling.run_tiled(plugin_cls, self._data, cfg)
+            else:
+                plugin_instance.data = self._data
+                plugin_instance.run()
+                self._data = plugin_instance.data
+
+    def to_dict(self):
+        """Returns the pipeline as a JSON-friendly dict"""
+        return {'steps': [{'toolkit': plugin_cls.__name__, 'config': plugin_cfg or {}}
+                          for plugin_cls, plugin_cfg in self.steps]}
+
+    def save(self, pipeline_fname):
+        """Saves the pipeline to the JSON file pipeline_fname"""
+        with open(pipeline_fname, "w") as fidout:
+            json.dump(self.to_dict(), fidout, indent=4)
+
+    @classmethod
+    def get_plugin_class(cls, toolkit, available_plugins=None):
+        """Returns the plugin class with the name toolkit.  If available_plugins (list of tuples
+        (plugin_name, plugin_class)) is not specified, the installed plugins are used.  Raises
+        ValueError if the plugin was not found."""
+        if available_plugins is None:
+            available_plugins = mainmodel.load_plugins()
+        for plugin_name, plugin_cls in available_plugins:
+            if plugin_name == toolkit:
+                return plugin_cls
+        raise ValueError("Unable to locate plugin '{0}'.".format(toolkit))
+
+    @classmethod
+    def from_dict(cls, pipeline_dict, available_plugins=None):
+        """Returns a new PluginPipeline from a dict in the saved pipeline format"""
+        pipeline = cls()
+        for step in pipeline_dict.get('steps', []):
+            plugin_cls = cls.get_plugin_class(step['toolkit'], available_plugins)
+            pipeline.add_step(plugin_cls, step.get('config') or None)
+        return pipeline
+
+    @classmethod
+    def from_file(cls, pipeline_fname, available_plugins=None):
+        """Returns a new PluginPipeline read from the JSON file pipeline_fname"""
+        with open(pipeline_fname, "r") as fidin:
+            return cls.from_dict(json.load(fidin), available_plugins)
+
+    @classmethod
+    def from_chain(cls, chain, available_plugins=None):
+        """Returns a new PluginPipeline from a chain of plugin names, either a list or a str
+        separated by commas e.g. 'NormalizePlugin,MedianFilterPlugin'.  Each plugin uses its
+        default configuration."""
+        if isinstance(chain, basestring):
+            chain = [toolkit.strip() for toolkit in chain.split(chain_separator) if toolkit.strip()]
+        return cls.from_dict({'steps': [{'toolkit': toolkit} for toolkit in chain]}, available_plugins)
+
+    @classmethod
+    def from_toolkit(cls, toolkit, available_plugins=None):
+        """Returns a new PluginPipeline from a toolkit specification:  either the name of a saved
+        pipeline file (see find_pipeline_file) or a chain of plugin names.  Raises IOError if the
+        pipeline file wasn't found."""
+        if toolkit.lower().endswith(pipeline_ext):
+            return cls.from_file(find_pipeline_file(toolkit), available_plugins)
+        return cls.from_chain(toolkit, available_plugins)
@@ -7,6 +7,7 @@ __author__ = 'Chris R. Coughlin'
 from controllers import pathfinder
 import dataio
 import mainmodel
+import precision
 import ultrasonicgate
 from matplotlib import cm
 import matplotlib.colors as colors
@@ -79,9 +80,9 @@ class ThreeDManipMixin(object):
 
     def detrend_data(self, data, axis, type):
         """Applies a detrend (where type is 'constant' for average or 'linear')
-        to the data along the specified axis number."""
+        to the data along the specified axis number in the application's compute precision."""
         if data is not None:
-            data = scipy.signal.detrend(data, axis, type)
+            data = scipy.signal.detrend(precision.as_compute(data), axis, type)
         return data
 
     def flipud_data(self, data):
@@ -0,0 +1,103 @@
+"""precision.py - application-wide compute precision for plugins, gates and data manipulations
+
+The Compute Precision option in the Application section of the configuration file sets the
+floating point type used when data have to be converted for a calculation:
+
+    native      floating point data keep their type; integer data are converted to the smallest
+                floating point type that can represent them (float32 for 8 and 16-bit integers)
+                and are stored as integers with scale_factor and add_offset attributes
+    float32     all calculations are performed in single precision
+    float64     all calculations are performed in double precision (default)
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+from models import config
+import numpy as np
+
+# Supported compute precisions
+NATIVE = 'native'
+FLOAT32 = 'float32'
+FLOAT64 = 'float64'
+precision_modes = [NATIVE, FLOAT32, FLOAT64]
+default_precision = FLOAT64
+
+# Compute precision read from each configuration file - checked for every calculation, so the
+# configuration file is only parsed the first time
+precision_cache = {}
+
+
+def get_precision():
+    """Returns the compute precision set in the application's configuration
+    (defaults to float64 if not specified)"""
+    config_path = pathfinder.config_path()
+    precision = precision_cache.get(config_path)
+    if precision is None:
+        precision = config.Configure(config_path).get_app_option("compute precision")
+        if precision not in precision_modes:
+            precision = default_precision
+        precision_cache[config_path] = precision
+    return precision
+
+
+def set_precision(precision):
+    """Sets the application's compute precision.  Raises ValueError if precision
+    is not one of the supported precision_modes."""
+    if precision not in precision_modes:
+        raise ValueError("Compute precision must be one of {0}".format(", ".join(precision_modes)))
+    config_path = pathfinder.config_path()
+    config.Configure(config_path).set_app_option({'compute precision': precision})
+    precision_cache[config_path] = precision
+
+
+def compute_dtype(dtype, precision=None, exact=False):
+    """Returns the NumPy dtype to use for a calculation on data of the specified dtype.  Set exact
+    to True for operations that don't need floating point (e.g. maximum, minimum) so that integer
+    data keep their type under native precision.  If precision is None (default) the application's
+    compute precision is used."""
+    dtype = np.dtype(dtype)
+    if precision is None:
+        precision = get_precision()
+    if precision == FLOAT32:
+        return np.promote_types(dtype, np.float32) if dtype.kind == 'c' else np.dtype(np.float32)
+    if precision == FLOAT64:
+        return np.promote_types(dtype, np.float64) if dtype.kind == 'c' else np.dtype(np.float64)
+    if dtype.kind in 'fc' or (exact and dtype.kind in 'iub'):
+        return dtype
+    return np.promote_types(dtype, np.float32)
+
+
+def as_compute(data, precision=None, exact=False):
+    """Returns the NumPy array data converted to its compute_dtype, or data itself if no
+    conversion is required"""
+    if data is None:
+        return data
+    data = np.asarray(data)
+    dtype = compute_dtype(data.dtype, precision, exact)
+    if data.dtype == dtype:
+        return data
+    return data.astype(dtype)
+
+
+def apply_scale(data, scale=1.0, offset=0.0, precision=None):
+    """Returns data * scale + offset in the data's compute_dtype, without
+    creating double precision intermediates under native or float32 precision"""
+    data = np.asarray(data)
+    dtype = compute_dtype(data.dtype, precision)
+    scaled_data = data.astype(dtype)
+    if scale != 1:
+        scaled_data *= dtype.type(scale)
+    if offset != 0:
+        scaled_data += dtype.type(offset)
+    return scaled_data
+
+
+def store_scaled(dtype, precision=None):
+    """Returns True if integer data of the specified dtype that need a scale and offset should be
+    stored as integers with scale_factor and add_offset attributes instead of being converted"""
+    if precision is None:
+        precision = get_precision()
+    return precision == NATIVE and np.dtype(dtype).kind in 'iu'
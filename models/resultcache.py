@@ -0,0 +1,213 @@
+"""resultcache.py - on-disk cache of plugin results
+
+Results are stored as HDF5 files named for a digest of the plugin class and version,
+the plugin configuration, the application's compute precision and the input data, so re-running a plugin with the same
+configuration on the same data returns the stored results rather than running the
+plugin again.  When the cache exceeds its maximum size the least recently used results
+are deleted.
+
+Plugins whose results depend on anything other than their configuration and data (e.g.
+external files or random numbers) should set cacheable = False.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import precision
+import h5py
+import numpy as np
+import hashlib
+import json
+import os
+import tempfile
+
+# Default maximum size of the cache in bytes
+default_max_size = 1024 * 2 ** 20
+cache_ext = '.hdf5'
+
+
+def is_cacheable(plugin):
+    """Returns True if the results of the plugin class (or PluginPipeline) plugin can be cached"""
+    if hasattr(plugin, 'steps'):
+        return all(is_cacheable(plugin_cls) for plugin_cls, plugin_cfg in plugin.steps)
+    return getattr(plugin, 'cacheable', True) is not False
+
+
+def normalized_config(plugin_cfg):
+    """Returns a str representation of the plugin configuration dict plugin_cfg that doesn't
+    depend on key order or value types, e.g. {'kernel size': 5} and {'kernel size': '5'}
+    are equivalent."""
+    if not plugin_cfg:
+        return ''
+    return json.dumps(dict((str(k), str(v)) for k, v in plugin_cfg.items()), sort_keys=True)
+
+
+def plugin_signature(plugin):
+    """Returns a str identifying the plugin class (or PluginPipeline) plugin and its version"""
+    if hasattr(plugin, 'steps'):
+        return ';'.join(plugin_signature(plugin_cls) + normalized_config(plugin_cfg)
+                        for plugin_cls, plugin_cfg in plugin.steps)
+    version = getattr(plugin, 'version', '')
+    if not isinstance(version, basestring):
+        # Abstract property rather than a class attribute
+        version = ''
+    return "{0}.{1}:{2}".format(plugin.__module__, plugin.__name__, version)
+
+
+def update_digest(digest, data):
+    """Updates the hashlib digest with the contents of data (NumPy array or dict of NumPy arrays)"""
+    if hasattr(data, "keys"):
+        for dataset in sorted(data.keys()):
+            digest.update(str(dataset))
+            if hasattr(data, "is_loaded") and not data.is_loaded(dataset):
+                # Unread dataset of a dataio.LazyDatasetMap - identified by its source file rather than read
+                digest.update(data.fingerprint(dataset))
+            else:
+                update_digest(digest, data[dataset])
+    elif data is None:
+        digest.update('None')
+    else:
+        data = np.ascontiguousarray(data)
+        digest.update(str(data.dtype))
+        digest.update(str(data.shape))
+        digest.update(data.data)
+
+
+def data_digest(data):
+    """Returns the hex digest of data (NumPy array or dict of NumPy arrays)"""
+    digest = hashlib.sha1()
+    update_digest(digest, data)
+    return digest.hexdigest()
+
+
+class PartialResults(dict):
+    """Cached results of a plugin run on a dataio.LazyDatasetMap:  only the datasets that were read or replaced
+    are stored, the others are unchanged from the input (see dataio.LazyDatasetMap.overlay)"""
+    pass
+
+
+class ResultCache(object):
+    """Least recently used on-disk cache of plugin results"""
+
+    def __init__(self, cache_path, max_size=None):
+        self.cache_path = cache_path
+        if max_size is None:
+            max_size = default_max_size
+        self.max_size = max_size
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+
+    def key(self, plugin, plugin_cfg, data, **kwargs):
+        """Returns the cache key for running the plugin class (or PluginPipeline) plugin with the
+        configuration dict plugin_cfg and keyword arguments kwargs on data under the current compute precision"""
+        digest = hashlib.sha1()
+        digest.update(plugin_signature(plugin))
+        digest.update(normalized_config(plugin_cfg))
+        digest.update(normalized_config(kwargs))
+        digest.update(precision.get_precision())
+        update_digest(digest, data)
+        return digest.hexdigest()
+
+    def cache_file(self, key):
+        """Returns the full path to the cache file for key"""
+        return os.path.join(self.cache_path, key + cache_ext)
+
+    def contains(self, key):
+        """Returns True if results are cached for key"""
+        return os.path.exists(self.cache_file(key))
+
+    def get(self, key):
+        """Returns the cached results for key, or None if not found"""
+        cache_file = self.cache_file(key)
+        try:
+            with h5py.File(cache_file, 'r') as fidin:
+                if 'data' in fidin:
+                    data = fidin['data'][...]
+                else:
+                    data = dict((dataset, fidin['datasets'][dataset][...]) for dataset in fidin['datasets'])
+                    if fidin['datasets'].attrs.get('partial', False):
+                        data = PartialResults(data)
+        except (IOError, KeyError):
+            return None
+        try:
+            # Mark as recently used
+            os.utime(cache_file, None)
+        except OSError: # evicted by another process
+            pass
+        return data
+
+    def put(self, key, data):
+        """Stores the results data (NumPy array or dict of NumPy arrays) for key and deletes
+        least recently used results if the cache is full.  Returns True if the results were stored."""
+        if data is None:
+            return False
+        partial = hasattr(data, "loaded_keys")
+        try:
+            if partial:
+                # Datasets of a dataio.LazyDatasetMap that were never read are unchanged from the input
+                datasets = dict((str(dataset), np.asarray(data[dataset])) for dataset in data.loaded_keys)
+            elif hasattr(data, "keys"):
+                datasets = dict((str(dataset), np.asarray(data[dataset])) for dataset in data)
+            else:
+                datasets = np.asarray(data)
+        except (TypeError, ValueError):
+            return False
+        temp_fd, temp_fname = tempfile.mkstemp(suffix='.tmp', dir=self.cache_path)
+        os.close(temp_fd)
+        try:
+            with h5py.File(temp_fname, 'w') as fidout:
+                if hasattr(datasets, "keys"):
+                    grp = fidout.create_group('datasets')
+                    grp.attrs['partial'] = partial
+                    for dataset in datasets:
+                        grp.create_dataset(dataset, data=datasets[dataset])
+                else:
+                    fidout.create_dataset('data', data=datasets)
+            if os.path.exists(self.cache_file(key)):
+                os.remove(self.cache_file(key))
+            os.rename(temp_fname, self.cache_file(key))
+        except (IOError, OSError, TypeError, ValueError):
+            if os.path.exists(temp_fname):
+                os.remove(temp_fname)
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        """Returns a list of tuples (last access time, size in bytes, filename) of the cached results,
+        least recently used first"""
+        cached = []
+        for cache_file in os.listdir(self.cache_path):
+            if cache_file.endswith(cache_ext):
+                full_path = os.path.join(self.cache_path, cache_file)
+                try:
+                    cached.append((os.path.getmtime(full_path), os.path.getsize(full_path), full_path))
+                except OSError: # deleted by another process
+                    pass
+        return sorted(cached)
+
+    def size(self):
+        """Returns the current size of the cache in bytes"""
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self):
+        """Deletes least recently used results until the cache is no larger than max_size"""
+        cached = self.entries()
+        total_size = sum(entry[1] for entry in cached)
+        for mtime, size, cache_file in cached:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(cache_file)
+                total_size -= size
+            except OSError: # in use or already deleted
+                pass
+
+    def clear(self):
+        """Deletes all cached results"""
+        for mtime, size, cache_file in self.entries():
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
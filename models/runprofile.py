@@ -0,0 +1,194 @@
+"""runprofile.py - records the wall time, CPU time and peak memory of each stage of a plugin run
+
+Profiles are appended as JSON lines to the profiles file in the user's NDIToolbox folder
+(see pathfinder.profiles_path), one line per run:
+
+    {"name": "MedianFilterPlugin", "source": "batch", "started": 1381939200.0, "wall_time": 1.2,
+     "stages": [{"stage": "read data", "pid": 1234, "wall_time": 0.3, "cpu_time": 0.28, "peak_rss": 104857600},
+                ...]}
+
+wall_time and cpu_time are in seconds, peak_rss is the peak resident set size of the process in
+bytes at the end of the stage (None if it couldn't be determined).
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+import contextlib
+import json
+import multiprocessing
+import os
+import Queue
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def cpu_time():
+    """Returns the user + system CPU time of the current process in seconds"""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def peak_rss():
+    """Returns the peak resident set size of the current process in bytes, or None if not available"""
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return maxrss
+        return maxrss * 1024
+    if psutil is not None:
+        mem_info = psutil.Process().memory_info()
+        return getattr(mem_info, 'peak_wset', mem_info.rss)
+    return None
+
+
+def data_size(data):
+    """Returns the size in bytes of data (NumPy array or dict of NumPy arrays), or None if unknown.  Only the
+    datasets of a dataio.LazyDatasetMap that have been read so far are counted."""
+    if hasattr(data, "keys"):
+        sizes = [data_size(data[dataset]) for dataset in getattr(data, "loaded_keys", data)]
+        if None in sizes:
+            return None
+        return sum(sizes)
+    return getattr(data, 'nbytes', None)
+
+
+class RunProfile(object):
+    """Timing and memory breakdown of a single plugin run.  Stages run in other processes (e.g.
+    the plugin itself) send their records back through the queue attribute; call collect() to
+    add them to the profile."""
+
+    def __init__(self, name, source='gui', **info):
+        self.name = name
+        self.source = source
+        self.info = info
+        self.started = time.time()
+        self.finished = None
+        self.stages = []
+        self._queue = None
+
+    @property
+    def queue(self):
+        """Returns the multiprocessing.Queue used to return stage records from another process"""
+        if self._queue is None:
+            self._queue = multiprocessing.Queue()
+        return self._queue
+
+    @contextlib.contextmanager
+    def stage(self, stage_name):
+        """Context manager that records the wall time, CPU time and peak RSS of the enclosed code
+        as the stage stage_name"""
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        try:
+            yield
+        finally:
+            self.stages.append({'stage': stage_name,
+                                'pid': os.getpid(),
+                                'wall_time': time.time() - wall_start,
+                                'cpu_time': cpu_time() - cpu_start,
+                                'peak_rss': peak_rss()})
+
+    def send(self, profile_queue):
+        """Sends this profile's stage records to another process' RunProfile through profile_queue"""
+        profile_queue.put(self.stages)
+
+    def collect(self, timeout=1):
+        """Adds the stage records sent from another process to this profile.  Returns True if records
+        were received within timeout seconds."""
+        if self._queue is None:
+            return False
+        try:
+            self.stages.extend(self._queue.get(True, timeout))
+            return True
+        except Queue.Empty:
+            return False
+
+    def finish(self):
+        """Marks the end of the run"""
+        self.finished = time.time()
+
+    @property
+    def wall_time(self):
+        """Returns the total time of the run in seconds, or the elapsed time so far if the run hasn't finished"""
+        if self.finished is None:
+            return time.time() - self.started
+        return self.finished - self.started
+
+    def to_dict(self):
+        """Returns the profile as a JSON-friendly dict"""
+        profile = {'name': self.name,
+                   'source': self.source,
+                   'started': self.started,
+                   'wall_time': self.wall_time,
+                   'stages': self.stages}
+        profile.update(self.info)
+        return profile
+
+    def summary(self):
+        """Returns a human-readable summary of the profile"""
+        return summarize(self.to_dict())
+
+    def save(self, profiles_file=None):
+        """Finishes the run if required and appends the profile as a JSON line to profiles_file
+        (defaults to pathfinder.profiles_path())"""
+        if self.finished is None:
+            self.finish()
+        if profiles_file is None:
+            profiles_file = pathfinder.profiles_path()
+        with open(profiles_file, "a") as fidout:
+            fidout.write(json.dumps(self.to_dict()) + "\n")
+
+
+@contextlib.contextmanager
+def null_stage():
+    """Context manager that does nothing, used in place of RunProfile.stage when not profiling"""
+    yield
+
+
+def stage(profile, stage_name):
+    """Returns a context manager recording the stage stage_name in the RunProfile profile,
+    or a context manager that does nothing if profile is None"""
+    if profile is None:
+        return null_stage()
+    return profile.stage(stage_name)
+
+
+def summarize(profile):
+    """Returns a human-readable summary of the profile (dict)"""
+    lines = ["{0} ({1}): {2:.3f} s total".format(profile['name'], profile['source'], profile['wall_time'])]
+    for record in profile['stages']:
+        peak = "n/a"
+        if record['peak_rss'] is not None:
+            peak = "{0:.1f} MB".format(record['peak_rss'] / float(2 ** 20))
+        lines.append("    {0:<16} wall {1:8.3f} s  cpu {2:8.3f} s  peak RSS {3} (pid {4})".format(
+            record['stage'], record['wall_time'], record['cpu_time'], peak, record['pid']))
+    return "\n".join(lines)
+
+
+def load_profiles(profiles_file=None):
+    """Returns a list of the profiles (dicts) saved in profiles_file (defaults to pathfinder.profiles_path())"""
+    if profiles_file is None:
+        profiles_file = pathfinder.profiles_path()
+    profiles = []
+    if os.path.exists(profiles_file):
+        with open(profiles_file, "r") as fidin:
+            for line in fidin:
+                line = line.strip()
+                if line:
+                    try:
+                        profiles.append(json.loads(line))
+                    except ValueError: # partially-written line
+                        pass
+    return profiles
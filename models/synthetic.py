@@ -0,0 +1,165 @@
+"""synthetic.py - generates synthetic ultrasonic data files for testing and benchmarking
+
+Each data file holds a simulated immersion C-scan:  a grid of A-scans (waveforms) with a front wall echo and a
+back wall echo whose depth and amplitude vary across the part, plus noise.  The waveform data are sized to
+approximately the requested number of bytes and saved as an NDIToolbox HDF5 file, a comma-delimited text file,
+a UTWin C-scan (.csc, with or without waveform compression) or a Winspect (.sdt) data file.  Only the parts of
+the UTWin and Winspect formats read by NDIToolbox are written.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import dataio
+from models.dataio import UTWinCscanReader
+import numpy as np
+import math
+
+# Default number of samples per waveform
+default_rf_length = 256
+
+# UTWin scan version written to synthetic files (waveforms are stored in the format used since v. 2.40)
+utwin_scan_version = 300
+
+
+def waveform_shape(nbytes, itemsize=2, rf_length=default_rf_length):
+    """Returns the (height, width, rf_length) shape of a roughly square C-scan of waveforms occupying
+    approximately nbytes bytes with elements of itemsize bytes"""
+    num_waveforms = max(1, int(nbytes / float(itemsize * rf_length)))
+    width = max(1, int(math.sqrt(num_waveforms)))
+    height = max(1, num_waveforms // width)
+    return height, width, rf_length
+
+
+def waveforms(shape, peak=1.0, seed=0):
+    """Returns a float32 NumPy array of the specified (height, width, rf_length) shape of simulated A-scans with
+    amplitudes between -peak and peak"""
+    height, width, rf_length = shape
+    random_state = np.random.RandomState(seed)
+    t = np.arange(rf_length, dtype=np.float32)
+    rows, cols = np.mgrid[0:height, 0:width].astype(np.float32)
+    # Back wall depth and amplitude vary across the part, with a simulated flaw in the center
+    depth = 0.6 * rf_length + 0.1 * rf_length * np.sin(2 * np.pi * cols / max(width, 1))
+    flaw = ((rows - height / 2.) ** 2 + (cols - width / 2.) ** 2) < (min(height, width) / 6.) ** 2
+    depth[flaw] = 0.4 * rf_length
+    amplitude = 0.5 + 0.3 * np.cos(2 * np.pi * rows / max(height, 1))
+
+    def echo(center):
+        """Returns a Gaussian-modulated tone burst centered on sample center"""
+        offset = t - center[..., np.newaxis]
+        return np.exp(-(offset / 4.) ** 2) * np.cos(offset * np.pi / 2.)
+
+    # Far from each echo its envelope underflows to 0 as intended
+    with np.errstate(under='ignore'):
+        data = 0.9 * echo(np.full((height, width), 0.1 * rf_length, dtype=np.float32))
+        data += amplitude[..., np.newaxis] * echo(depth)
+        data += 0.05 * random_state.standard_normal(shape).astype(np.float32)
+        data *= peak / max(np.abs(data).max(), 1e-6)
+    return data.astype(np.float32)
+
+
+def write_hdf5(data_fname, nbytes, rf_length=default_rf_length, seed=0):
+    """Saves approximately nbytes of 16-bit waveforms to the NDIToolbox HDF5 file data_fname"""
+    shape = waveform_shape(nbytes, 2, rf_length)
+    dataio.save_data(data_fname, waveforms(shape, 32000, seed).astype(np.int16))
+
+
+def write_csv(data_fname, nbytes, seed=0):
+    """Saves a 2D array to the comma-delimited text file data_fname, approximately nbytes long"""
+    # Each value is written as e.g. -0.123456,
+    height, width, rf_length = waveform_shape(nbytes, 10, 1)
+    amplitude = waveforms((height, width, 32), 1.0, seed).max(axis=2)
+    np.savetxt(data_fname, amplitude, fmt="%.6f", delimiter=",")
+
+
+def write_utwin_message(file_hdl, message_id, payload):
+    """Writes a UTWin message (ID, length and payload) to the open file file_hdl"""
+    np.array([message_id], dtype=np.int16).tofile(file_hdl)
+    np.array([len(payload) + 4], dtype=np.int32).tofile(file_hdl)
+    file_hdl.write(payload)
+
+
+def pack(*fields):
+    """Returns the str of the binary representation of the (value, UTWin field type) fields"""
+    return "".join(np.array(value, dtype=UTWinCscanReader.field_sizes[field_type]).tostring()
+                   for value, field_type in fields)
+
+
+def write_utwin(data_fname, nbytes, compression_ratio=None, rf_length=default_rf_length, seed=0):
+    """Saves approximately nbytes of 16-bit waveforms with time of flight and amplitude C-scans to the UTWin
+    C-scan file data_fname.  If compression_ratio is specified, the waveforms are compressed by saving every
+    compression_ratio-th sample."""
+    height, width, rf_length = waveform_shape(nbytes, 2, rf_length)
+    data = waveforms((height, width, rf_length), 32000, seed).astype(np.int16)
+    tof_resolution = 0.01
+    tof_counts = np.argmax(data[:, :, rf_length // 4:], axis=2) + rf_length // 4
+    amplitude_data = np.abs(data).max(axis=2)
+    ids = UTWinCscanReader.message_ids
+    with open(data_fname, "wb") as fidout:
+        header = "UTCSCANFILE"
+        fidout.write(np.array([len(header)], dtype=np.int32).tostring() + header)
+        write_utwin_message(fidout, ids['UTSAVE_UTHead'], pack((utwin_scan_version, 'ushort')))
+        write_utwin_message(fidout, ids['UTSAVE_UTCD0'],
+                            pack((width, 'int'), (height, 'int'), (rf_length, 'int'), (0, 'float'),
+                                 (rf_length * 0.01, 'float'), (0.01, 'float'), (tof_resolution, 'float')))
+        write_utwin_message(fidout, ids['UTSAVE_UTCScan0'],
+                            pack((0, 'short'), (0, 'short'), (0, 'short'),
+                                 (width, 'double'), (1, 'double'), (100, 'double'),
+                                 (height, 'double'), (1, 'double'), (100, 'double'),
+                                 (0, 'double'), (1, 'double'), (100, 'double'),
+                                 (0, 'ushort'), (1, 'int'), (1, 'short')))
+        is_compressed = 1 if compression_ratio else 0
+        ratio = compression_ratio or 1
+        compressed_rf_length = int(float(rf_length) / ratio + 0.5) + 2 if is_compressed else rf_length
+        write_utwin_message(fidout, ids['UTSAVE_UTCD10'],
+                            pack((is_compressed, 'short'), (0, 'short'), (is_compressed, 'short'),
+                                 (ratio, 'double'), (0, 'int'), (compressed_rf_length, 'int')))
+        write_utwin_message(fidout, ids['UTSAVE_UTCScan3'],
+                            pack((is_compressed, 'short'), (is_compressed, 'short'), (ratio, 'double'),
+                                 (0, 'short'), (0, 'short'), (0, 'short'), (0, 'short'), (0, 'double'),
+                                 (0, 'double'), (0, 'short'), (0, 'short')))
+        write_utwin_message(fidout, ids['UTSAVE_UTCD1'],
+                            pack((0, 'ushort'), (0, 'float'), (tof_counts.size, 'int')) +
+                            tof_counts.astype(np.uint16).tostring())
+        write_utwin_message(fidout, ids['UTSAVE_UTCD2'],
+                            pack((0, 'ushort'), (amplitude_data.size, 'int')) + amplitude_data.tostring())
+        for row in range(height):
+            line = data[row]
+            if is_compressed:
+                # One sample is kept for each compression_ratio samples
+                compressed_line = np.zeros((width, compressed_rf_length), dtype=np.int16)
+                num_samples = (rf_length - 1) // ratio
+                compressed_line[:, :num_samples] = line[:, ::ratio][:, :num_samples]
+                line = compressed_line
+            write_utwin_message(fidout, ids['WAVEFORM_post240'],
+                                pack((row, 'int'), (line.size, 'int')) + line.tostring())
+
+
+def write_winspect(data_fname, nbytes, rf_length=default_rf_length, seed=0):
+    """Saves approximately nbytes of 8-bit waveforms and an amplitude C-scan to the Winspect data file data_fname"""
+    height, width, rf_length = waveform_shape(nbytes, 1, rf_length)
+    data = waveforms((height, width, rf_length), 127, seed).astype(np.int8)
+    amplitude_data = np.abs(data).max(axis=2).astype(np.int8)
+    axis_header = ("Number of Sample Points          : {0}\n"
+                   "Minimum Sample Position          : 0.000000 mm\n"
+                   "Sample Resolution                : 1.000000 mm\n")
+    subset_header = ("Subset Label                     : {0}\n"
+                     "Element Size (bytes)             : 1\n"
+                     "Element Representation           : CHAR 8\n"
+                     "Number of Sample Points          : {1}\n"
+                     "Minimum Sample Position          : 0.000000 Usec\n"
+                     "Sample Resolution                : 0.010000 Usec\n"
+                     "Measurement Range                : -1.000000 1.000000 Volts\n")
+    with open(data_fname, "wb") as fidout:
+        fidout.write("Format Standard                  : OHRNDE\n"
+                     "Number of Scan Axes              : 2\n"
+                     "Number of Data Subsets           : 2\n")
+        fidout.write("--- First Axis ---\n" + axis_header.format(width))
+        fidout.write("--- Second Axis ---\n" + axis_header.format(height))
+        fidout.write("  -- Data Subset 0 --\n" + subset_header.format("Amplitude", 1))
+        fidout.write("  -- Data Subset 1 --\n" + subset_header.format("Waveform", rf_length))
+        fidout.write("|^AS Header^|                    : 0\n")
+        fidout.write("|^Data Set^|\n")
+        fidout.write(amplitude_data.tostring())
+        fidout.write(data.tostring())
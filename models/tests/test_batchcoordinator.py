@@ -0,0 +1,129 @@
+"""test_batchcoordinator.py - tests the batchcoordinator module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import batchcoordinator
+from multiprocessing.connection import Listener
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+def square(value):
+    """Sample batch job"""
+    time.sleep(0.01)
+    return value * value
+
+
+def fail(value):
+    """Sample batch job that raises an exception"""
+    raise ValueError("Unable to process {0}".format(value))
+
+
+def fail_once(marker_file):
+    """Sample batch job that fails the first time it's run"""
+    if not os.path.exists(marker_file):
+        open(marker_file, "w").close()
+        raise IOError("Share unavailable")
+    return 'ok'
+
+
+class TestBatchCoordinator(unittest.TestCase):
+    """Tests the BatchCoordinator class and batch workers"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.authkey = 'test key'
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def test_parse_address(self):
+        """Verify parsing host:port strings"""
+        self.assertEqual(('scanserver', 7000), batchcoordinator.parse_address('scanserver:7000'))
+        self.assertEqual(('localhost', 7000), batchcoordinator.parse_address('7000'))
+        self.assertEqual(('', 7000), batchcoordinator.parse_address('7000', default_host=''))
+        self.assertEqual(('scanserver', batchcoordinator.default_port),
+                         batchcoordinator.parse_address('scanserver'))
+        with self.assertRaises(ValueError):
+            batchcoordinator.parse_address('scanserver:port')
+
+    def test_default_authkey(self):
+        """Verify the coordinator listens on localhost with a random key unless told otherwise"""
+        coordinator = batchcoordinator.BatchCoordinator()
+        self.assertEqual(('localhost', batchcoordinator.default_port), coordinator.address)
+        self.assertEqual(2 * batchcoordinator.authkey_bytes, len(coordinator.authkey))
+        self.assertNotEqual(coordinator.authkey, batchcoordinator.BatchCoordinator().authkey)
+        self.assertNotEqual(batchcoordinator.generate_authkey(), batchcoordinator.generate_authkey())
+
+    def test_lost_worker(self):
+        """Verify jobs are reassigned when their worker stops sending heartbeats"""
+        coordinator = batchcoordinator.BatchCoordinator(address=('localhost', 0), authkey=self.authkey,
+                                                        heartbeat_timeout=60, max_retries=1)
+        job = coordinator.add_job('a', square, {'value': 3})
+        self.assertEqual(('job', 0, square, {'value': 3}), coordinator.handle_message(('get_job', 'worker1')))
+        self.assertEqual(('wait',), coordinator.handle_message(('get_job', 'worker2')))
+        job.heartbeat -= 120
+        self.assertListEqual([], coordinator.step())
+        self.assertEqual(('job', 0, square, {'value': 3}), coordinator.handle_message(('get_job', 'worker2')))
+        # Results from the lost worker are ignored
+        coordinator.handle_message(('result', 'worker1', 0, 1, None))
+        coordinator.handle_message(('heartbeat', 'worker2', 0))
+        self.assertListEqual([], coordinator.step())
+        coordinator.handle_message(('result', 'worker2', 0, 9, None))
+        self.assertListEqual([job], coordinator.step())
+        self.assertEqual(9, job.result)
+        self.assertEqual(2, job.attempts)
+        self.assertTrue(coordinator.idle)
+        self.assertEqual(2, coordinator.num_connected_workers)
+        coordinator.stop()
+        self.assertEqual(('done',), coordinator.handle_message(('get_job', 'worker1')))
+
+    def test_run_workers(self):
+        """Verify several workers on localhost run all the jobs and failed jobs are retried"""
+        completed = []
+        coordinator = batchcoordinator.BatchCoordinator(address=('localhost', 0), authkey=self.authkey,
+                                                        max_retries=1, on_complete=completed.append)
+        for value in range(6):
+            coordinator.add_job(str(value), square, {'value': value})
+        coordinator.add_job('fails', fail, {'value': 0})
+        coordinator.add_job('retried', fail_once, {'marker_file': os.path.join(self.temp_folder, 'marker')})
+        # Reserve a port for the coordinator, but start the workers before it listens so that they
+        # don't inherit its socket
+        reserved = Listener(('localhost', 0))
+        coordinator.address = reserved.address
+        reserved.close()
+        workers = [multiprocessing.Process(target=batchcoordinator.run_worker, args=(coordinator.address,),
+                                           kwargs={'authkey': self.authkey, 'poll_interval': 0.05,
+                                                   'connect_timeout': 10})
+                   for idx in range(3)]
+        for worker in workers:
+            worker.start()
+        coordinator.start()
+        try:
+            jobs = coordinator.run()
+        finally:
+            for worker in workers:
+                worker.join(10)
+                if worker.is_alive():
+                    worker.terminate()
+        self.assertEqual(len(jobs), len(completed))
+        self.assertEqual([0, 1, 4, 9, 16, 25], [job.result for job in jobs[:6]])
+        self.assertIn('Unable to process 0', jobs[6].error)
+        self.assertEqual(2, jobs[6].attempts)
+        self.assertEqual('ok', jobs[7].result)
+        self.assertIsNone(jobs[7].error)
+        self.assertEqual(1, len(coordinator.failed_jobs))
+        self.assertIn('7 of 8 files', coordinator.summary())
+        for worker in workers:
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
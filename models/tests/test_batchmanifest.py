@@ -0,0 +1,112 @@
+"""test_batchmanifest.py - tests the batchmanifest module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import batchmanifest
+from models import precision
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestBatchManifest(unittest.TestCase):
+    """Tests the BatchManifest class"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.manifest_file = os.path.join(self.temp_folder, "batch_manifest.jsonl")
+        self.input_file = os.path.join(self.temp_folder, "scan1.csv")
+        self.output_file = os.path.join(self.temp_folder, "scan1.hdf5")
+        for fname in [self.input_file, self.output_file]:
+            with open(fname, "w") as fidout:
+                fidout.write("1,2,3\n")
+        self.params = batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '3'},
+                                                save_output=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def test_params_hash(self):
+        """Verify the parameters hash changes with the toolkit, its configuration and options"""
+        self.assertEqual(self.params, batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '3'},
+                                                                save_output=True))
+        self.assertNotEqual(self.params, batchmanifest.params_hash('NormalizePlugin', 'v1', {'kernel size': '3'},
+                                                                   save_output=True))
+        self.assertNotEqual(self.params, batchmanifest.params_hash('MedianFilterPlugin', 'v2', {'kernel size': '3'},
+                                                                   save_output=True))
+        self.assertNotEqual(self.params, batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '5'},
+                                                                   save_output=True))
+        self.assertNotEqual(self.params, batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '3'},
+                                                                   save_output=False))
+
+    def test_params_hash_precision(self):
+        """Verify jobs run under a different compute precision aren't considered completed"""
+        original_precision = precision.get_precision()
+        manifest = batchmanifest.BatchManifest(self.manifest_file)
+        try:
+            precision.set_precision(precision.FLOAT64)
+            params = batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '3'})
+            manifest.record(self.input_file, 'MedianFilterPlugin', params, batchmanifest.COMPLETED)
+            self.assertTrue(manifest.is_completed(self.input_file, 'MedianFilterPlugin', params))
+            precision.set_precision(precision.NATIVE)
+            native_params = batchmanifest.params_hash('MedianFilterPlugin', 'v1', {'kernel size': '3'})
+            self.assertNotEqual(params, native_params)
+            self.assertFalse(manifest.is_completed(self.input_file, 'MedianFilterPlugin', native_params))
+        finally:
+            precision.set_precision(original_precision)
+
+    def test_record(self):
+        """Verify completed and failed jobs are recorded and reloaded"""
+        manifest = batchmanifest.BatchManifest(self.manifest_file)
+        self.assertIsNone(manifest.get(self.input_file, 'MedianFilterPlugin'))
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.FAILED,
+                        error="ValueError")
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.COMPLETED,
+                        outputs=[self.output_file])
+        reloaded_manifest = batchmanifest.BatchManifest(self.manifest_file)
+        record = reloaded_manifest.get(self.input_file, 'MedianFilterPlugin')
+        self.assertEqual(batchmanifest.COMPLETED, record['status'])
+        self.assertListEqual([os.path.abspath(self.output_file)], record['outputs'])
+        self.assertEqual(os.path.getsize(self.input_file), record['size'])
+        self.assertIsNone(reloaded_manifest.get(self.input_file, 'NormalizePlugin'))
+
+    def test_partial_record(self):
+        """Verify partially-written records are ignored"""
+        manifest = batchmanifest.BatchManifest(self.manifest_file)
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.COMPLETED)
+        with open(self.manifest_file, "a") as fidout:
+            fidout.write('{"input_file": "')
+        reloaded_manifest = batchmanifest.BatchManifest(self.manifest_file)
+        self.assertTrue(reloaded_manifest.is_completed(self.input_file, 'MedianFilterPlugin', self.params))
+
+    def test_is_completed(self):
+        """Verify is_completed only returns True for successful jobs with the same parameters"""
+        manifest = batchmanifest.BatchManifest(self.manifest_file)
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.FAILED, error="IOError")
+        self.assertFalse(manifest.is_completed(self.input_file, 'MedianFilterPlugin', self.params))
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.COMPLETED)
+        self.assertTrue(manifest.is_completed(self.input_file, 'MedianFilterPlugin', self.params))
+        self.assertFalse(manifest.is_completed(self.input_file, 'MedianFilterPlugin', 'other params'))
+
+    def test_is_up_to_date(self):
+        """Verify is_up_to_date returns False if the input file changed or an output file is missing"""
+        manifest = batchmanifest.BatchManifest(self.manifest_file)
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.COMPLETED,
+                        outputs=[self.output_file])
+        self.assertTrue(manifest.is_up_to_date(self.input_file, 'MedianFilterPlugin', self.params))
+        with open(self.input_file, "a") as fidout:
+            fidout.write("4,5,6\n")
+        self.assertFalse(manifest.is_up_to_date(self.input_file, 'MedianFilterPlugin', self.params))
+        manifest.record(self.input_file, 'MedianFilterPlugin', self.params, batchmanifest.COMPLETED,
+                        outputs=[self.output_file])
+        self.assertTrue(manifest.is_up_to_date(self.input_file, 'MedianFilterPlugin', self.params))
+        os.remove(self.output_file)
+        self.assertFalse(manifest.is_up_to_date(self.input_file, 'MedianFilterPlugin', self.params))
+
+
+if __name__ == "__main__":
+    unittest.main()
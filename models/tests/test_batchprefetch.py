@@ -0,0 +1,95 @@
+"""test_batchprefetch.py - tests the batchprefetch module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import batchprefetch
+import time
+import unittest
+
+
+def read_value(value, delay=0):
+    """Sample read stage"""
+    time.sleep(delay)
+    if value < 0:
+        raise IOError("Unable to read {0}".format(value))
+    return value
+
+
+def compute_square(value, delay=0):
+    """Sample compute stage"""
+    time.sleep(delay)
+    if value == 13:
+        raise ValueError("Unlucky")
+    return value * value
+
+
+def write_result(value, delay=0):
+    """Sample write stage"""
+    time.sleep(delay)
+    if value == 49:
+        raise IOError("Disk full")
+    return value
+
+
+class TestPrefetchScheduler(unittest.TestCase):
+    """Tests the PrefetchScheduler class"""
+
+    def test_run(self):
+        """Verify each job is run through all three stages and errors in any stage are recorded"""
+        completed = []
+        scheduler = batchprefetch.PrefetchScheduler(read_value, compute_square, write_result, memory_budget=None,
+                                                    on_complete=completed.append)
+        for value in [1, 2, -1, 13, 7, 3]:
+            scheduler.add_job(str(value), kwds={'value': value})
+        jobs = scheduler.run()
+        self.assertEqual(jobs, completed)
+        self.assertEqual([1, 4, None, None, None, 9], [job.result for job in jobs])
+        self.assertIn('Unable to read -1', jobs[2].error)
+        self.assertIn('Unlucky', jobs[3].error)
+        self.assertIn('Disk full', jobs[4].error)
+        self.assertEqual(3, len(scheduler.failed_jobs))
+        self.assertListEqual([], scheduler.in_flight)
+
+    def test_overlap(self):
+        """Verify reading, computing and writing overlap"""
+        delay = 0.05
+        num_jobs = 6
+        scheduler = batchprefetch.PrefetchScheduler(lambda value: read_value(value, delay),
+                                                    lambda value: compute_square(value, delay),
+                                                    lambda value: write_result(value, delay), memory_budget=None)
+        for value in range(num_jobs):
+            scheduler.add_job(str(value), kwds={'value': value})
+        start_time = time.time()
+        scheduler.run()
+        # Sequential run would take 3 * delay * num_jobs
+        self.assertTrue(time.time() - start_time < 2 * delay * num_jobs)
+        self.assertEqual([value * value for value in range(num_jobs)], [job.result for job in scheduler.jobs])
+
+    def test_memory_budget(self):
+        """Verify jobs aren't read ahead if they don't fit in the memory budget"""
+        in_flight = []
+
+        def read_job(value):
+            in_flight.append(len(scheduler.in_flight))
+            return value
+
+        scheduler = batchprefetch.PrefetchScheduler(read_job, compute_square, write_result, prefetch=4,
+                                                    memory_budget=100)
+        for value in range(4):
+            scheduler.add_job(str(value), kwds={'value': value}, memory=60)
+        scheduler.run()
+        self.assertEqual([1, 1, 1, 1], in_flight)
+        scheduler = batchprefetch.PrefetchScheduler(read_job, compute_square, write_result, prefetch=1,
+                                                    memory_budget=None)
+        del in_flight[:]
+        for value in range(6):
+            scheduler.add_job(str(value), kwds={'value': value})
+        scheduler.run()
+        self.assertTrue(max(in_flight) <= scheduler.max_in_flight)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""test_batchscheduler.py - tests the batchscheduler module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import batchscheduler
+import time
+import unittest
+
+
+def square(value):
+    """Sample batch job"""
+    time.sleep(0.01)
+    return value * value
+
+
+def init_counter(start):
+    """Sample worker initializer"""
+    global counter
+    counter = start
+
+
+def next_count(value):
+    """Sample batch job that uses the state set by init_counter"""
+    global counter
+    counter += 1
+    return counter
+
+
+def fail(value):
+    """Sample batch job that raises an exception"""
+    raise ValueError("Unable to process {0}".format(value))
+
+
+class TestBatchScheduler(unittest.TestCase):
+    """Tests the BatchScheduler class"""
+
+    def test_memory_budget(self):
+        """Verify returning the memory budget"""
+        budget = batchscheduler.get_memory_budget()
+        if batchscheduler.physical_memory() is not None:
+            self.assertTrue(budget > 0)
+
+    def test_can_start(self):
+        """Verify jobs are only admitted within the worker count and memory budget"""
+        scheduler = batchscheduler.BatchScheduler(num_workers=2, memory_budget=100, multiprocess=False)
+        small_job = batchscheduler.BatchJob('small', square, memory=40)
+        large_job = batchscheduler.BatchJob('large', square, memory=200)
+        self.assertTrue(scheduler.can_start(large_job, []))
+        self.assertTrue(scheduler.can_start(small_job, [small_job]))
+        self.assertFalse(scheduler.can_start(large_job, [small_job]))
+        self.assertFalse(scheduler.can_start(small_job, [small_job, small_job]))
+        scheduler.memory_budget = None
+        self.assertTrue(scheduler.can_start(large_job, [small_job]))
+
+    def test_run_serial(self):
+        """Verify running jobs in the current process and collecting results and errors"""
+        completed = []
+        scheduler = batchscheduler.BatchScheduler(multiprocess=False, on_complete=completed.append)
+        scheduler.add_job('a', square, {'value': 3}, size=2 ** 20)
+        scheduler.add_job('b', fail, {'value': 4}, size=2 ** 20)
+        jobs = scheduler.run()
+        self.assertEqual(jobs, completed)
+        self.assertEqual(9, jobs[0].result)
+        self.assertTrue(jobs[0].succeeded)
+        self.assertIn('Unable to process 4', jobs[1].error)
+        self.assertEqual([jobs[1]], scheduler.failed_jobs)
+        summary = scheduler.summary()
+        self.assertIn('1 of 2 files', summary)
+        self.assertIn('MB/s', summary)
+        self.assertIn('** Error processing b', summary)
+
+    def test_run_pool(self):
+        """Verify running jobs in a pool of processes"""
+        scheduler = batchscheduler.BatchScheduler(num_workers=2, memory_budget=None)
+        for value in range(4):
+            scheduler.add_job(str(value), square, {'value': value})
+        scheduler.add_job('fails', fail, {'value': 0})
+        jobs = scheduler.run()
+        self.assertEqual([0, 1, 4, 9], [job.result for job in jobs[:4]])
+        self.assertEqual(1, len(scheduler.failed_jobs))
+
+    def test_run_pool_budget(self):
+        """Verify jobs that don't fit in the memory budget together are run one at a time"""
+        scheduler = batchscheduler.BatchScheduler(num_workers=3, memory_budget=100)
+        for value in range(3):
+            scheduler.add_job(str(value), square, {'value': value}, memory=60)
+        jobs = scheduler.run()
+        for previous_job, job in zip(jobs[:-1], jobs[1:]):
+            self.assertTrue(job.started >= previous_job.finished)
+        self.assertEqual([0, 1, 4], [job.result for job in jobs])
+
+    def test_initializer(self):
+        """Verify the initializer is called once before the jobs are run"""
+        scheduler = batchscheduler.BatchScheduler(multiprocess=False, initializer=init_counter, initargs=(10,))
+        for value in range(3):
+            scheduler.add_job(str(value), next_count, {'value': value})
+        self.assertEqual([11, 12, 13], [job.result for job in scheduler.run()])
+        scheduler = batchscheduler.BatchScheduler(num_workers=1, initializer=init_counter, initargs=(10,))
+        for value in range(3):
+            scheduler.add_job(str(value), next_count, {'value': value})
+        self.assertEqual([11, 12, 13], [job.result for job in scheduler.run()])
+
+    def test_step(self):
+        """Verify jobs added while the scheduler is running use the same workers"""
+        scheduler = batchscheduler.BatchScheduler(num_workers=1, initializer=init_counter, initargs=(10,))
+        scheduler.start()
+        try:
+            completed = []
+            for value in range(2):
+                scheduler.add_job(str(value), next_count, {'value': value})
+                while not scheduler.idle:
+                    completed.extend(scheduler.step())
+                    time.sleep(scheduler.poll_interval)
+            self.assertEqual([11, 12], [job.result for job in completed])
+        finally:
+            scheduler.stop()
+        self.assertIsNone(scheduler.workers)
+
+if __name__ == "__main__":
+    unittest.main()
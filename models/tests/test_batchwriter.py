@@ -0,0 +1,79 @@
+"""test_batchwriter.py - tests the batchwriter module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import batchwriter
+import h5py
+import numpy as np
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def send_sample_results(results_queue, input_file, value):
+    """Sends sample results to the batch writer from another process"""
+    batchwriter.send_results(results_queue, input_file, {'data': np.ones((3, 3)) * value})
+
+
+class TestBatchWriter(unittest.TestCase):
+    """Tests the BatchWriter class"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.container_fname = os.path.join(self.temp_folder, "results.hdf5")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def test_write_results(self):
+        """Verify results are written to a group per input file"""
+        with h5py.File(self.container_fname, 'w') as fidout:
+            self.assertEqual('scan1', batchwriter.write_results(fidout, '/data/a/scan1.csc',
+                                                                {'tof0': np.zeros(4), 'amplitude0': np.ones(4)}))
+            # Input files with the same name in different folders get their own groups
+            self.assertEqual('scan1_1', batchwriter.write_results(fidout, '/data/b/scan1.csc',
+                                                                  {'data': np.arange(4)}))
+            # Results for the same input file are replaced
+            self.assertEqual('scan1', batchwriter.write_results(fidout, '/data/a/scan1.csc',
+                                                                {'tof0': np.arange(4)}))
+        with h5py.File(self.container_fname, 'r') as fidin:
+            self.assertListEqual(['scan1', 'scan1_1'], sorted(fidin.keys()))
+            self.assertListEqual(['tof0'], list(fidin['scan1'].keys()))
+            self.assertTrue(np.array_equal(np.arange(4), fidin['scan1/tof0'][...]))
+            self.assertEqual(os.path.abspath('/data/b/scan1.csc'), fidin['scan1_1'].attrs['input_file'])
+
+    def test_writer(self):
+        """Verify the writer process saves results sent from several processes"""
+        writer = batchwriter.BatchWriter(self.container_fname, queue_size=2)
+        writer.start()
+        senders = [multiprocessing.Process(target=send_sample_results,
+                                           args=(writer.queue, "scan{0}.csc".format(idx), idx))
+                   for idx in range(4)]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        writer.put("scan4.csc", {'data': np.ones((3, 3)) * 4})
+        self.assertListEqual([], writer.close())
+        with h5py.File(self.container_fname, 'r') as fidin:
+            self.assertEqual(5, len(fidin.keys()))
+            for idx in range(5):
+                self.assertTrue(np.array_equal(np.ones((3, 3)) * idx, fidin["scan{0}/data".format(idx)][...]))
+
+    def test_writer_errors(self):
+        """Verify results that can't be saved are reported"""
+        writer = batchwriter.BatchWriter(os.path.join(self.temp_folder, "missing", "results.hdf5"))
+        writer.start()
+        writer.put("scan1.csc", {'data': np.zeros(3)})
+        errors = writer.close()
+        self.assertEqual(2, len(errors))
+        self.assertEqual(os.path.abspath("scan1.csc"), errors[1][0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""test_cinerenderer.py - tests the cinerenderer module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import cinerenderer
+from models import ndescanhandler
+from matplotlib import cm
+import numpy as np
+import time
+import unittest
+
+
+class TestCineRenderer(unittest.TestCase):
+    """Tests the CineRenderer class"""
+
+    def setUp(self):
+        self.data = np.random.uniform(-1, 1, (6, 5, 20))
+        self.scnr = ndescanhandler.NDEScanHandler(self.data)
+        self.cmap = cm.get_cmap('Spectral')
+        self.renderer = cinerenderer.CineRenderer(self.scnr, self.cmap, (-0.5, 0.5), capacity=4)
+
+    def tearDown(self):
+        self.renderer.stop()
+
+    def wait_for(self, slice_indices, timeout=5):
+        """Waits up to timeout seconds for the frames of slice_indices to be rendered"""
+        start_time = time.time()
+        while not all(self.renderer.is_ready(slice_idx) for slice_idx in slice_indices):
+            if time.time() - start_time > timeout:
+                self.fail("Frames {0} weren't rendered".format(slice_indices))
+            time.sleep(0.01)
+
+    def test_render(self):
+        """Verify frames are the Z slices colormapped to the color limits"""
+        frame = self.renderer.render(3)
+        self.assertEqual((6, 5, 4), frame.shape)
+        self.assertEqual(np.uint8, frame.dtype)
+        expected = self.cmap(np.clip((self.data[:, :, 3] + 0.5), 0, 1), bytes=True)
+        self.assertTrue(np.array_equal(expected, frame))
+
+    def test_capacity(self):
+        """Verify the ring buffer is limited to the capacity, the number of slices and the buffer size"""
+        self.assertEqual(4, self.renderer.capacity)
+        self.assertEqual((4, 6, 5, 4), self.renderer.frames.shape)
+        self.assertEqual(20, cinerenderer.CineRenderer(self.scnr, self.cmap, (-1, 1), capacity=50).capacity)
+        self.assertEqual(3, cinerenderer.CineRenderer(self.scnr, self.cmap, (-1, 1), max_bytes=3 * 6 * 5 * 4).capacity)
+        self.assertEqual(1, cinerenderer.CineRenderer(self.scnr, self.cmap, (-1, 1), max_bytes=6 * 5 * 4).capacity)
+        self.assertEqual(0, cinerenderer.CineRenderer(self.scnr, self.cmap, (-1, 1), max_bytes=1).capacity)
+
+    def test_unbuffered(self):
+        """Verify frames are rendered on request if none fit in the ring buffer"""
+        renderer = cinerenderer.CineRenderer(self.scnr, self.cmap, (-0.5, 0.5), max_bytes=1)
+        renderer.start(3)
+        self.assertIsNone(renderer.thread)
+        self.assertEqual([], renderer.window())
+        self.assertTrue(np.array_equal(self.renderer.render(3), renderer.frame(3)))
+        self.assertEqual(1, renderer.misses)
+        renderer.stop()
+
+    def test_next_index(self):
+        """Verify playback steps through the slices and wraps around if looping"""
+        self.assertEqual(1, self.renderer.next_index(0))
+        self.assertEqual(0, self.renderer.next_index(19))
+        renderer = cinerenderer.CineRenderer(self.scnr, self.cmap, (-1, 1), step=-3, loop=False)
+        self.assertEqual(7, renderer.next_index(10))
+        self.assertIsNone(renderer.next_index(2))
+        renderer.position = 10
+        self.assertEqual([10, 7, 4, 1], renderer.window())
+        self.renderer.position = 18
+        self.assertEqual([18, 19, 0, 1], self.renderer.window())
+
+    def test_playback(self):
+        """Verify frames are rendered ahead of the playback position into the ring buffer"""
+        self.renderer.start(18)
+        self.wait_for([18, 19, 0, 1])
+        self.assertEqual(set([18, 19, 0, 1]), set(self.renderer.slots))
+        for slice_idx in [18, 19, 0, 1]:
+            self.assertTrue(np.array_equal(self.renderer.render(slice_idx), self.renderer.frame(slice_idx)))
+        self.assertEqual(0, self.renderer.misses)
+        self.renderer.seek(0)
+        self.wait_for([0, 1, 2, 3])
+        self.assertEqual(set([0, 1, 2, 3]), set(self.renderer.slots))
+        self.assertEqual(4, len(set(self.renderer.slot_indices)))
+        # Frames that haven't been rendered are rendered on request
+        self.assertTrue(np.array_equal(self.renderer.render(10), self.renderer.frame(10)))
+        self.assertEqual(1, self.renderer.misses)
+        self.renderer.stop()
+        self.assertIsNone(self.renderer.thread)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,7 @@ __author__ = 'Chris R. Coughlin'
 
 import unittest
 from models import dataio
+from models import precision
 from controllers import pathfinder
 from utils.skiptest import skipIfModuleNotInstalled
 import h5py
@@ -14,7 +15,10 @@ import numpy as np
 import numpy.testing
 import scipy.misc
 import os
+import pickle
 import random
+import shutil
+import tempfile
 
 
 class TestDataIO(unittest.TestCase):
@@ -58,6 +62,22 @@ class TestDataIO(unittest.TestCase):
         read_hyperslab = dataio.get_data(self.sample_data_file, slice_idx)
         self.assertTrue(np.array_equal(self.sample_data[slice_idx], read_hyperslab))
 
+    def test_get_scaled_data(self):
+        """Verify get_data applies the scale_factor and add_offset attributes of integer data"""
+        counts = np.arange(25, dtype=np.uint16)
+        scaled_data_file = os.path.join(os.path.dirname(__file__), "scaled_sample.hdf5")
+        try:
+            dataio.save_data(scaled_data_file, counts, scale=0.01, offset=-1.0)
+            with h5py.File(scaled_data_file, 'r') as fidin:
+                self.assertEqual(np.uint16, fidin["scaled_sample.hdf5"].dtype)
+            read_data = dataio.get_data(scaled_data_file)
+            self.assertTrue(np.allclose(counts * 0.01 - 1.0, read_data))
+            self.assertEqual(precision.compute_dtype(np.uint16), read_data.dtype)
+            self.assertTrue(np.allclose(counts[5:15] * 0.01 - 1.0, dataio.get_data(scaled_data_file, np.s_[5:15])))
+        finally:
+            if os.path.exists(scaled_data_file):
+                os.remove(scaled_data_file)
+
     def test_get_txt_data(self):
         """Verify retrieval of ASCII delimited data"""
         sample_data_file = os.path.join(os.path.dirname(__file__), 'support_files',
@@ -508,6 +528,31 @@ class TestUTWinCScanDataFile(unittest.TestCase):
         except WindowsError: # file in use
             pass
 
+    def test_import_tof_native(self):
+        """Verify Time Of Flight data are imported as integers with a scale factor under native precision"""
+        tof_data_file = os.path.join(os.path.dirname(__file__), 'support_files', 'CScanData_tofdata.npy')
+        tof_resolution = 0.01
+        csc_data_file = os.path.join(os.path.dirname(__file__), 'support_files', 'CScanData')
+        expected_tof_data = np.load(tof_data_file) * tof_resolution
+        dest_file = os.path.join(pathfinder.data_path(),
+                                 os.path.basename(csc_data_file) + "_tofdata0.csc.hdf5")
+        original_precision = precision.get_precision()
+        try:
+            precision.set_precision(precision.NATIVE)
+            self.cscan_datafile.import_tof_data()
+            with h5py.File(dest_file, "r") as fidin:
+                root, ext = os.path.splitext(os.path.basename(dest_file))
+                for key in fidin.keys():
+                    if key.startswith(root):
+                        self.assertEqual(np.uint16, fidin[key].dtype)
+            read_data = dataio.get_data(dest_file)
+            self.assertEqual(np.float32, read_data.dtype)
+            numpy.testing.assert_array_almost_equal(expected_tof_data, read_data, decimal=3)
+        finally:
+            precision.set_precision(original_precision)
+            if os.path.exists(dest_file):
+                os.remove(dest_file)
+
     def test_import_amp(self):
         """Verify import of amplitude data"""
         amp_data_file = os.path.join(os.path.dirname(__file__), 'support_files', 'CScanData_ampdata.npy')
@@ -587,6 +632,111 @@ class TestWinspectReader(unittest.TestCase):
             except WindowsError: # file in use
                 pass
 
+class TestLazyDatasetMap(unittest.TestCase):
+    """Tests the LazyDatasetMap class"""
+
+    def setUp(self):
+        self.sample_utwin_file = os.path.join(os.path.dirname(__file__), 'support_files', 'CScanData.csc')
+        self.sample_winspect_file = os.path.join(os.path.dirname(__file__), 'support_files', 'sample_data.sdt')
+        self.lazy_map = dataio.LazyDatasetMap(self.sample_utwin_file,
+                                              {'ones': (np.ones, ((2, 3),)), 'zeros': (np.zeros, (4,))})
+
+    def test_lazy_read(self):
+        """Verify datasets are only read when first accessed"""
+        self.assertListEqual(['ones', 'zeros'], list(self.lazy_map))
+        self.assertEqual(2, len(self.lazy_map))
+        self.assertTrue('ones' in self.lazy_map)
+        self.assertFalse('twos' in self.lazy_map)
+        self.assertListEqual([], self.lazy_map.loaded_keys)
+        ones = self.lazy_map['ones']
+        self.assertTrue(np.array_equal(np.ones((2, 3)), ones))
+        self.assertIs(ones, self.lazy_map['ones'])
+        self.assertTrue(self.lazy_map.is_loaded('ones'))
+        self.assertFalse(self.lazy_map.is_loaded('zeros'))
+        self.assertListEqual(['ones'], self.lazy_map.loaded_keys)
+        with self.assertRaises(KeyError):
+            self.lazy_map['twos']
+
+    def test_replace(self):
+        """Verify datasets can be replaced, added and removed"""
+        self.lazy_map['zeros'] = np.arange(3)
+        self.lazy_map['twos'] = np.ones(3) * 2
+        self.assertListEqual(['ones', 'zeros', 'twos'], list(self.lazy_map))
+        self.assertListEqual(['zeros', 'twos'], self.lazy_map.loaded_keys)
+        del self.lazy_map['ones']
+        self.assertListEqual(['zeros', 'twos'], list(self.lazy_map))
+        with self.assertRaises(KeyError):
+            del self.lazy_map['ones']
+
+    def test_unload(self):
+        """Verify unloading discards data read but not replaced datasets"""
+        self.lazy_map['ones']
+        self.lazy_map['zeros'] = np.arange(3)
+        self.lazy_map.unload('ones')
+        self.lazy_map.unload('zeros')
+        self.assertListEqual(['zeros'], self.lazy_map.loaded_keys)
+        self.assertTrue(np.array_equal(np.ones((2, 3)), self.lazy_map['ones']))
+
+    def test_pickle(self):
+        """Verify the map can be pickled without reading its datasets"""
+        self.lazy_map['zeros'] = np.arange(3)
+        unpickled_map = pickle.loads(pickle.dumps(self.lazy_map, pickle.HIGHEST_PROTOCOL))
+        self.assertListEqual(['zeros'], unpickled_map.loaded_keys)
+        self.assertTrue(np.array_equal(np.ones((2, 3)), unpickled_map['ones']))
+
+    def test_fingerprint(self):
+        """Verify the fingerprint identifies the source file and dataset"""
+        fingerprint = self.lazy_map.fingerprint('ones')
+        self.assertTrue(os.path.abspath(self.sample_utwin_file) in fingerprint)
+        self.assertNotEqual(fingerprint, self.lazy_map.fingerprint('zeros'))
+
+    def test_overlay(self):
+        """Verify overlay returns a copy with datasets replaced"""
+        overlaid_map = self.lazy_map.overlay({'zeros': np.arange(3)})
+        self.assertListEqual(['zeros'], overlaid_map.loaded_keys)
+        self.assertTrue(np.array_equal(np.arange(3), overlaid_map['zeros']))
+        self.assertTrue(np.array_equal(np.ones((2, 3)), overlaid_map['ones']))
+        self.assertListEqual([], self.lazy_map.loaded_keys)
+
+    def test_get_utwin_datasets(self):
+        """Verify the lazily read UTWin datasets match the datasets read all at once"""
+        expected_data = dataio.get_utwin_data(self.sample_utwin_file)
+        lazy_map = dataio.get_utwin_datasets(self.sample_utwin_file)
+        expected_keys = [data_type + str(idx) for data_type in expected_data
+                         for idx in range(len(expected_data[data_type]))]
+        self.assertItemsEqual(expected_keys, list(lazy_map))
+        self.assertListEqual([], lazy_map.loaded_keys)
+        for data_type in expected_data:
+            for idx in range(len(expected_data[data_type])):
+                self.assertTrue(np.array_equal(expected_data[data_type][idx], lazy_map[data_type + str(idx)]))
+
+    def test_get_winspect_datasets(self):
+        """Verify the lazily read Winspect data subsets match the subsets read all at once"""
+        expected_data_list = dataio.get_winspect_data(self.sample_winspect_file)
+        lazy_map = dataio.get_winspect_datasets(self.sample_winspect_file)
+        self.assertEqual(len(expected_data_list), len(lazy_map))
+        self.assertListEqual([], lazy_map.loaded_keys)
+        for dataset in expected_data_list:
+            self.assertTrue(np.array_equal(dataset.data, lazy_map[dataset.data_type + "0"]))
+
+    def test_get_winspect_datasets_labels(self):
+        """Verify Winspect data subsets with non-standard labels are keyed by label"""
+        with open(self.sample_winspect_file, 'rb') as fidin:
+            contents = fidin.read()
+        temp_path = tempfile.mkdtemp()
+        try:
+            labelled_file = os.path.join(temp_path, 'labelled_data.sdt')
+            with open(labelled_file, 'wb') as fidout:
+                fidout.write(contents.replace(': Amplitude\r\n', ': Amplitude (Gate 1)\r\n', 1).replace(
+                    ': Waveform\r\n', ': Amplitude (Gate 2)\r\n', 1))
+            expected_data_list = dataio.get_winspect_data(self.sample_winspect_file)
+            lazy_map = dataio.get_winspect_datasets(labelled_file)
+            self.assertListEqual(['amplitude_gate_1_0', 'amplitude_gate_2_0'], list(lazy_map))
+            self.assertTrue(np.array_equal(expected_data_list[0].data, lazy_map['amplitude_gate_1_0']))
+            self.assertTrue(np.array_equal(expected_data_list[1].data, lazy_map['amplitude_gate_2_0']))
+        finally:
+            shutil.rmtree(temp_path, ignore_errors=True)
+
 
 if __name__ == "__main__":
     random.seed()
@@ -0,0 +1,109 @@
+"""test_decimation.py - tests the decimation module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import decimation
+import numpy as np
+import unittest
+
+
+class TestMinMaxDecimator(unittest.TestCase):
+    """Tests the MinMaxDecimator class"""
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.data = self.random_state.standard_normal(10 ** 6)
+        self.peaks = {123457: 50., 654321: -50., 999999: 25.}
+        for idx, peak in self.peaks.items():
+            self.data[idx] = peak
+        self.decimator = decimation.MinMaxDecimator(self.data)
+
+    def check_envelope(self, decimator, x0, x1, num_pixels):
+        """Verifies that the decimated data between x0 and x1 are points of the data in order, have the same
+        minimum and maximum as the data in view, and are no more than four points per pixel"""
+        x, y = decimator.decimate(x0, x1, num_pixels)
+        start_idx, stop_idx = decimator.visible_range(x0, x1)
+        self.assertTrue(np.all(np.diff(x) > 0))
+        self.assertLessEqual(len(x), 4 * num_pixels + 8)
+        self.assertEqual(np.max(y), np.max(decimator.y[start_idx:stop_idx]))
+        self.assertEqual(np.min(y), np.min(decimator.y[start_idx:stop_idx]))
+        return x, y
+
+    def test_levels(self):
+        """Verify each level holds the indices of the extrema of its blocks"""
+        self.assertEqual(decimation.base_block_size, self.decimator.levels[0][0])
+        for block_size, min_idx, max_idx in self.decimator.levels:
+            self.assertEqual(len(self.data) // block_size, len(min_idx))
+            blocks = self.data[:block_size * len(min_idx)].reshape(-1, block_size)
+            np.testing.assert_array_equal(blocks.min(axis=1), self.data[min_idx])
+            np.testing.assert_array_equal(blocks.max(axis=1), self.data[max_idx])
+        self.assertEqual(1, len(self.decimator.levels[-1][1]))
+
+    def test_decimate_full(self):
+        """Verify decimating all the data keeps its peaks and endpoints"""
+        x, y = self.check_envelope(self.decimator, None, None, 1000)
+        for idx, peak in self.peaks.items():
+            self.assertIn(idx, x)
+            self.assertEqual(peak, y[np.searchsorted(x, idx)])
+        self.assertEqual(0, x[0])
+        self.assertEqual(len(self.data) - 1, x[-1])
+        np.testing.assert_array_equal(self.data[x], y)
+
+    def test_decimate_zoom(self):
+        """Verify decimating a range of the data uses the data in view and the point either side"""
+        for x0, x1, num_pixels in [(100000.5, 700000, 800), (123000, 125000.2, 300), (500, 3000, 100),
+                                   (990000, 2000000, 50), (-1000, 100, 10)]:
+            x, y = self.check_envelope(self.decimator, x0, x1, num_pixels)
+            self.assertLessEqual(x[0], max(0, x0))
+            self.assertGreaterEqual(x[-1], min(len(self.data) - 1, x1))
+
+    def test_decimate_small(self):
+        """Verify views of no more than two points per pixel aren't decimated"""
+        x, y = self.decimator.decimate(1000, 1100, 100)
+        np.testing.assert_array_equal(np.arange(999, 1102), x)
+        np.testing.assert_array_equal(self.data[999:1102], y)
+        x, y = self.decimator.decimate(2 * len(self.data), 3 * len(self.data), 100)
+        self.assertEqual(0, len(x))
+
+    def test_decimate_xy(self):
+        """Verify decimating data plotted against sorted X data"""
+        x_data = np.linspace(-5, 5, len(self.data))
+        decimator = decimation.MinMaxDecimator(x_data, self.data)
+        x, y = self.check_envelope(decimator, -1, 3, 500)
+        self.assertLessEqual(x[0], -1)
+        self.assertGreaterEqual(x[-1], 3)
+        np.testing.assert_array_equal(self.data[np.searchsorted(x_data, x)], y)
+        # Unsorted X data can't be decimated
+        unsorted_decimator = decimation.MinMaxDecimator(x_data[::-1], self.data)
+        x, y = unsorted_decimator.decimate(-1, 3, 500)
+        self.assertEqual(len(self.data), len(x))
+        self.assertRaises(ValueError, decimation.MinMaxDecimator, x_data[1:], self.data)
+
+    def test_nan(self):
+        """Verify NaN is ignored by the block extrema"""
+        self.data[:5000:2] = np.nan
+        self.data[10000:20000] = np.nan
+        decimator = decimation.MinMaxDecimator(self.data)
+        x, y = decimator.decimate(None, None, 1000)
+        self.assertEqual(50., np.nanmax(y))
+        self.assertEqual(-50., np.nanmin(y))
+        x, y = decimator.decimate(0, 5000, 100)
+        self.assertEqual(np.nanmax(self.data[:5002]), np.nanmax(y))
+        self.assertEqual(np.nanmin(self.data[:5002]), np.nanmin(y))
+
+    def test_short_data(self):
+        """Verify data shorter than a block are decimated directly"""
+        decimator = decimation.MinMaxDecimator(np.array([3, 1, 4, 1, 5, 9, 2, 6, 5, 3]))
+        self.assertEqual([], decimator.levels)
+        x, y = decimator.decimate(None, None, 5)
+        self.assertEqual(10, len(x))
+        x, y = decimator.decimate(None, None, 2)
+        np.testing.assert_array_equal([0, 1, 4, 5, 6, 9], x)
+        np.testing.assert_array_equal([3, 1, 5, 9, 2, 3], y)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,6 +9,8 @@ import models.mainmodel as model
 import models.dataio as dataio
 import models.abstractplugin as abstractplugin
 import models.config as config
+import models.pipeline as pipeline
+import models.runprofile as runprofile
 import models.ultrasonicgate as ultrasonicgate
 import controllers.pathfinder as pathfinder
 from utils.skiptest import skipIfModuleNotInstalled
@@ -88,6 +90,10 @@ class TestMainModel(unittest.TestCase):
         self.model = model.MainModel(self.mock_controller)
         cfg = config.Configure(pathfinder.config_path())
         self.original_loglevel = cfg.get_app_option("log level")
+        # Keep cached plugin results etc. out of the user's data folders
+        self.original_user_path = pathfinder.user_path()
+        self.temp_user_path = tempfile.mkdtemp()
+        self.model.migrate_user_path(self.temp_user_path)
 
     def random_data(self):
         """Returns a list of random data"""
@@ -105,7 +111,8 @@ class TestMainModel(unittest.TestCase):
         data_folders = [pathfinder.user_path(), pathfinder.data_path(),
                         pathfinder.thumbnails_path(), pathfinder.gates_path(),
                         pathfinder.plugins_path(), pathfinder.podmodels_path(),
-                        pathfinder.colormaps_path(), pathfinder.batchoutput_path()]
+                        pathfinder.colormaps_path(), pathfinder.batchoutput_path(),
+                        pathfinder.pipelines_path(), pathfinder.cache_path()]
         self.model.check_user_path()
         for folder in data_folders:
             self.assertTrue(os.path.exists(folder))
@@ -262,6 +269,60 @@ class TestMainModel(unittest.TestCase):
         expected_data = plugin_data / np.max(plugin_data)
         self.assertTrue(np.array_equal(expected_data, returned_data))
 
+    def test_run_plugin_cached(self):
+        """Verify run_plugin returns cached results without starting a process"""
+        plugin_data = np.array(self.random_data())
+        plugin_config = {'pi': 3.141592654}
+        plugin_cls = self.get_normalize_plugin()
+        plugin_process, plugin_queue, exception_queue = model.run_plugin(plugin_cls,
+                                                                         data=plugin_data, config=plugin_config)
+        expected_data = plugin_queue.get()
+        plugin_process.join()
+        cache_key, cached_data = model.get_cached_result(plugin_cls, plugin_data, plugin_config)
+        self.assertTrue(np.array_equal(expected_data, cached_data))
+        profile = runprofile.RunProfile(plugin_cls.__name__)
+        plugin_process, plugin_queue, exception_queue = model.run_plugin(plugin_cls, data=plugin_data,
+                                                                         config=plugin_config, profile=profile)
+        self.assertTrue(isinstance(plugin_process, model.CompletedProcess))
+        self.assertFalse(plugin_process.is_alive())
+        self.assertTrue(np.array_equal(expected_data, plugin_queue.get(False)))
+        stages = [record['stage'] for record in profile.stages]
+        self.assertTrue('cache lookup' in stages)
+        self.assertFalse('process start' in stages)
+        plugin_process, plugin_queue, exception_queue = model.run_plugin(plugin_cls, data=plugin_data,
+                                                                         config=plugin_config, use_cache=False)
+        self.assertTrue(isinstance(plugin_process, multiprocessing.Process))
+        plugin_queue.get()
+        plugin_process.join()
+
+    def test_run_plugin_profile(self):
+        """Verify run_plugin records the stages of the plugin run"""
+        plugin_data = np.array(self.random_data())
+        plugin_cls = self.get_normalize_plugin()
+        profile = runprofile.RunProfile(plugin_cls.__name__)
+        plugin_process, plugin_queue, exception_queue = model.run_plugin(plugin_cls, data=plugin_data,
+                                                                         use_cache=False, profile=profile)
+        plugin_queue.get()
+        self.assertTrue(profile.collect(timeout=10))
+        plugin_process.join()
+        stages = [record['stage'] for record in profile.stages]
+        for stage in ['process start', 'instantiate', 'run', 'return']:
+            self.assertTrue(stage in stages)
+        worker_pids = set(record['pid'] for record in profile.stages if record['stage'] == 'run')
+        self.assertEqual(set([plugin_process.pid]), worker_pids)
+
+    def test_run_pipeline(self):
+        """Verify the main model can run a pipeline of plugins in a single process"""
+        plugin_data = np.array(self.random_data())
+        plugin_cls = self.get_normalize_plugin()
+        plugin_pipeline = pipeline.PluginPipeline([(plugin_cls, None), (plugin_cls, None)])
+        pipeline_process, pipeline_queue, exception_queue = model.run_pipeline(plugin_pipeline, data=plugin_data)
+        self.assertTrue(isinstance(pipeline_process, multiprocessing.Process))
+        returned_data = pipeline_queue.get()
+        pipeline_process.join()
+        expected_data = plugin_data / np.max(plugin_data)
+        self.assertTrue(np.allclose(expected_data, returned_data))
+
     @skipIfModuleNotInstalled("tcunittest")
     def test_run_plugin_exceptions(self):
         """Verify run_plugin returns exception messages in Queue"""
@@ -517,6 +578,8 @@ class TestMainModel(unittest.TestCase):
         except WindowsError: # file in use
             pass
         model.set_loglevel(self.original_loglevel)
+        config.Configure(pathfinder.config_path()).set_app_option({"User Path": self.original_user_path})
+        shutil.rmtree(self.temp_user_path, ignore_errors=True)
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
@@ -6,8 +6,12 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'Chris R. Coughlin'
 
 from models import ndescanhandler
+from models import precision
+import h5py
 import numpy as np
+import os
 import random
+import threading
 import unittest
 
 class TestNDEScanHandler(unittest.TestCase):
@@ -100,6 +104,317 @@ class TestNDEScanHandler(unittest.TestCase):
             returned_result = self.scnr.gen_cscan(start_idx, stop_idx, op)
             self.assertTrue(np.array_equal(expected_result, returned_result))
 
+    def test_gen_cscan_precision(self):
+        """Verify computed C scans honour the compute precision"""
+        int_array = np.arange(24, dtype=np.int16).reshape((3, 2, 4))
+        scnr = ndescanhandler.NDEScanHandler(int_array)
+        original_precision = precision.get_precision()
+        try:
+            precision.set_precision(precision.NATIVE)
+            self.assertEqual(np.int16, scnr.gen_cscan(0, 4, np.amax).dtype)
+            for op in [np.average, np.mean, np.median]:
+                returned_result = scnr.gen_cscan(0, 4, op)
+                self.assertEqual(np.float32, returned_result.dtype)
+                self.assertTrue(np.allclose(op(int_array, axis=2), returned_result))
+            precision.set_precision(precision.FLOAT32)
+            self.assertEqual(np.float32, scnr.gen_cscan(0, 4, np.amax).dtype)
+        finally:
+            precision.set_precision(original_precision)
+
+    def test_cscan_blocks(self):
+        """Verify the (y, x) plane is covered by blocks no larger than the requested size"""
+        shape = (7, 5, 16)
+        for max_block_bytes in [16, 64, 128, 10 ** 6]:
+            blocks = ndescanhandler.cscan_blocks(shape, 8, 2, max_block_bytes)
+            coverage = np.zeros(shape[:2], dtype=np.int)
+            for rows, cols in blocks:
+                coverage[rows, cols] += 1
+                block_size = (rows.stop - rows.start) * (cols.stop - cols.start) * 8 * 2
+                self.assertTrue(block_size <= max(max_block_bytes, 16))
+            self.assertTrue(np.all(coverage == 1))
+        self.assertEqual(1, len(ndescanhandler.cscan_blocks(shape, 8, 2, 10 ** 6)))
+
+    def test_gen_tiled_cscan(self):
+        """Verify C scans computed in blocks by threads or processes match the C scan of the complete gate"""
+        data = np.random.uniform(-100, 100, (9, 7, 32))
+        for use_threads in [True, False]:
+            scnr = ndescanhandler.NDEScanHandler(data)
+            for op in scnr.available_cscan_functions:
+                progress = []
+                returned_result = scnr.gen_cscan(3, 27, op, progress_fn=progress.append, num_workers=2,
+                                                 use_threads=use_threads, max_block_bytes=500)
+                self.assertTrue(np.allclose(op(data[:, :, 3:27], axis=2), returned_result))
+                self.assertEqual(1.0, progress[-1])
+                self.assertTrue(len(progress) > 1)
+
+    def test_gen_cscan_cancel(self):
+        """Verify a cancelled C scan returns None"""
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertIsNone(self.scnr.gen_cscan(0, 4, np.amax, cancel_event=cancel_event))
+        self.assertIsNone(self.scnr.gen_cscan(0, 4, np.amax, cancel_event=cancel_event, max_block_bytes=8))
+
+        def cancel_after_first(fraction):
+            """Cancels the C scan once the first block is complete"""
+            cancel_event.set()
+
+        cancel_event.clear()
+        self.assertIsNone(self.scnr.gen_cscan(0, 4, np.median, progress_fn=cancel_after_first,
+                                              cancel_event=cancel_event, num_workers=1, max_block_bytes=8))
+
+    def test_gen_cscan_hdf5(self):
+        """Verify C scans are computed from data read block by block from an HDF5 file"""
+        data_file = os.path.join(os.path.dirname(__file__), 'support_files', 'test_ndescanhandler.hdf5')
+        data = np.random.randint(-1000, 1000, (6, 5, 20)).astype(np.int16)
+        try:
+            with h5py.File(data_file, 'w') as fidout:
+                dataset = fidout.create_dataset('data', data=data)
+                dataset.attrs['scale_factor'] = 0.5
+            with h5py.File(data_file, 'r') as fidin:
+                scnr = ndescanhandler.NDEScanHandler(fidin['data'])
+                self.assertTrue(np.allclose(0.5 * data[:, :, 2:18].max(axis=2),
+                                            scnr.gen_cscan(2, 18, np.amax, max_block_bytes=100)))
+                self.assertTrue(np.allclose(0.5 * np.median(data[:, :, 2:18], axis=2),
+                                            scnr.gen_cscan(2, 18, np.median)))
+        finally:
+            if os.path.exists(data_file):
+                os.remove(data_file)
+
+    def test_gen_cscan_cached(self):
+        """Verify computed C scans are cached until the data are replaced"""
+        data = np.random.uniform(-100, 100, (4, 3, 8))
+        scnr = ndescanhandler.NDEScanHandler(data)
+        cscan = scnr.gen_cscan(1, 6, np.median)
+        self.assertEqual(1, len(scnr.cache))
+        self.assertTrue(np.array_equal(cscan, scnr.gen_cscan(1, 6, np.median)))
+        self.assertTrue(np.array_equal(cscan, scnr.gen_cscan(1.0, 6.0, np.median)))
+        self.assertEqual(1, len(scnr.cache))
+        scnr.gen_cscan(1, 6, np.mean)
+        scnr.gen_cscan(2, 6, np.median)
+        self.assertEqual(3, len(scnr.cache))
+        scnr.set_data(data)
+        self.assertEqual(3, len(scnr.cache))
+        new_data = -data
+        scnr.set_data(new_data)
+        self.assertEqual(0, len(scnr.cache))
+        self.assertTrue(np.allclose(np.median(new_data[:, :, 1:6], axis=2), scnr.gen_cscan(1, 6, np.median)))
+        hbscan = scnr.hbscan_data(2)
+        self.assertIn(('hbscan_data', 2, None, scnr.data_version), scnr.cache)
+        scnr.invalidate()
+        self.assertNotIn(('hbscan_data', 2, None, scnr.data_version), scnr.cache)
+        self.assertTrue(np.array_equal(hbscan, scnr.hbscan_data(2)))
+
+    def test_cached_results_writeable(self):
+        """Verify cached results can be modified by callers without changing the cache"""
+        data = np.random.uniform(-100, 100, (4, 3, 8))
+        scnr = ndescanhandler.NDEScanHandler(data)
+        expected_cscan = np.median(data[:, :, 1:6], axis=2)
+        for cscan in [scnr.gen_cscan(1, 6, np.median), scnr.gen_cscan(1, 6, np.median)]:
+            self.assertTrue(cscan.flags.writeable)
+            cscan *= 2
+        self.assertTrue(np.allclose(expected_cscan, scnr.gen_cscan(1, 6, np.median)))
+        scnr.vbscan_data(1)
+        vbscan = scnr.vbscan_data(1)
+        vbscan[:] = 0
+        self.assertTrue(np.array_equal(data[:, 1, :], scnr.vbscan_data(1)))
+        # The cache holds compact copies rather than views of the data
+        self.assertEqual(data[:, 1, :].nbytes + expected_cscan.nbytes, scnr.cache.nbytes)
+
+    def test_gen_cscan_cancelled_not_cached(self):
+        """Verify a cancelled C scan isn't cached"""
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertIsNone(self.scnr.gen_cscan(0, 4, np.amax, cancel_event=cancel_event))
+        self.assertEqual(0, len(self.scnr.cache))
+        self.assertTrue(np.array_equal(np.amax(self.threed_array, axis=2), self.scnr.gen_cscan(0, 4, np.amax)))
+
+    def test_extract_features(self):
+        """Verify extract_features returns each feature of each trace"""
+        data = np.random.randint(-1000, 1000, (5, 4, 16)).astype(np.int16)
+        maps = ndescanhandler.extract_features(data, ndescanhandler.cscan_features, threshold=500, index_offset=3,
+                                               compute_precision=precision.FLOAT64)
+        self.assertEqual(set(ndescanhandler.cscan_features), set(maps))
+        self.assertTrue(np.array_equal(np.amax(data, axis=2), maps['max']))
+        self.assertTrue(np.array_equal(np.amin(data, axis=2), maps['min']))
+        self.assertTrue(np.array_equal(np.ptp(data, axis=2), maps['ptp']))
+        float_data = data.astype(np.float64)
+        self.assertTrue(np.allclose(np.mean(float_data, axis=2), maps['mean']))
+        self.assertTrue(np.allclose(np.sum(float_data ** 2, axis=2), maps['energy']))
+        self.assertTrue(np.allclose(np.sqrt(np.mean(float_data ** 2, axis=2)), maps['rms']))
+        self.assertTrue(np.array_equal(np.argmax(data, axis=2) + 3, maps['argmax']))
+        for (row, col), crossing in np.ndenumerate(maps['first_crossing']):
+            crossings = np.nonzero(np.abs(data[row, col]) >= 500)[0]
+            self.assertEqual(crossings[0] + 3 if len(crossings) else -1, crossing)
+        maps = ndescanhandler.extract_features(data, ['ptp'])
+        self.assertEqual(['ptp'], list(maps))
+        with self.assertRaises(ValueError):
+            ndescanhandler.extract_features(data, ['first_crossing'])
+        with self.assertRaises(ValueError):
+            ndescanhandler.extract_features(data, ['qqq'])
+
+    def test_gen_cscan_features(self):
+        """Verify multi-feature C scans match the individual C scans, whether computed whole or in blocks"""
+        data = np.random.uniform(-100, 100, (9, 7, 32))
+        features = ['max', 'min', 'ptp', 'mean', 'argmax', 'first_crossing']
+        for max_block_bytes in [None, 500]:
+            scnr = ndescanhandler.NDEScanHandler(data)
+            progress = []
+            maps = scnr.gen_cscan_features(3, 27, features, threshold=90, progress_fn=progress.append,
+                                           num_workers=2, max_block_bytes=max_block_bytes)
+            self.assertEqual(1.0, progress[-1])
+            for feature, fn in [('max', np.amax), ('min', np.amin), ('ptp', np.ptp), ('mean', np.mean)]:
+                self.assertTrue(np.allclose(scnr.gen_cscan(3, 27, fn), maps[feature]))
+            self.assertTrue(np.array_equal(np.argmax(data[:, :, 3:27], axis=2) + 3, maps['argmax']))
+            # Cached features are reused and only the missing features are computed
+            cached_maps = len(scnr.cache)
+            more_maps = scnr.gen_cscan_features(3, 27, ['max', 'rms'], threshold=90)
+            self.assertEqual(cached_maps + 1, len(scnr.cache))
+            self.assertTrue(np.array_equal(maps['max'], more_maps['max']))
+            self.assertTrue(np.allclose(np.sqrt(np.mean(data[:, :, 3:27] ** 2, axis=2)), more_maps['rms']))
+        with self.assertRaises(ValueError):
+            scnr.gen_cscan_features(3, 27, ['qqq'])
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertIsNone(scnr.gen_cscan_features(3, 27, ['energy'], cancel_event=cancel_event))
+
+    def test_gen_gated_cscan(self):
+        """Verify gated peak amplitude, peak time and threshold crossing C scans"""
+        data = np.random.uniform(-100, 100, (6, 5, 40))
+        for max_block_bytes in [None, 400]:
+            scnr = ndescanhandler.NDEScanHandler(data)
+            maps = scnr.gen_gated_cscan(10, 30, threshold=80, num_workers=2, max_block_bytes=max_block_bytes)
+            self.assertEqual(set(['peak', 'peak_time', 'crossing_time']), set(maps))
+            gated = np.abs(data[:, :, 10:30])
+            self.assertTrue(np.allclose(gated.max(axis=2), maps['peak']))
+            self.assertTrue(np.array_equal(np.argmax(gated, axis=2) + 10, maps['peak_time']))
+            for (row, col), crossing in np.ndenumerate(maps['crossing_time']):
+                crossings = np.nonzero(gated[row, col] >= 80)[0]
+                self.assertEqual(crossings[0] + 10 if len(crossings) else -1, crossing)
+            self.assertEqual(3, len(scnr.cache))
+            self.assertTrue(np.array_equal(maps['peak'], scnr.gen_gated_cscan(10, 30, threshold=80)['peak']))
+            self.assertEqual(3, len(scnr.cache))
+        signed_maps = scnr.gen_gated_cscan(10, 30, rectify=False)
+        self.assertTrue(np.allclose(data[:, :, 10:30].max(axis=2), signed_maps['peak']))
+        with self.assertRaises(ValueError):
+            scnr.gen_gated_cscan(50, 60)
+
+    def test_gen_gated_cscan_interface(self):
+        """Verify gates that follow the interface echo"""
+        data = np.zeros((4, 3, 60))
+        interface_times = np.random.randint(5, 15, (4, 3))
+        peak_offsets = np.random.randint(10, 20, (4, 3))
+        for (row, col), interface_time in np.ndenumerate(interface_times):
+            data[row, col, interface_time] = 50.
+            data[row, col, interface_time + peak_offsets[row, col]] = -10. - row - col
+        # No interface echo
+        data[0, 0, :] = 1.
+        scnr = ndescanhandler.NDEScanHandler(data)
+        maps = scnr.gen_gated_cscan(8, 22, threshold=5, interface_gate=(0, 20, 25), max_block_bytes=500)
+        interface_times[0, 0] = -1
+        self.assertTrue(np.array_equal(interface_times, maps['interface_time']))
+        expected_times = interface_times + peak_offsets
+        expected_times[0, 0] = -1
+        self.assertTrue(np.array_equal(expected_times, maps['peak_time']))
+        self.assertTrue(np.array_equal(expected_times, maps['crossing_time']))
+        self.assertTrue(np.isnan(maps['peak'][0, 0]))
+        expected_peaks = 10. + np.add.outer(np.arange(4), np.arange(3))
+        self.assertTrue(np.allclose(expected_peaks.ravel()[1:], maps['peak'].ravel()[1:]))
+
+    def test_approximate_quantile(self):
+        """Verify streaming quantile estimates are within the error bound of the exact quantile"""
+        data = np.random.standard_normal((5, 4, 90))
+        bound = (data.max(axis=2) - data.min(axis=2)) / 8. ** 2
+        for q in [0, 10, 25, 50, 97, 100]:
+            estimate = ndescanhandler.approximate_quantile(lambda start, stop: data[:, :, start:stop], 90, q,
+                                                           bins=8, passes=2, stream_length=7)
+            self.assertTrue(np.all(np.abs(estimate - np.percentile(data, q, axis=2)) <= bound + 1e-9))
+        # The median of an even number of samples is the mean of the middle two
+        estimate = ndescanhandler.approximate_quantile(lambda start, stop: data[:, :, start:stop], 90, 50,
+                                                       bins=64, passes=3, stream_length=7)
+        self.assertTrue(np.allclose(np.median(data, axis=2), estimate, atol=1e-4))
+
+    def test_gen_quantile_cscan(self):
+        """Verify exact and approximate percentile C scans"""
+        data = np.random.uniform(-100, 100, (8, 6, 120))
+        gated = data[:, :, 10:110]
+        for max_block_bytes in [None, 2000]:
+            scnr = ndescanhandler.NDEScanHandler(data)
+            self.assertTrue(np.allclose(np.percentile(gated, 25, axis=2),
+                                        scnr.gen_quantile_cscan(10, 110, 25, max_block_bytes=max_block_bytes)))
+            progress = []
+            estimate = scnr.gen_quantile_cscan(10, 110, 25, mode=ndescanhandler.APPROXIMATE,
+                                               progress_fn=progress.append, max_block_bytes=max_block_bytes)
+            bound = (gated.max(axis=2) - gated.min(axis=2)) / ndescanhandler.default_quantile_bins ** 2
+            self.assertTrue(np.all(np.abs(estimate - np.percentile(gated, 25, axis=2)) <= bound + 1e-9))
+            self.assertAlmostEqual(1.0, progress[-1])
+            # Median C scans follow the handler's quantile mode
+            scnr.quantile_mode = ndescanhandler.APPROXIMATE
+            median = scnr.gen_cscan(10, 110, np.median, max_block_bytes=max_block_bytes)
+            self.assertTrue(np.all(np.abs(median - np.median(gated, axis=2)) <= bound + 1e-9))
+        with self.assertRaises(ValueError):
+            scnr.gen_quantile_cscan(10, 110, 50, mode='guess')
+
+    def test_gen_quantile_cscan_cancel(self):
+        """Verify cancelling an approximate percentile C scan"""
+        data = np.random.uniform(-100, 100, (8, 6, 120))
+        scnr = ndescanhandler.NDEScanHandler(data)
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertIsNone(scnr.gen_quantile_cscan(0, 120, 50, mode=ndescanhandler.APPROXIMATE,
+                                                  cancel_event=cancel_event, max_block_bytes=2000))
+
+
+
+class TestScanCache(unittest.TestCase):
+    """Tests the ScanCache class"""
+
+    def test_lru(self):
+        """Verify the least recently used arrays are discarded to stay within the size limit"""
+        cache = ndescanhandler.ScanCache(max_bytes=300)
+        arrays = [np.zeros(10, dtype=np.float64) + idx for idx in range(4)]
+        for idx in range(3):
+            cache.put(idx, arrays[idx])
+        self.assertEqual(240, cache.nbytes)
+        # Using array 0 makes array 1 the least recently used
+        self.assertTrue(np.array_equal(arrays[0], cache.get(0)))
+        cache.put(3, arrays[3])
+        self.assertIsNone(cache.get(1))
+        for idx in [0, 2, 3]:
+            self.assertTrue(np.array_equal(arrays[idx], cache.get(idx)))
+        self.assertEqual(240, cache.nbytes)
+
+    def test_too_large(self):
+        """Verify arrays larger than the cache aren't stored"""
+        cache = ndescanhandler.ScanCache(max_bytes=100)
+        cache.put('small', np.zeros(4))
+        large_array = np.zeros(100)
+        self.assertIs(large_array, cache.put('large', large_array))
+        self.assertNotIn('large', cache)
+        self.assertIn('small', cache)
+
+    def test_copies(self):
+        """Verify the cache stores and returns copies of arrays"""
+        cache = ndescanhandler.ScanCache()
+        data = np.arange(24, dtype=np.float64).reshape((4, 6))
+        column = data[:, 1]
+        self.assertIs(column, cache.put('column', column))
+        self.assertTrue(column.flags.writeable)
+        column[:] = -1
+        cached_column = cache.get('column')
+        self.assertTrue(np.array_equal(np.arange(1, 24, 6), cached_column))
+        self.assertTrue(cached_column.flags.writeable)
+        cached_column[:] = -2
+        self.assertTrue(np.array_equal(np.arange(1, 24, 6), cache.get('column')))
+        self.assertEqual(column.nbytes, cache.nbytes)
+
+    def test_clear(self):
+        """Verify clearing the cache"""
+        cache = ndescanhandler.ScanCache()
+        cache.put('a', np.zeros(4))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.nbytes)
+
 if __name__ == "__main__":
     random.seed()
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""test_outofcore.py - tests the outofcore module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import outofcore
+from models import abstractplugin
+from models import mainmodel
+from models import dataio
+from models.tests import test_tiling
+from plugins import normalize_plugin as normalize_plugin_module
+from controllers import pathfinder
+import h5py
+import numpy as np
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+
+class TestOutOfCore(unittest.TestCase):
+    """Tests the outofcore module"""
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.data = np.array([random.uniform(1, 100) for i in range(9 * 7 * 11)]).reshape((9, 7, 11))
+        self.src_fname = os.path.join(self.temp_path, "scan.hdf5")
+        self.dest_fname = os.path.join(self.temp_path, "scan_results.hdf5")
+        dataio.save_data(self.src_fname, self.data)
+        # Force several chunks from the small test array
+        self.max_chunk_bytes = self.data.nbytes / 4
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+    def in_memory_results(self, plugin_cls):
+        """Returns the results of running the plugin on the complete data set in memory"""
+        plugin = plugin_cls()
+        plugin.data = self.data.copy()
+        plugin.run()
+        return plugin.data
+
+    def test_is_chunk_safe(self):
+        """Verify only plugins that declare a tiling mode can be run on chunks"""
+        self.assertTrue(outofcore.is_chunk_safe(test_tiling.ScalePlugin))
+        self.assertTrue(outofcore.is_chunk_safe(test_tiling.MedianPlugin()))
+        self.assertFalse(outofcore.is_chunk_safe(test_tiling.UntiledPlugin()))
+
+    def test_is_chunk_safe_system_plugins(self):
+        """Verify the plugins that ship with the application can be checked by class"""
+        system_plugins_folder = os.path.join(pathfinder.app_path(), 'plugins')
+        system_plugins = dict(mainmodel.load_dynamic_modules(system_plugins_folder, abstractplugin.AbstractPlugin))
+        self.assertTrue(system_plugins)
+        for plugin_name, plugin_cls in system_plugins.items():
+            self.assertEqual(plugin_cls.tile_mode is not None, outofcore.is_chunk_safe(plugin_cls))
+        self.assertTrue(outofcore.is_chunk_safe(system_plugins['MedianFilterPlugin']))
+
+    def test_chunk_slices(self):
+        """Verify the data are split into chunks no larger than the maximum chunk size"""
+        chunks = outofcore.chunk_slices(self.data.shape, self.data.itemsize, 'elementwise',
+                                        max_chunk_bytes=self.max_chunk_bytes)
+        self.assertTrue(len(chunks) > 1)
+        for source, destination, crop in chunks:
+            self.assertTrue(self.data[destination].nbytes <= 2 * self.max_chunk_bytes)
+        self.assertEqual(1, len(outofcore.chunk_slices(self.data.shape, self.data.itemsize, 'elementwise')))
+
+    def test_chunk_slices_second_axis(self):
+        """Verify chunks are also split along a second axis if a single slice along the first is too large"""
+        data = np.arange(2 * 50 * 11, dtype=np.float64).reshape((2, 50, 11))
+        max_chunk_bytes = data[0].nbytes / 5
+        for tile_mode, halo in [('elementwise', 0), ('trace', 0), ('neighbourhood', 2)]:
+            coverage = np.zeros(data.shape)
+            chunks = outofcore.chunk_slices(data.shape, data.itemsize, tile_mode, tile_halo=halo,
+                                            max_chunk_bytes=max_chunk_bytes)
+            for source, destination, crop in chunks:
+                coverage[destination] += 1
+                self.assertTrue(data[destination].nbytes <= max_chunk_bytes)
+                self.assertTrue(np.array_equal(data[source][crop], data[destination]))
+                if tile_mode == 'trace':
+                    self.assertEqual(data.shape[-1], data[destination].shape[-1])
+            self.assertTrue(np.all(coverage == 1))
+
+    def test_run_out_of_core(self):
+        """Verify running plugins one chunk at a time returns the same results as running in memory"""
+        for plugin_cls in [test_tiling.ScalePlugin, test_tiling.TraceMaxPlugin, test_tiling.MedianPlugin,
+                           test_tiling.NormalizePlugin]:
+            progress = []
+            outofcore.run_out_of_core(plugin_cls, self.src_fname, self.dest_fname,
+                                      max_chunk_bytes=self.max_chunk_bytes, progress_fn=progress.append,
+                                      num_workers=2, use_threads=True)
+            self.assertTrue(len(progress) > 1)
+            self.assertAlmostEqual(1.0, progress[-1])
+            self.assertTrue(np.allclose(self.in_memory_results(plugin_cls), dataio.get_data(self.dest_fname)))
+            with h5py.File(self.dest_fname, 'r') as fidin:
+                self.assertIsNotNone(outofcore.find_dataset(fidin, self.dest_fname).chunks)
+
+    def test_run_out_of_core_normalize(self):
+        """Verify the Normalize plugin gives the same results one chunk at a time for integer and complex data"""
+        # Imported from the application's plugins rather than found on sys.path, which may find an older
+        # copy in the user's plugins folder
+        normalize_plugin = normalize_plugin_module.NormalizePlugin
+        for data in [np.random.randint(-30000, 30000, self.data.shape).astype(np.int16),
+                     self.data + 1j * self.data[::-1]]:
+            dataio.save_data(self.src_fname, data)
+            self.data = data
+            outofcore.run_out_of_core(normalize_plugin, self.src_fname, self.dest_fname,
+                                      max_chunk_bytes=data.nbytes / 4)
+            self.assertTrue(np.allclose(self.in_memory_results(normalize_plugin), dataio.get_data(self.dest_fname)))
+        # Multiple datasets are normalized against the maximum of each dataset
+        self.assertEqual({'maximum': {'a': 4, 'b': 3}},
+                         normalize_plugin().prepare([{'a': np.array([1, 4]), 'b': np.array([3, 0])},
+                                                     {'a': np.array([2, 1]), 'b': np.array([1, 2])}]))
+
+    def test_run_out_of_core_config(self):
+        """Verify the plugin configuration is used for every chunk"""
+        outofcore.run_out_of_core(test_tiling.ScalePlugin, self.src_fname, self.dest_fname, {'factor': '3'},
+                                  max_chunk_bytes=self.max_chunk_bytes)
+        self.assertTrue(np.allclose(self.data * 3, dataio.get_data(self.dest_fname)))
+
+    def test_run_out_of_core_errors(self):
+        """Verify plugins that can't be run on chunks of data are rejected"""
+        with self.assertRaises(ValueError):
+            outofcore.run_out_of_core(test_tiling.UntiledPlugin, self.src_fname, self.dest_fname)
+        with self.assertRaises(ValueError):
+            outofcore.run_out_of_core(test_tiling.ScalePlugin, self.src_fname, self.src_fname)
+        self.assertTrue(np.array_equal(self.data, dataio.get_data(self.src_fname)))
+
+if __name__ == "__main__":
+    random.seed()
+    unittest.main()
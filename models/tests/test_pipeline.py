@@ -0,0 +1,113 @@
+"""test_pipeline.py - tests the pipeline module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import abstractplugin
+from models import config
+from models import pipeline
+from controllers import pathfinder
+import numpy as np
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+
+class AddPlugin(abstractplugin.TRIPlugin):
+    """Adds a constant to the data"""
+
+    def __init__(self, **kwargs):
+        abstractplugin.TRIPlugin.__init__(self, **kwargs)
+        self.config = {'offset': '1'}
+
+    def run(self):
+        self._data = self._data + float(self.config['offset'])
+
+
+class MultiplyPlugin(abstractplugin.TRIPlugin):
+    """Multiplies the data by a constant"""
+
+    def __init__(self, **kwargs):
+        abstractplugin.TRIPlugin.__init__(self, **kwargs)
+        self.config = {'factor': '2'}
+
+    def run(self):
+        self._data = self._data * float(self.config['factor'])
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests the PluginPipeline class"""
+
+    def setUp(self):
+        self.data = np.array([random.uniform(-100, 100) for i in range(25)])
+        self.available_plugins = [('AddPlugin', AddPlugin), ('MultiplyPlugin', MultiplyPlugin)]
+        self.pipeline_file = tempfile.NamedTemporaryFile(suffix=pipeline.pipeline_ext, delete=False).name
+        # Keep saved pipelines out of the user's data folders
+        self.original_user_path = pathfinder.user_path()
+        self.temp_user_path = tempfile.mkdtemp()
+        config.Configure(pathfinder.config_path()).set_app_option({"User Path": self.temp_user_path})
+
+    def tearDown(self):
+        if os.path.exists(self.pipeline_file):
+            os.remove(self.pipeline_file)
+        config.Configure(pathfinder.config_path()).set_app_option({"User Path": self.original_user_path})
+        shutil.rmtree(self.temp_user_path, ignore_errors=True)
+
+    def test_is_pipeline(self):
+        """Verify distinguishing a pipeline from a single plugin"""
+        self.assertTrue(pipeline.is_pipeline("AddPlugin,MultiplyPlugin"))
+        self.assertTrue(pipeline.is_pipeline("filters.json"))
+        self.assertFalse(pipeline.is_pipeline("AddPlugin"))
+        self.assertFalse(pipeline.is_pipeline(None))
+
+    def test_run(self):
+        """Verify each step is run in order on the output of the previous step"""
+        plugin_pipeline = pipeline.PluginPipeline([(AddPlugin, None), (MultiplyPlugin, {'factor': '3'})])
+        plugin_pipeline.data = self.data
+        plugin_pipeline.run()
+        self.assertTrue(np.allclose((self.data + 1) * 3, plugin_pipeline.data))
+
+    def test_shared_config(self):
+        """Verify the shared config is passed to each step but doesn't override step config"""
+        plugin_pipeline = pipeline.PluginPipeline([(AddPlugin, {'offset': '5'}), (MultiplyPlugin, None)])
+        plugin_pipeline.config = {'offset': '2', 'factor': '4'}
+        plugin_pipeline.data = self.data
+        plugin_pipeline.run()
+        self.assertTrue(np.allclose((self.data + 5) * 4, plugin_pipeline.data))
+
+    def test_save(self):
+        """Verify saving and loading a pipeline"""
+        plugin_pipeline = pipeline.PluginPipeline([(AddPlugin, {'offset': '5'}), (MultiplyPlugin, None)])
+        plugin_pipeline.save(self.pipeline_file)
+        with open(self.pipeline_file, "r") as fidin:
+            self.assertEqual(plugin_pipeline.to_dict(), json.load(fidin))
+        loaded_pipeline = pipeline.PluginPipeline.from_toolkit(self.pipeline_file, self.available_plugins)
+        self.assertEqual([(AddPlugin, {'offset': '5'}), (MultiplyPlugin, None)], loaded_pipeline.steps)
+
+    def test_from_toolkit_pipelines_path(self):
+        """Verify saved pipelines are found in the user's pipelines folder and missing pipelines are reported"""
+        os.makedirs(pathfinder.pipelines_path())
+        plugin_pipeline = pipeline.PluginPipeline([(MultiplyPlugin, {'factor': '3'})])
+        plugin_pipeline.save(os.path.join(pathfinder.pipelines_path(), "triple.json"))
+        loaded_pipeline = pipeline.PluginPipeline.from_toolkit("triple.json", self.available_plugins)
+        self.assertEqual(plugin_pipeline.steps, loaded_pipeline.steps)
+        with self.assertRaises(IOError) as context:
+            pipeline.PluginPipeline.from_toolkit("missing.json", self.available_plugins)
+        self.assertTrue("missing.json" in str(context.exception))
+
+    def test_from_chain(self):
+        """Verify creating a pipeline from a chain of plugin names"""
+        plugin_pipeline = pipeline.PluginPipeline.from_chain("MultiplyPlugin, AddPlugin", self.available_plugins)
+        self.assertEqual([(MultiplyPlugin, None), (AddPlugin, None)], plugin_pipeline.steps)
+        self.assertEqual("MultiplyPlugin -> AddPlugin", plugin_pipeline.name)
+        self.assertRaises(ValueError, pipeline.PluginPipeline.from_chain, "AddPlugin,NoSuchPlugin",
+                          self.available_plugins)
+
+if __name__ == "__main__":
+    random.seed()
+    unittest.main()
@@ -0,0 +1,81 @@
+"""test_precision.py - tests the precision module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from controllers import pathfinder
+from models import config
+from models import precision
+import numpy as np
+import unittest
+
+
+class TestPrecision(unittest.TestCase):
+    """Tests the precision module"""
+
+    def setUp(self):
+        self.original_precision = config.Configure(pathfinder.config_path()).get_app_option("compute precision")
+
+    def tearDown(self):
+        precision.set_precision(self.original_precision or precision.default_precision)
+
+    def test_get_set_precision(self):
+        """Verify setting and returning the compute precision in config"""
+        for mode in precision.precision_modes:
+            precision.set_precision(mode)
+            self.assertEqual(mode, precision.get_precision())
+        with self.assertRaises(ValueError):
+            precision.set_precision('float16')
+        config.Configure(pathfinder.config_path()).set_app_option({'compute precision': 'abc'})
+        precision.precision_cache.clear()
+        self.assertEqual(precision.default_precision, precision.get_precision())
+
+    def test_precision_cache(self):
+        """Verify the compute precision is only read from config until it's set"""
+        precision.set_precision(precision.NATIVE)
+        config.Configure(pathfinder.config_path()).set_app_option({'compute precision': precision.FLOAT32})
+        self.assertEqual(precision.NATIVE, precision.get_precision())
+        precision.precision_cache.clear()
+        self.assertEqual(precision.FLOAT32, precision.get_precision())
+        precision.set_precision(precision.FLOAT64)
+        self.assertEqual(precision.FLOAT64, precision.get_precision())
+
+    def test_compute_dtype(self):
+        """Verify the dtype used for calculations under each compute precision"""
+        self.assertEqual(np.float64, precision.compute_dtype(np.int16, precision.FLOAT64))
+        self.assertEqual(np.float64, precision.compute_dtype(np.float32, precision.FLOAT64))
+        self.assertEqual(np.float32, precision.compute_dtype(np.float64, precision.FLOAT32))
+        self.assertEqual(np.complex64, precision.compute_dtype(np.complex64, precision.FLOAT32))
+        self.assertEqual(np.float32, precision.compute_dtype(np.int16, precision.NATIVE))
+        self.assertEqual(np.float32, precision.compute_dtype(np.uint8, precision.NATIVE))
+        self.assertEqual(np.float64, precision.compute_dtype(np.int32, precision.NATIVE))
+        self.assertEqual(np.float32, precision.compute_dtype(np.float32, precision.NATIVE))
+        self.assertEqual(np.int16, precision.compute_dtype(np.int16, precision.NATIVE, exact=True))
+        self.assertEqual(np.float32, precision.compute_dtype(np.int16, precision.FLOAT32, exact=True))
+
+    def test_as_compute(self):
+        """Verify converting data to the compute dtype only when required"""
+        data = np.arange(10, dtype=np.float32)
+        self.assertIs(data, precision.as_compute(data, precision.NATIVE))
+        self.assertEqual(np.float64, precision.as_compute(data, precision.FLOAT64).dtype)
+        self.assertIsNone(precision.as_compute(None))
+
+    def test_apply_scale(self):
+        """Verify scaling integer data without double precision intermediates"""
+        counts = np.arange(100, dtype=np.uint16)
+        for mode, expected_dtype in [(precision.NATIVE, np.float32), (precision.FLOAT32, np.float32),
+                                     (precision.FLOAT64, np.float64)]:
+            scaled_data = precision.apply_scale(counts, 0.01, 2.0, mode)
+            self.assertEqual(expected_dtype, scaled_data.dtype)
+            self.assertTrue(np.allclose(counts * 0.01 + 2.0, scaled_data))
+
+    def test_store_scaled(self):
+        """Verify integer data are only stored with a scale factor under native precision"""
+        self.assertTrue(precision.store_scaled(np.uint16, precision.NATIVE))
+        self.assertFalse(precision.store_scaled(np.float32, precision.NATIVE))
+        self.assertFalse(precision.store_scaled(np.uint16, precision.FLOAT64))
+
+if __name__ == "__main__":
+    unittest.main()
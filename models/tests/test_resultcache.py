@@ -0,0 +1,151 @@
+"""test_resultcache.py - tests the resultcache module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import abstractplugin
+from models import dataio
+from models import pipeline
+from models import precision
+from models import resultcache
+import numpy as np
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+
+class CachedPlugin(abstractplugin.TRIPlugin):
+    """Plugin whose results can be cached"""
+
+    version = "1.0"
+
+    def __init__(self, **kwargs):
+        abstractplugin.TRIPlugin.__init__(self, **kwargs)
+        self.config = {'factor': '2'}
+
+    def run(self):
+        self._data = self._data * float(self.config['factor'])
+
+
+class UncachedPlugin(abstractplugin.TRIPlugin):
+    """Plugin that has opted out of caching"""
+
+    cacheable = False
+
+
+class TestResultCache(unittest.TestCase):
+    """Tests the ResultCache class"""
+
+    def setUp(self):
+        self.cache_path = tempfile.mkdtemp()
+        self.cache = resultcache.ResultCache(self.cache_path)
+        self.data = np.array([random.uniform(-100, 100) for i in range(100)])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_path, ignore_errors=True)
+
+    def test_is_cacheable(self):
+        """Verify plugins can opt out of caching"""
+        self.assertTrue(resultcache.is_cacheable(CachedPlugin))
+        self.assertFalse(resultcache.is_cacheable(UncachedPlugin))
+        self.assertFalse(resultcache.is_cacheable(pipeline.PluginPipeline([(CachedPlugin, None),
+                                                                           (UncachedPlugin, None)])))
+
+    def test_normalized_config(self):
+        """Verify configurations are compared independent of order and type of values"""
+        self.assertEqual(resultcache.normalized_config({'a': 1, 'b': '2'}),
+                         resultcache.normalized_config({'b': 2, 'a': '1'}))
+        self.assertEqual('', resultcache.normalized_config(None))
+
+    def test_key(self):
+        """Verify cache keys depend on the plugin, its version, its configuration and the data"""
+        key = self.cache.key(CachedPlugin, {'factor': '2'}, self.data)
+        self.assertEqual(key, self.cache.key(CachedPlugin, {'factor': 2}, self.data.copy()))
+        self.assertNotEqual(key, self.cache.key(CachedPlugin, {'factor': '3'}, self.data))
+        self.assertNotEqual(key, self.cache.key(CachedPlugin, {'factor': '2'}, self.data + 1))
+        self.assertNotEqual(key, self.cache.key(CachedPlugin, {'factor': '2'}, self.data.astype(np.float32)))
+        self.assertNotEqual(key, self.cache.key(UncachedPlugin, {'factor': '2'}, self.data))
+        self.assertNotEqual(key, self.cache.key(CachedPlugin, {'factor': '2'}, self.data, start_pos=1))
+        CachedPlugin.version = "1.1"
+        try:
+            self.assertNotEqual(key, self.cache.key(CachedPlugin, {'factor': '2'}, self.data))
+        finally:
+            CachedPlugin.version = "1.0"
+
+    def test_key_precision(self):
+        """Verify results cached under one compute precision aren't returned under another"""
+        original_precision = precision.get_precision()
+        try:
+            precision.set_precision(precision.FLOAT64)
+            key = self.cache.key(CachedPlugin, None, self.data)
+            self.cache.put(key, self.data)
+            precision.set_precision(precision.FLOAT32)
+            float32_key = self.cache.key(CachedPlugin, None, self.data)
+            self.assertNotEqual(key, float32_key)
+            self.assertFalse(self.cache.contains(float32_key))
+            self.assertIsNone(self.cache.get(float32_key))
+        finally:
+            precision.set_precision(original_precision)
+
+    def test_put_get(self):
+        """Verify storing and retrieving results"""
+        key = self.cache.key(CachedPlugin, None, self.data)
+        self.assertIsNone(self.cache.get(key))
+        self.assertTrue(self.cache.put(key, self.data * 2))
+        self.assertTrue(self.cache.contains(key))
+        self.assertTrue(np.array_equal(self.data * 2, self.cache.get(key)))
+
+    def test_put_get_datasets(self):
+        """Verify storing and retrieving multiple datasets"""
+        datasets = {'amplitude0': self.data, 'waveform0': self.data.reshape(10, 10)}
+        key = self.cache.key(CachedPlugin, None, datasets)
+        self.assertTrue(self.cache.put(key, datasets))
+        cached_datasets = self.cache.get(key)
+        self.assertItemsEqual(datasets.keys(), cached_datasets.keys())
+        for dataset in datasets:
+            self.assertTrue(np.array_equal(datasets[dataset], cached_datasets[dataset]))
+
+    def test_put_get_lazy_datasets(self):
+        """Verify only the datasets read from a LazyDatasetMap are cached and unread datasets aren't read"""
+        lazy_map = dataio.LazyDatasetMap(__file__, {'amplitude0': (np.ones, (4,)), 'waveform0': (np.zeros, (8,))})
+        key = self.cache.key(CachedPlugin, None, lazy_map)
+        self.assertListEqual([], lazy_map.loaded_keys)
+        lazy_map['amplitude0'] = lazy_map['amplitude0'] * 2
+        self.assertTrue(self.cache.put(key, lazy_map))
+        self.assertListEqual(['amplitude0'], lazy_map.loaded_keys)
+        cached_datasets = self.cache.get(key)
+        self.assertTrue(isinstance(cached_datasets, resultcache.PartialResults))
+        self.assertListEqual(['amplitude0'], list(cached_datasets.keys()))
+        self.assertTrue(np.array_equal(np.ones(4) * 2, cached_datasets['amplitude0']))
+        self.assertFalse(isinstance(self.cache.get(self.cache.key(CachedPlugin, None, self.data)),
+                                    resultcache.PartialResults))
+
+    def test_evict(self):
+        """Verify the least recently used results are deleted when the cache is full"""
+        keys = [str(idx) for idx in range(3)]
+        for idx, key in enumerate(keys):
+            self.cache.put(key, self.data)
+            os.utime(self.cache.cache_file(key), (1000 + idx, 1000 + idx))
+        # Use the oldest entry so that the second oldest becomes least recently used
+        self.cache.get(keys[0])
+        self.cache.max_size = self.cache.size() - 1
+        self.cache.evict()
+        self.assertTrue(self.cache.contains(keys[0]))
+        self.assertFalse(self.cache.contains(keys[1]))
+        self.assertTrue(self.cache.contains(keys[2]))
+        self.assertTrue(self.cache.size() <= self.cache.max_size)
+
+    def test_clear(self):
+        """Verify deleting all cached results"""
+        self.cache.put('a', self.data)
+        self.cache.put('b', self.data)
+        self.cache.clear()
+        self.assertEqual(0, self.cache.size())
+
+if __name__ == "__main__":
+    random.seed()
+    unittest.main()
@@ -0,0 +1,96 @@
+"""test_runprofile.py - tests the runprofile module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import runprofile
+import numpy as np
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+
+def send_stages(profile_queue):
+    """Records a stage in a child process and sends it back through profile_queue"""
+    profile = runprofile.RunProfile('child', source='worker')
+    with profile.stage('child stage'):
+        np.ones(1000).sum()
+    profile.send(profile_queue)
+
+
+class TestRunProfile(unittest.TestCase):
+    """Tests the RunProfile class"""
+
+    def setUp(self):
+        self.profiles_file = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False).name
+
+    def tearDown(self):
+        if os.path.exists(self.profiles_file):
+            os.remove(self.profiles_file)
+
+    def test_stage(self):
+        """Verify recording wall time, CPU time and peak memory of a stage"""
+        profile = runprofile.RunProfile('test')
+        with profile.stage('compute'):
+            np.random.random(100000).sum()
+        self.assertEqual(1, len(profile.stages))
+        record = profile.stages[0]
+        self.assertEqual('compute', record['stage'])
+        self.assertEqual(os.getpid(), record['pid'])
+        self.assertTrue(record['wall_time'] >= 0)
+        self.assertTrue(record['cpu_time'] >= 0)
+        peak_rss = runprofile.peak_rss()
+        if peak_rss is not None:
+            self.assertTrue(record['peak_rss'] > 0)
+
+    def test_stage_exception(self):
+        """Verify a stage is recorded even if it raises an exception"""
+        profile = runprofile.RunProfile('test')
+        with self.assertRaises(ValueError):
+            with profile.stage('fails'):
+                raise ValueError()
+        self.assertEqual(['fails'], [record['stage'] for record in profile.stages])
+
+    def test_null_stage(self):
+        """Verify stages aren't recorded without a profile"""
+        with runprofile.stage(None, 'ignored'):
+            pass
+
+    def test_collect(self):
+        """Verify adding stages recorded in another process"""
+        profile = runprofile.RunProfile('test')
+        self.assertFalse(profile.collect(timeout=0))
+        child = multiprocessing.Process(target=send_stages, args=(profile.queue,))
+        child.start()
+        self.assertTrue(profile.collect(timeout=10))
+        child.join()
+        self.assertEqual('child stage', profile.stages[0]['stage'])
+        self.assertEqual(child.pid, profile.stages[0]['pid'])
+
+    def test_data_size(self):
+        """Verify returning the size of the data"""
+        data = np.zeros((10, 10))
+        self.assertEqual(data.nbytes, runprofile.data_size(data))
+        self.assertEqual(2 * data.nbytes, runprofile.data_size({'a': data, 'b': data}))
+        self.assertIsNone(runprofile.data_size(None))
+
+    def test_save(self):
+        """Verify saving and loading profiles as JSON lines"""
+        profile = runprofile.RunProfile('test', source='batch', input_file='scan.csc')
+        with profile.stage('read data'):
+            pass
+        profile.save(self.profiles_file)
+        profile.save(self.profiles_file)
+        profiles = runprofile.load_profiles(self.profiles_file)
+        self.assertEqual(2, len(profiles))
+        self.assertEqual('test', profiles[0]['name'])
+        self.assertEqual('batch', profiles[0]['source'])
+        self.assertEqual('scan.csc', profiles[0]['input_file'])
+        self.assertEqual('read data', profiles[0]['stages'][0]['stage'])
+        self.assertTrue('read data' in runprofile.summarize(profiles[0]))
+
+if __name__ == "__main__":
+    unittest.main()
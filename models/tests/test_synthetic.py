@@ -0,0 +1,100 @@
+"""test_synthetic.py - tests the synthetic module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import dataio
+from models import synthetic
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestSynthetic(unittest.TestCase):
+    """Tests the synthetic module"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.nbytes = 64 * 1024
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def temp_file(self, fname):
+        """Returns the full path to fname in the test's temporary folder"""
+        return os.path.join(self.temp_folder, fname)
+
+    def test_waveform_shape(self):
+        """Verify waveform_shape returns a roughly square C-scan of the requested size"""
+        height, width, rf_length = synthetic.waveform_shape(2 ** 20, itemsize=2, rf_length=128)
+        self.assertEqual(128, rf_length)
+        self.assertTrue(abs(height - width) <= 1)
+        self.assertAlmostEqual(2 ** 20, height * width * rf_length * 2, delta=0.05 * 2 ** 20)
+        self.assertEqual((1, 1, 256), synthetic.waveform_shape(0))
+
+    def test_waveforms(self):
+        """Verify waveforms returns reproducible A-scans scaled to the peak amplitude"""
+        shape = (6, 5, 64)
+        data = synthetic.waveforms(shape, peak=100, seed=3)
+        self.assertEqual(shape, data.shape)
+        self.assertEqual(np.float32, data.dtype)
+        self.assertAlmostEqual(100, np.abs(data).max(), places=3)
+        self.assertTrue(np.array_equal(data, synthetic.waveforms(shape, peak=100, seed=3)))
+        self.assertFalse(np.array_equal(data, synthetic.waveforms(shape, peak=100, seed=4)))
+
+    def test_write_hdf5(self):
+        """Verify write_hdf5 saves 16-bit waveforms to an NDIToolbox data file"""
+        data_fname = self.temp_file("synthetic.hdf5")
+        synthetic.write_hdf5(data_fname, self.nbytes, rf_length=64)
+        data = dataio.get_data(data_fname)
+        self.assertEqual(3, data.ndim)
+        self.assertEqual(64, data.shape[2])
+        self.assertEqual(np.int16, data.dtype)
+        self.assertAlmostEqual(self.nbytes, data.nbytes, delta=0.1 * self.nbytes)
+
+    def test_write_csv(self):
+        """Verify write_csv saves a 2D array to a comma-delimited text file"""
+        data_fname = self.temp_file("synthetic.csv")
+        synthetic.write_csv(data_fname, self.nbytes)
+        data = dataio.get_txt_data(data_fname, delimiter=',')
+        self.assertEqual(2, data.ndim)
+        self.assertAlmostEqual(self.nbytes, os.path.getsize(data_fname), delta=0.2 * self.nbytes)
+
+    def test_write_utwin(self):
+        """Verify write_utwin saves waveforms, time of flight and amplitude data readable as a UTWin file"""
+        data_fname = self.temp_file("synthetic.csc")
+        synthetic.write_utwin(data_fname, self.nbytes, rf_length=64, seed=1)
+        data = dataio.get_utwin_data(data_fname)
+        height, width, rf_length = synthetic.waveform_shape(self.nbytes, 2, 64)
+        expected_waveforms = synthetic.waveforms((height, width, rf_length), 32000, 1).astype(np.int16)
+        waveform_data = data['waveform'][0]
+        self.assertEqual(expected_waveforms.size, waveform_data.size)
+        self.assertTrue(np.array_equal(np.sort(expected_waveforms.ravel()), np.sort(waveform_data.ravel())))
+        self.assertEqual((height, width), data['amplitude'][0].shape)
+        self.assertEqual((height, width), data['tof'][0].shape)
+
+    def test_write_utwin_compressed(self):
+        """Verify write_utwin saves compressed waveforms readable as a UTWin file"""
+        data_fname = self.temp_file("synthetic_compressed.csc")
+        synthetic.write_utwin(data_fname, self.nbytes, compression_ratio=2, rf_length=64)
+        data = dataio.get_utwin_data(data_fname)
+        height, width, rf_length = synthetic.waveform_shape(self.nbytes, 2, 64)
+        self.assertEqual(height * width * rf_length, data['waveform'][0].size)
+
+    def test_write_winspect(self):
+        """Verify write_winspect saves waveform and amplitude data readable as a Winspect file"""
+        data_fname = self.temp_file("synthetic.sdt")
+        synthetic.write_winspect(data_fname, self.nbytes, rf_length=64)
+        datasets = dict((dataset.data_type, dataset.data) for dataset in dataio.get_winspect_data(data_fname))
+        height, width, rf_length = synthetic.waveform_shape(self.nbytes, 1, 64)
+        self.assertListEqual(['amplitude', 'waveform'], sorted(datasets))
+        self.assertEqual(height * width, datasets['amplitude'].size)
+        self.assertEqual(height * width * rf_length, datasets['waveform'].size)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+"""test_tiling.py - tests the tiling module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import abstractplugin
+from models import dataio
+from models import tiling
+import numpy as np
+import scipy.signal
+import random
+import unittest
+
+
+class ScalePlugin(abstractplugin.TRIPlugin):
+    """Elementwise plugin used to test tiled execution"""
+
+    tile_mode = tiling.ELEMENTWISE
+    tile_datasets = True
+
+    def __init__(self, **kwargs):
+        abstractplugin.TRIPlugin.__init__(self, **kwargs)
+        self.config = {'factor': '2'}
+
+    def run(self):
+        if hasattr(self._data, "keys"):
+            for dataset in self._data:
+                self._data[dataset] = self._data[dataset] * float(self.config['factor'])
+        else:
+            self._data = self._data * float(self.config['factor'])
+
+
+class TraceMaxPlugin(abstractplugin.TRIPlugin):
+    """Per-trace plugin used to test tiled execution"""
+
+    tile_mode = tiling.TRACE
+    tile_axis = -1
+
+    def run(self):
+        self._data = self._data / np.amax(np.abs(self._data), axis=-1)[..., np.newaxis]
+
+
+class MedianPlugin(abstractplugin.TRIPlugin):
+    """Neighbourhood plugin used to test tiled execution"""
+
+    tile_mode = tiling.NEIGHBOURHOOD
+    tile_halo = 1
+
+    def run(self):
+        self._data = scipy.signal.medfilt(self._data, 3)
+
+
+class NormalizePlugin(abstractplugin.TRIPlugin):
+    """Elementwise plugin that needs the maximum of the complete data set"""
+
+    tile_mode = tiling.ELEMENTWISE
+
+    def __init__(self, **kwargs):
+        abstractplugin.TRIPlugin.__init__(self, **kwargs)
+        self.config = {}
+
+    def prepare(self, chunks):
+        return {'maximum': max(np.max(chunk) for chunk in chunks)}
+
+    def run(self):
+        self._data = self._data / self.config.get('maximum', np.max(self._data))
+
+
+class DifferencePlugin(abstractplugin.TRIPlugin):
+    """Elementwise plugin that combines datasets, so can't tile each dataset separately"""
+
+    tile_mode = tiling.ELEMENTWISE
+
+    def run(self):
+        self._data['difference'] = self._data['waveform1'] - self._data['waveform0']
+
+
+def read_dataset(reads, data):
+    """Loader for a dataio.LazyDatasetMap that records each read"""
+    reads.append(data.shape)
+    return data.copy()
+
+
+class UntiledPlugin(abstractplugin.TRIPlugin):
+    """Plugin that doesn't declare a tiling mode"""
+
+    def run(self):
+        self._data = self._data / np.max(self._data)
+
+
+class TestTiling(unittest.TestCase):
+    """Tests the tiling module"""
+
+    def setUp(self):
+        self.original_min_tile_size = tiling.min_tile_size
+        # Force tiling of small test arrays
+        tiling.min_tile_size = 8
+        self.data = np.array([random.uniform(1, 100) for i in range(5 * 7 * 11)]).reshape((5, 7, 11))
+
+    def tearDown(self):
+        tiling.min_tile_size = self.original_min_tile_size
+
+    def test_get_tiling(self):
+        """Verify returning a plugin's tiling declaration"""
+        self.assertEqual((tiling.ELEMENTWISE, -1, 0), tiling.get_tiling(ScalePlugin()))
+        self.assertEqual((tiling.NEIGHBOURHOOD, -1, 1), tiling.get_tiling(MedianPlugin()))
+        self.assertIsNone(tiling.get_tiling(UntiledPlugin()))
+
+    def test_is_tileable(self):
+        """Verify only plugins that declare a tiling mode are tileable"""
+        self.assertTrue(tiling.is_tileable(ScalePlugin(), self.data))
+        self.assertTrue(tiling.is_tileable(ScalePlugin(), {'a': self.data}))
+        self.assertFalse(tiling.is_tileable(ScalePlugin(), None))
+        self.assertFalse(tiling.is_tileable(UntiledPlugin(), self.data))
+        # Multiple datasets are only tiled separately if the plugin has declared it
+        self.assertFalse(tiling.is_tileable(DifferencePlugin(), {'a': self.data}))
+
+    def test_is_tileable_unread(self):
+        """Verify checking whether multiple datasets are tileable doesn't read them"""
+        reads = []
+        datasets = dataio.LazyDatasetMap('scan.csc', {'waveform0': (read_dataset, (reads, self.data))})
+        self.assertTrue(tiling.is_tileable(ScalePlugin(), datasets))
+        self.assertFalse(tiling.is_tileable(DifferencePlugin(), datasets))
+        self.assertEqual([], reads)
+        self.assertFalse(datasets.is_loaded('waveform0'))
+
+    def test_split_axis(self):
+        """Verify choosing the axis to split the data along"""
+        self.assertEqual(0, tiling.split_axis((5, 7, 11), tiling.ELEMENTWISE))
+        self.assertEqual(0, tiling.split_axis((5, 7, 11), tiling.TRACE, -1))
+        self.assertEqual(1, tiling.split_axis((5, 7, 11), tiling.TRACE, 0))
+        self.assertIsNone(tiling.split_axis((11,), tiling.TRACE, -1))
+
+    def test_tile_slices(self):
+        """Verify tiles cover the entire array exactly once"""
+        for halo in range(3):
+            coverage = np.zeros(self.data.shape)
+            tiles = tiling.tile_slices(self.data.shape, tiling.NEIGHBOURHOOD, tile_halo=halo, num_tiles=3)
+            self.assertEqual(3, len(tiles))
+            for source, destination, crop in tiles:
+                coverage[destination] += 1
+                self.assertTrue(np.array_equal(self.data[source][crop], self.data[destination]))
+            self.assertTrue(np.all(coverage == 1))
+
+    def test_run_tiled(self):
+        """Verify tiled execution returns the same results as running on the entire array"""
+        for plugin_cls in [ScalePlugin, TraceMaxPlugin, MedianPlugin, UntiledPlugin]:
+            plugin = plugin_cls()
+            plugin.data = self.data.copy()
+            plugin.run()
+            tiled_data = tiling.run_tiled(plugin_cls, self.data.copy(), num_workers=3, use_threads=True)
+            self.assertTrue(np.allclose(plugin.data, tiled_data))
+
+    def test_run_tiled_config(self):
+        """Verify tiled execution passes the plugin configuration to each tile"""
+        tiled_data = tiling.run_tiled(ScalePlugin, self.data.copy(), {'factor': '3'}, num_workers=2,
+                                      use_threads=True)
+        self.assertTrue(np.allclose(self.data * 3, tiled_data))
+
+    def test_run_tiled_prepare(self):
+        """Verify the plugin's prepare() method sees the complete data set before it is split"""
+        tiled_data = tiling.run_tiled(NormalizePlugin, self.data.copy(), num_workers=3, use_threads=True)
+        self.assertTrue(np.allclose(self.data / np.max(self.data), tiled_data))
+        self.assertEqual({'maximum': 2}, tiling.prepare_config(NormalizePlugin(), None, [np.array([1, 2])]))
+        self.assertEqual({'factor': '2'}, tiling.prepare_config(ScalePlugin(), {'factor': '2'}, [self.data]))
+
+    def test_run_tiled_processes(self):
+        """Verify tiled execution in a pool of processes"""
+        plugin = MedianPlugin()
+        plugin.data = self.data.copy()
+        plugin.run()
+        tiled_data = tiling.run_tiled(MedianPlugin, self.data.copy(), num_workers=2, use_threads=False)
+        self.assertTrue(np.allclose(plugin.data, tiled_data))
+
+    def test_run_tiled_datasets(self):
+        """Verify tiled execution of multiple datasets"""
+        datasets = {'amplitude0': self.data[:, :, 0].copy(), 'waveform0': self.data.copy()}
+        tiled_datasets = tiling.run_tiled(ScalePlugin, datasets, num_workers=2, use_threads=True)
+        self.assertTrue(np.allclose(self.data[:, :, 0] * 2, tiled_datasets['amplitude0']))
+        self.assertTrue(np.allclose(self.data * 2, tiled_datasets['waveform0']))
+
+    def test_run_tiled_datasets_together(self):
+        """Verify multiple datasets are run together if the plugin hasn't declared they can be tiled separately"""
+        datasets = {'waveform0': self.data.copy(), 'waveform1': 3 * self.data}
+        tiled_datasets = tiling.run_tiled(DifferencePlugin, datasets, num_workers=2, use_threads=True)
+        self.assertTrue(np.allclose(2 * self.data, tiled_datasets['difference']))
+
+if __name__ == "__main__":
+    random.seed()
+    unittest.main()
@@ -6,6 +6,7 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'Chris R. Coughlin'
 
 import unittest
+from models import precision
 from models import ultrasonicgate
 import numpy as np
 import random
@@ -63,6 +64,21 @@ class TestUltrasonicGate(unittest.TestCase):
         sample_gate.apply_gate()
         self.assertTrue(np.array_equal(expected_data, sample_gate.data))
 
+    def test_apply_gate_precision(self):
+        """Verify gating integer data honours the compute precision"""
+        sample_data = np.arange(30, dtype=np.int16).reshape([2, 5, -1])
+        sample_gate = ultrasonicgate.UltrasonicGate(start_pos=1, end_pos=3)
+        original_precision = precision.get_precision()
+        try:
+            precision.set_precision(precision.NATIVE)
+            sample_gate.data = sample_data
+            sample_gate.apply_gate()
+            self.assertEqual(np.float32, sample_gate.data.dtype)
+            self.assertTrue(np.array_equal(sample_data[:, :, 1:3], sample_gate.data[:, :, 1:3]))
+            self.assertFalse(np.any(sample_gate.data[:, :, 3:]))
+        finally:
+            precision.set_precision(original_precision)
+
     def test_get_window(self):
         """Verify the base UltrasonicGate class returns a no-op window"""
         expected_gate = np.ones(self.stop_pos - self.start_pos)
@@ -0,0 +1,83 @@
+"""test_watchfolder.py - tests the watchfolder module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models import watchfolder
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestFolderWatcher(unittest.TestCase):
+    """Tests the FolderWatcher class"""
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        self.watcher = watchfolder.FolderWatcher(self.temp_folder, patterns=["*.csc"], settle_time=10)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def write_file(self, basename, contents="0" * 16):
+        """Appends contents to the file basename in the watched folder and returns its full path"""
+        fname = os.path.join(self.temp_folder, basename)
+        with open(fname, "a") as fidout:
+            fidout.write(contents)
+        return fname
+
+    def test_matches(self):
+        """Verify only files matching the watcher's patterns are returned"""
+        self.assertTrue(self.watcher.matches("scan1.csc"))
+        self.assertTrue(self.watcher.matches("SCAN1.CSC"))
+        self.assertFalse(self.watcher.matches("scan1.sdt"))
+        self.write_file("scan1.csc")
+        self.write_file("scan1.sdt")
+        self.assertListEqual([os.path.join(self.temp_folder, "scan1.csc")], self.watcher.list_files())
+
+    def test_poll(self):
+        """Verify files are only returned once they've stopped changing"""
+        fname = self.write_file("scan1.csc")
+        now = time.time()
+        self.assertListEqual([], self.watcher.poll(now))
+        self.write_file("scan1.csc")
+        self.assertListEqual([], self.watcher.poll(now + 5))
+        self.assertListEqual([], self.watcher.poll(now + 10))
+        self.assertListEqual([fname], self.watcher.poll(now + 15))
+        # Dispatched files aren't returned again unless they change
+        self.assertListEqual([], self.watcher.poll(now + 30))
+        os.utime(fname, (now + 40, now + 40))
+        self.assertListEqual([], self.watcher.poll(now + 40))
+        self.assertListEqual([fname], self.watcher.poll(now + 50))
+
+    def test_poll_existing(self):
+        """Verify files that haven't been modified recently are returned immediately unless processed"""
+        processed_fname = self.write_file("scan1.csc")
+        fname = self.write_file("scan2.csc")
+        now = time.time()
+        for existing_fname in [processed_fname, fname]:
+            os.utime(existing_fname, (now - 60, now - 60))
+        self.watcher.is_processed = lambda filename: filename == processed_fname
+        self.assertListEqual([fname], self.watcher.poll(now))
+        self.assertListEqual([], self.watcher.poll(now + 30))
+
+    def test_poll_copied(self):
+        """Verify files that appear after the first poll have to settle even if they weren't modified recently"""
+        now = time.time()
+        self.assertListEqual([], self.watcher.poll(now))
+        fname = self.write_file("scan1.csc")
+        os.utime(fname, (now - 60, now - 60))
+        self.assertListEqual([], self.watcher.poll(now + 5))
+        self.write_file("scan1.csc")
+        os.utime(fname, (now - 60, now - 60))
+        self.assertListEqual([], self.watcher.poll(now + 10))
+        self.assertListEqual([], self.watcher.poll(now + 15))
+        self.assertListEqual([fname], self.watcher.poll(now + 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
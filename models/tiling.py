@@ -0,0 +1,234 @@
+"""tiling.py - splits data into tiles and runs NDIToolbox plugins over the tiles in parallel
+
+Plugins opt in to tiled execution by declaring how their run() method touches the data:
+
+    tile_mode = 'elementwise'       each output point depends only on the same input point
+                                    (e.g. a change of scale)
+    tile_mode = 'trace'             each trace (1D line along tile_axis, e.g. an A-scan) is
+                                    processed independently of its neighbours (e.g. a gate)
+    tile_mode = 'neighbourhood'     each output point depends on the input points no further
+                                    than tile_halo points away (e.g. a median filter)
+
+Plugins that don't declare a tile_mode (the default) are always run on the complete data set.
+
+Multiple datasets (dicts, e.g. the contents of a UTWin file) are passed to the plugin's run() as they are
+unless the plugin also declares tile_datasets = True, i.e. that run() processes each dataset the same way
+and independently of the others.  Each dataset is then tiled separately.
+
+Plugins that need a statistic of the complete data set before they can process part of it (e.g.
+normalization needs the maximum of the data) can also define prepare(chunks), which is called with
+an iterable of the data (in one or more chunks) before the data are split and returns a dict of
+configuration updates that is passed to every tile.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+import numpy as np
+import multiprocessing
+import multiprocessing.pool
+import math
+
+# Supported plugin tiling modes
+ELEMENTWISE = 'elementwise'
+TRACE = 'trace'
+NEIGHBOURHOOD = 'neighbourhood'
+tile_modes = [ELEMENTWISE, TRACE, NEIGHBOURHOOD]
+
+# Data sets with fewer points than this are run as a single tile - the overhead of
+# splitting and reassembling small arrays outweighs any gains from parallel execution
+min_tile_size = 2 ** 20
+
+
+def get_tiling(plugin_instance):
+    """Returns the tiling declaration of the plugin instance as a tuple (tile_mode, tile_axis, tile_halo),
+    or None if the plugin has not declared a supported tile_mode."""
+    tile_mode = getattr(plugin_instance, 'tile_mode', None)
+    if tile_mode not in tile_modes:
+        return None
+    tile_axis = getattr(plugin_instance, 'tile_axis', -1)
+    tile_halo = 0
+    if tile_mode == NEIGHBOURHOOD:
+        tile_halo = int(getattr(plugin_instance, 'tile_halo', 0))
+    return tile_mode, tile_axis, tile_halo
+
+
+def tiles_datasets(plugin_instance):
+    """Returns True if the plugin instance has declared that multiple datasets can be tiled separately"""
+    return get_tiling(plugin_instance) is not None and bool(getattr(plugin_instance, 'tile_datasets', False))
+
+
+def is_tileable(plugin_instance, data):
+    """Returns True if the plugin instance has declared a tiling mode and the data are large enough
+    to benefit from tiled execution.  Multiple datasets (dicts) are tileable if the plugin has declared
+    tile_datasets; each dataset's size is checked as it's run so that unread datasets (e.g. of a
+    dataio.LazyDatasetMap) aren't read here."""
+    if get_tiling(plugin_instance) is None or data is None:
+        return False
+    if hasattr(data, "keys"):
+        return tiles_datasets(plugin_instance)
+    return isinstance(data, np.ndarray) and data.size >= 2 * min_tile_size
+
+
+def split_axes(shape, tile_mode, tile_axis=-1):
+    """Returns the list of axes along which an array of the specified shape can be split into tiles under
+    the specified tiling mode, in the order they should be split."""
+    ndim = len(shape)
+    if tile_mode == TRACE and ndim > 0:
+        trace_axis = tile_axis % ndim
+        return [axis for axis in range(ndim) if axis != trace_axis]
+    return range(ndim)
+
+
+def split_axis(shape, tile_mode, tile_axis=-1):
+    """Returns the axis along which an array of the specified shape should be split into tiles,
+    or None if the array can't be split under the specified tiling mode."""
+    axes = split_axes(shape, tile_mode, tile_axis)
+    if not axes:
+        return None
+    return axes[0]
+
+
+def tile_slices(shape, tile_mode, tile_axis=-1, tile_halo=0, num_tiles=None):
+    """Returns a list of tiles for an array of the specified shape.  Each tile is a tuple
+    (source, destination, crop) of slice tuples:
+
+    source -        region of the original array to pass to the plugin (includes the halo)
+    destination -   region of the output array the tile's results are written to
+    crop -          region of the plugin's output for the tile that is written to the destination
+                    (i.e. the plugin output with the halo removed)
+
+    If num_tiles is not specified, the array is split into one tile per CPU.
+    """
+    if num_tiles is None:
+        num_tiles = multiprocessing.cpu_count()
+    return axis_slices(shape, split_axis(shape, tile_mode, tile_axis), tile_halo, num_tiles)
+
+
+def axis_slices(shape, axis, tile_halo=0, num_tiles=1):
+    """Returns a list of up to num_tiles tiles (see tile_slices) splitting an array of the specified
+    shape along axis.  Returns a single tile of the whole array if axis is None."""
+    whole_array = tuple(slice(None) for dim in shape)
+    if axis is None or shape[axis] < 2 or num_tiles < 2:
+        return [(whole_array, whole_array, whole_array)]
+    axis_len = shape[axis]
+    step = int(math.ceil(float(axis_len) / min(num_tiles, axis_len)))
+    tiles = []
+    for start in range(0, axis_len, step):
+        stop = min(start + step, axis_len)
+        src_start = max(0, start - tile_halo)
+        src_stop = min(axis_len, stop + tile_halo)
+        source = list(whole_array)
+        source[axis] = slice(src_start, src_stop)
+        destination = list(whole_array)
+        destination[axis] = slice(start, stop)
+        crop = list(whole_array)
+        crop[axis] = slice(start - src_start, stop - src_start)
+        tiles.append((tuple(source), tuple(destination), tuple(crop)))
+    return tiles
+
+
+def prepare_config(plugin_instance, plugin_cfg, chunks):
+    """Returns the configuration to run each tile with:  plugin_cfg updated with the results of the plugin's
+    prepare(chunks) method if it has one, or plugin_cfg if not."""
+    if not hasattr(plugin_instance, 'prepare'):
+        return plugin_cfg
+    updates = plugin_instance.prepare(chunks)
+    if not updates:
+        return plugin_cfg
+    cfg = dict(plugin_cfg or {})
+    cfg.update(updates)
+    return cfg
+
+
+def run_tile(tile_args):
+    """Runs a plugin on a single tile of data and returns the results.  tile_args is a tuple
+    (plugin_cls, tile_data, plugin_cfg, np_err, kwargs); np_err is the NumPy floating point error
+    handling in effect in the caller, which is thread-specific and not inherited by worker processes."""
+    plugin_cls, tile_data, plugin_cfg, np_err, kwargs = tile_args
+    np.seterr(**np_err)
+    plugin_instance = plugin_cls(**kwargs)
+    if plugin_cfg is not None:
+        plugin_instance.config = plugin_cfg
+    plugin_instance.data = tile_data
+    plugin_instance.run()
+    return plugin_instance.data
+
+
+def get_pool(num_workers=None, use_threads=None):
+    """Returns a worker pool for running tiles.  NumPy releases the GIL for most array operations so
+    a pool of threads is often just as effective as a pool of processes and avoids copying tiles between
+    processes.  If use_threads is None (default), threads are used if the current process is a daemon
+    (e.g. a batch mode worker), which is not permitted to start child processes."""
+    if use_threads is None:
+        use_threads = multiprocessing.current_process().daemon
+    if use_threads:
+        return multiprocessing.pool.ThreadPool(num_workers)
+    return multiprocessing.Pool(num_workers)
+
+
+def run_tiled_array(plugin_cls, data, plugin_cfg=None, num_workers=None, use_threads=None, prepared=False,
+                    **kwargs):
+    """Splits the NumPy array data into tiles according to the plugin's tiling declaration, runs the
+    plugin on each tile in parallel and returns the reassembled results.  Data that are too small
+    or can't be split are run as a single tile in the current process.  Set prepared to True if
+    plugin_cfg already includes the results of the plugin's prepare() method for the complete data set,
+    e.g. when data is one chunk of a larger data set.  Raises ValueError if the plugin changes the
+    shape of a tile."""
+    plugin_instance = plugin_cls(**kwargs)
+    if plugin_cfg is not None:
+        plugin_instance.config = plugin_cfg
+    tiling = get_tiling(plugin_instance)
+    np_err = np.geterr()
+    if tiling is None or not isinstance(data, np.ndarray) or data.size < 2 * min_tile_size:
+        return run_tile((plugin_cls, data, plugin_cfg, np_err, kwargs))
+    tile_mode, tile_axis, tile_halo = tiling
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_tiles = min(num_workers, max(1, data.size // min_tile_size))
+    tiles = tile_slices(data.shape, tile_mode, tile_axis, tile_halo, num_tiles)
+    if len(tiles) == 1:
+        return run_tile((plugin_cls, data, plugin_cfg, np_err, kwargs))
+    if not prepared:
+        plugin_cfg = prepare_config(plugin_instance, plugin_cfg, [data])
+    tile_args = []
+    for source, destination, crop in tiles:
+        tile_data = data[source]
+        if tile_halo > 0:
+            # Overlapping tiles - don't let a plugin that works in place modify its neighbours' halos
+            tile_data = tile_data.copy()
+        tile_args.append((plugin_cls, tile_data, plugin_cfg, np_err, kwargs))
+    pool = get_pool(num_workers, use_threads)
+    try:
+        tile_results = pool.map(run_tile, tile_args)
+    finally:
+        pool.close()
+        pool.join()
+    tiled_data = None
+    for (source, destination, crop), tile_arg, tile_result in zip(tiles, tile_args, tile_results):
+        tile_result = np.asarray(tile_result)
+        if tile_result.shape != tile_arg[1].shape:
+            raise ValueError("Plugin changed the shape of the data, unable to run as tiles.")
+        if tiled_data is None:
+            tiled_data = np.empty(data.shape, dtype=tile_result.dtype)
+        tiled_data[destination] = tile_result[crop]
+    return tiled_data
+
+
+def run_tiled(plugin_cls, data, plugin_cfg=None, num_workers=None, use_threads=None, **kwargs):
+    """Runs the plugin class plugin_cls on the data using tiled execution.  If data contains multiple
+    datasets (i.e. has keys) and the plugin has declared tile_datasets, each dataset is tiled separately
+    and the datasets are replaced with the results; otherwise the plugin is run once on all the datasets.
+    Returns the results."""
+    if hasattr(data, "keys"):
+        plugin_instance = plugin_cls(**kwargs)
+        if plugin_cfg is not None:
+            plugin_instance.config = plugin_cfg
+        if not tiles_datasets(plugin_instance):
+            return run_tile((plugin_cls, data, plugin_cfg, np.geterr(), kwargs))
+        for dataset in data.keys():
+            data[dataset] = run_tiled_array(plugin_cls, data[dataset], plugin_cfg, num_workers, use_threads,
+                                            **kwargs)
+        return data
+    return run_tiled_array(plugin_cls, data, plugin_cfg, num_workers, use_threads, **kwargs)
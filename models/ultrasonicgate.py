@@ -6,6 +6,7 @@
 __author__ = 'Chris R. Coughlin'
 
 from models import abstractplugin
+from models import precision
 import numpy as np
 
 class UltrasonicGate(abstractplugin.AbstractPlugin):
@@ -17,6 +18,9 @@ class UltrasonicGate(abstractplugin.AbstractPlugin):
     url = "http://www.nditoolbox.com"
     copyright = ""
     version = "1.0"
+    # Gates are applied to each A-scan independently
+    tile_mode = 'trace'
+    tile_axis = -1
 
     def __init__(self, **kwargs):
         self.name = kwargs.get('name', self.name)
@@ -47,7 +51,7 @@ class UltrasonicGate(abstractplugin.AbstractPlugin):
     def apply_gate(self):
         """Builds and then executes an ultrasonic gate:  multiplies
         the data by the window function in the range data[self.start_idx:self.stop_idx],
-        by zero elsewhere."""
+        by zero elsewhere.  The gated data are returned in the application's compute precision."""
         if self._data is not None:
             if self._data.ndim == 1:
                 # Build the gate function - a standard window function offset from origin.
@@ -58,17 +62,16 @@ class UltrasonicGate(abstractplugin.AbstractPlugin):
                 # Right of gate - multiply by zero
                 right_of_gate = np.zeros(self._data.shape[0] - self.stop_idx)
                 completed_gate = np.concatenate((left_of_gate, middle_of_gate, right_of_gate))
-                self._data = np.multiply(self._data, completed_gate)
+                self._data = precision.as_compute(self._data)
+                self._data = np.multiply(self._data, completed_gate.astype(self._data.dtype))
             elif self._data.ndim == 3:
                 left_of_gate = np.zeros(self.start_idx)
                 middle_of_gate = self.get_window()
                 right_of_gate = np.zeros(self._data.shape[2] - self.stop_idx)
                 completed_gate = np.concatenate((left_of_gate, middle_of_gate, right_of_gate))
-                for xidx in range(self._data.shape[1]):
-                    for yidx in range(self._data.shape[0]):
-                        ascan = self._data[yidx, xidx, :]
-                        new_ascan = np.multiply(ascan, completed_gate)
-                        self._data[yidx, xidx, :] = new_ascan
+                self._data = precision.as_compute(self._data)
+                # Gate every A-scan in place
+                self._data *= completed_gate.astype(self._data.dtype)
 
     def run(self):
         """Runs the gate on the data"""
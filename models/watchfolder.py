@@ -0,0 +1,96 @@
+"""watchfolder.py - watches a folder for new data files, e.g. a share that scanners save to during a shift
+
+The folder is polled rather than relying on platform-specific file system notifications (which are
+unreliable on network shares).  A file is considered complete once its size and modification time
+haven't changed for settle_time seconds, so files that are still being written by the acquisition software
+aren't read.  Files already in the folder when it's first polled that were last modified more than settle_time
+seconds ago are considered complete immediately; files that appear later always have to settle, as copying a
+file can preserve its original modification time.  Files that have already
+been processed (e.g. those recorded in a batch manifest) are skipped, and a file that changes after it
+has been dispatched is dispatched again.
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+import fnmatch
+import os
+import time
+
+# Default time in seconds a file's size must be unchanged before it's considered complete
+default_settle_time = 5.0
+
+# Default time in seconds between polls of the folder
+default_poll_interval = 2.0
+
+
+class FolderWatcher(object):
+    """Polls folder for files matching any of the wildcard patterns (defaults to all files).  If specified,
+    is_processed(filename) is called once for each complete file found and should return True if the file
+    has already been processed and can be skipped."""
+
+    def __init__(self, folder, patterns=None, settle_time=None, is_processed=None):
+        if settle_time is None:
+            settle_time = default_settle_time
+        self.folder = folder
+        self.patterns = patterns or ["*"]
+        self.settle_time = settle_time
+        self.is_processed = is_processed
+        # Files still being written - filename: (size, mtime, time of last change)
+        self.pending = {}
+        # Files dispatched or skipped - filename: (size, mtime)
+        self.dispatched = {}
+        self.polled = False
+
+    def matches(self, filename):
+        """Returns True if filename matches any of the watcher's patterns (case-insensitive)"""
+        basename = os.path.basename(filename).lower()
+        return any(fnmatch.fnmatch(basename, pattern.lower()) for pattern in self.patterns)
+
+    def list_files(self):
+        """Returns the list of files in the folder that match the watcher's patterns"""
+        try:
+            filenames = os.listdir(self.folder)
+        except OSError: # e.g. network share temporarily unavailable
+            return []
+        return [os.path.join(self.folder, filename) for filename in sorted(filenames) if self.matches(filename)]
+
+    def poll(self, now=None):
+        """Checks the folder and returns the list of files that are complete and haven't been dispatched or
+        processed yet.  Returned files are considered dispatched and aren't returned again unless they change."""
+        if now is None:
+            now = time.time()
+        ready_files = []
+        current_files = set()
+        for filename in self.list_files():
+            try:
+                stat = os.stat(filename)
+            except OSError: # file removed since listing
+                continue
+            if not os.path.isfile(filename):
+                continue
+            current_files.add(filename)
+            state = (stat.st_size, stat.st_mtime)
+            if self.dispatched.get(filename) == state:
+                continue
+            previous = self.pending.get(filename)
+            if not self.polled and now - stat.st_mtime >= self.settle_time:
+                # Saved before the watcher started
+                pass
+            elif previous is None or previous[:2] != state:
+                self.pending[filename] = state + (now,)
+                continue
+            elif now - previous[2] < self.settle_time:
+                continue
+            self.pending.pop(filename, None)
+            self.dispatched[filename] = state
+            if self.is_processed is not None and self.is_processed(filename):
+                continue
+            ready_files.append(filename)
+        self.polled = True
+        # Forget files that have been removed from the folder
+        for filename in list(self.pending):
+            if filename not in current_files:
+                del self.pending[filename]
+        return ready_files
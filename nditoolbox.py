@@ -1,12 +1,27 @@
 __author__ = 'Chris R. Coughlin'
 
 from views import mainui
+from models import batchcoordinator
+from models import batchmanifest
+from models import batchprefetch
+from models import batchscheduler
+from models import batchwriter
 from models import mainmodel
+from models import pipeline
+from models import runprofile
+from models import watchfolder
 from controllers import batchui_ctrl
+from controllers import benchmark_ctrl
+from controllers import pathfinder
 import argparse
+import datetime
 import glob
+import json
 import multiprocessing
+import os.path
+import socket
 import sys
+import time
 
 module_logger = mainmodel.get_logger(__name__)
 
@@ -23,13 +38,29 @@ def platform_config():
         myappid = 'tri.nditoolbox.bane.1' # arbitrary string
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
+def report_job(job):
+    """Prints the results of a completed batch job"""
+    if job.error is not None:
+        print("\n** Error processing {0}: {1}".format(job.name, job.error))
+    elif hasattr(job.result, "keys"):
+        print("\n{0}".format(runprofile.summarize(job.result)))
+    else:
+        print("\nProcessed {0} in {1:.3f} s".format(job.name, job.wall_time))
+
+def job_outputs(job):
+    """Returns the list of files created by a completed batch job"""
+    if hasattr(job.result, "keys"):
+        return job.result.get('output_files', [])
+    return job.result or []
+
 if __name__ == "__main__":
     multiprocessing.freeze_support()
     if len(sys.argv) > 1:
         # Enter headless batch mode - given a list of input files, run a specified toolkit on each in turn
         print("\nNDIToolbox Batch Mode")
         parser = argparse.ArgumentParser(description='Run NDIToolbox toolkit in batch mode')
-        parser.add_argument('-t', '--toolkit', help='Name of toolkit to run')
+        parser.add_argument('-t', '--toolkit',
+                            help='Name of toolkit to run, comma-separated chain of toolkits or saved pipeline file')
         parser.add_argument('-c', '--toolkit_config', help='Config file for toolkit')
         parser.add_argument('-f', '--filetype', help='Specify type of input file (default: guess from file extension)')
         parser.add_argument('-i', '--input_files', nargs=argparse.REMAINDER, help='Specify input file or files')
@@ -37,47 +68,291 @@ if __name__ == "__main__":
                             help="Save plugin output to new HDF5 data file")
         parser.add_argument('-m', '--multiprocess', action='store_true', default=False,
                             help="Use multiple simultaneous processes for analysis")
+        parser.add_argument('--no_cache', action='store_true', default=False,
+                            help="Always run the toolkit rather than retrieving previous results from the cache")
+        parser.add_argument('-o', '--out_of_core', action='store_true', default=False,
+                            help="Process NDIToolbox HDF5 files one chunk at a time (implies --save_output)")
+        parser.add_argument('--memory_budget', type=float,
+                            help="Maximum estimated memory (MB) of simultaneous jobs in multiprocessing mode")
+        parser.add_argument('--incremental', action='store_true', default=False,
+                            help="Skip input files already processed with the same toolkit and configuration "
+                                 "that haven't changed since")
+        parser.add_argument('--resume', action='store_true', default=False,
+                            help="Only process input files that failed or didn't finish in previous runs")
+        parser.add_argument('-w', '--watch', metavar='FOLDER',
+                            help="Watch FOLDER and process new files as they arrive (use -i to specify "
+                                 "wildcard patterns of files to process)")
+        parser.add_argument('--settle_time', type=float, default=watchfolder.default_settle_time,
+                            help="Seconds a watched file must be unchanged before it's processed "
+                                 "(default: %(default)s)")
+        parser.add_argument('--prefetch', type=int, default=batchprefetch.default_prefetch, metavar='N',
+                            help="Number of input files to read ahead while the toolkit runs when not using "
+                                 "multiprocessing mode, 0 to disable (default: %(default)s)")
+        parser.add_argument('--container', metavar='FILE',
+                            help="Save the results of every input file to one HDF5 container file (implies "
+                                 "--save_output)")
+        parser.add_argument('--coordinator', metavar='[HOST:]PORT',
+                            help="Serve the jobs to batch workers instead of running them (listens on localhost "
+                                 "unless HOST is given, e.g. 0.0.0.0 to accept workers on other machines)")
+        parser.add_argument('--worker', metavar='HOST:PORT',
+                            help="Run the jobs served by the batch coordinator at HOST:PORT (use -m to run one "
+                                 "worker per CPU)")
+        parser.add_argument('--authkey',
+                            help="Key shared by the batch coordinator and its workers (required by workers; the "
+                                 "coordinator generates and prints a random key if not given)")
+        parser.add_argument('--benchmark', action='store_true', default=False,
+                            help="Measure batch throughput on synthetic input files (and the toolkit if specified) "
+                                 "and save the results to the batch output folder")
+        parser.add_argument('--benchmark_files', type=int, default=benchmark_ctrl.default_num_files, metavar='N',
+                            help="Number of files of each format to benchmark (default: %(default)s)")
+        parser.add_argument('--benchmark_size', type=float, default=benchmark_ctrl.default_file_size, metavar='MB',
+                            help="Size of each benchmark file in MB (default: %(default)s)")
+        parser.add_argument('--benchmark_formats', metavar='FORMATS',
+                            help="Comma-separated formats to benchmark (default: all of {0})".format(
+                                ", ".join(sorted(benchmark_ctrl.benchmark_formats))))
+        parser.add_argument('--benchmark_cscan', action='store_true', default=False,
+                            help="Compare computing C scan features in a single pass with one pass per feature "
+                                 "on a synthetic scan of --benchmark_size MB and save the results to the batch "
+                                 "output folder")
         args = parser.parse_args()
         mainmodel.MainModel.check_user_path()
+        if args.worker:
+            if not args.authkey:
+                print("** --authkey is required to connect to a batch coordinator")
+                sys.exit(1)
+            worker_address = batchcoordinator.parse_address(args.worker)
+            print("Running jobs from batch coordinator at {0}:{1}...".format(*worker_address))
+            worker_kwargs = {'initializer':batchui_ctrl.init_worker}
+            try:
+                if args.multiprocess:
+                    batchcoordinator.run_workers(worker_address, args.authkey, **worker_kwargs)
+                else:
+                    batchcoordinator.run_worker(worker_address, args.authkey, **worker_kwargs)
+            except IOError as err:
+                print("** {0}".format(err))
+                sys.exit(1)
+            sys.exit(0)
+        if args.benchmark_cscan:
+            results = benchmark_ctrl.benchmark_cscan_features(file_size=args.benchmark_size)
+            print(benchmark_ctrl.format_cscan_results(results))
+            results_fname = os.path.join(pathfinder.batchoutput_path(), "benchmark_cscan_{0}.json".format(
+                datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
+            with open(results_fname, "w") as fidout:
+                json.dump(results, fidout, indent=2)
+            print("Benchmark results saved to {0}".format(results_fname))
+            sys.exit(0)
         available_plugins = mainmodel.load_plugins()
         available_plugins_names = [plugin[0] for plugin in available_plugins]
-        if args.toolkit and args.toolkit not in available_plugins_names:
+        if args.toolkit and pipeline.is_pipeline(args.toolkit):
+            try:
+                pipeline.PluginPipeline.from_toolkit(args.toolkit, available_plugins)
+            except (ValueError, KeyError, IOError) as err:
+                print("** Unable to load pipeline '{0}': {1}".format(args.toolkit, err))
+                print("Available plugins:")
+                for plugin_name in available_plugins_names:
+                    print("\t{0}".format(plugin_name))
+                sys.exit(1)
+        elif args.toolkit and args.toolkit not in available_plugins_names:
             print("** Unable to locate plugin '{0}'.  Available plugins:".format(args.toolkit))
             for plugin_name in available_plugins_names:
                 print("\t{0}".format(plugin_name))
             sys.exit(1)
-        workers = multiprocessing.Pool()
-        if args.multiprocess:
-            print("Using multiprocessing mode, {0} simultaneous processes".format(multiprocessing.cpu_count()))
-        if args.input_files:
+        if args.benchmark:
+            def report_progress(msg):
+                print(msg)
+            benchmark_formats = None
+            if args.benchmark_formats:
+                benchmark_formats = [_fmt.strip() for _fmt in args.benchmark_formats.split(',') if _fmt.strip()]
+            try:
+                results = benchmark_ctrl.run_benchmark(toolkit=args.toolkit, formats=benchmark_formats,
+                                                       num_files=args.benchmark_files,
+                                                       file_size=args.benchmark_size,
+                                                       progress_fn=report_progress)
+            except ValueError as err:
+                print("** {0}".format(err))
+                sys.exit(1)
+            print(benchmark_ctrl.format_results(results))
+            results_fname = os.path.join(pathfinder.batchoutput_path(), "benchmark_{0}.json".format(
+                datetime.datetime.now().strftime("%Y%m%d_%H%M%S")))
+            with open(results_fname, "w") as fidout:
+                json.dump(results, fidout, indent=2)
+            print("Benchmark results saved to {0}".format(results_fname))
+            sys.exit(0)
+        container = None
+        if args.container:
+            if not args.toolkit or args.out_of_core or args.coordinator:
+                print("** --container can only be used to save toolkit results in single machine batch runs")
+                sys.exit(1)
+            args.save_output = True
+            container = args.container
+            if not os.path.isabs(container):
+                container = os.path.join(pathfinder.batchoutput_path(), container)
+        if args.out_of_core:
+            run_toolkit = batchui_ctrl.run_plugin_out_of_core
+            toolkit_kwargs = {}
+        else:
+            run_toolkit = batchui_ctrl.run_plugin
+            toolkit_kwargs = {'save_data':args.save_output, 'use_cache':not args.no_cache, 'container':container}
+        memory_budget = None
+        if args.memory_budget is not None:
+            memory_budget = int(args.memory_budget * 2 ** 20)
+        # Every job is recorded in the batch manifest so that later runs can skip it
+        manifest = batchmanifest.BatchManifest()
+        manifest_toolkit = args.toolkit or 'import'
+        toolkit_config = None
+        toolkit_cfg_dict = None
+        if args.toolkit_config is not None:
+            toolkit_config = os.path.abspath(args.toolkit_config)
+            toolkit_cfg_dict = batchui_ctrl.read_toolkit_config(args.toolkit_config)
+        job_params = batchmanifest.params_hash(manifest_toolkit, batchui_ctrl.toolkit_signature(args.toolkit),
+                                               toolkit_cfg_dict, filetype=args.filetype,
+                                               save_output=args.save_output, out_of_core=args.out_of_core,
+                                               container=container)
+
+        # Jobs that succeeded but whose results haven't been confirmed saved to the container yet
+        container_jobs = []
+
+        def record_job(job, error=None):
+            """Records the job in the manifest, as failed if it didn't succeed or error is specified"""
+            try:
+                if job.succeeded and error is None:
+                    manifest.record(job.name, manifest_toolkit, job_params, batchmanifest.COMPLETED,
+                                    outputs=job_outputs(job))
+                else:
+                    manifest.record(job.name, manifest_toolkit, job_params, batchmanifest.FAILED,
+                                    error=error or job.error)
+            except (IOError, OSError) as err:
+                print("** Unable to update batch manifest: {0}".format(err))
+
+        def on_job_complete(job):
+            """Reports the results of a completed job and records it in the manifest.  Jobs that save their
+            results to a container are recorded once the container has been written (see close_writer)."""
+            report_job(job)
+            if job.succeeded and container is not None:
+                container_jobs.append(job)
+            else:
+                record_job(job)
+
+        if args.coordinator:
+            coordinator_address = batchcoordinator.parse_address(args.coordinator)
+            scheduler = batchcoordinator.BatchCoordinator(address=coordinator_address, authkey=args.authkey,
+                                                          on_complete=on_job_complete)
+            worker_host = coordinator_address[0]
+            if worker_host in ('', '0.0.0.0'):
+                worker_host = socket.gethostname()
+            print("Serving jobs on {0}:{1}, start workers with nditoolbox.py --worker {2}:{1} --authkey {3}".format(
+                coordinator_address[0] or '0.0.0.0', coordinator_address[1], worker_host, scheduler.authkey))
+            if coordinator_address[0] == 'localhost':
+                print("Only workers on this machine can connect - specify the coordinator's host to accept "
+                      "workers on other machines")
+        else:
+            writer = None
+            if container is not None:
+                # Workers send their results to a single process that writes the container
+                writer = batchwriter.BatchWriter(container)
+                writer.start()
+                print("Saving results to {0}".format(container))
+            worker_initargs = (toolkit_config, writer and writer.queue)
+            if args.toolkit and not (args.multiprocess or args.out_of_core or args.watch) and args.prefetch > 0:
+                # Read the next input files and save results while the toolkit runs
+                scheduler = batchprefetch.PrefetchScheduler(batchui_ctrl.load_plugin_run,
+                                                            batchui_ctrl.process_plugin_run,
+                                                            batchui_ctrl.finish_plugin_run, prefetch=args.prefetch,
+                                                            memory_budget=memory_budget,
+                                                            on_complete=on_job_complete,
+                                                            initializer=batchui_ctrl.init_worker,
+                                                            initargs=worker_initargs)
+            else:
+                scheduler = batchscheduler.BatchScheduler(memory_budget=memory_budget,
+                                                          multiprocess=args.multiprocess,
+                                                          on_complete=on_job_complete,
+                                                          initializer=batchui_ctrl.init_worker,
+                                                          initargs=worker_initargs)
+
+        def close_writer():
+            """Waits for the batch writer (if any) to save all the results, reports any errors and records the
+            jobs that saved to the container in the manifest.  Returns True if all the results were saved."""
+            if container is None:
+                return True
+            writer_errors = writer.close()
+            # Errors without an input file (e.g. the container couldn't be opened) apply to every job
+            save_errors = {}
+            for input_file, err in writer_errors:
+                print("** Error saving results of {0}: {1}".format(input_file or container, err))
+                save_errors[input_file] = err
+            for job in container_jobs:
+                record_job(job, save_errors.get(os.path.abspath(job.name), save_errors.get(None)))
+            return not writer_errors
+        skipped_files = []
+
+        def add_batch_job(input_file):
+            """Adds the job processing input_file to the scheduler"""
+            # Absolute paths so that workers started in other folders (or on other machines) find the files
+            if args.toolkit:
+                job_fn = run_toolkit
+                job_kwargs = {'toolkit':args.toolkit,
+                              'input_file':os.path.abspath(input_file),
+                              'toolkit_config':toolkit_config,
+                              'file_type':args.filetype}
+                job_kwargs.update(toolkit_kwargs)
+            else:
+                job_fn = batchui_ctrl.import_data
+                job_kwargs = {'input_file':os.path.abspath(input_file),
+                              'file_type':args.filetype}
+            print("Adding {0} to job list...".format(input_file))
+            scheduler.add_job(input_file, job_fn, job_kwargs,
+                              memory=batchui_ctrl.estimate_memory(input_file, args.filetype),
+                              size=os.path.getsize(input_file))
+
+        if args.multiprocess and not args.coordinator:
+            print("Using multiprocessing mode, up to {0} simultaneous processes".format(scheduler.num_workers))
+            if scheduler.memory_budget is not None:
+                print("Memory budget {0:.0f} MB".format(scheduler.memory_budget / float(2 ** 20)))
+        if args.watch:
+            # Process each new file in the folder as soon as it's complete until interrupted
+            watcher = watchfolder.FolderWatcher(args.watch, patterns=args.input_files, settle_time=args.settle_time,
+                                                is_processed=lambda fname: manifest.is_up_to_date(fname,
+                                                                                                  manifest_toolkit,
+                                                                                                  job_params))
+            print("Watching {0} for new files, press Ctrl-C to stop...".format(args.watch))
+            scheduler.start()
+            last_poll = 0
+            try:
+                while True:
+                    if time.time() - last_poll >= watchfolder.default_poll_interval:
+                        last_poll = time.time()
+                        for _p in watcher.poll():
+                            if args.filetype is None and batchui_ctrl.get_file_type(_p) is None:
+                                continue
+                            try:
+                                add_batch_job(_p)
+                            except OSError: # file removed since it was found
+                                pass
+                    if not scheduler.step():
+                        time.sleep(watchfolder.default_poll_interval if scheduler.idle else scheduler.poll_interval)
+            except KeyboardInterrupt:
+                print("\nStopping...")
+                scheduler.stop(terminate=True)
+            close_writer()
+            print("\n{0}".format(scheduler.summary()))
+        elif args.input_files:
             for _f in args.input_files:
                     paths = glob.glob(_f)
                     for _p in paths:
-                        if not args.multiprocess:
-                            print("\nProcessing {0}...".format(_p))
-                            if args.toolkit:
-                                batchui_ctrl.run_plugin(toolkit=args.toolkit,
-                                                        input_file=_p,
-                                                        toolkit_config=args.toolkit_config,
-                                                        file_type=args.filetype,
-                                                        save_data=args.save_output)
-                            else:
-                                batchui_ctrl.import_data(input_file=_p, file_type=args.filetype)
-                        else:
-                            print("\nAdding {0} to job list...".format(_p))
-                            if args.toolkit:
-                                workers.apply_async(batchui_ctrl.run_plugin,
-                                                    kwds={'toolkit':args.toolkit,
-                                                          'input_file':_p,
-                                                          'toolkit_config':args.toolkit_config,
-                                                          'file_type':args.filetype,
-                                                          'save_data':args.save_output})
-                            else:
-                                workers.apply_async(batchui_ctrl.import_data,
-                                                    kwds={'input_file':_p,
-                                                          'file_type':args.filetype})
-            workers.close()
-            workers.join()
+                        if args.resume and manifest.is_completed(_p, manifest_toolkit, job_params):
+                            skipped_files.append(_p)
+                            continue
+                        if args.incremental and manifest.is_up_to_date(_p, manifest_toolkit, job_params):
+                            skipped_files.append(_p)
+                            continue
+                        add_batch_job(_p)
+            if skipped_files:
+                print("Skipped {0} previously processed files".format(len(skipped_files)))
+            scheduler.run()
+            results_saved = close_writer()
+            print("\n{0}".format(scheduler.summary()))
+            if scheduler.failed_jobs or not results_saved:
+                sys.exit(1)
     else:
         module_logger.info("Completed multiprocessing support.")
         platform_config()
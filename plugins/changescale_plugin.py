@@ -7,6 +7,7 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'ccoughlin'
 
 from models.abstractplugin import TRIPlugin
+from models import precision
 import math
 
 
@@ -15,6 +16,10 @@ class ChangeScalePlugin(TRIPlugin):
 
     name = "Change Scale"
     description = "Linear conversion between signal measurement scales (e.g. volts to microvolts)"
+    # Each point is converted independently of every other point
+    tile_mode = 'elementwise'
+    # Every dataset of multiple datasets is processed the same way
+    tile_datasets = True
 
     def __init__(self, **kwargs):
         TRIPlugin.__init__(self, name=self.name, description=self.description, authors=self.authors,
@@ -48,7 +53,8 @@ class ChangeScalePlugin(TRIPlugin):
             if hasattr(self._data, "keys"):
                 for dataset in self._data:
                     # Execute plugin on every dataset
-                    self._data[dataset] = self._data[dataset] * self.scale_conversion_factor + self.scale_offset
+                    self._data[dataset] = precision.apply_scale(self._data[dataset], self.scale_conversion_factor,
+                                                                 self.scale_offset)
             else:
                 # A single dataset was provided
-                self._data = self._data * self.scale_conversion_factor + self.scale_offset
\ No newline at end of file
+                self._data = precision.apply_scale(self._data, self.scale_conversion_factor, self.scale_offset)
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""cscanfeatures_plugin.py - NDIToolbox plugin that computes C-scans of several
+A-scan features (e.g. peak amplitude and time of flight) in a single pass over 3D data
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from models.abstractplugin import TRIPlugin
+from models import ndescanhandler
+
+class CScanFeaturesPlugin(TRIPlugin):
+    """Replaces 3D data with a dict of C-scans, one per requested
+    feature of each A-scan in the configured Z index range"""
+
+    name = "C Scan Features"
+    description = "Computes C scans of A-scan features (maximum, time of flight, etc.) in a single pass."
+
+    def __init__(self, **kwargs):
+        TRIPlugin.__init__(self, name=self.name, description=self.description, authors=self.authors,
+                           version=self.version, url=self.url, copyright=self.copyright, **kwargs)
+        # Stop index defaults to the end of the A-scans and threshold is only required
+        # for the first_crossing feature
+        self.config = {'start index': '0',
+                       'stop index': '',
+                       'features': 'max, min, ptp, mean, argmax',
+                       'threshold': ''}
+
+    @property
+    def features(self):
+        """Returns the list of configured features"""
+        return [feature.strip() for feature in self.config.get('features', '').split(',') if feature.strip()]
+
+    def gen_features(self, data):
+        """Returns a dict of the configured feature C scans of the 3D array data.  Raises ValueError
+        if the configuration is invalid."""
+        start_idx = int(self.config.get('start index') or 0)
+        stop_idx = int(self.config.get('stop index') or data.shape[2])
+        if stop_idx <= start_idx:
+            raise ValueError("Stop index must be greater than start index")
+        threshold = self.config.get('threshold', '')
+        threshold = float(threshold) if threshold not in ('', None) else None
+        scnr = ndescanhandler.NDEScanHandler(data, cache_bytes=0)
+        return scnr.gen_cscan_features(start_idx, stop_idx, self.features, threshold)
+
+    def run(self):
+        """Runs the plugin.  A single 3D dataset is replaced with a dict of C scans; in multiple
+        datasets each 3D dataset (e.g. waveform) is replaced with datasets named
+        dataset_feature.  Data that aren't 3D are left unchanged."""
+        if self._data is not None:
+            if hasattr(self._data, "keys"):
+                for dataset in list(self._data.keys()):
+                    if self._data[dataset].ndim == 3:
+                        feature_maps = self.gen_features(self._data[dataset])
+                        del self._data[dataset]
+                        for feature, feature_map in feature_maps.items():
+                            self._data["{0}_{1}".format(dataset, feature)] = feature_map
+            elif self._data.ndim == 3:
+                self._data = self.gen_features(self._data)
@@ -7,7 +7,8 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'Chris R. Coughlin'
 
 from models.abstractplugin import TRIPlugin
-import scipy.signal
+from models import precision
+import scipy.ndimage
 
 class MedianFilterPlugin(TRIPlugin):
     """Applies a median filter to the
@@ -15,6 +16,10 @@ class MedianFilterPlugin(TRIPlugin):
 
     name = "Median Filter"
     description = "Applies a median filter to the current data set."
+    # Each point is filtered using its neighbours up to half the kernel size away
+    tile_mode = 'neighbourhood'
+    # Every dataset of multiple datasets is processed the same way
+    tile_datasets = True
 
     def __init__(self, **kwargs):
         TRIPlugin.__init__(self, name=self.name, description=self.description, authors=self.authors,
@@ -25,6 +30,29 @@ class MedianFilterPlugin(TRIPlugin):
         # they are returned as str.
         self.config = {'kernel size': '3'}
 
+    @property
+    def kernel_size(self):
+        """Returns the configured kernel size, incremented by one if even - SciPy's medfilt
+        function requires odd numbers for kernel size."""
+        # The UI returns configuration options as str - the Plugin is
+        # responsible for casting them to required type
+        kernel_size = int(self.config.get('kernel size', 3))
+        if kernel_size % 2 == 0:
+            kernel_size += 1
+        return kernel_size
+
+    @property
+    def tile_halo(self):
+        """Number of neighbouring points required on either side of a tile"""
+        return self.kernel_size // 2
+
+    def median_filter(self, data):
+        """Returns the median filtered data in the application's compute precision.  Gives the same
+        results as scipy.signal.medfilt (edges padded with zeros) without converting the data
+        to double precision."""
+        filtered_data = scipy.ndimage.median_filter(data, self.kernel_size, mode='constant')
+        return precision.as_compute(filtered_data, exact=True)
+
     def run(self):
         """Runs the plugin, asking the user to specify a kernel size for the median filter.
         A filter of rank A where A is the specified kernel size is then applied to the
@@ -33,12 +61,6 @@ class MedianFilterPlugin(TRIPlugin):
         numbers for kernel size.
         """
         if self._data is not None:
-            # The UI returns configuration options as str - the Plugin is
-            # responsible for casting them to required type
-            kernel_size = int(self.config.get('kernel size', 3))
-            if kernel_size % 2 == 0:
-                # medfilt function requires odd number for kernel size
-                kernel_size += 1
             # Some types of NDE data (e.g. ultrasonics) frequently package multiple
             # datasets into a single file - TOF, amplitude, and waveform for example.
             # To determine if the plugin has been sent multiple datasets, check for
@@ -47,11 +69,11 @@ class MedianFilterPlugin(TRIPlugin):
             if hasattr(self._data, "keys"):
                 for dataset in self._data:
                     # Execute plugin on every dataset
-                    self._data[dataset] = scipy.signal.medfilt(self._data[dataset], kernel_size)
+                    self._data[dataset] = self.median_filter(self._data[dataset])
                 # You could alternatively execute on one particular type of data
                 # e.g.
                 # if dataset == "waveform":
-                #   self._data = scipy.signal.medfilt(self._data[dataset], kernel_size)
+                #   self._data = self.median_filter(self._data[dataset])
             else:
                 # A single dataset was provided
-                self._data = scipy.signal.medfilt(self._data, kernel_size)
\ No newline at end of file
+                self._data = self.median_filter(self._data)
\ No newline at end of file
@@ -7,6 +7,7 @@ Chris R. Coughlin (TRI/Austin, Inc.)
 __author__ = 'Chris R. Coughlin'
 
 from models.abstractplugin import TRIPlugin
+from models import precision
 import numpy as np
 
 class NormalizePlugin(TRIPlugin):
@@ -26,11 +27,44 @@ class NormalizePlugin(TRIPlugin):
     version = "1.1"
     url = "www.tri-austin.com"
     copyright = "Copyright (C) 2013 TRI/Austin, Inc.  All rights reserved."
+    # Once the maximum of the complete data set is known (see prepare) each point is
+    # normalized independently of every other point
+    tile_mode = 'elementwise'
+    # Every dataset of multiple datasets is processed the same way
+    tile_datasets = True
 
     def __init__(self, **kwargs):
         TRIPlugin.__init__(self, name=self.name, description=self.description, authors=self.authors,
                            version=self.version, url=self.url, copyright=self.copyright, **kwargs)
 
+    def prepare(self, chunks):
+        """Called before the data are split into tiles or chunks - returns the largest single
+        element of the complete data set (of each dataset if the chunks are dicts) so that every
+        tile is normalized against the same value."""
+        maximum = None
+        for chunk in chunks:
+            if hasattr(chunk, "keys"):
+                chunk_max = dict((dataset, np.max(chunk[dataset])) for dataset in chunk)
+                if maximum is not None:
+                    chunk_max = dict((dataset, np.max([max_el, maximum[dataset]]))
+                                     for dataset, max_el in chunk_max.items())
+            else:
+                chunk_max = np.max(chunk)
+                if maximum is not None:
+                    chunk_max = np.max([chunk_max, maximum])
+            maximum = chunk_max
+        return {'maximum': maximum}
+
+    def get_maximum(self, data, dataset=None):
+        """Returns the largest single element of the complete data set (or of the named dataset)
+        if it was supplied by prepare(), otherwise the largest element in data"""
+        maximum = getattr(self, 'config', {}).get('maximum')
+        if hasattr(maximum, "keys"):
+            maximum = maximum.get(dataset)
+        if maximum is None:
+            return np.max(data)
+        return maximum
+
     def run(self):
         """Executes the plugin - if data are not None they are normalized
         against the largest single element in the array."""
@@ -43,7 +77,8 @@ class NormalizePlugin(TRIPlugin):
             if hasattr(self._data, "keys"):
                 for dataset in self._data:
                     # Execute plugin on every dataset
-                    max_el = np.max(self._data[dataset])
+                    max_el = self.get_maximum(self._data[dataset], dataset)
+                    self._data[dataset] = precision.as_compute(self._data[dataset])
                     self._data[dataset] /= max_el
                 # You could alternatively execute on one particular type of data
                 # e.g.
@@ -52,5 +87,6 @@ class NormalizePlugin(TRIPlugin):
                 #   self._data[dataset] /= max_el
             else:
                 # A single dataset was provided
-                max_el = np.max(self._data)
+                max_el = self.get_maximum(self._data)
+                self._data = precision.as_compute(self._data)
                 self._data /= max_el
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""blitmanager.py - redraws the frequently-changing artists of a matplotlib figure without redrawing the figure
+
+Redrawing a matplotlib figure redraws every axes, tick label and image in it.  Plots that change in response to
+the cursor (e.g. the A-scan and B-scans of a MegaPlot) instead mark the artists that change as animated:  a full
+redraw of the figure leaves them out, the background of their axes is saved, and afterwards the artists are updated
+in place (set_data, set_text etc.) and only their axes are restored from the saved background, drawn over and
+copied to the screen (blitted).
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from matplotlib.transforms import Bbox
+import matplotlib.axis as maxis
+import matplotlib.text as mtext
+import collections
+
+
+class BlitManager(object):
+    """Blits the animated artists of each axes in the matplotlib canvas.  The background of each axes is saved
+    whenever the canvas is drawn; until then (or if an axes has no background) update() redraws the canvas."""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.artists = collections.OrderedDict()
+        self.backgrounds = {}
+        self.draw_cid = self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def animate(self, axes, artists):
+        """Sets the list of artists in axes (e.g. its lines, images and title) that are redrawn by blitting.
+        The axes' background is discarded until the canvas is next drawn."""
+        for artist in self.artists.get(axes, []):
+            if artist not in artists:
+                artist.set_animated(False)
+        for artist in artists:
+            artist.set_animated(True)
+        self.artists[axes] = list(artists)
+        self.backgrounds.pop(axes, None)
+
+    def remove(self, axes):
+        """Stops blitting the artists in axes, which are then drawn with the rest of the figure"""
+        for artist in self.artists.pop(axes, []):
+            artist.set_animated(False)
+        self.backgrounds.pop(axes, None)
+
+    @property
+    def ready(self):
+        """True if every axes has a saved background, i.e. update() can blit rather than redraw"""
+        return all(axes in self.backgrounds for axes in self.artists)
+
+    def region(self, axes, renderer):
+        """Returns the Bbox of the canvas redrawn when blitting axes:  the axes and the rows above or below it
+        occupied by any of its animated text (e.g. the title), with room for taller text"""
+        y0, y1 = axes.bbox.y0, axes.bbox.y1
+        for artist in self.artists.get(axes, []):
+            if isinstance(artist, mtext.Text) and artist.get_visible() and artist.get_text():
+                extent = artist.get_window_extent(renderer)
+                y0 = min(y0, extent.y0 - extent.height / 2.)
+                y1 = max(y1, extent.y1 + extent.height / 2.)
+        figure_bbox = self.canvas.figure.bbox
+        return Bbox.from_extents(axes.bbox.x0, max(y0, figure_bbox.y0), axes.bbox.x1, min(y1, figure_bbox.y1))
+
+    def on_draw(self, evt):
+        """Saves the background of each axes after the canvas is drawn and draws the animated artists over it"""
+        self.backgrounds = {}
+        for axes in self.artists:
+            region = self.region(axes, evt.renderer)
+            self.backgrounds[axes] = (region, self.canvas.copy_from_bbox(region))
+            self.draw_axes(axes)
+
+    def draw_axes(self, axes):
+        """Draws the animated artists of axes, and the rest of the axes' artists (e.g. spines and grid lines)
+        that are drawn over them in a full redraw.  Text and tick labels that aren't animated are left as
+        they are in the background."""
+        animated = self.artists.get(axes, [])
+        if not animated:
+            return
+        lowest_zorder = min(artist.get_zorder() for artist in animated)
+        # (zorder, artist) in the order they're drawn in a full redraw - grid lines are drawn with their axis
+        layers = []
+        for artist in axes.get_children():
+            if artist in animated:
+                layers.append((artist.get_zorder(), artist))
+            elif artist.get_animated() or not artist.get_visible() or artist.get_zorder() <= lowest_zorder:
+                continue
+            elif isinstance(artist, maxis.Axis):
+                layers.extend((artist.get_zorder(), tick.gridline) for tick in artist.get_major_ticks()
+                              if tick.get_visible() and getattr(tick, 'gridOn', False))
+            elif artist is not axes.patch and not isinstance(artist, mtext.Text):
+                layers.append((artist.get_zorder(), artist))
+        for zorder, artist in sorted(layers, key=lambda layer: layer[0]):
+            axes.draw_artist(artist)
+
+    def update(self, axes_list=None):
+        """Restores the background of each of the axes in axes_list (defaults to all the axes with animated
+        artists), draws their animated artists and blits them to the screen.  Redraws the canvas instead if
+        any of the axes don't have a saved background."""
+        if axes_list is None:
+            axes_list = list(self.artists)
+        if not all(axes in self.backgrounds for axes in axes_list):
+            self.canvas.draw()
+            return
+        for axes in axes_list:
+            region, background = self.backgrounds[axes]
+            self.canvas.restore_region(background)
+            self.draw_axes(axes)
+            self.canvas.blit(region)
+
+    def disconnect(self):
+        """Stops saving backgrounds when the canvas is drawn"""
+        self.canvas.mpl_disconnect(self.draw_cid)
@@ -98,6 +98,10 @@ class UI(wx.Frame):
                                  helpString="Runs the Probability Of Detection Toolkit")
         self.tool_mnu.AppendItem(podtk_mnui)
         self.Bind(wx.EVT_MENU, self.controller.on_run_podtk, id=podtk_mnui.GetId())
+        outofcore_mnui = wx.MenuItem(self.tool_mnu, wx.ID_ANY, text="Run Plugin On Data File...",
+                                     helpString="Runs a plugin on the selected data file one chunk at a time")
+        self.tool_mnu.AppendItem(outofcore_mnui)
+        self.Bind(wx.EVT_MENU, self.controller.on_run_plugin_out_of_core, id=outofcore_mnui.GetId())
         self.prefs_mnu = wx.Menu() # Preferences Menu
         userpath_mnui = wx.MenuItem(self.prefs_mnu, wx.ID_ANY, text="Choose Data Folder...",
                                     helpString="Specify the local storage folder")
@@ -107,12 +111,20 @@ class UI(wx.Frame):
                                     helpString="Specify the severity of events recorded in the application log")
         self.prefs_mnu.AppendItem(log_mnui)
         self.Bind(wx.EVT_MENU, self.controller.on_choose_loglevel, id=log_mnui.GetId())
+        precision_mnui = wx.MenuItem(self.prefs_mnu, wx.ID_ANY, text="Choose Compute Precision...",
+                                     helpString="Specify the floating point precision used in calculations")
+        self.prefs_mnu.AppendItem(precision_mnui)
+        self.Bind(wx.EVT_MENU, self.controller.on_choose_precision, id=precision_mnui.GetId())
         self.tool_mnu.AppendMenu(wx.ID_ANY, 'Preferences', self.prefs_mnu)
         self.tool_mnu.AppendSeparator()
         gc_mnui = wx.MenuItem(self.tool_mnu, wx.ID_ANY, text="Free Memory...",
                               helpString="Attempt to free up memory by scheduling garbage collection")
         self.tool_mnu.AppendItem(gc_mnui)
         self.Bind(wx.EVT_MENU, self.controller.on_gc, id=gc_mnui.GetId())
+        clearcache_mnui = wx.MenuItem(self.tool_mnu, wx.ID_ANY, text="Clear Plugin Results Cache",
+                                      helpString="Delete the stored results of previous plugin runs")
+        self.tool_mnu.AppendItem(clearcache_mnui)
+        self.Bind(wx.EVT_MENU, self.controller.on_clear_cache, id=clearcache_mnui.GetId())
         self.menubar.Append(self.tool_mnu, "&Tools")
 
     def init_help_menu(self):
@@ -207,6 +207,15 @@ class PlotWindow(wx.Frame):
                                            help="Download and install a new plugin")
         self.Bind(wx.EVT_MENU, self.controller.on_download_plugin, id=download_plugin_mnui.GetId())
         self.plugins_mnu.AppendItem(download_plugin_mnui)
+        self.plugins_mnu.AppendSeparator()
+        run_pipeline_mnui = wx.MenuItem(self.plugins_mnu, wx.ID_ANY, text="Run Pipeline...",
+                                        help="Run a saved sequence of plugins on the data")
+        self.Bind(wx.EVT_MENU, self.controller.on_run_pipeline, id=run_pipeline_mnui.GetId())
+        self.plugins_mnu.AppendItem(run_pipeline_mnui)
+        create_pipeline_mnui = wx.MenuItem(self.plugins_mnu, wx.ID_ANY, text="Create Pipeline...",
+                                           help="Create and save a new sequence of plugins")
+        self.Bind(wx.EVT_MENU, self.controller.on_create_pipeline, id=create_pipeline_mnui.GetId())
+        self.plugins_mnu.AppendItem(create_pipeline_mnui)
         self.tools_mnu.AppendMenu(wx.ID_ANY, "Plugins", self.plugins_mnu)
 
     def init_help_menu(self):
@@ -399,6 +408,10 @@ class MegaPlotWindow(PlotWindow):
         slice_lbl = wx.StaticText(self.ctrl_panel, wx.ID_ANY, u"Slice Index", wx.DefaultPosition, wx.DefaultSize)
         self.ctrl_sizer.Add(slice_lbl, ui_defaults.lbl_pct, ui_defaults.lblsizer_flags, ui_defaults.widget_margin)
         self.ctrl_sizer.Add(self.slice_sc, ui_defaults.ctrl_pct, ui_defaults.sizer_flags, ui_defaults.widget_margin)
+        self.cine_tb = wx.ToggleButton(self.ctrl_panel, wx.ID_ANY, u"Play")
+        self.cine_tb.SetToolTipString(u"Play the Z slices as the C Scan")
+        self.Bind(wx.EVT_TOGGLEBUTTON, self.controller.on_toggle_cine, self.cine_tb)
+        self.ctrl_sizer.Add(self.cine_tb, ui_defaults.ctrl_pct, ui_defaults.sizer_flags, ui_defaults.widget_margin)
         self.ctrl_panel.SetSizerAndFit(self.ctrl_sizer)
         self.main_panel_sizer.Add(self.ctrl_panel, ui_defaults.lbl_pct, ui_defaults.sizer_flags,
                                   ui_defaults.widget_margin)
@@ -422,6 +435,7 @@ class MegaPlotWindow(PlotWindow):
         self.main_panel.SetSizerAndFit(self.main_panel_sizer)
         self.sizer.Add(self.main_panel, 1, ui_defaults.sizer_flags, 0)
         self.SetSizerAndFit(self.sizer)
+        self.Bind(wx.EVT_CLOSE, self.controller.on_close)
 
     def add_toolbar(self):
         """Creates the matplotlib toolbar (zoom, pan/scroll, etc.)
@@ -495,6 +509,10 @@ class MegaPlotWindow(PlotWindow):
         self.Bind(wx.EVT_MENU, self.controller.on_change_bscans, id=self.plot_conventional_bscans_mnui.GetId())
         self.plot_mnu.AppendItem(self.plot_conventional_bscans_mnui)
         self.plot_conventional_bscans_mnui.Check(self.controller.conventional_bscans)
+        cine_rate_mnui = wx.MenuItem(self.plot_mnu, wx.ID_ANY, text="Cine Frame Rate...",
+                                     help="Set the frame rate of playing the Z slices")
+        self.Bind(wx.EVT_MENU, self.controller.on_set_cine_frame_rate, id=cine_rate_mnui.GetId())
+        self.plot_mnu.AppendItem(cine_rate_mnui)
         gridtoggle_mnui = wx.MenuItem(self.plot_mnu, wx.ID_ANY, text="Toggle Grid",
                                       help="Turns grid on or off")
         self.plot_mnu.AppendItem(gridtoggle_mnui)
@@ -507,6 +525,20 @@ class MegaPlotWindow(PlotWindow):
                                          help="Specify function to generate C Scan")
         self.Bind(wx.EVT_MENU, self.controller.on_define_cscan, id=self.setcscan_mnui.GetId())
         self.ops_mnu.AppendItem(self.setcscan_mnui)
+        self.cscanfeatures_mnui = wx.MenuItem(self.ops_mnu, wx.ID_ANY, text="C Scan Features...",
+                                              help="Compute and save C Scans of several A-scan features")
+        self.Bind(wx.EVT_MENU, self.controller.on_cscan_features, id=self.cscanfeatures_mnui.GetId())
+        self.ops_mnu.AppendItem(self.cscanfeatures_mnui)
+        self.gatedcscan_mnui = wx.MenuItem(self.ops_mnu, wx.ID_ANY, text="Gated C Scan...",
+                                           help="Generate a peak amplitude or time of flight C Scan from a gate")
+        self.Bind(wx.EVT_MENU, self.controller.on_gated_cscan, id=self.gatedcscan_mnui.GetId())
+        self.ops_mnu.AppendItem(self.gatedcscan_mnui)
+        self.approx_quantiles_mnui = wx.MenuItem(self.ops_mnu, wx.ID_ANY, text="Approximate Percentiles",
+                                                 help="Estimate median and percentile C Scans in bounded memory",
+                                                 kind=wx.ITEM_CHECK)
+        self.Bind(wx.EVT_MENU, self.controller.on_toggle_approx_quantiles, id=self.approx_quantiles_mnui.GetId())
+        self.ops_mnu.AppendItem(self.approx_quantiles_mnui)
+        self.approx_quantiles_mnui.Check(self.controller.get_quantile_mode_config() == 'approximate')
         self.rect_mnu = wx.Menu() # Rectification operations
         self.fullrect_mnui = wx.MenuItem(self.rect_mnu, wx.ID_ANY, text="Full",
                                          help="Full Rectification")
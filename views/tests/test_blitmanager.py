@@ -0,0 +1,88 @@
+"""test_blitmanager.py - tests the blitmanager module
+
+Chris R. Coughlin (TRI/Austin, Inc.)
+"""
+
+__author__ = 'Chris R. Coughlin'
+
+from views import blitmanager
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+import unittest
+
+
+class TestBlitManager(unittest.TestCase):
+    """Tests the BlitManager class"""
+
+    def create_figure(self, animated):
+        """Returns a canvas with a line plot and an image plot (and the BlitManager if animated is True),
+        and the line and image"""
+        figure = Figure(figsize=(6, 5), dpi=72)
+        canvas = FigureCanvasAgg(figure)
+        line_axes = figure.add_subplot(221)
+        img_axes = figure.add_subplot(224)
+        for axes in (line_axes, img_axes):
+            axes.grid(True)
+        line, = line_axes.plot(np.sin(np.arange(50) / 5.))
+        line_axes.set_ylim(-2, 2)
+        line_axes.set_title("Line 0")
+        img = img_axes.imshow(np.random.RandomState(0).rand(20, 30), aspect='auto', origin='lower',
+                              interpolation='nearest')
+        img_axes.set_title("Image 0")
+        blit_manager = None
+        if animated:
+            blit_manager = blitmanager.BlitManager(canvas)
+            blit_manager.animate(line_axes, [line, line_axes.title])
+            blit_manager.animate(img_axes, [img, img_axes.title])
+        return canvas, blit_manager, line, img
+
+    def pixels(self, canvas):
+        """Returns the canvas' pixels as a NumPy array"""
+        width, height = canvas.get_width_height()
+        return np.fromstring(canvas.tostring_argb(), dtype=np.uint8).reshape(height, width, 4)
+
+    def update_artists(self, line, img):
+        """Changes the line, image and titles"""
+        line.set_ydata(np.cos(np.arange(50) / 3.))
+        line.axes.title.set_text("Line 12345")
+        img.set_data(np.random.RandomState(1).rand(20, 30))
+        img.autoscale()
+        img.axes.title.set_text("Image 7")
+
+    def test_blit(self):
+        """Verify blitting the animated artists gives the same image as redrawing the figure"""
+        blit_canvas, blit_manager, blit_line, blit_img = self.create_figure(True)
+        canvas, unused, line, img = self.create_figure(False)
+        self.assertFalse(blit_manager.ready)
+        blit_canvas.draw()
+        canvas.draw()
+        self.assertTrue(blit_manager.ready)
+        self.assertTrue(np.array_equal(self.pixels(canvas), self.pixels(blit_canvas)))
+        initial_pixels = self.pixels(blit_canvas)
+        self.update_artists(blit_line, blit_img)
+        self.update_artists(line, img)
+        blit_manager.update()
+        canvas.draw()
+        self.assertFalse(np.array_equal(initial_pixels, self.pixels(blit_canvas)))
+        self.assertTrue(np.array_equal(self.pixels(canvas), self.pixels(blit_canvas)))
+
+    def test_update_draws(self):
+        """Verify the canvas is drawn if the axes don't have a saved background"""
+        canvas, blit_manager, line, img = self.create_figure(True)
+        blit_manager.update()
+        self.assertTrue(blit_manager.ready)
+        blit_manager.animate(line.axes, [line])
+        self.assertFalse(blit_manager.ready)
+
+    def test_remove(self):
+        """Verify removed axes are drawn with the rest of the figure"""
+        canvas, blit_manager, line, img = self.create_figure(True)
+        blit_manager.remove(line.axes)
+        self.assertFalse(line.get_animated())
+        self.assertTrue(img.get_animated())
+        self.assertEqual([img.axes], list(blit_manager.artists))
+
+
+if __name__ == "__main__":
+    unittest.main()